@@ -0,0 +1,388 @@
+"""
+Incremental alert rule engine behind `GET /api/alerts/stream`.
+
+`/api/alerts` evaluates its three signals from scratch on each request. `AlertRuleEngine` evaluates the
+same rules at default settings, and after the first full pass it only reads the rows appended since
+its last pass. Transactions and chargebacks are append-mostly, as in the columnar engine, so new rows
+are found with a rowid watermark on each table:
+- **HIGH_CHARGEBACK_RATIO** rereads the `merchant_stats` rows of the merchants that received rows.
+- **WEEKLY_SPIKE** keeps the per merchant × reason code counts of the current and baseline windows in
+  memory and adds each new chargeback to its window.
+- **HIGH_VALUE_DISPUTE** checks the transactions of the new chargebacks.
+
+Anything else a pass can observe triggers a full re-evaluation:
+- the row at a watermark is gone or changed;
+- the `merchant_stats` totals moved by more than the new rows account for (a delete, a detached
+  partition);
+- the spike window rolled over to a new day;
+- ALERT_STREAM_RESYNC_SECONDS have passed (for changes appends cannot show, such as an fx recompute
+  from another process).
+
+`AlertStream` turns the engine's results into events. An alert fires once when it becomes active and
+is not repeated while it stays active. A `resolved` event follows when it clears. Events carry
+increasing ids and the last ALERT_STREAM_REPLAY_EVENTS are kept, so a client reconnecting with
+`Last-Event-ID` gets exactly what it missed. A client that is new, or too far behind, gets the
+currently active alerts first. One background thread evaluates the rules. It wakes on every data
+version bump and every ALERT_STREAM_POLL_SECONDS. Subscribers share one broadcast event and read the
+shared buffer from their own position, so each connection costs a coroutine and an integer.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import date
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection, Engine
+from app.cache import data_version
+from app.columnar import MIN_ROWID, sql_round
+from app.constants import (
+    ALERT_STREAM_HEARTBEAT_SECONDS,
+    ALERT_STREAM_POLL_SECONDS,
+    ALERT_STREAM_REPLAY_EVENTS,
+    ALERT_STREAM_RESYNC_SECONDS,
+    HIGH_VALUE_THRESHOLD_USD,
+    MERCHANT_RATIO_ALERT_THRESHOLD,
+    SPIKE_BASELINE_WINDOWS,
+    SPIKE_FACTOR,
+    SPIKE_MIN_CHARGEBACKS,
+    SPIKE_WINDOW_DAYS,
+)
+from app.database import read_snapshot
+from app.rollups import DAILY_LABEL
+from app.schemas import Alert
+
+logger = logging.getLogger(__name__)
+
+HIGH_RATIO, WEEKLY_SPIKE, HIGH_VALUE = "HIGH_CHARGEBACK_RATIO", "WEEKLY_SPIKE", "HIGH_VALUE_DISPUTE"
+
+WATERMARKS_SQL = text("""
+    SELECT
+        (SELECT MAX(rowid) FROM transactions),
+        (SELECT id FROM transactions WHERE rowid = (SELECT MAX(rowid) FROM transactions)),
+        (SELECT MAX(rowid) FROM chargebacks),
+        (SELECT id FROM chargebacks WHERE rowid = (SELECT MAX(rowid) FROM chargebacks))
+""")
+
+CHECK_SQL = text("""
+    SELECT
+        (SELECT id FROM transactions WHERE rowid = :tx_rowid),
+        (SELECT id FROM chargebacks WHERE rowid = :cb_rowid),
+        (SELECT COALESCE(SUM(transaction_count), 0) FROM merchant_stats),
+        (SELECT COALESCE(SUM(chargeback_count), 0) FROM merchant_stats)
+""")
+
+NEW_TRANSACTIONS_SQL = text("""
+    SELECT rowid, id, merchant_id
+    FROM transactions
+    WHERE rowid > :after
+    ORDER BY rowid
+""")
+
+NEW_CHARGEBACKS_SQL = text(f"""
+    SELECT c.rowid, c.id, c.reason_code, {DAILY_LABEL.format("c.chargeback_date")}, t.external_id, t.merchant_id, t.amount_usd
+    FROM chargebacks c
+    LEFT JOIN transactions t ON t.id = c.transaction_id
+    WHERE c.rowid > :after
+    ORDER BY c.rowid
+""")
+
+MERCHANT_RATIOS_SQL = text("""
+    SELECT m.external_id, m.name, s.transaction_count, s.chargeback_count, s.chargeback_ratio
+    FROM merchant_stats s
+    JOIN merchants m ON m.id = s.merchant_id
+    WHERE s.merchant_id IN :merchant_ids
+""").bindparams(bindparam("merchant_ids", expanding=True))
+
+# The inner GROUP BY of WEEKLY_SPIKE_SQL, without its filters: every pair seen in the windows.
+SPIKE_WINDOW_COUNTS_SQL = text("""
+    SELECT
+        merchant_id,
+        reason_code,
+        SUM(CASE WHEN period >= :current_start THEN chargeback_count ELSE 0 END),
+        SUM(CASE WHEN period < :current_start THEN chargeback_count ELSE 0 END)
+    FROM chargeback_daily
+    WHERE period >= :baseline_start AND period < :current_end
+    GROUP BY merchant_id, reason_code
+""")
+
+# Rules track merchants by surrogate key; alerts carry the external id.
+MERCHANT_NAMES_SQL = text("SELECT id, external_id, name FROM merchants")
+
+
+class ResyncNeeded(Exception):
+    pass
+
+
+class AlertRuleEngine:
+    """The three alert rules at default settings, kept current from the rows appended since the last pass."""
+
+    def __init__(self):
+        self.active: dict = {}
+        self.as_of: Optional[date] = None
+        self.synced_at = 0.0
+        self.full_passes = 0
+        self._marks: Optional[tuple] = None
+        self._totals = (0, 0)
+        self._window: dict = {}
+        self._windows: dict = {}
+        self._names: dict = {}
+
+    def evaluate(self, conn: Connection) -> dict:
+        """Bring `active` (alert key -> Alert) up to date and return it. Runs in one read transaction."""
+        with read_snapshot(conn):
+            if (
+                self._marks is None or self.as_of != date.today()
+                or time.monotonic() - self.synced_at > ALERT_STREAM_RESYNC_SECONDS
+            ):
+                return self._full_pass(conn)
+            try:
+                return self._incremental_pass(conn)
+            except ResyncNeeded:
+                return self._full_pass(conn)
+
+    def _full_pass(self, conn: Connection) -> dict:
+        from app.partitions import UNBOUNDED, fact_sources
+        from app.routers.alerts import HIGH_RATIO_SQL, high_ratio_alert, high_value_alert, high_value_statement
+
+        self.full_passes += 1
+        self.as_of = date.today()
+        self._windows = _spike_windows(self.as_of)
+        self._names = _merchant_names(conn)
+        tx_rowid, tx_id, cb_rowid, cb_id = conn.execute(WATERMARKS_SQL).one()
+        _, _, *totals = conn.execute(CHECK_SQL, {"tx_rowid": tx_rowid, "cb_rowid": cb_rowid}).one()
+        self._marks, self._totals = (tx_rowid, tx_id, cb_rowid, cb_id), tuple(totals)
+
+        active = {}
+        for row in conn.execute(HIGH_RATIO_SQL, {"ratio_threshold": MERCHANT_RATIO_ALERT_THRESHOLD}):
+            active[(HIGH_RATIO, row[0])] = high_ratio_alert(row, MERCHANT_RATIO_ALERT_THRESHOLD)
+        self._window = {
+            (merchant_id, reason_code): [current, baseline]
+            for merchant_id, reason_code, current, baseline in conn.execute(SPIKE_WINDOW_COUNTS_SQL, self._windows)
+        }
+        for pair in sorted(self._window, key=self._spike_order):
+            alert = self._spike_alert(pair)
+            if alert is not None:
+                active[self._spike_key(pair)] = alert
+        statement = high_value_statement(fact_sources(conn, UNBOUNDED), UNBOUNDED.bounds)
+        for row in conn.execute(statement, {"threshold": HIGH_VALUE_THRESHOLD_USD}):
+            active.setdefault((HIGH_VALUE, row[0]), high_value_alert(row))
+
+        self.active = active
+        self.synced_at = time.monotonic()
+        return active
+
+    def _incremental_pass(self, conn: Connection) -> dict:
+        from app.routers.alerts import high_ratio_alert, high_value_alert
+
+        tx_rowid, tx_id, cb_rowid, cb_id = self._marks
+        current_tx_id, current_cb_id, *totals = conn.execute(CHECK_SQL, {"tx_rowid": tx_rowid, "cb_rowid": cb_rowid}).one()
+        if current_tx_id != tx_id or current_cb_id != cb_id:
+            raise ResyncNeeded()
+        new_transactions = conn.execute(NEW_TRANSACTIONS_SQL, {"after": MIN_ROWID if tx_rowid is None else tx_rowid}).fetchall()
+        new_chargebacks = conn.execute(NEW_CHARGEBACKS_SQL, {"after": MIN_ROWID if cb_rowid is None else cb_rowid}).fetchall()
+        counted = sum(1 for row in new_chargebacks if row[4] is not None)
+        if tuple(totals) != (self._totals[0] + len(new_transactions), self._totals[1] + counted):
+            raise ResyncNeeded()
+        if new_transactions:
+            tx_rowid, tx_id = new_transactions[-1][0], new_transactions[-1][1]
+        if new_chargebacks:
+            cb_rowid, cb_id = new_chargebacks[-1][0], new_chargebacks[-1][1]
+        self._marks, self._totals = (tx_rowid, tx_id, cb_rowid, cb_id), tuple(totals)
+
+        merchants = {row[2] for row in new_transactions} | {row[5] for row in new_chargebacks if row[5] is not None}
+        if merchants - self._names.keys():
+            self._names = _merchant_names(conn)
+
+        active = dict(self.active)
+        if merchants:
+            for merchant_id in merchants:
+                active.pop((HIGH_RATIO, self._merchant(merchant_id)[0]), None)
+            for row in conn.execute(MERCHANT_RATIOS_SQL, {"merchant_ids": sorted(merchants)}):
+                if row[4] > MERCHANT_RATIO_ALERT_THRESHOLD:
+                    active[(HIGH_RATIO, row[0])] = high_ratio_alert(row, MERCHANT_RATIO_ALERT_THRESHOLD)
+
+        pairs = set()
+        for _, _, reason_code, day, transaction_id, merchant_id, amount_usd in new_chargebacks:
+            if transaction_id is None:
+                continue
+            if self._windows["baseline_start"] <= day < self._windows["current_end"]:
+                counts = self._window.setdefault((merchant_id, reason_code), [0, 0])
+                counts[0 if day >= self._windows["current_start"] else 1] += 1
+                pairs.add((merchant_id, reason_code))
+            if amount_usd is not None and amount_usd > HIGH_VALUE_THRESHOLD_USD and merchant_id in self._names:
+                active.setdefault((HIGH_VALUE, transaction_id), high_value_alert(
+                    (transaction_id, *self._names[merchant_id], sql_round(amount_usd, 2)),
+                ))
+        for pair in pairs:
+            alert = self._spike_alert(pair)
+            if alert is None:
+                active.pop(self._spike_key(pair), None)
+            else:
+                active[self._spike_key(pair)] = alert
+
+        self.active = active
+        return active
+
+    def _merchant(self, merchant_id: int) -> tuple:
+        """External id and name of a merchant's surrogate key."""
+        return self._names.get(merchant_id, (str(merchant_id), str(merchant_id)))
+
+    def _spike_key(self, pair: tuple) -> tuple:
+        """Alert key of a (merchant surrogate key, reason code) pair; keys carry external ids."""
+        return (WEEKLY_SPIKE, self._merchant(pair[0])[0], pair[1])
+
+    def _spike_order(self, pair: tuple) -> tuple:
+        current, baseline = self._window[pair]
+        return (-(current / baseline) if baseline else 0, *pair)
+
+    def _spike_alert(self, pair: tuple) -> Optional[Alert]:
+        from app.routers.alerts import weekly_spike_alert
+
+        current, baseline = self._window[pair]
+        if current < SPIKE_MIN_CHARGEBACKS or baseline <= 0 or current * SPIKE_BASELINE_WINDOWS <= SPIKE_FACTOR * baseline:
+            return None
+        merchant_id, reason_code = pair
+        row = (*self._merchant(merchant_id), reason_code, current, baseline)
+        return weekly_spike_alert(row, self.as_of, SPIKE_WINDOW_DAYS, SPIKE_BASELINE_WINDOWS)
+
+
+def _merchant_names(conn: Connection) -> dict:
+    return {merchant_id: (external_id, name) for merchant_id, external_id, name in conn.execute(MERCHANT_NAMES_SQL)}
+
+
+def _spike_windows(as_of: date) -> dict:
+    from app.routers.alerts import spike_windows
+
+    return spike_windows(as_of, SPIKE_WINDOW_DAYS, SPIKE_BASELINE_WINDOWS)
+
+
+@dataclass(frozen=True)
+class AlertEvent:
+    id: int
+    kind: str
+    key: tuple
+    alert: Alert
+
+    def frame(self) -> str:
+        """The event in `text/event-stream` format."""
+        return f"id: {self.id}\nevent: {self.kind}\ndata: {self.alert.model_dump_json()}\n\n"
+
+
+class AlertStream:
+    def __init__(self, engine: Optional[Engine] = None, replay_events: int = ALERT_STREAM_REPLAY_EVENTS):
+        self.engine = engine
+        self.rules = AlertRuleEngine()
+        self._events: deque = deque(maxlen=replay_events)
+        self._fired: dict = {}
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        data_version.subscribe(lambda _: self._wake.set())
+
+    def start(self, engine: Engine) -> None:
+        """Evaluate against `engine` in the background. Switching engines starts over from a full pass."""
+        with self._poll_lock:
+            if engine is not self.engine:
+                self.engine, self.rules = engine, AlertRuleEngine()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="alert-stream", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            self._wake.set()
+            thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("alert stream evaluation failed")
+            self._wake.wait(ALERT_STREAM_POLL_SECONDS)
+
+    def poll(self) -> list:
+        """Evaluate the rules once and publish what changed. Returns the new events."""
+        with self._poll_lock, self.engine.connect() as conn:
+            active = self.rules.evaluate(conn)
+        with self._lock:
+            events = [self._publish("alert", key, alert) for key, alert in active.items() if key not in self._fired]
+            events += [
+                self._publish("resolved", key, fired.alert) for key, fired in list(self._fired.items()) if key not in active
+            ]
+        if events and self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._notify)
+            except RuntimeError:
+                self._loop = None
+        return events
+
+    def _publish(self, kind: str, key: tuple, alert: Alert) -> AlertEvent:
+        event = AlertEvent(id=next(self._ids), kind=kind, key=key, alert=alert)
+        self._events.append(event)
+        self._last_id = event.id
+        if kind == "alert":
+            self._fired[key] = event
+        else:
+            del self._fired[key]
+        return event
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        if changed is not None:
+            changed.set()
+
+    def replay(self, last_event_id: Optional[int]) -> tuple:
+        """
+        Events a client that saw `last_event_id` has missed, and the id to continue from. A new
+        client, or one whose position is no longer buffered, gets the active alerts instead.
+        """
+        with self._lock:
+            if last_event_id is not None and self._events and self._events[0].id - 1 <= last_event_id <= self._last_id:
+                return self._since(last_event_id), self._last_id
+            return sorted(self._fired.values(), key=lambda event: event.id), self._last_id
+
+    def _since(self, last_event_id: int) -> list:
+        if not self._events or last_event_id >= self._last_id:
+            return []
+        start = max(last_event_id + 1 - self._events[0].id, 0)
+        return list(itertools.islice(self._events, start, None))
+
+    async def frames(self, last_event_id: Optional[int], is_disconnected: Callable[[], Awaitable[bool]]):
+        """SSE frames for one subscriber: what it missed, then each event as it is published."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._changed = loop, asyncio.Event()
+        pending, position = self.replay(last_event_id)
+        yield f"retry: {int(ALERT_STREAM_POLL_SECONDS * 1000)}\n\n"
+        while True:
+            for event in pending:
+                yield event.frame()
+            changed = self._changed
+            # A subscriber that fell behind the replay buffer gets the active alerts again.
+            pending, position = self.replay(position)
+            if pending:
+                continue
+            try:
+                await asyncio.wait_for(changed.wait(), ALERT_STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": keepalive\n\n"
+
+
+alert_stream = AlertStream()
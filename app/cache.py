@@ -0,0 +1,269 @@
+"""
+Response cache for the analytics GET endpoints.
+
+Entries are keyed by path plus canonicalised query string and tagged with the data version that
+produced them. Any write path (seed, bulk ingestion) calls `bump_data_version()`, which makes
+every older entry stale without touching the cache. Eviction is LRU, bounded by both entry count
+and total body bytes. Responses carry a strong ETag (a hash of the body), so a client presenting
+a matching `If-None-Match` gets `304 Not Modified` straight from memory, without running any SQL.
+
+The data version lives in process memory. `DataVersionWatcher` bumps it when another process
+(`scripts/manage.py`, another server worker) commits to the SQLite database, by polling
+`PRAGMA data_version` every DATA_VERSION_POLL_SECONDS. On other databases an entry written
+elsewhere is only noticed once its TTL expires.
+"""
+import hashlib
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlencode
+from sqlalchemy.engine import Engine
+from app.constants import (
+    DATA_VERSION_POLL_SECONDS,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DataVersion:
+    def __init__(self):
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self._value = 0
+        self._listeners: list = []
+
+    @property
+    def current(self) -> int:
+        return self._value
+
+    def subscribe(self, listener: Callable[[int], None]) -> None:
+        """Call `listener(version)` after every bump, on the thread that bumped."""
+        self._listeners.append(listener)
+
+    def bump(self) -> int:
+        with self._lock:
+            self._value = version = next(self._counter)
+        for listener in self._listeners:
+            listener(version)
+        return version
+
+
+data_version = DataVersion()
+
+
+def bump_data_version() -> int:
+    return data_version.bump()
+
+
+class DataVersionWatcher:
+    """
+    Bumps `version` when the database changes under another connection. SQLite changes a
+    connection's `PRAGMA data_version` whenever any other connection commits, including one in
+    another process, so a dedicated connection polled every `interval_seconds` sees every commit.
+    Writes made through this process bump the version themselves; the watcher bumps once more,
+    which only costs the cache entries stored in between.
+    """
+
+    def __init__(self, version: DataVersion = data_version, interval_seconds: float = DATA_VERSION_POLL_SECONDS):
+        self.version = version
+        self.interval_seconds = interval_seconds
+        self._connection = None
+        self._seen: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, engine: Engine) -> None:
+        if self.interval_seconds <= 0 or engine.dialect.name != "sqlite" or self._thread is not None:
+            return
+        self.watch(engine)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="data-version", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def watch(self, engine: Engine) -> None:
+        """Open the dedicated connection, outside `engine`'s pool, and take the current value as seen."""
+        connection = engine.raw_connection()
+        connection.detach()
+        self._connection = connection
+        self._seen = self._read()
+
+    def check(self) -> bool:
+        """Bump the version if another connection committed since the last check."""
+        value = self._read()
+        if value == self._seen:
+            return False
+        self._seen = value
+        self.version.bump()
+        return True
+
+    def _read(self) -> int:
+        cursor = self._connection.cursor()
+        try:
+            return cursor.execute("PRAGMA data_version").fetchone()[0]
+        finally:
+            cursor.close()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("data version check failed")
+
+
+watcher = DataVersionWatcher()
+
+
+@dataclass
+class CachedResponse:
+    version: int
+    stored_at: float
+    etag: str
+    status: int
+    headers: list
+    body: bytes
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, version: int) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version or time.monotonic() - entry.stored_at > self.ttl_seconds:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry: CachedResponse) -> None:
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(entry.body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key) -> None:
+        self._bytes -= len(self._entries.pop(key).body)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCacheMiddleware:
+    """Pure ASGI middleware serving cached GET responses for the paths matched by `path_patterns`."""
+
+    def __init__(self, app, path_patterns: list, cache: ResponseCache = response_cache, version: DataVersion = data_version):
+        self.app = app
+        self.path_patterns = path_patterns
+        self.cache = cache
+        self.version = version
+
+    def _cacheable(self, scope) -> bool:
+        return (
+            scope["type"] == "http"
+            and scope["method"] == "GET"
+            and any(pattern.match(scope["path"]) for pattern in self.path_patterns)
+        )
+
+    async def __call__(self, scope, receive, send):
+        if not self._cacheable(scope):
+            await self.app(scope, receive, send)
+            return
+
+        query = urlencode(sorted(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)))
+        key = (scope["path"], query)
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        if_none_match = headers.get("if-none-match")
+        version = self.version.current
+
+        entry = self.cache.get(key, version)
+        if entry is not None:
+            await self._replay(send, entry, if_none_match, b"HIT")
+            return
+
+        start = {}
+        chunks = []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, capture)
+        body = b"".join(chunks)
+        entry = CachedResponse(
+            version=version,
+            stored_at=time.monotonic(),
+            etag=make_etag(body),
+            status=start["status"],
+            headers=[(k, v) for k, v in start.get("headers", []) if k.lower() not in (b"etag", b"cache-control")],
+            body=body,
+        )
+        if entry.status == 200 and version == self.version.current:
+            self.cache.put(key, entry)
+        await self._replay(send, entry, if_none_match, b"MISS")
+
+    async def _replay(self, send, entry: CachedResponse, if_none_match: Optional[str], outcome: bytes):
+        validators = [(b"x-cache", outcome)]
+        if entry.status == 200:
+            validators += [(b"etag", entry.etag.encode("latin-1")), (b"cache-control", b"no-cache")]
+        if entry.status == 200 and _etag_matches(if_none_match, entry.etag):
+            kept = [(k, v) for k, v in entry.headers if k.lower() not in (b"content-length", b"content-type")]
+            await send({"type": "http.response.start", "status": 304, "headers": kept + validators})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send({"type": "http.response.start", "status": entry.status, "headers": entry.headers + validators})
+        await send({"type": "http.response.body", "body": entry.body})
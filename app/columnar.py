@@ -0,0 +1,326 @@
+"""
+Optional in-memory columnar engine for the group-by endpoints.
+
+`transactions` and `chargebacks` are mirrored into NumPy arrays: the stored categorical codes (see
+`app/encoding.py`) are remapped to dense integer codes, decoded only when a snapshot is taken, and
+chargebacks carry the row index of their transaction instead of its id. `/segments/high-risk`, `/reason-codes` and `/win-rate`
+are then answered with `np.bincount` group-bys (`/trends` reads the bucket tables in `app/rollups.py`). Each method of `ColumnarSnapshot`
+returns the same rows, in the same order, as the router's SQL statement.
+
+Both tables are append-mostly (seed and bulk ingestion only add rows), so a refresh loads the
+rows whose rowid is past the last one loaded. If rows were deleted or rewritten, the watermark no
+longer lines up with the table and the mirror is rebuilt from scratch.
+
+Enabled with `MONTEVERDE_ANALYTICS_ENGINE=columnar`. It needs numpy, which is not a hard
+dependency.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from app.cache import data_version
+from app.constants import ANALYTICS_ENGINE, COLUMNAR_LOAD_BATCH_SIZE, COLUMNAR_RECHECK_SECONDS
+from app.database import read_snapshot
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ANALYTICS_ENGINES = {"sql", "columnar"}
+MIN_ROWID = -(1 << 63)
+
+DICTIONARY_VALUES_SQL = text("SELECT id, value FROM dictionary")
+REASON_DESCRIPTIONS_SQL = text("SELECT code, description FROM reason_codes")
+
+
+def sql_round(value: float, digits: int) -> float:
+    """Round like SQLite's ROUND(): half away from zero on the 15-significant-digit decimal form."""
+    return float(Decimal(f"{value:.15g}").quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP))
+
+
+def get_analytics_engine() -> str:
+    return ANALYTICS_ENGINE
+
+
+def check_analytics_engine(engine: str = ANALYTICS_ENGINE) -> None:
+    if engine not in ANALYTICS_ENGINES:
+        raise RuntimeError(f"MONTEVERDE_ANALYTICS_ENGINE must be one of: {', '.join(sorted(ANALYTICS_ENGINES))}")
+    if engine == "columnar" and np is None:
+        raise RuntimeError("MONTEVERDE_ANALYTICS_ENGINE=columnar requires numpy (pip install numpy)")
+
+
+class Column:
+    """Growable array. `view()` is a zero-copy slice that later appends never modify."""
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self._buffer = np.empty(1024, dtype=dtype)
+        self._length = 0
+
+    def append(self, values) -> None:
+        values = np.asarray(values, dtype=self.dtype)
+        needed = self._length + len(values)
+        if needed > len(self._buffer):
+            grown = np.empty(max(needed, 2 * len(self._buffer)), dtype=self.dtype)
+            grown[:self._length] = self._buffer[:self._length]
+            self._buffer = grown
+        self._buffer[self._length:needed] = values
+        self._length = needed
+
+    def view(self):
+        return self._buffer[:self._length]
+
+
+class Dictionary:
+    """Dictionary encoding for one categorical column: value -> dense integer code."""
+
+    def __init__(self):
+        self.codes: dict = {}
+        self.values: list = []
+
+    def _add(self, value) -> int:
+        code = self.codes[value] = len(self.values)
+        self.values.append(value)
+        return code
+
+    def encode(self, values) -> list:
+        codes = self.codes
+        return [codes[v] if v in codes else self._add(v) for v in values]
+
+    def code(self, value) -> int:
+        return self.codes.get(value, -1)
+
+
+class _MirroredTable:
+    """Rows of one table loaded so far, tracked by a (rowid, primary key) watermark."""
+
+    table = ""
+    load_columns = ""
+
+    def __init__(self):
+        self.reset()
+        self.load_sql = text(f"""
+            SELECT rowid, {self.load_columns}
+            FROM {self.table}
+            WHERE rowid > :after
+            ORDER BY rowid
+        """).execution_options(yield_per=COLUMNAR_LOAD_BATCH_SIZE)
+        self.check_sql = text(f"""
+            SELECT
+                (SELECT COUNT(*) FROM {self.table}),
+                (SELECT COUNT(*) FROM {self.table} WHERE rowid > :after),
+                (SELECT id FROM {self.table} WHERE rowid = :after)
+        """)
+
+    def reset(self) -> None:
+        self.rows = 0
+        self.watermark: Optional[tuple] = None
+
+    def append(self, rows: list) -> None:
+        raise NotImplementedError
+
+    def _load(self, conn: Connection, after: int) -> None:
+        for part in conn.execute(self.load_sql, {"after": after}).partitions():
+            self.append(part)
+            self.rows += len(part)
+            self.watermark = (part[-1][0], part[-1][1])
+
+    def sync(self, conn: Connection, force: bool = False) -> bool:
+        """Load rows appended since the last sync, or everything if the table was rewritten. True on a full reload."""
+        if not force and self.watermark is not None:
+            rowid, pk = self.watermark
+            total, newer, current_pk = conn.execute(self.check_sql, {"after": rowid}).one()
+            if current_pk == pk and total == self.rows + newer:
+                if newer:
+                    self._load(conn, rowid)
+                return False
+        self.reset()
+        self._load(conn, MIN_ROWID)
+        return True
+
+
+class _TransactionColumns(_MirroredTable):
+    table = "transactions"
+    load_columns = "id, country_id, product_category_id, payment_method_id"
+    dimensions = {"country": 2, "category": 3, "payment_method": 4}
+
+    def reset(self) -> None:
+        super().reset()
+        self.index: dict = {}
+        self.dictionaries = {name: Dictionary() for name in self.dimensions}
+        self.columns = {name: Column(np.int32) for name in self.dimensions}
+
+    def append(self, rows: list) -> None:
+        self.index.update((row[1], self.rows + i) for i, row in enumerate(rows))
+        for name, position in self.dimensions.items():
+            self.columns[name].append(self.dictionaries[name].encode(row[position] for row in rows))
+
+
+class _ChargebackColumns(_MirroredTable):
+    table = "chargebacks"
+    load_columns = "id, transaction_id, reason_code, status_id, amount"
+
+    def __init__(self, transactions: _TransactionColumns):
+        self.transactions = transactions
+        super().__init__()
+
+    def reset(self) -> None:
+        super().reset()
+        self.reasons = Dictionary()
+        self.statuses = Dictionary()
+        self.transaction = Column(np.int64)
+        self.reason = Column(np.int32)
+        self.status = Column(np.int32)
+        self.amount = Column(np.float64)
+
+    def append(self, rows: list) -> None:
+        tx_index = self.transactions.index
+        self.transaction.append([tx_index.get(row[2], -1) for row in rows])
+        self.reason.append(self.reasons.encode(row[3] for row in rows))
+        self.status.append(self.statuses.encode(row[4] for row in rows))
+        self.amount.append([row[5] for row in rows])
+
+
+def segment_sort_key(row) -> tuple:
+    return (-row[4], row[1])
+
+
+def reason_code_sort_key(row) -> tuple:
+    return (-row[2], row[0], row[1])
+
+
+def win_rate_sort_key(row) -> tuple:
+    return (row[6] is None, -(row[6] or 0.0), row[0], row[1])
+
+
+def _page(rows: list, key, limit: int, offset: int, after: Optional[tuple]) -> list:
+    rows.sort(key=key)
+    if after is not None:
+        rows = [row for row in rows if key(row) > after]
+    return rows[offset:offset + limit]
+
+
+@dataclass(frozen=True)
+class ColumnarSnapshot:
+    dimension_codes: dict
+    dimension_values: dict
+    cb_transaction: object
+    cb_reason: object
+    cb_status: object
+    cb_amount: object
+    reason_values: list
+    status_codes: dict
+
+    def segments(self, dimension: str, threshold: float, limit: int, offset: int, after: Optional[tuple] = None) -> list:
+        codes = self.dimension_codes[dimension]
+        values = self.dimension_values[dimension]
+        tx_counts = np.bincount(codes)
+        linked = self.cb_transaction[self.cb_transaction >= 0]
+        cb_counts = np.bincount(codes[linked], minlength=len(tx_counts))
+        rows = []
+        for code in np.flatnonzero(tx_counts):
+            transactions, chargebacks = int(tx_counts[code]), int(cb_counts[code])
+            ratio = sql_round(chargebacks / transactions * 100, 4)
+            if ratio > threshold:
+                rows.append((dimension, values[code], transactions, chargebacks, ratio))
+        return _page(rows, segment_sort_key, limit, offset, after)
+
+    def reason_codes(self, limit: int, offset: int, after: Optional[tuple] = None) -> list:
+        total = len(self.cb_reason)
+        counts = np.bincount(self.cb_reason)
+        amounts = np.bincount(self.cb_reason, weights=self.cb_amount)
+        rows = [
+            (*self.reason_values[code], int(counts[code]), sql_round(float(amounts[code]), 2),
+             sql_round(int(counts[code]) / total * 100, 2))
+            for code in np.flatnonzero(counts)
+        ]
+        return _page(rows, reason_code_sort_key, limit, offset, after)
+
+    def _count_status(self, status: str, minlength: int):
+        selected = self.cb_reason[self.cb_status == self.status_codes.get(status, -1)]
+        return np.bincount(selected, minlength=minlength)
+
+    def win_rate(self, limit: int, offset: int, after: Optional[tuple] = None) -> list:
+        totals = np.bincount(self.cb_reason)
+        won, lost, open_ = (self._count_status(s, len(totals)) for s in ("won", "lost", "open"))
+        rows = []
+        for code in np.flatnonzero(totals):
+            resolved = int(won[code]) + int(lost[code])
+            rate = sql_round(int(won[code]) / resolved * 100, 2) if resolved else None
+            rows.append((*self.reason_values[code], int(totals[code]), int(won[code]), int(lost[code]), int(open_[code]), rate))
+        return _page(rows, win_rate_sort_key, limit, offset, after)
+
+
+def _decodings(conn: Connection) -> tuple:
+    """Value of every dictionary code and description of every reason code."""
+    return dict(conn.execute(DICTIONARY_VALUES_SQL).all()), dict(conn.execute(REASON_DESCRIPTIONS_SQL).all())
+
+
+class ColumnarStore:
+    """
+    Process-wide mirror of `transactions` and `chargebacks`. `snapshot()` returns an immutable view
+    that stays valid while later refreshes append to the columns.
+    """
+
+    def __init__(self, recheck_seconds: float = COLUMNAR_RECHECK_SECONDS):
+        self.recheck_seconds = recheck_seconds
+        self._lock = threading.Lock()
+        self._snapshot: Optional[ColumnarSnapshot] = None
+        self._checked_version: Optional[int] = None
+        self._checked_at = 0.0
+        self.full_reloads = 0
+        self.transactions = self.chargebacks = None
+
+    def _fresh(self, version: int) -> bool:
+        return (
+            self._snapshot is not None
+            and self._checked_version == version
+            and time.monotonic() - self._checked_at < self.recheck_seconds
+        )
+
+    def snapshot(self, conn: Connection) -> ColumnarSnapshot:
+        """
+        Current snapshot, refreshed first if the data version moved or `recheck_seconds` passed
+        (writes made by other processes are not reflected in the data version).
+        """
+        version = data_version.current
+        if self._fresh(version):
+            return self._snapshot
+        with self._lock:
+            if not self._fresh(version):
+                self._refresh(conn)
+                self._checked_version = version
+                self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def _refresh(self, conn: Connection) -> None:
+        """
+        Sync both tables and the decodings in one read transaction: a chargeback committed after its
+        transaction was synced would otherwise be mirrored without it, and never be revisited.
+        """
+        if self.transactions is None:
+            self.transactions = _TransactionColumns()
+            self.chargebacks = _ChargebackColumns(self.transactions)
+        with read_snapshot(conn):
+            reloaded = self.transactions.sync(conn)
+            if self.chargebacks.sync(conn, force=reloaded) or reloaded:
+                self.full_reloads += 1
+            values, descriptions = _decodings(conn)
+        tx, cb = self.transactions, self.chargebacks
+        self._snapshot = ColumnarSnapshot(
+            dimension_codes={name: column.view() for name, column in tx.columns.items()},
+            dimension_values={name: [values[code] for code in d.values] for name, d in tx.dictionaries.items()},
+            cb_transaction=cb.transaction.view(),
+            cb_reason=cb.reason.view(),
+            cb_status=cb.status.view(),
+            cb_amount=cb.amount.view(),
+            reason_values=[(code, descriptions[code]) for code in cb.reasons.values],
+            status_codes={values[code]: dense for code, dense in cb.statuses.codes.items()},
+        )
+
+
+columnar_store = ColumnarStore()
@@ -1,16 +1,88 @@
+import os
+
+# SQLAlchemy URL of the primary database (see app/database.py).
+DATABASE_URL = os.environ.get("MONTEVERDE_DATABASE_URL", "sqlite:///./monteverde.db")
+
+# Units per USD. Seeds the `fx_rates` table when it is created; conversions read the table.
 CURRENCY_TO_USD = {"MXN": 17.0, "COP": 4000.0, "CLP": 950.0}
 HIGH_VALUE_THRESHOLD_USD = 500.0
 MERCHANT_RATIO_ALERT_THRESHOLD = 1.5
+REPEAT_OFFENDER_MIN_CHARGEBACKS = 3
+SEGMENT_RATIO_THRESHOLD = 1.5
+# BIN_PATTERN: a card BIN with BIN_MIN_CHARGEBACKS+ chargebacks within BIN_WINDOW_HOURS.
+BIN_WINDOW_HOURS = 48
+BIN_MIN_CHARGEBACKS = 2
+# WEEKLY_SPIKE: a merchant × reason code whose count in the last SPIKE_WINDOW_DAYS exceeds
+# SPIKE_FACTOR × its average over the SPIKE_BASELINE_WINDOWS windows before it.
+SPIKE_WINDOW_DAYS = 7
+SPIKE_BASELINE_WINDOWS = 1
+SPIKE_FACTOR = 2.0
+SPIKE_MIN_CHARGEBACKS = 3
+ALERT_SIGNAL_WORKERS = int(os.environ.get("MONTEVERDE_ALERT_SIGNAL_WORKERS", "6"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("MONTEVERDE_RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("MONTEVERDE_RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("MONTEVERDE_RESPONSE_CACHE_TTL_SECONDS", "300"))
+# How often the API checks for commits made by other processes (0 disables; see app/cache.py).
+DATA_VERSION_POLL_SECONDS = float(os.environ.get("MONTEVERDE_DATA_VERSION_POLL_SECONDS", "1"))
+
+# Read-path connection pool. Each pooled connection is query-only and gets the pragmas of the
+# selected profile; keep it at least as large as ALERT_SIGNAL_WORKERS' concurrent signals.
+READ_POOL_SIZE = int(os.environ.get("MONTEVERDE_READ_POOL_SIZE", "8"))
+READ_POOL_MAX_OVERFLOW = int(os.environ.get("MONTEVERDE_READ_POOL_MAX_OVERFLOW", str(READ_POOL_SIZE)))
+SQLITE_STATEMENT_CACHE_SIZE = int(os.environ.get("MONTEVERDE_SQLITE_STATEMENT_CACHE_SIZE", "256"))
+SQLITE_PRAGMA_PROFILES = {
+    "default": {"busy_timeout": 5000},
+    "analytics": {"busy_timeout": 5000, "cache_size": -65536, "mmap_size": 268435456, "temp_store": "MEMORY"},
+    "large": {"busy_timeout": 5000, "cache_size": -524288, "mmap_size": 4294967296, "temp_store": "MEMORY"},
+}
+SQLITE_PRAGMA_PROFILE = os.environ.get("MONTEVERDE_SQLITE_PRAGMA_PROFILE", "analytics")
+
+ANALYTICS_ENGINE = os.environ.get("MONTEVERDE_ANALYTICS_ENGINE", "sql")
+COLUMNAR_RECHECK_SECONDS = float(os.environ.get("MONTEVERDE_COLUMNAR_RECHECK_SECONDS", "5"))
+COLUMNAR_LOAD_BATCH_SIZE = 50000
+EXPORT_CHUNK_ROWS = 2000
+
+# Request/SQL instrumentation exposed at GET /metrics.
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_MS = float(os.environ.get("MONTEVERDE_SLOW_QUERY_MS", "250"))
+SLOW_QUERY_SAMPLES = int(os.environ.get("MONTEVERDE_SLOW_QUERY_SAMPLES", "20"))
+SLOW_QUERY_LOG = os.environ.get("MONTEVERDE_SLOW_QUERY_LOG", "")
+
+# Monthly partitions (see app/partitions.py). A month can be archived once its last day is
+# PARTITION_CLOSE_AFTER_DAYS in the past: by then no new chargebacks are expected against it.
+PARTITION_CLOSE_AFTER_DAYS = int(os.environ.get("MONTEVERDE_PARTITION_CLOSE_AFTER_DAYS", "120"))
+PARTITION_DIR = os.environ.get("MONTEVERDE_PARTITION_DIR", "./partitions")
+
+# Background jobs (see app/jobs.py). JOB_WORKERS processes run the jobs; at most JOB_MAX_PENDING may be
+# queued or running, and a finished job's result is kept for JOB_RESULT_TTL_SECONDS.
+JOB_WORKERS = int(os.environ.get("MONTEVERDE_JOB_WORKERS", "2"))
+JOB_MAX_PENDING = int(os.environ.get("MONTEVERDE_JOB_MAX_PENDING", "64"))
+JOB_RESULT_TTL_SECONDS = float(os.environ.get("MONTEVERDE_JOB_RESULT_TTL_SECONDS", "900"))
+# SQLite virtual-machine instructions between two cancellation checks of a running query.
+JOB_CANCEL_CHECK_INSTRUCTIONS = 1_000_000
+
+# Precomputed alerts, recommendations and fraud patterns (see app/precompute.py). The snapshot is rebuilt
+# every PRECOMPUTE_INTERVAL_SECONDS (0 disables the scheduler) and once writes have been quiet for
+# PRECOMPUTE_DEBOUNCE_SECONDS; one older than PRECOMPUTE_MAX_AGE_SECONDS is not served.
+PRECOMPUTE_INTERVAL_SECONDS = float(os.environ.get("MONTEVERDE_PRECOMPUTE_INTERVAL_SECONDS", "60"))
+PRECOMPUTE_MAX_AGE_SECONDS = float(os.environ.get("MONTEVERDE_PRECOMPUTE_MAX_AGE_SECONDS", "300"))
+PRECOMPUTE_DEBOUNCE_SECONDS = 0.5
 
+# GET /api/alerts/stream (see app/alert_stream.py). The rule engine checks for new rows on every data
+# version bump and every ALERT_STREAM_POLL_SECONDS, and re-evaluates everything every
+# ALERT_STREAM_RESYNC_SECONDS. The last ALERT_STREAM_REPLAY_EVENTS events can be resumed with Last-Event-ID.
+ALERT_STREAM_POLL_SECONDS = float(os.environ.get("MONTEVERDE_ALERT_STREAM_POLL_SECONDS", "5"))
+ALERT_STREAM_RESYNC_SECONDS = float(os.environ.get("MONTEVERDE_ALERT_STREAM_RESYNC_SECONDS", "300"))
+ALERT_STREAM_REPLAY_EVENTS = int(os.environ.get("MONTEVERDE_ALERT_STREAM_REPLAY_EVENTS", "1000"))
+ALERT_STREAM_HEARTBEAT_SECONDS = 15.0
 
-def currency_to_usd_sql(amount_col: str = "t.amount", currency_col: str = "t.currency") -> str:
-    cases = "\n".join(
-        f"            WHEN '{currency}' THEN {rate}"
-        for currency, rate in CURRENCY_TO_USD.items()
-    )
-    return f"""(
-            {amount_col} / CASE {currency_col}
-{cases}
-            ELSE 1.0
-            END
-        )"""
+# Sketches behind GET /api/distributions (see app/sketches.py). Distinct customers use HyperLogLog with
+# 2^SKETCH_HLL_PRECISION registers (relative standard error 1.04 / sqrt(2^p)), kept as an exact set of
+# customer hashes up to SKETCH_HLL_SPARSE_LIMIT. Amount quantiles are within SKETCH_QUANTILE_RELATIVE_ACCURACY
+# of the true amount. Each process reads the days rewritten since its last read on a data version bump or
+# every SKETCH_RECHECK_SECONDS.
+SKETCH_HLL_PRECISION = 12
+SKETCH_HLL_SPARSE_LIMIT = 128
+SKETCH_QUANTILE_RELATIVE_ACCURACY = 0.01
+SKETCH_RECHECK_SECONDS = float(os.environ.get("MONTEVERDE_SKETCH_RECHECK_SECONDS", "5"))
+SKETCH_FOLD_BATCH_SIZE = 50000
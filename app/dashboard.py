@@ -0,0 +1,228 @@
+"""
+Shared chargeback working set for `GET /api/dashboard`.
+
+Reason codes, win rate, high-risk segments, recommendations, the high-value alert and BIN patterns
+each read every chargeback, most of them joined to its transaction. The dashboard reads that join
+once, inside the same read transaction as its other panels, and `load_working_set` folds each row
+into every panel's counters as the cursor streams it: only the aggregates, the high-value hits and
+the BIN bursts are kept, never the rows. Every `WorkingSet` method returns the same rows, in the
+same order, as the statement of the endpoint it stands in for (`HIGH_VALUE_SQL` has no ORDER BY;
+here its rows follow card BIN order). Counters are keyed on dictionary codes and merchant surrogate
+keys, decoded per panel row.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from app.columnar import reason_code_sort_key, segment_sort_key, sql_round, win_rate_sort_key
+from app.constants import BIN_MIN_CHARGEBACKS, BIN_WINDOW_HOURS, HIGH_VALUE_THRESHOLD_USD
+from app.detection import detect_bin_bursts
+from app.partitions import HOT, UNBOUNDED, DateRange, range_condition, union_all
+
+# Positions in a working set row.
+(CB_REASON_CODE, CB_STATUS, CB_AMOUNT, CB_DATE,
+ TX_ID, TX_MERCHANT_ID, TX_CARD_BIN, TX_COUNTRY, TX_CATEGORY, TX_PAYMENT_METHOD, TX_AMOUNT_USD) = range(11)
+
+DIMENSION_COLUMNS = {
+    "country": ("country_id", TX_COUNTRY),
+    "category": ("product_category_id", TX_CATEGORY),
+    "payment_method": ("payment_method_id", TX_PAYMENT_METHOD),
+}
+
+# A LEFT JOIN keeps chargebacks without a transaction, which the chargeback-only panels still count.
+# The ORDER BY is the one burst detection needs.
+WORKING_SET_SQL = text("""
+    SELECT
+        c.reason_code,
+        c.status_id,
+        c.amount,
+        c.chargeback_date,
+        t.external_id,
+        t.merchant_id,
+        t.card_bin,
+        t.country_id,
+        t.product_category_id,
+        t.payment_method_id,
+        t.amount_usd
+    FROM chargebacks c
+    LEFT JOIN transactions t ON t.id = c.transaction_id
+    ORDER BY t.card_bin, c.chargeback_date, c.id
+""").execution_options(yield_per=2000)
+
+PARTITIONED_WORKING_SET_SELECT = """
+        SELECT
+            c.reason_code, c.status_id, c.amount, c.chargeback_date,
+            t.external_id, t.merchant_id, t.card_bin, t.country_id, t.product_category_id, t.payment_method_id,
+            t.amount_usd, c.id AS chargeback_id
+        FROM {chargebacks} c
+        LEFT JOIN {transactions} t ON t.id = c.transaction_id
+        WHERE {dates}"""
+
+# One GROUP BY per dimension, each answered from its dimension index.
+TRANSACTION_COUNTS_SELECT = " UNION ALL ".join(
+    f"SELECT '{dimension}' AS dimension, {column} AS value, COUNT(*) AS n FROM {{transactions}} GROUP BY {column}"
+    for dimension, (column, _) in DIMENSION_COLUMNS.items()
+)
+TRANSACTION_COUNTS_SQL = text(union_all(TRANSACTION_COUNTS_SELECT, (HOT,)))
+
+MERCHANT_NAMES_SQL = text("SELECT id, external_id, name FROM merchants")
+DICTIONARY_VALUES_SQL = text("SELECT id, value FROM dictionary")
+REASON_DESCRIPTIONS_SQL = text("SELECT code, description FROM reason_codes")
+
+
+@lru_cache(maxsize=256)
+def working_set_statement(sources: tuple, bounds: tuple):
+    """WORKING_SET_SQL over `sources`, for chargebacks dated inside a range of shape `bounds`."""
+    if sources == (HOT,) and bounds == (False, False):
+        return WORKING_SET_SQL
+    partials = union_all(PARTITIONED_WORKING_SET_SELECT, sources, dates=range_condition("c.chargeback_date", bounds))
+    return text(f"""
+    SELECT
+        reason_code, status_id, amount, chargeback_date,
+        external_id, merchant_id, card_bin, country_id, product_category_id, payment_method_id, amount_usd
+    FROM ({partials})
+    ORDER BY card_bin, chargeback_date, chargeback_id
+""").execution_options(yield_per=2000)
+
+
+@lru_cache(maxsize=256)
+def transaction_counts_statement(sources: tuple):
+    if sources == (HOT,):
+        return TRANSACTION_COUNTS_SQL
+    return text(f"""
+    SELECT dimension, value, SUM(n)
+    FROM ({union_all(TRANSACTION_COUNTS_SELECT, sources)})
+    GROUP BY dimension, value
+""")
+
+
+def load_working_set(
+    conn: Connection,
+    sources: tuple = (HOT,),
+    dates: DateRange = UNBOUNDED,
+    high_value_threshold: float = HIGH_VALUE_THRESHOLD_USD,
+    time_window_hours: int = BIN_WINDOW_HOURS,
+    min_count: int = BIN_MIN_CHARGEBACKS,
+) -> "WorkingSet":
+    """Aggregate every working-set panel in one pass over the chargeback ⨝ transaction cursor."""
+    values = dict(conn.execute(DICTIONARY_VALUES_SQL).all())
+    # Status code -> position of its counter in a reason group.
+    counters = {code: 2 + i for i, status in enumerate(("won", "lost", "open"))
+                for code, value in values.items() if value == status}
+    by_reason: dict = {}
+    segments = {dimension: Counter() for dimension in DIMENSION_COLUMNS}
+    merchant_reasons: Counter = Counter()
+    high_value = []
+    total = 0
+
+    def timeline():
+        nonlocal total
+        for row in conn.execute(working_set_statement(sources, dates.bounds), dates.params):
+            total += 1
+            group = by_reason.get(row[CB_REASON_CODE])
+            if group is None:
+                group = by_reason[row[CB_REASON_CODE]] = [0, 0.0, 0, 0, 0]
+            group[0] += 1
+            group[1] += row[CB_AMOUNT]
+            counter = counters.get(row[CB_STATUS])
+            if counter is not None:
+                group[counter] += 1
+            if row[TX_ID] is None:
+                continue
+            for dimension, (_, position) in DIMENSION_COLUMNS.items():
+                segments[dimension][row[position]] += 1
+            merchant_reasons[row[TX_MERCHANT_ID], row[CB_REASON_CODE]] += 1
+            if row[TX_AMOUNT_USD] is not None and row[TX_AMOUNT_USD] > high_value_threshold:
+                high_value.append((row[TX_ID], row[TX_MERCHANT_ID], row[TX_AMOUNT_USD]))
+            yield row[TX_CARD_BIN], row[CB_DATE], row[TX_MERCHANT_ID], row[CB_AMOUNT]
+
+    # Burst detection pulls the rows in card BIN order; the other panels are counted on the way.
+    bursts = list(detect_bin_bursts(timeline(), time_window_hours=time_window_hours, min_count=min_count))
+    return WorkingSet(
+        chargeback_count=total,
+        by_reason=by_reason,
+        segment_chargebacks=segments,
+        merchant_reasons=merchant_reasons,
+        high_value_hits=high_value,
+        bursts=bursts,
+        merchant_names={row[0]: (row[1], row[2]) for row in conn.execute(MERCHANT_NAMES_SQL)},
+        values=values,
+        descriptions=dict(conn.execute(REASON_DESCRIPTIONS_SQL).all()),
+    )
+
+
+def transaction_counts(conn: Connection, sources: tuple = (HOT,)) -> dict:
+    """`dimension -> {segment value code -> transaction count}` for the segments panel."""
+    counts = {dimension: {} for dimension in DIMENSION_COLUMNS}
+    for dimension, value, count in conn.execute(transaction_counts_statement(sources)):
+        counts[dimension][value] = count
+    return counts
+
+
+@dataclass(frozen=True)
+class WorkingSet:
+    chargeback_count: int
+    # Reason code -> [count, amount, won, lost, open].
+    by_reason: dict
+    # Dimension -> Counter of chargebacks per segment value code.
+    segment_chargebacks: dict
+    # (merchant surrogate key, reason code) -> chargebacks.
+    merchant_reasons: Counter
+    # (transaction external id, merchant surrogate key, amount_usd) over the high-value threshold.
+    high_value_hits: list
+    bursts: list
+    # Merchant surrogate key -> (external id, name).
+    merchant_names: dict
+    # Dictionary code -> value, and reason code -> description.
+    values: dict
+    descriptions: dict
+
+    def reason_codes(self, limit: int) -> list:
+        total = self.chargeback_count
+        rows = [
+            (code, self.descriptions[code], count, sql_round(amount, 2), sql_round(count / total * 100, 2))
+            for code, (count, amount, _, _, _) in self.by_reason.items()
+        ]
+        return sorted(rows, key=reason_code_sort_key)[:limit]
+
+    def win_rate(self, limit: int) -> list:
+        rows = []
+        for code, (count, _, won, lost, open_) in self.by_reason.items():
+            rate = sql_round(won / (won + lost) * 100, 2) if won + lost else None
+            rows.append((code, self.descriptions[code], count, won, lost, open_, rate))
+        return sorted(rows, key=win_rate_sort_key)[:limit]
+
+    def segments(self, dimension: str, transactions: dict, threshold: float, limit: int) -> list:
+        chargebacks = self.segment_chargebacks[dimension]
+        rows = []
+        for code, transaction_count in transactions.items():
+            ratio = sql_round(chargebacks[code] / transaction_count * 100, 4)
+            if ratio > threshold:
+                rows.append((dimension, self.values[code], transaction_count, chargebacks[code], ratio))
+        return sorted(rows, key=segment_sort_key)[:limit]
+
+    def recommendations(self, limit: int) -> list:
+        """Dominant reason code per merchant: highest count, ties to the lowest code."""
+        dominant: dict = {}
+        for (merchant_id, reason_code), count in self.merchant_reasons.items():
+            if merchant_id not in self.merchant_names:
+                continue
+            best = dominant.get(merchant_id)
+            if best is None or (-count, reason_code) < (-best[1], best[0]):
+                dominant[merchant_id] = (reason_code, count)
+        rows = [
+            (*self.merchant_names[merchant_id], reason_code, count)
+            for merchant_id, (reason_code, count) in dominant.items()
+        ]
+        return sorted(rows, key=lambda row: (-row[3], row[0]))[:limit]
+
+    def high_value(self) -> list:
+        return [
+            (transaction_id, *self.merchant_names[merchant_id], sql_round(amount_usd, 2))
+            for transaction_id, merchant_id, amount_usd in self.high_value_hits
+            if merchant_id in self.merchant_names
+        ]
+
+    def bin_patterns(self, limit: int) -> list:
+        return sorted(self.bursts, key=lambda b: (-b.chargeback_count, b.card_bin))[:limit]
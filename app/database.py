@@ -1,10 +1,73 @@
-from sqlalchemy import create_engine, text
+from contextlib import contextmanager
+from fastapi import Depends
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from app.constants import (
+    DATABASE_URL,
+    READ_POOL_MAX_OVERFLOW,
+    READ_POOL_SIZE,
+    SQLITE_PRAGMA_PROFILE,
+    SQLITE_PRAGMA_PROFILES,
+    SQLITE_STATEMENT_CACHE_SIZE,
+)
+from app.metrics import InstrumentedConnection, instrument_engine
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./monteverde.db"
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+def apply_pragmas(dbapi_connection, pragmas: dict) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def create_read_engine(
+    url: str,
+    pool_size: int = READ_POOL_SIZE,
+    max_overflow: int = READ_POOL_MAX_OVERFLOW,
+    profile: str = SQLITE_PRAGMA_PROFILE,
+) -> Engine:
+    """
+    Engine for the analytics read path: a fixed pool of query-only connections, each configured
+    with the pragma `profile` from `SQLITE_PRAGMA_PROFILES` and a large prepared-statement cache.
+    Statements and fetched rows are recorded by `app.metrics`.
+    """
+    read_engine = create_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=False,
+        connect_args={
+            "check_same_thread": False,
+            "cached_statements": SQLITE_STATEMENT_CACHE_SIZE,
+            "factory": InstrumentedConnection,
+        },
+    )
+    pragmas = {**SQLITE_PRAGMA_PROFILES[profile], "query_only": "ON"}
+
+    @event.listens_for(read_engine, "connect")
+    def _configure_read_connection(dbapi_connection, _):
+        apply_pragmas(dbapi_connection, pragmas)
+
+    return instrument_engine(read_engine)
+
+
+def create_write_engine(url: str) -> Engine:
+    """Engine for the seed and ingestion paths: WAL mode, so readers proceed during a bulk load."""
+    write_engine = create_engine(url, connect_args={"check_same_thread": False, "factory": InstrumentedConnection})
+
+    @event.listens_for(write_engine, "connect")
+    def _configure_write_connection(dbapi_connection, _):
+        apply_pragmas(dbapi_connection, {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 5000})
+
+    return instrument_engine(write_engine)
+
+
+engine = create_write_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+read_engine = create_read_engine(SQLALCHEMY_DATABASE_URL)
 
 
 class Base(DeclarativeBase):
@@ -19,6 +82,52 @@ def get_db():
         db.close()
 
 
+def get_read_engine() -> Engine:
+    return read_engine
+
+
+def get_read_conn(engine: Engine = Depends(get_read_engine)) -> Connection:
+    """Pooled query-only connection for routers that only run `text()` SQL; skips ORM session setup."""
+    with engine.connect() as conn:
+        yield conn
+
+
+@contextmanager
+def read_snapshot(conn: Connection):
+    """
+    Run the block inside one SQLite read transaction, so every statement on `conn` sees the same
+    committed state while writers keep committing (WAL). pysqlite only opens a transaction before
+    DML, so the BEGIN is issued here.
+    """
+    conn.exec_driver_sql("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+
+@contextmanager
+def write_transaction(conn: Connection):
+    """
+    Run the block in one explicit write transaction, committed on success. The driver only opens a
+    transaction before DML; beginning it here makes DDL in the block atomic with the DML.
+    """
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
 def create_tables():
-    from app.models import Merchant, Transaction, Chargeback
+    from app.models import (
+        DictionaryValue, ReasonCode, Merchant, Transaction, Chargeback, MerchantStats, FxRate, ChargebackDaily,
+        ChargebackWeekly, ChargebackMonthly, CustomerRisk, Partition, PartitionMerchantStats, PartitionChargebackDaily,
+        PartitionCustomerRisk, LegacyOrphan, SketchDay, ChargebackSketch, SegmentSketch,
+    )
+    from app.migrations import apply_migrations
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        apply_migrations(conn)
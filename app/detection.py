@@ -0,0 +1,91 @@
+"""
+Streaming burst detection over chargebacks ordered by (card_bin, chargeback_date).
+
+A two-pointer sweep keeps only the chargebacks inside the current time window, so each BIN is
+processed in O(n) after the sort and memory is bounded by the densest window rather than by the
+size of the BIN.
+"""
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+
+@dataclass
+class Burst:
+    start: datetime
+    end: datetime
+    chargeback_count: int
+
+
+@dataclass
+class BinBursts:
+    card_bin: str
+    chargeback_count: int = 0
+    total_amount: float = 0.0
+    merchant_ids: set = field(default_factory=set)
+    bursts: list[Burst] = field(default_factory=list)
+
+    @property
+    def merchant_count(self) -> int:
+        return len(self.merchant_ids)
+
+
+def _as_datetime(value) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def detect_bin_bursts(rows: Iterable, time_window_hours: float, min_count: int) -> Iterator[BinBursts]:
+    """
+    Yield one `BinBursts` per BIN that has at least `min_count` chargebacks within
+    `time_window_hours` of each other (inclusive).
+
+    `rows` must be `(card_bin, chargeback_date, merchant_id, amount)` tuples sorted by
+    `(card_bin, chargeback_date)`. Qualifying windows that share a chargeback are merged, so each
+    reported burst is a maximal run of overlapping dense windows.
+    """
+    span = timedelta(hours=time_window_hours)
+    current = None
+    window: deque = deque()
+    position = 0
+    burst_first = burst_last = None
+    burst_start = burst_end = None
+
+    def close_burst():
+        if burst_first is not None:
+            current.bursts.append(Burst(start=burst_start, end=burst_end, chargeback_count=burst_last - burst_first + 1))
+
+    for card_bin, chargeback_date, merchant_id, amount in rows:
+        if current is None or card_bin != current.card_bin:
+            if current is not None:
+                close_burst()
+                if current.bursts:
+                    yield current
+            current = BinBursts(card_bin=card_bin)
+            window.clear()
+            position = 0
+            burst_first = burst_last = None
+
+        ts = _as_datetime(chargeback_date)
+        current.chargeback_count += 1
+        current.total_amount += amount
+        current.merchant_ids.add(merchant_id)
+
+        window.append((position, ts))
+        while ts - window[0][1] > span:
+            window.popleft()
+
+        if len(window) >= min_count:
+            window_first, window_start = window[0]
+            if burst_first is not None and window_first <= burst_last:
+                burst_last, burst_end = position, ts
+            else:
+                close_burst()
+                burst_first, burst_start = window_first, window_start
+                burst_last, burst_end = position, ts
+        position += 1
+
+    if current is not None:
+        close_burst()
+        if current.bursts:
+            yield current
@@ -0,0 +1,237 @@
+"""
+How merchants, transactions and chargebacks are stored, versus how clients send and see them.
+
+Clients use the record layout of `MERCHANT_RECORD`, `TRANSACTION_RECORD` and `CHARGEBACK_RECORD`:
+string ids and categorical values. The tables store the same records more compactly:
+- integer surrogate keys: `id` is the rowid and the client's id is kept in `external_id`. Foreign
+  keys, and every secondary index entry (which carries the rowid), hold a small integer instead of a
+  UUID;
+- dictionary-encoded categoricals: currency, payment method, country, product category and status
+  are stored in `<column>_id` as an id into the `dictionary` table;
+- reason descriptions are stored once per code in `reason_codes` instead of on every chargeback.
+
+Queries group, join and filter on the integer columns and decode only the values they return, with
+`DECODE_SQL`, `ENCODE_SQL` and `MERCHANT_KEY_SQL`. Writers go through `encode_records`.
+"""
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+from sqlalchemy import Column, DateTime, Float, MetaData, String, Table, select, text
+from sqlalchemy.engine import Connection
+from app.models import Chargeback, Merchant, Transaction
+
+# Dictionary kinds. Transaction and chargeback statuses are separate kinds: their values differ.
+CURRENCY = "currency"
+PAYMENT_METHOD = "payment_method"
+COUNTRY = "country"
+PRODUCT_CATEGORY = "product_category"
+TRANSACTION_STATUS = "transaction_status"
+CHARGEBACK_STATUS = "chargeback_status"
+
+# The value of a dictionary code (an SQL expression).
+DECODE_SQL = "(SELECT value FROM dictionary WHERE id = {})"
+# The code of a `kind` value (an SQL expression); NULL for a value never stored, which matches nothing.
+ENCODE_SQL = "(SELECT id FROM dictionary WHERE kind = '{kind}' AND value = {value})"
+# The surrogate key of a merchant's external id (an SQL expression).
+MERCHANT_KEY_SQL = "(SELECT id FROM merchants WHERE external_id = {})"
+
+RECORDS = MetaData()
+
+MERCHANT_RECORD = Table(
+    "merchants", RECORDS,
+    Column("id", String, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("country", String, nullable=False),
+)
+
+TRANSACTION_RECORD = Table(
+    "transactions", RECORDS,
+    Column("id", String, primary_key=True),
+    Column("timestamp", DateTime, nullable=False),
+    Column("amount", Float, nullable=False),
+    Column("currency", String, nullable=False),
+    Column("merchant_id", String, nullable=False),
+    Column("customer_id", String, nullable=False),
+    Column("payment_method", String, nullable=False),
+    Column("country", String, nullable=False),
+    Column("product_category", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("card_bin", String(6), nullable=False),
+)
+
+CHARGEBACK_RECORD = Table(
+    "chargebacks", RECORDS,
+    Column("id", String, primary_key=True),
+    Column("transaction_id", String, nullable=False),
+    Column("chargeback_date", DateTime, nullable=False),
+    Column("reason_code", String, nullable=False),
+    Column("reason_description", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("amount", Float, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Encoding:
+    """How the records of `record` are stored in `model`'s table."""
+    record: Table
+    model: type
+    # Record column -> dictionary kind; the code is stored in `<column>_id`.
+    categoricals: dict = field(default_factory=dict)
+    # Record column holding the external id of a `parent` row; stored as its surrogate key.
+    foreign_key: Optional[str] = None
+    parent: Optional[type] = None
+
+
+MERCHANTS = Encoding(MERCHANT_RECORD, Merchant)
+TRANSACTIONS = Encoding(
+    TRANSACTION_RECORD, Transaction,
+    categoricals={
+        "currency": CURRENCY,
+        "payment_method": PAYMENT_METHOD,
+        "country": COUNTRY,
+        "product_category": PRODUCT_CATEGORY,
+        "status": TRANSACTION_STATUS,
+    },
+    foreign_key="merchant_id", parent=Merchant,
+)
+CHARGEBACKS = Encoding(
+    CHARGEBACK_RECORD, Chargeback,
+    categoricals={"status": CHARGEBACK_STATUS},
+    foreign_key="transaction_id", parent=Transaction,
+)
+ENCODINGS = {encoding.record.name: encoding for encoding in (MERCHANTS, TRANSACTIONS, CHARGEBACKS)}
+
+ADD_DICTIONARY_VALUE_SQL = text("INSERT OR IGNORE INTO dictionary (kind, value) VALUES (:kind, :value)")
+DICTIONARY_SQL = text("SELECT value, id FROM dictionary WHERE kind = :kind")
+ADD_REASON_CODE_SQL = text("INSERT OR IGNORE INTO reason_codes (code, description) VALUES (:code, :description)")
+
+
+def dictionary_codes(conn: Connection, kind: str, values: Iterable[str]) -> dict:
+    """Code of every `kind` value, after adding those of `values` not stored yet."""
+    new = [{"kind": kind, "value": value} for value in set(values)]
+    if new:
+        conn.execute(ADD_DICTIONARY_VALUE_SQL, new)
+    return dict(conn.execute(DICTIONARY_SQL, {"kind": kind}).all())
+
+
+def add_reason_codes(conn: Connection, descriptions: dict) -> None:
+    """Record the description of each reason code in `descriptions`; a code keeps its first description."""
+    if descriptions:
+        conn.execute(ADD_REASON_CODE_SQL, [
+            {"code": code, "description": description} for code, description in descriptions.items()
+        ])
+
+
+def surrogate_keys(conn: Connection, model: type, external_ids: Iterable[str]) -> dict:
+    """Surrogate key of each of `external_ids` present in `model`'s table."""
+    table = model.__table__
+    return dict(conn.execute(
+        select(table.c.external_id, table.c.id).where(table.c.external_id.in_(set(external_ids)))
+    ).all())
+
+
+def encode_records(conn: Connection, encoding: Encoding, records: list, parents: Optional[dict] = None) -> list:
+    """
+    Table rows for validated `records`. `parents` maps the external ids of `encoding.foreign_key` to
+    surrogate keys and is looked up when not given; every parent must exist.
+    """
+    codes = {
+        name: dictionary_codes(conn, kind, (record[name] for record in records))
+        for name, kind in encoding.categoricals.items()
+    }
+    if encoding.foreign_key is not None and parents is None:
+        parents = surrogate_keys(conn, encoding.parent, (record[encoding.foreign_key] for record in records))
+    if "reason_description" in encoding.record.c:
+        descriptions = {}
+        for record in records:
+            descriptions.setdefault(record["reason_code"], record["reason_description"])
+        add_reason_codes(conn, descriptions)
+
+    rows = []
+    for record in records:
+        row = {"external_id": record["id"]}
+        for name, value in record.items():
+            if name in codes:
+                row[f"{name}_id"] = codes[name][value]
+            elif name == encoding.foreign_key:
+                row[name] = parents[value]
+            elif name not in ("id", "reason_description"):
+                row[name] = value
+        rows.append(row)
+    return rows
+
+
+def insert_records(conn: Connection, table: str, records: list, parents: Optional[dict] = None) -> None:
+    """Insert validated `records` of the record layout `table` ("merchants", "transactions", "chargebacks")."""
+    encoding = ENCODINGS[table]
+    if records:
+        conn.execute(encoding.model.__table__.insert(), encode_records(conn, encoding, records, parents))
+
+
+# Databases from before the compact layout store records as they are sent. `copy_legacy_rows` converts
+# such a table in one statement per dictionary kind plus one for the rows.
+NEXT_ID_SQL = text("SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = :table), 0)")
+SET_SEQUENCE_SQL = [
+    text("DELETE FROM sqlite_sequence WHERE name = :table"),
+    text("INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :seq)"),
+]
+
+
+def copy_legacy_rows(conn: Connection, table: str, origin: str, target: str, parents: Optional[str] = None) -> int:
+    """
+    Copy the rows of `origin`, a `table` ("merchants", "transactions", "chargebacks") in the record
+    layout, into `target`, a table in the storage layout. Foreign keys are resolved against
+    `parents` (by external id); rows whose parent is missing go to `legacy_orphans` instead, under
+    `target`. Rows get new surrogate keys in rowid order from the sequence of `table`, so they never
+    collide with the hot table's. A reason code takes the description of its first row.
+    Returns the number of rows copied.
+    """
+    encoding = ENCODINGS[table]
+    for name, kind in encoding.categoricals.items():
+        conn.execute(text(
+            f"INSERT OR IGNORE INTO dictionary (kind, value) SELECT DISTINCT '{kind}', {name} FROM {origin}"
+        ))
+    if "reason_description" in encoding.record.c:
+        conn.execute(text(
+            "INSERT OR IGNORE INTO reason_codes (code, description)"
+            f" SELECT reason_code, reason_description FROM {origin}"
+            f" WHERE rowid IN (SELECT MIN(rowid) FROM {origin} GROUP BY reason_code)"
+        ))
+
+    columns, values, joins = ["id"], [":base + ROW_NUMBER() OVER (ORDER BY o.rowid)"], ""
+    for column in encoding.record.columns:
+        if column.name == "id":
+            columns.append("external_id")
+            values.append("o.id")
+        elif column.name in encoding.categoricals:
+            columns.append(f"{column.name}_id")
+            values.append(ENCODE_SQL.format(kind=encoding.categoricals[column.name], value=f"o.{column.name}"))
+        elif column.name == encoding.foreign_key:
+            columns.append(column.name)
+            values.append("p.id")
+            joins = f"JOIN {parents} p ON p.external_id = o.{column.name}"
+        elif column.name != "reason_description":
+            columns.append(column.name)
+            values.append(f"o.{column.name}")
+    schema, _, name = origin.rpartition(".")
+    origin_columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA {schema or 'main'}.table_info({name})")]
+    if "amount_usd" in origin_columns:
+        columns.append("amount_usd")
+        values.append("o.amount_usd")
+
+    if parents is not None:
+        record = ", ".join(f"'{column}', o.{column}" for column in origin_columns)
+        conn.execute(text(
+            "INSERT INTO legacy_orphans (source, external_id, parent_id, record)"
+            f" SELECT :source, o.id, o.{encoding.foreign_key}, json_object({record}) FROM {origin} o"
+            f" WHERE NOT EXISTS (SELECT 1 FROM {parents} p WHERE p.external_id = o.{encoding.foreign_key})"
+            " ORDER BY o.rowid"
+        ), {"source": target.rpartition(".")[2]})
+
+    base = conn.execute(NEXT_ID_SQL, {"table": table}).scalar()
+    copied = conn.execute(text(
+        f"INSERT INTO {target} ({', '.join(columns)}) SELECT {', '.join(values)} FROM {origin} o {joins} ORDER BY o.rowid"
+    ), {"base": base}).rowcount
+    for statement in SET_SEQUENCE_SQL:
+        conn.execute(statement, {"table": table, "seq": base + copied})
+    return copied
@@ -0,0 +1,130 @@
+"""
+Date-effective FX rates and the persisted `amount_usd` columns.
+
+`fx_rates` holds one row per (currency, effective_date). A rate applies from its effective date
+until the next one for the same currency. Triggers fill `transactions.amount_usd` from the
+transaction timestamp and `chargebacks.amount_usd` from the chargeback date whenever a row is
+written, so readers filter and sort on an indexed column instead of converting on the fly.
+Currencies without a rate are treated as USD. Transactions store a dictionary code for their
+currency (see app/encoding.py), which is decoded to look the rate up.
+
+Changing `fx_rates` does not touch existing rows. Run `python -m scripts.manage set-fx-rate`,
+which records a rate and recomputes the rows it affects, or `recompute-usd` after editing the
+table by hand.
+"""
+from datetime import date
+from typing import Optional
+from sqlalchemy import text
+from app.constants import CURRENCY_TO_USD
+
+BASELINE_EFFECTIVE_DATE = date(1970, 1, 1)
+
+
+def rate_sql(currency: str, at: str) -> str:
+    """
+    Units of `currency` per USD in effect at `at`; one seek on the fx_rates primary key.
+    Both arguments must be table-qualified, otherwise they resolve to the fx_rates columns.
+    """
+    return f"""COALESCE((
+            SELECT r.units_per_usd FROM fx_rates r
+            WHERE r.currency = {currency} AND r.effective_date <= {at}
+            ORDER BY r.effective_date DESC
+            LIMIT 1
+        ), 1.0)"""
+
+
+TRANSACTION_CURRENCY_SQL = "(SELECT d.value FROM dictionary d WHERE d.id = transactions.currency_id)"
+CHARGEBACK_CURRENCY_SQL = """(
+            SELECT d.value FROM transactions t JOIN dictionary d ON d.id = t.currency_id
+            WHERE t.id = chargebacks.transaction_id
+        )"""
+# The code of `:currency`, for the recompute filters; NULL (matching nothing) if it was never stored.
+CURRENCY_CODE_SQL = "(SELECT id FROM dictionary WHERE kind = 'currency' AND value = :currency)"
+
+TRANSACTION_USD_SQL = f"amount / {rate_sql(TRANSACTION_CURRENCY_SQL, 'transactions.timestamp')}"
+CHARGEBACK_USD_SQL = f"amount / {rate_sql(CHARGEBACK_CURRENCY_SQL, 'chargebacks.chargeback_date')}"
+
+AMOUNT_USD_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_insert_amount_usd
+    AFTER INSERT ON transactions
+    BEGIN
+        UPDATE transactions SET amount_usd = {TRANSACTION_USD_SQL} WHERE rowid = NEW.rowid;
+        UPDATE chargebacks SET amount_usd = {CHARGEBACK_USD_SQL} WHERE transaction_id = NEW.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_update_amount_usd
+    AFTER UPDATE OF amount, currency_id, timestamp ON transactions
+    BEGIN
+        UPDATE transactions SET amount_usd = {TRANSACTION_USD_SQL} WHERE rowid = NEW.rowid;
+        UPDATE chargebacks SET amount_usd = {CHARGEBACK_USD_SQL} WHERE transaction_id = NEW.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_insert_amount_usd
+    AFTER INSERT ON chargebacks
+    BEGIN
+        UPDATE chargebacks SET amount_usd = {CHARGEBACK_USD_SQL} WHERE rowid = NEW.rowid;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_update_amount_usd
+    AFTER UPDATE OF amount, chargeback_date, transaction_id ON chargebacks
+    BEGIN
+        UPDATE chargebacks SET amount_usd = {CHARGEBACK_USD_SQL} WHERE rowid = NEW.rowid;
+    END
+    """,
+]
+
+RECOMPUTE_TRANSACTIONS_SQL = text(f"""
+    UPDATE transactions
+    SET amount_usd = {TRANSACTION_USD_SQL}
+    WHERE (:currency IS NULL OR currency_id = {CURRENCY_CODE_SQL})
+      AND (:since IS NULL OR timestamp >= :since)
+""")
+
+RECOMPUTE_CHARGEBACKS_SQL = text(f"""
+    UPDATE chargebacks
+    SET amount_usd = {CHARGEBACK_USD_SQL}
+    WHERE (:currency IS NULL OR transaction_id IN (SELECT id FROM transactions WHERE currency_id = {CURRENCY_CODE_SQL}))
+      AND (:since IS NULL OR chargeback_date >= :since)
+""")
+
+UPSERT_RATE_SQL = text("""
+    INSERT INTO fx_rates (currency, effective_date, units_per_usd)
+    VALUES (:currency, :effective_date, :units_per_usd)
+    ON CONFLICT (currency, effective_date) DO UPDATE SET units_per_usd = excluded.units_per_usd
+""")
+
+
+def recompute_amount_usd(connection, currency: Optional[str] = None, since: Optional[date] = None) -> dict:
+    """
+    Recompute `amount_usd` for every row, or only rows in `currency` dated on or after `since`
+    (the only rows a new rate effective on `since` can change). Returns rows updated per table.
+    """
+    params = {"currency": currency, "since": since.isoformat() if since else None}
+    return {
+        "transactions.amount_usd": connection.execute(RECOMPUTE_TRANSACTIONS_SQL, params).rowcount,
+        "chargebacks.amount_usd": connection.execute(RECOMPUTE_CHARGEBACKS_SQL, params).rowcount,
+    }
+
+
+def set_fx_rate(connection, currency: str, effective_date: date, units_per_usd: float) -> dict:
+    """Record a rate and recompute the rows it now governs."""
+    if units_per_usd <= 0:
+        raise ValueError("units_per_usd must be positive")
+    connection.execute(UPSERT_RATE_SQL, {
+        "currency": currency, "effective_date": effective_date.isoformat(), "units_per_usd": units_per_usd,
+    })
+    return recompute_amount_usd(connection, currency=currency, since=effective_date)
+
+
+def seed_fx_rates(target, connection, **kw) -> None:
+    """`after_create` hook for fx_rates: start every known currency at its `CURRENCY_TO_USD` rate."""
+    for currency, units_per_usd in CURRENCY_TO_USD.items():
+        connection.execute(UPSERT_RATE_SQL, {
+            "currency": currency,
+            "effective_date": BASELINE_EFFECTIVE_DATE.isoformat(),
+            "units_per_usd": units_per_usd,
+        })
@@ -0,0 +1,267 @@
+"""
+Incremental parsing, validation and batched insertion for bulk uploads.
+
+Records are validated against the record layouts in `app/encoding.py` (required columns, types,
+string lengths, id uniqueness, foreign keys), encoded to the stored layout and written with one
+`executemany` per batch inside its own transaction, so memory and lock time are bounded by the
+batch size rather than by the upload. New chargebacks are merged into the persisted sketches of
+their days in the same transaction (see app/sketches.py). A batch that fails to insert ends the
+upload: the batches before it stay committed and the stats say where it stopped.
+"""
+import csv
+import json
+import logging
+import math
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, Optional
+from sqlalchemy import DateTime, Float, Integer, String
+from sqlalchemy.orm import Session
+from app import encoding
+from app.encoding import Encoding, insert_records, surrogate_keys
+from app.sketches import appending_chargebacks
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+MAX_LINE_BYTES = 1 << 20
+MAX_REPORTED_REJECTS = 1000
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class IngestStats:
+    received: int = 0
+    inserted: int = 0
+    rejected: int = 0
+    rejects: list = field(default_factory=list)
+    error: Optional[str] = None
+
+    def reject(self, line: int, row_id: Optional[str], error: str) -> None:
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({"line": line, "id": row_id, "error": error})
+
+
+def _coerce(column, value):
+    if isinstance(value, bool):
+        raise RowError(f"{column.name}: expected {column.type.__class__.__name__.lower()}, got boolean")
+    if isinstance(column.type, DateTime):
+        if isinstance(value, str):
+            try:
+                return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).replace(tzinfo=None)
+            except ValueError:
+                raise RowError(f"{column.name}: invalid ISO-8601 datetime {value!r}")
+        raise RowError(f"{column.name}: expected ISO-8601 datetime string")
+    if isinstance(column.type, Float):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise RowError(f"{column.name}: invalid number {value!r}")
+        if not math.isfinite(number):
+            raise RowError(f"{column.name}: number must be finite")
+        return number
+    if isinstance(column.type, Integer):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise RowError(f"{column.name}: invalid integer {value!r}")
+    if isinstance(column.type, String):
+        if not isinstance(value, (str, int, float)):
+            raise RowError(f"{column.name}: expected string")
+        text_value = str(value)
+        if column.type.length is not None and len(text_value) > column.type.length:
+            raise RowError(f"{column.name}: longer than {column.type.length} characters")
+        if text_value == "" and not column.nullable:
+            raise RowError(f"{column.name}: must not be empty")
+        return text_value
+    return value
+
+
+class TableSpec:
+    """Validation and foreign-key rules derived from a record layout."""
+
+    def __init__(self, encoding: Encoding):
+        self.encoding = encoding
+        self.table = encoding.record
+        self.columns = {c.name: c for c in self.table.columns if not c.server_default and not c.info.get("derived")}
+        self.required = {name for name, c in self.columns.items() if not c.nullable and c.default is None}
+        self.pk = self.table.primary_key.columns.values()[0].name
+        self.foreign_key = encoding.foreign_key
+
+    def validate(self, record) -> dict:
+        if not isinstance(record, dict):
+            raise RowError("record must be an object")
+        unknown = set(record) - set(self.columns)
+        if unknown:
+            raise RowError(f"unknown field(s): {', '.join(sorted(unknown))}")
+        missing = [name for name in self.required if record.get(name) in (None, "")]
+        if missing:
+            raise RowError(f"missing required field(s): {', '.join(sorted(missing))}")
+        return {
+            name: None if record.get(name) in (None, "") else _coerce(column, record[name])
+            for name, column in self.columns.items()
+        }
+
+
+TRANSACTIONS = TableSpec(encoding.TRANSACTIONS)
+CHARGEBACKS = TableSpec(encoding.CHARGEBACKS)
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[tuple[int, Optional[str]]]:
+    """
+    Split a byte stream into `(line_number, text)` pairs without buffering more than one line.
+    Lines longer than `MAX_LINE_BYTES` are discarded and yielded as `(line_number, None)`.
+    """
+    buffer = b""
+    line_number = 0
+    oversized = False
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while (newline := buffer.find(b"\n", start)) >= 0:
+            line = buffer[start:newline]
+            start = newline + 1
+            line_number += 1
+            if oversized:
+                oversized = False
+                yield line_number, None
+            else:
+                yield line_number, line.decode("utf-8", errors="replace").rstrip("\r")
+        buffer = buffer[start:]
+        if len(buffer) > MAX_LINE_BYTES:
+            buffer = b""
+            oversized = True
+    if buffer or oversized:
+        line_number += 1
+        yield line_number, None if oversized else buffer.decode("utf-8", errors="replace").rstrip("\r")
+
+
+def parse_ndjson(lines: Iterable[tuple[int, Optional[str]]]) -> Iterator[tuple[int, object]]:
+    for line_number, line in lines:
+        if line is None:
+            yield line_number, RowError(f"line exceeds {MAX_LINE_BYTES} bytes")
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield line_number, RowError(f"invalid JSON: {exc.msg}")
+
+
+def parse_csv(lines: Iterable[tuple[int, Optional[str]]]) -> Iterator[tuple[int, object]]:
+    """
+    One `csv.reader` reads the whole stream, so a quoted field may span lines. Each record is
+    reported under the line it starts on.
+    """
+    oversized = []
+
+    def physical_lines():
+        for line_number, line in lines:
+            if line is None:
+                oversized.append(line_number)
+                line = ""
+            yield line + "\n"
+
+    reader = csv.reader(physical_lines())
+    header = None
+    while True:
+        line_number = reader.line_num + 1
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as exc:
+            yield line_number, RowError(f"invalid CSV: {exc}")
+            continue
+        # The reader does not read ahead: every oversized line it consumed belongs to this record.
+        if oversized:
+            oversized.clear()
+            yield line_number, RowError(f"line exceeds {MAX_LINE_BYTES} bytes")
+            continue
+        if len(values) <= 1 and not "".join(values).strip():
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield line_number, RowError(f"expected {len(header)} columns, got {len(values)}")
+            continue
+        yield line_number, dict(zip(header, values))
+
+
+def insert_batch(db: Session, spec: TableSpec, batch: list[tuple[int, dict]], stats: IngestStats) -> None:
+    """Check keys for one batch, insert the survivors with a single executemany and commit."""
+    conn = db.connection()
+    existing = surrogate_keys(conn, spec.encoding.model, (row[spec.pk] for _, row in batch))
+    known_parents = surrogate_keys(conn, spec.encoding.parent, (row[spec.foreign_key] for _, row in batch))
+
+    rows, seen = [], set()
+    for line_number, row in batch:
+        row_id = row[spec.pk]
+        if row_id in existing or row_id in seen:
+            stats.reject(line_number, row_id, f"duplicate {spec.pk}")
+        elif row[spec.foreign_key] not in known_parents:
+            stats.reject(line_number, row_id, f"unknown {spec.foreign_key} {row[spec.foreign_key]!r}")
+        else:
+            seen.add(row_id)
+            rows.append(row)
+
+    with appending_chargebacks(conn):
+        insert_records(conn, spec.table.name, rows, parents=known_parents)
+    db.commit()
+    stats.inserted += len(rows)
+
+
+PARSERS = {"ndjson": parse_ndjson, "csv": parse_csv}
+
+
+def ingest(
+    chunks: Iterable[bytes],
+    spec: TableSpec,
+    fmt: str,
+    db: Session,
+    batch_size: int = BATCH_SIZE,
+    on_batch: Optional[Callable[[], None]] = None,
+) -> IngestStats:
+    """
+    Stream `chunks` through parse → validate → batched insert. Only one batch is held at a time.
+    If a batch fails to insert, it is rolled back, `error` says which, and nothing after it is read.
+    """
+    stats = IngestStats()
+    batch: list[tuple[int, dict]] = []
+
+    def flush() -> bool:
+        try:
+            insert_batch(db, spec, batch, stats)
+        except Exception as exc:
+            db.rollback()
+            logger.exception("bulk insert of the batch starting at line %d failed", batch[0][0])
+            stats.error = f"batch starting at line {batch[0][0]} was not inserted: {getattr(exc, 'orig', exc)}"
+            return False
+        if on_batch:
+            on_batch()
+        return True
+
+    for line_number, record in PARSERS[fmt](iter_lines(chunks)):
+        stats.received += 1
+        if isinstance(record, RowError):
+            stats.reject(line_number, None, str(record))
+            continue
+        try:
+            batch.append((line_number, spec.validate(record)))
+        except RowError as exc:
+            row_id = record.get(spec.pk) if isinstance(record, dict) else None
+            stats.reject(line_number, None if row_id is None else str(row_id), str(exc))
+            continue
+        if len(batch) >= batch_size:
+            if not flush():
+                return stats
+            batch = []
+    if batch:
+        flush()
+    return stats
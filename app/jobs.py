@@ -0,0 +1,301 @@
+"""
+Background jobs for work too long to run inside a request: seeding and the heavy analytics lists.
+
+`POST /api/jobs` validates the job's params, hands it to `runner` and returns its id straight away.
+Jobs run in a pool of JOB_WORKERS spawned processes, so a long seed or fraud scan holds neither an
+API worker thread nor the GIL. Each process opens its own engine on the database URL the request
+resolved, so a job reads the same database as the endpoint it stands in for and returns the same
+body. At most JOB_MAX_PENDING jobs may be queued or running; beyond that submission is refused.
+
+Progress and cancellation go through a manager process. A job reports `(done, total)` at its own
+checkpoints, and every checkpoint raises `JobCancelled` once the job is cancelled. Long SQL
+statements are interrupted as well: a job's read connection has an SQLite progress handler that
+aborts the running statement after cancellation. A queued job is cancelled before it starts. A seed
+cancelled mid-load keeps the shards already written, with its rollups and indexes rebuilt.
+
+Jobs and their results live in the API process. A finished job is evicted JOB_RESULT_TTL_SECONDS
+after it finished, after which its id returns 404. With `--workers N`, a job is only known to the
+server process that accepted it.
+"""
+import json
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Optional
+from pydantic import BaseModel, Field, model_validator
+from sqlalchemy.exc import OperationalError
+from app.cache import bump_data_version
+from app.constants import (
+    BIN_MIN_CHARGEBACKS,
+    BIN_WINDOW_HOURS,
+    JOB_CANCEL_CHECK_INSTRUCTIONS,
+    JOB_MAX_PENDING,
+    JOB_RESULT_TTL_SECONDS,
+    JOB_WORKERS,
+)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = {SUCCEEDED, FAILED, CANCELLED}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class JobContext:
+    """Handed to the job function in its worker process: progress reports and cancellation checks."""
+    job_id: str
+    progress: Any
+    cancelled: Any
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.job_id in self.cancelled
+
+    def check(self) -> None:
+        if self.is_cancelled:
+            raise JobCancelled(self.job_id)
+
+    def report(self, done: int, total: Optional[int] = None) -> None:
+        self.progress[self.job_id] = (done, total)
+        self.check()
+
+    @contextmanager
+    def read_conn(self, url: str):
+        """A query-only connection whose running statement is interrupted once the job is cancelled."""
+        with _read_engine(url).connect() as conn:
+            dbapi_connection = conn.connection.driver_connection
+            dbapi_connection.set_progress_handler(lambda: int(self.is_cancelled), JOB_CANCEL_CHECK_INSTRUCTIONS)
+            try:
+                yield conn
+            except OperationalError as exc:
+                if "interrupted" in str(exc) and self.is_cancelled:
+                    raise JobCancelled(self.job_id) from None
+                raise
+            finally:
+                dbapi_connection.set_progress_handler(None, 0)
+
+
+@lru_cache(maxsize=8)
+def _read_engine(url: str):
+    from app.database import create_read_engine
+
+    return create_read_engine(url, pool_size=1, max_overflow=0)
+
+
+@dataclass(frozen=True)
+class JobKind:
+    name: str
+    run: Callable
+    params: type
+    writes: bool
+
+
+JOB_KINDS: dict[str, JobKind] = {}
+
+
+def job_kind(name: str, params: type, writes: bool = False):
+    """Register `fn(job, url, params)` as the job kind `name`; `writes` jobs get the write database URL."""
+    def register(fn: Callable) -> Callable:
+        JOB_KINDS[name] = JobKind(name, fn, params, writes)
+        return fn
+    return register
+
+
+class DateRangeParams(BaseModel):
+    start: Optional[date] = None
+    end: Optional[date] = None
+
+    @model_validator(mode="after")
+    def _check_range(self):
+        if self.start is not None and self.end is not None and self.start >= self.end:
+            raise ValueError("start must be before end")
+        return self
+
+
+class SeedParams(BaseModel):
+    scale: float = Field(1.0, gt=0, le=2000)
+    seed: Optional[int] = None
+
+
+class FraudPatternParams(DateRangeParams):
+    limit: int = Field(50, ge=1, le=500)
+    time_window_hours: int = Field(BIN_WINDOW_HOURS, ge=1, le=24 * 90)
+    min_count: int = Field(BIN_MIN_CHARGEBACKS, ge=2, le=1000)
+
+
+class RecommendationParams(DateRangeParams):
+    limit: int = Field(50, ge=1, le=500)
+
+
+@job_kind("seed", SeedParams, writes=True)
+def _seed(job: JobContext, url: str, params: SeedParams) -> dict:
+    from sqlalchemy.orm import Session
+    from app.database import create_write_engine
+    from scripts.seed_data import DEFAULT_SEED, run_seed
+
+    engine = create_write_engine(url)
+    try:
+        with Session(engine) as db:
+            seed = DEFAULT_SEED if params.seed is None else params.seed
+            return run_seed(db, scale=params.scale, seed=seed, progress=job.report)
+    finally:
+        engine.dispose()
+
+
+@job_kind("fraud-patterns", FraudPatternParams)
+def _fraud_patterns(job: JobContext, url: str, params: FraudPatternParams) -> list:
+    from fastapi import Response
+    from app.partitions import DateRange
+    from app.routers.fraud import get_fraud_patterns
+
+    with job.read_conn(url) as conn:
+        response = get_fraud_patterns(
+            Response(), limit=params.limit, offset=0, time_window_hours=params.time_window_hours,
+            min_count=params.min_count, cursor=None, format="rows", dates=DateRange(params.start, params.end), conn=conn,
+        )
+    return json.loads(response.body)
+
+
+@job_kind("recommendations", RecommendationParams)
+def _recommendations(job: JobContext, url: str, params: RecommendationParams) -> list:
+    from fastapi import Response
+    from app.partitions import DateRange
+    from app.routers.recommendations import get_recommendations
+
+    with job.read_conn(url) as conn:
+        response = get_recommendations(
+            Response(), limit=params.limit, offset=0, cursor=None, format="rows",
+            dates=DateRange(params.start, params.end), conn=conn,
+        )
+    return json.loads(response.body)
+
+
+def _execute(kind: str, url: str, params: dict, job: JobContext):
+    """Entry point in the worker process."""
+    job.report(0)
+    spec = JOB_KINDS[kind]
+    return spec.run(job, url, spec.params(**params))
+
+
+@dataclass
+class JobRecord:
+    id: str
+    kind: str
+    params: dict
+    submitted_at: datetime
+    status: str = QUEUED
+    result: Any = None
+    error: Optional[str] = None
+    finished_at: Optional[datetime] = None
+    progress: Optional[tuple] = None
+    future: Optional[Future] = field(default=None, repr=False)
+
+
+class JobRunner:
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 ttl_seconds: float = JOB_RESULT_TTL_SECONDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._jobs: dict[str, JobRecord] = {}
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._progress = self._cancelled = None
+
+    def _start(self) -> None:
+        # Spawned, not forked: the API process holds SQLite connections and threads.
+        context = multiprocessing.get_context("spawn")
+        self._manager = context.Manager()
+        self._progress, self._cancelled = self._manager.dict(), self._manager.dict()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def submit(self, kind: str, params: dict, url: str) -> JobRecord:
+        with self._lock:
+            self._evict()
+            if sum(job.status not in FINISHED for job in self._jobs.values()) >= self.max_pending:
+                raise JobQueueFull(f"{self.max_pending} jobs are already queued or running")
+            if self._pool is None:
+                self._start()
+            job = JobRecord(id=uuid.uuid4().hex, kind=kind, params=params, submitted_at=datetime.now())
+            self._jobs[job.id] = job
+            job.future = self._pool.submit(
+                _execute, kind, url, params, JobContext(job.id, self._progress, self._cancelled),
+            )
+        job.future.add_done_callback(lambda future: self._finish(job, future))
+        return job
+
+    def _finish(self, job: JobRecord, future: Future) -> None:
+        exception = None if future.cancelled() else future.exception()
+        with self._lock:
+            if future.cancelled() or isinstance(exception, JobCancelled):
+                job.status = CANCELLED
+            elif exception is not None:
+                job.status, job.error = FAILED, f"{type(exception).__name__}: {exception}"
+            else:
+                job.status, job.result = SUCCEEDED, future.result()
+            job.finished_at = datetime.now()
+            job.future = None
+            manager_alive = self._pool is not None
+        if manager_alive:
+            try:
+                job.progress = self._progress.pop(job.id, job.progress)
+                self._cancelled.pop(job.id, None)
+            except (OSError, EOFError):
+                pass
+        if JOB_KINDS[job.kind].writes:
+            bump_data_version()
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        with self._lock:
+            self._evict()
+            job = self._jobs.get(job_id)
+        if job is not None and job.status not in FINISHED:
+            progress = self._progress.get(job_id)
+            with self._lock:
+                if progress is not None and job.status not in FINISHED:
+                    job.progress = progress
+                    job.status = RUNNING
+        return job
+
+    def cancel(self, job_id: str) -> Optional[JobRecord]:
+        """Cancel a queued job outright; a running one stops at its next checkpoint."""
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        self._cancelled[job_id] = True
+        future = job.future
+        if future is not None:
+            future.cancel()
+        return self.get(job_id)
+
+    def _evict(self) -> None:
+        horizon = datetime.now() - timedelta(seconds=self.ttl_seconds)
+        for job_id in [job.id for job in self._jobs.values() if job.finished_at is not None and job.finished_at <= horizon]:
+            del self._jobs[job_id]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, manager = self._pool, self._manager
+            self._pool = self._manager = None
+            if pool is None:
+                return
+            for job in self._jobs.values():
+                if job.status not in FINISHED:
+                    self._cancelled[job.id] = True
+        pool.shutdown(wait=True, cancel_futures=True)
+        manager.shutdown()
+
+
+runner = JobRunner()
@@ -1,14 +1,34 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Response
+from fastapi.responses import PlainTextResponse
+from starlette.routing import compile_path
 from sqlalchemy.orm import Session
-from app.database import create_tables, get_db
-from app.routers import merchants, reason_codes, segments, trends, alerts, fraud, recommendations, win_rate
+from app.alert_stream import alert_stream
+from app.cache import ResponseCacheMiddleware, watcher
+from app.columnar import check_analytics_engine
+from app.database import create_tables, engine, get_db, read_engine
+from app.jobs import JOB_KINDS, runner as job_runner
+from app.metrics import METRICS_PATH, MetricsMiddleware, TimedRoute, configure_slow_query_log, registry
+from app.precompute import scheduler
+from app.routers import (
+    merchants, reason_codes, segments, trends, alerts, fraud, customers, recommendations, win_rate, dashboard, ingest,
+    export, jobs, precompute, alert_stream as alert_stream_router, distributions,
+)
+from app.schemas import Job
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    check_analytics_engine()
+    configure_slow_query_log()
     create_tables()
+    watcher.start(engine)
+    scheduler.start(read_engine)
     yield
+    scheduler.stop()
+    watcher.stop()
+    alert_stream.stop()
+    job_runner.shutdown()
 
 
 app = FastAPI(
@@ -17,19 +37,59 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan,
 )
+app.router.route_class = TimedRoute
 
 app.include_router(merchants.router, prefix="/api", tags=["Merchants"])
 app.include_router(reason_codes.router, prefix="/api", tags=["Reason Codes"])
 app.include_router(segments.router, prefix="/api", tags=["Segments"])
 app.include_router(trends.router, prefix="/api", tags=["Trends"])
+app.include_router(alert_stream_router.router, prefix="/api", tags=["Alerts"])
 app.include_router(alerts.router, prefix="/api", tags=["Alerts"])
 app.include_router(fraud.router, prefix="/api", tags=["Fraud Patterns"])
+app.include_router(customers.router, prefix="/api", tags=["Customers"])
 app.include_router(recommendations.router, prefix="/api", tags=["Recommendations"])
 app.include_router(win_rate.router, prefix="/api", tags=["Win Rate"])
+app.include_router(distributions.router, prefix="/api", tags=["Distributions"])
+app.include_router(dashboard.router, prefix="/api", tags=["Dashboard"])
+app.include_router(ingest.router, prefix="/api", tags=["Ingestion"])
+app.include_router(export.router, prefix="/api", tags=["Export"])
+app.include_router(jobs.router, prefix="/api", tags=["Jobs"])
+app.include_router(precompute.router, prefix="/api", tags=["Precompute"])
+
+API_ROUTERS = [
+    merchants, reason_codes, segments, trends, alerts, fraud, customers, recommendations, win_rate, dashboard, ingest, export,
+    jobs, precompute, alert_stream_router, distributions,
+]
+CACHED_ROUTERS = [
+    merchants, reason_codes, segments, trends, alerts, fraud, customers, recommendations, win_rate, dashboard, distributions,
+]
+app.add_middleware(
+    ResponseCacheMiddleware,
+    path_patterns=[
+        compile_path("/api" + route.path)[0]
+        for module in CACHED_ROUTERS
+        for route in module.router.routes
+        if "GET" in route.methods
+    ],
+)
+# Added last so it is the outermost middleware: cache hits are recorded too, with zero statements.
+app.add_middleware(
+    MetricsMiddleware,
+    route_paths=["/api" + route.path for module in API_ROUTERS for route in module.router.routes] + ["/api/seed"],
+)
+
+
+@app.post("/api/seed", tags=["Seed"], response_model=Job, status_code=202)
+def seed_data(response: Response, db: Session = Depends(get_db)):
+    """
+    Queue a `seed` job at the default scale and return it without waiting, like `POST /api/jobs`.
+    Poll the `Location` for progress; the result reports the rows written.
+    """
+    params = JOB_KINDS["seed"].params().model_dump(mode="json")
+    return jobs.enqueue_job("seed", params, db.get_bind().url.render_as_string(hide_password=False), response)
 
 
-@app.post("/api/seed", tags=["Seed"])
-def seed_data(db: Session = Depends(get_db)):
-    from scripts.seed_data import run_seed
-    inserted = run_seed(db)
-    return inserted
+@app.get(METRICS_PATH, tags=["Metrics"], response_class=PlainTextResponse)
+def metrics():
+    """Per-route latency, SQL statements, SQL time, rows and serialization time in Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
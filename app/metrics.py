@@ -0,0 +1,348 @@
+"""
+Per-route request and SQL instrumentation, exposed in Prometheus text format at `GET /metrics`.
+
+`MetricsMiddleware` opens a `RequestStats` for every HTTP request and stores it in a context
+variable. Engine event hooks (`instrument_engine`) add each statement's execute time to it, and the
+`InstrumentedConnection` cursor adds fetched rows and fetch time, so SQL work is attributed to the
+route that caused it even when it runs in the threadpool or during a streamed response.
+`TimedRoute` stamps when the endpoint function returns; the time from there to the first
+byte of the response is reported as serialization (response-model validation, encoding, rendering).
+
+Statements slower than `SLOW_QUERY_MS` are kept as samples with their `EXPLAIN QUERY PLAN`
+(the most recent `SLOW_QUERY_SAMPLES`) and, when `MONTEVERDE_SLOW_QUERY_LOG` names a file, written
+to it as JSON lines. Recording is a few counter updates per statement and per request; plans are
+only computed for slow statements.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi.routing import APIRoute
+from starlette.routing import compile_path
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.constants import METRICS_LATENCY_BUCKETS, SLOW_QUERY_LOG, SLOW_QUERY_MS, SLOW_QUERY_SAMPLES
+
+METRICS_PATH = "/metrics"
+UNMATCHED_ROUTE = "unmatched"
+
+slow_query_log = logging.getLogger("monteverde.slow_queries")
+
+
+@dataclass
+class RequestStats:
+    route: str
+    statements: int = 0
+    sql_seconds: float = 0.0
+    rows: int = 0
+    endpoint_done: Optional[float] = None
+    # Threads started by the request (the concurrent alert signals) share it through the copied context.
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, statements: int = 0, sql_seconds: float = 0.0, rows: int = 0) -> None:
+        with self._lock:
+            self.statements += statements
+            self.sql_seconds += sql_seconds
+            self.rows += rows
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+class CountingCursor(sqlite3.Cursor):
+    """Adds fetched rows and fetch time to the current request."""
+
+    def _count(self, started: float, rows: int) -> None:
+        stats = _current.get()
+        if stats is not None:
+            stats.add(sql_seconds=time.perf_counter() - started, rows=rows)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._count(started, row is not None)
+        return row
+
+    def fetchmany(self, size: int = -1):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size == -1 else size)
+        self._count(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._count(started, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """`sqlite3.connect(factory=...)` connection whose cursors count fetched rows."""
+
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+
+@dataclass
+class Histogram:
+    buckets: tuple
+    counts: list = field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+@dataclass
+class RouteMetrics:
+    latency: Histogram
+    statements: int = 0
+    sql_seconds: float = 0.0
+    serialization_seconds: float = 0.0
+    rows: int = 0
+    slow_queries: int = 0
+    responses: dict = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class SlowQuery:
+    at: str
+    route: str
+    seconds: float
+    statement: str
+    parameters: list
+    plan: list
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: tuple = METRICS_LATENCY_BUCKETS, slow_query_seconds: float = SLOW_QUERY_MS / 1000,
+                 max_samples: int = SLOW_QUERY_SAMPLES):
+        self.buckets = buckets
+        self.slow_query_seconds = slow_query_seconds
+        self.routes: dict = {}
+        self.slow_samples: deque = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def _route(self, route: str) -> RouteMetrics:
+        metrics = self.routes.get(route)
+        if metrics is None:
+            metrics = self.routes[route] = RouteMetrics(latency=Histogram(self.buckets))
+        return metrics
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float, stats: RequestStats,
+                        serialization_seconds: float) -> None:
+        with self._lock:
+            metrics = self._route(route)
+            metrics.latency.observe(seconds)
+            metrics.statements += stats.statements
+            metrics.sql_seconds += stats.sql_seconds
+            metrics.rows += stats.rows
+            metrics.serialization_seconds += serialization_seconds
+            key = (method, status)
+            metrics.responses[key] = metrics.responses.get(key, 0) + 1
+
+    def observe_slow_query(self, sample: SlowQuery) -> None:
+        with self._lock:
+            self._route(sample.route).slow_queries += 1
+            self.slow_samples.append(sample)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.routes.clear()
+            self.slow_samples.clear()
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            routes = sorted(self.routes.items())
+            samples = list(self.slow_samples)
+        lines = [
+            "# HELP monteverde_http_requests_total HTTP responses by route, method and status.",
+            "# TYPE monteverde_http_requests_total counter",
+        ]
+        for route, metrics in routes:
+            for (method, status), count in sorted(metrics.responses.items()):
+                lines.append(f'monteverde_http_requests_total{{route="{_escape(route)}",method="{method}",status="{status}"}} {count}')
+        lines += [
+            "# HELP monteverde_http_request_duration_seconds Request latency by route.",
+            "# TYPE monteverde_http_request_duration_seconds histogram",
+        ]
+        for route, metrics in routes:
+            label = f'route="{_escape(route)}"'
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), metrics.latency.counts):
+                cumulative += count
+                lines.append(f'monteverde_http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"monteverde_http_request_duration_seconds_sum{{{label}}} {metrics.latency.total:.6f}")
+            lines.append(f"monteverde_http_request_duration_seconds_count{{{label}}} {metrics.latency.count}")
+        for name, attribute, kind, help_text in (
+            ("monteverde_sql_statements_total", "statements", "counter", "SQL statements executed while serving the route."),
+            ("monteverde_sql_seconds_total", "sql_seconds", "counter", "Time spent executing SQL and fetching rows."),
+            ("monteverde_sql_rows_total", "rows", "counter", "Rows fetched from SQLite."),
+            ("monteverde_serialization_seconds_total", "serialization_seconds", "counter",
+             "Time from the endpoint returning to the response starting."),
+            ("monteverde_slow_queries_total", "slow_queries", "counter", "Statements slower than the slow-query threshold."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for route, metrics in routes:
+                value = getattr(metrics, attribute)
+                lines.append(f'{name}{{route="{_escape(route)}"}} {value:.6f}' if isinstance(value, float)
+                             else f'{name}{{route="{_escape(route)}"}} {value}')
+        lines += [
+            "# HELP monteverde_slow_query_seconds Most recent slow statements; SQL and plan in the comments above each sample.",
+            "# TYPE monteverde_slow_query_seconds gauge",
+        ]
+        for number, sample in enumerate(samples):
+            lines.append(f"# slow query {number} at {sample.at}: {sample.statement}")
+            lines.extend(f"#   plan: {step}" for step in sample.plan)
+            lines.append(f'monteverde_slow_query_seconds{{route="{_escape(sample.route)}",sample="{number}"}} {sample.seconds:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+def configure_slow_query_log(path: str = SLOW_QUERY_LOG) -> None:
+    """Append slow-query samples to `path` as JSON lines (no-op when `path` is empty)."""
+    if not path or any(getattr(h, "baseFilename", None) == path for h in slow_query_log.handlers):
+        return
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_query_log.addHandler(handler)
+    slow_query_log.setLevel(logging.INFO)
+    slow_query_log.propagate = False
+
+
+def _explain(dbapi_connection, statement: str, parameters) -> list:
+    try:
+        cursor = sqlite3.Cursor(dbapi_connection)
+        return [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())]
+    except sqlite3.Error:
+        return []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.add(statements=1, sql_seconds=elapsed)
+    if elapsed < registry.slow_query_seconds:
+        return
+    sample = SlowQuery(
+        at=datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        route=stats.route if stats is not None else "-",
+        seconds=elapsed,
+        statement=" ".join(statement.split()),
+        parameters=[] if executemany else [p if isinstance(p, (int, float, str, type(None))) else str(p) for p in parameters or ()],
+        plan=[] if executemany else _explain(cursor.connection, statement, parameters),
+    )
+    registry.observe_slow_query(sample)
+    if slow_query_log.handlers:
+        slow_query_log.info(json.dumps(sample.__dict__))
+
+
+def instrument_engine(engine: Engine) -> Engine:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+def _mark_endpoint_done() -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.endpoint_done = time.perf_counter()
+
+
+def _timed_endpoint(call):
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def timed(*args, **kwargs):
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                _mark_endpoint_done()
+    else:
+        @functools.wraps(call)
+        def timed(*args, **kwargs):
+            try:
+                return call(*args, **kwargs)
+            finally:
+                _mark_endpoint_done()
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """
+    Route class for the API routers: stamps when the endpoint function returns, so the time until
+    the response starts (response-model validation, encoding, rendering) is reported as serialization.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency, SQL work and serialization time per route template.
+    Requests are labelled by the first of `route_paths` their path matches, so path parameters do
+    not multiply the series and cache hits (which never reach the router) are labelled too.
+    """
+
+    def __init__(self, app, route_paths: list, metrics: MetricsRegistry = registry):
+        self.app = app
+        self.routes = [(compile_path(path)[0], path) for path in route_paths]
+        self.metrics = metrics
+
+    def route_label(self, path: str) -> str:
+        return next((template for pattern, template in self.routes if pattern.match(path)), UNMATCHED_ROUTE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == METRICS_PATH:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(self.route_label(scope["path"]))
+        token = _current.set(stats)
+        started = time.perf_counter()
+        response = {"status": 500, "started": None}
+
+        async def observe(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["started"] = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, observe)
+        finally:
+            _current.reset(token)
+            serialization = 0.0
+            if stats.endpoint_done is not None and response["started"] is not None:
+                serialization = max(0.0, response["started"] - stats.endpoint_done)
+            self.metrics.observe_request(
+                stats.route, scope["method"], response["status"],
+                time.perf_counter() - started, stats, serialization,
+            )
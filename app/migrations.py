@@ -0,0 +1,219 @@
+"""
+Versioned schema migrations for databases created by an older version of the app.
+
+`Base.metadata.create_all()` creates missing tables (and their indexes) but never alters an
+existing table. Changes to existing tables are registered here with `@migration`. Each one runs once
+per database, in version order, and is recorded in `schema_migrations`. Every step checks the
+current schema before changing it, so a migration is also safe on a database that `create_all()`
+just built with the change already in place.
+
+Index-only migrations (such as the ones proposed by `scripts/index_advisor.py`) go through
+`apply_index_migration`, which uses `CREATE INDEX IF NOT EXISTS` and records the version the same way.
+"""
+import logging
+import re
+from typing import Callable, Optional
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+
+MIGRATIONS: list[tuple[str, Callable]] = []
+
+logger = logging.getLogger(__name__)
+
+CREATE_SCHEMA_MIGRATIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR PRIMARY KEY,
+        applied_at DATETIME NOT NULL
+    )
+"""
+
+
+def migration(version: str):
+    def register(fn: Callable) -> Callable:
+        MIGRATIONS.append((version, fn))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return fn
+    return register
+
+
+def column_names(connection, table: str) -> set:
+    return {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def add_column(connection, table: str, column: str, ddl_type: str) -> bool:
+    if column in column_names(connection, table):
+        return False
+    connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+    return True
+
+
+def compact_layout(connection) -> bool:
+    """Whether the fact tables have the integer-key layout of app/encoding.py (see 0004_compact_keys)."""
+    return "external_id" in column_names(connection, "transactions")
+
+
+def index_names(connection) -> set:
+    return {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def declared_index_ddl(*names: str) -> list:
+    """`CREATE INDEX IF NOT EXISTS` statements for indexes declared on the models, by name."""
+    from app.database import Base, engine
+
+    declared = {index.name: index for table in Base.metadata.tables.values() for index in table.indexes}
+    return [str(CreateIndex(declared[name], if_not_exists=True).compile(dialect=engine.dialect)) for name in names]
+
+
+def create_indexes(connection, statements: list) -> list:
+    """Run `CREATE INDEX IF NOT EXISTS` statements. Returns the names of the indexes that were missing."""
+    existing = index_names(connection)
+    created = []
+    for ddl in statements:
+        name = re.search(r"INDEX (?:IF NOT EXISTS )?(\w+)", ddl).group(1)
+        connection.exec_driver_sql(ddl)
+        if name not in existing:
+            created.append(name)
+    return created
+
+
+def applied_migrations(connection) -> set:
+    connection.exec_driver_sql(CREATE_SCHEMA_MIGRATIONS_SQL)
+    return {row[0] for row in connection.exec_driver_sql("SELECT version FROM schema_migrations")}
+
+
+def record_migration(connection, version: str) -> None:
+    connection.execute(
+        text("INSERT INTO schema_migrations (version, applied_at) VALUES (:version, CURRENT_TIMESTAMP)"),
+        {"version": version},
+    )
+
+
+def apply_migrations(connection) -> list:
+    """Run every pending migration in version order. Returns the versions applied."""
+    done = applied_migrations(connection)
+    applied = []
+    for version, fn in MIGRATIONS:
+        if version in done:
+            continue
+        fn(connection)
+        record_migration(connection, version)
+        applied.append(version)
+    return applied
+
+
+def apply_index_migration(connection, version: str, statements: list) -> Optional[list]:
+    """
+    Create the indexes in `statements` once per database under `version`.
+    Returns the indexes created, or None if `version` was already applied.
+    """
+    if version in applied_migrations(connection):
+        return None
+    created = create_indexes(connection, statements)
+    record_migration(connection, version)
+    return created
+
+
+@migration("0001_amount_usd")
+def _add_amount_usd(connection) -> None:
+    from app.fx import recompute_amount_usd
+    from app.rollups import install_triggers
+
+    added = [table for table in ("transactions", "chargebacks") if add_column(connection, table, "amount_usd", "FLOAT")]
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_transactions_amount_usd ON transactions (amount_usd)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_chargebacks_amount_usd ON chargebacks (amount_usd)")
+    install_triggers(connection)
+    # A database still in the record layout gets its amounts when 0004_compact_keys rebuilds it.
+    if added and compact_layout(connection):
+        recompute_amount_usd(connection)
+
+
+@migration("0002_covering_indexes")
+def _add_covering_indexes(connection) -> None:
+    # Declared on the compact layout; 0004_compact_keys creates them with the rebuilt tables.
+    if not compact_layout(connection):
+        return
+    create_indexes(connection, declared_index_ddl(
+        "ix_transactions_country_id",
+        "ix_transactions_product_category_id",
+        "ix_transactions_payment_method_id",
+        "ix_transactions_amount_usd_merchant_id",
+        "ix_chargebacks_reason_code_amount_status_id",
+    ))
+    # Both are leading prefixes of a covering index above, which serves their lookups.
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_transactions_amount_usd")
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_chargebacks_reason_code")
+
+
+@migration("0003_monthly_partitions")
+def _reinstall_partition_aware_triggers(connection) -> None:
+    # The customer_risk triggers now also read the archived months' summaries.
+    from app.rollups import drop_triggers, install_triggers
+
+    drop_triggers(connection)
+    install_triggers(connection)
+
+
+# Tables whose merchant_id becomes the merchant's surrogate key; rebuilt from the fact tables.
+MERCHANT_KEYED_TABLES = (
+    "merchant_stats", "chargeback_daily", "chargeback_weekly", "chargeback_monthly",
+    "partition_merchant_stats", "partition_chargeback_daily", "partition_customer_risk",
+)
+
+
+@migration("0004_compact_keys")
+def _compact_keys(connection) -> None:
+    """
+    Rebuild the merchant and fact tables, and every attached partition, in the layout of
+    app/encoding.py: integer surrogate keys, dictionary codes, reason descriptions in `reason_codes`.
+    Transactions of an unknown merchant and chargebacks of an unknown transaction cannot be keyed
+    and are moved to `legacy_orphans` (and logged). Detached months are converted when they are
+    attached again.
+    """
+    from app.database import Base
+    from app.encoding import copy_legacy_rows
+    from app.partitions import HOT, _create_fact_tables, _seal, _write_summaries, partition_source
+    from app.rollups import drop_triggers, install_triggers, rebuild_all
+
+    if compact_layout(connection):
+        return
+    months = [row[0] for row in connection.exec_driver_sql("SELECT month FROM partitions WHERE status = 'attached'")]
+    legacy = ["merchants", HOT.transactions, HOT.chargebacks]
+    for month in months:
+        legacy += [partition_source(month).transactions, partition_source(month).chargebacks]
+
+    drop_triggers(connection)
+    for table in legacy:
+        for (index,) in connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+        ).fetchall():
+            connection.exec_driver_sql(f"DROP INDEX {index}")
+        connection.exec_driver_sql(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+    for table in MERCHANT_KEYED_TABLES:
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+    for table in ("merchants", "transactions", "chargebacks", *MERCHANT_KEYED_TABLES):
+        Base.metadata.tables[table].create(connection)
+
+    sources = [(HOT, None)] + [(partition_source(month), month) for month in months]
+    copied = {"merchants": copy_legacy_rows(connection, "merchants", "legacy_merchants", "merchants")}
+    for source, month in sources:
+        if month is not None:
+            _create_fact_tables(connection, source)
+        for table, target, parents in (
+            ("transactions", source.transactions, "merchants"),
+            ("chargebacks", source.chargebacks, source.transactions),
+        ):
+            copied[target] = copy_legacy_rows(connection, table, f"legacy_{target}", target, parents)
+    for source, _ in reversed(sources):
+        for table in (source.chargebacks, source.transactions):
+            left_out = connection.exec_driver_sql(f"SELECT COUNT(*) FROM legacy_{table}").scalar() - copied[table]
+            if left_out:
+                logger.warning("0004_compact_keys: moved %d rows of %s without a parent row to legacy_orphans",
+                               left_out, table)
+            connection.exec_driver_sql(f"DROP TABLE legacy_{table}")
+    connection.exec_driver_sql("DROP TABLE legacy_merchants")
+
+    for source, month in sources[1:]:
+        _seal(connection, month, source)
+        _write_summaries(connection, month, source)
+    rebuild_all(connection)
+    install_triggers(connection)
@@ -1,52 +1,305 @@
-from sqlalchemy import Column, String, Float, DateTime, ForeignKey, Index
+from sqlalchemy import (
+    Boolean, Column, String, Float, Integer, Date, DateTime, ForeignKey, Index, LargeBinary, UniqueConstraint, event,
+)
 from app.database import Base
+from app.fx import seed_fx_rates
+from app.rollups import install_rollups
 
+# Columns computed by triggers (see app/fx.py); they are never accepted from clients.
+DERIVED = {"derived": True}
 
+
+class DictionaryValue(Base):
+    """
+    Codes of the categorical fact columns (see app/encoding.py). One id space for every kind, so a
+    code decodes without knowing its column.
+    """
+    __tablename__ = "dictionary"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    value = Column(String, nullable=False)
+
+    __table_args__ = (UniqueConstraint("kind", "value", name="uq_dictionary_kind_value"),)
+
+
+class ReasonCode(Base):
+    """Description of each chargeback reason code, normalized out of `chargebacks`."""
+    __tablename__ = "reason_codes"
+
+    code = Column(String, primary_key=True)
+    description = Column(String, nullable=False)
+
+
+# Fact and merchant rows have integer surrogate keys; the ids clients send and see are kept in
+# `external_id`. AUTOINCREMENT keeps a deleted row's id from being reused, which the (rowid, id)
+# watermarks in app/columnar.py and app/alert_stream.py, and the appends in app/sketches.py, rely on.
 class Merchant(Base):
     __tablename__ = "merchants"
 
-    id = Column(String, primary_key=True)
+    id = Column(Integer, primary_key=True)
+    external_id = Column(String, nullable=False)
     name = Column(String, nullable=False)
     country = Column(String, nullable=False)
 
+    __table_args__ = (
+        Index("ix_merchants_external_id", "external_id", unique=True),
+        {"sqlite_autoincrement": True},
+    )
+
 
 class Transaction(Base):
     __tablename__ = "transactions"
 
-    id = Column(String, primary_key=True)
+    id = Column(Integer, primary_key=True)
+    external_id = Column(String, nullable=False)
     timestamp = Column(DateTime, nullable=False)
     amount = Column(Float, nullable=False)
-    currency = Column(String, nullable=False)
-    merchant_id = Column(String, ForeignKey("merchants.id"), nullable=False)
+    currency_id = Column(Integer, ForeignKey("dictionary.id"), nullable=False)
+    merchant_id = Column(Integer, ForeignKey("merchants.id"), nullable=False)
     customer_id = Column(String, nullable=False)
-    payment_method = Column(String, nullable=False)
-    country = Column(String, nullable=False)
-    product_category = Column(String, nullable=False)
-    status = Column(String, nullable=False)
+    payment_method_id = Column(Integer, ForeignKey("dictionary.id"), nullable=False)
+    country_id = Column(Integer, ForeignKey("dictionary.id"), nullable=False)
+    product_category_id = Column(Integer, ForeignKey("dictionary.id"), nullable=False)
+    status_id = Column(Integer, ForeignKey("dictionary.id"), nullable=False)
     card_bin = Column(String(6), nullable=False)
+    amount_usd = Column(Float, info=DERIVED)
 
     __table_args__ = (
+        Index("ix_transactions_external_id", "external_id", unique=True),
         Index("ix_transactions_merchant_id", "merchant_id"),
         Index("ix_transactions_customer_id", "customer_id"),
         Index("ix_transactions_card_bin", "card_bin"),
         Index("ix_transactions_timestamp", "timestamp"),
+        # Covering indexes proposed by scripts/index_advisor.py (migration 0002_covering_indexes).
+        # The rowid id is in every index entry already, so it is no longer listed.
+        # ix_transactions_amount_usd_merchant_id replaces the single-column index on amount_usd.
+        Index("ix_transactions_country_id", "country_id"),
+        Index("ix_transactions_product_category_id", "product_category_id"),
+        Index("ix_transactions_payment_method_id", "payment_method_id"),
+        Index("ix_transactions_amount_usd_merchant_id", "amount_usd", "merchant_id"),
+        {"sqlite_autoincrement": True},
     )
 
 
 class Chargeback(Base):
     __tablename__ = "chargebacks"
 
-    id = Column(String, primary_key=True)
-    transaction_id = Column(String, ForeignKey("transactions.id"), nullable=False)
+    id = Column(Integer, primary_key=True)
+    external_id = Column(String, nullable=False)
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=False)
     chargeback_date = Column(DateTime, nullable=False)
-    reason_code = Column(String, nullable=False)
-    reason_description = Column(String, nullable=False)
-    status = Column(String, nullable=False)
+    reason_code = Column(String, ForeignKey("reason_codes.code"), nullable=False)
+    status_id = Column(Integer, ForeignKey("dictionary.id"), nullable=False)
     amount = Column(Float, nullable=False)
+    amount_usd = Column(Float, info=DERIVED)
 
     __table_args__ = (
+        Index("ix_chargebacks_external_id", "external_id", unique=True),
         Index("ix_chargebacks_transaction_id", "transaction_id"),
         Index("ix_chargebacks_chargeback_date", "chargeback_date"),
-        Index("ix_chargebacks_reason_code", "reason_code"),
-        Index("ix_chargebacks_status", "status"),
+        Index("ix_chargebacks_status_id", "status_id"),
+        Index("ix_chargebacks_amount_usd", "amount_usd"),
+        # Also serves the lookups by reason_code alone (migration 0002_covering_indexes).
+        Index("ix_chargebacks_reason_code_amount_status_id", "reason_code", "amount", "status_id"),
+        {"sqlite_autoincrement": True},
     )
+
+
+class MerchantStats(Base):
+    __tablename__ = "merchant_stats"
+
+    merchant_id = Column(Integer, ForeignKey("merchants.id"), primary_key=True)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    chargeback_count = Column(Integer, nullable=False, default=0)
+    chargeback_amount = Column(Float, nullable=False, default=0.0)
+    chargeback_ratio = Column(Float, nullable=False, default=0.0)
+
+
+Index("ix_merchant_stats_chargeback_ratio", MerchantStats.chargeback_ratio.desc(), MerchantStats.merchant_id)
+
+
+class CustomerRisk(Base):
+    """Clustered on customer_id (WITHOUT ROWID), so a per-customer lookup reads one B-tree."""
+    __tablename__ = "customer_risk"
+
+    customer_id = Column(String, primary_key=True)
+    chargeback_count = Column(Integer, nullable=False, default=0)
+    merchant_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0.0)
+    first_chargeback_date = Column(DateTime, nullable=False)
+    last_chargeback_date = Column(DateTime, nullable=False)
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
+
+# Covers the repeat-offender listing: ordered by count, no table lookups.
+Index(
+    "ix_customer_risk_chargeback_count",
+    CustomerRisk.chargeback_count.desc(), CustomerRisk.customer_id, CustomerRisk.merchant_count, CustomerRisk.total_amount,
+)
+
+
+class ChargebackDaily(Base):
+    __tablename__ = "chargeback_daily"
+
+    period = Column(String, primary_key=True)
+    merchant_id = Column(Integer, ForeignKey("merchants.id"), primary_key=True)
+    reason_code = Column(String, primary_key=True)
+    chargeback_count = Column(Integer, nullable=False, default=0)
+    chargeback_amount = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        Index("ix_chargeback_daily_merchant_id", "merchant_id", "period"),
+        Index("ix_chargeback_daily_reason_code", "reason_code", "period"),
+    )
+
+
+class ChargebackWeekly(Base):
+    __tablename__ = "chargeback_weekly"
+
+    period = Column(String, primary_key=True)
+    merchant_id = Column(Integer, ForeignKey("merchants.id"), primary_key=True)
+    reason_code = Column(String, primary_key=True)
+    chargeback_count = Column(Integer, nullable=False, default=0)
+    chargeback_amount = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        Index("ix_chargeback_weekly_merchant_id", "merchant_id", "period"),
+        Index("ix_chargeback_weekly_reason_code", "reason_code", "period"),
+    )
+
+
+class ChargebackMonthly(Base):
+    __tablename__ = "chargeback_monthly"
+
+    period = Column(String, primary_key=True)
+    merchant_id = Column(Integer, ForeignKey("merchants.id"), primary_key=True)
+    reason_code = Column(String, primary_key=True)
+    chargeback_count = Column(Integer, nullable=False, default=0)
+    chargeback_amount = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        Index("ix_chargeback_monthly_merchant_id", "merchant_id", "period"),
+        Index("ix_chargeback_monthly_reason_code", "reason_code", "period"),
+    )
+
+
+class SketchDay(Base):
+    """
+    Version of each chargeback day's persisted sketches (see app/sketches.py). Readers reload the days
+    past the last version they read; `stale` days have changed since and are waiting for a rebuild.
+    """
+    __tablename__ = "sketch_days"
+
+    period = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+    stale = Column(Boolean, nullable=False)
+
+
+class ChargebackSketch(Base):
+    """Chargeback count, customer HyperLogLog and amount quantile sketch per (day, merchant, reason code)."""
+    __tablename__ = "chargeback_sketches"
+
+    period = Column(String, primary_key=True)
+    merchant_id = Column(Integer, primary_key=True)
+    reason_code = Column(String, primary_key=True)
+    chargeback_count = Column(Integer, nullable=False)
+    customers = Column(LargeBinary, nullable=False)
+    amounts = Column(LargeBinary, nullable=False)
+
+
+class SegmentSketch(Base):
+    """The same sketches per (day, segment dimension, dictionary code), across merchants and reason codes."""
+    __tablename__ = "segment_sketches"
+
+    period = Column(String, primary_key=True)
+    dimension = Column(String, primary_key=True)
+    value_id = Column(Integer, primary_key=True)
+    chargeback_count = Column(Integer, nullable=False)
+    customers = Column(LargeBinary, nullable=False)
+    amounts = Column(LargeBinary, nullable=False)
+
+
+class Partition(Base):
+    """Catalog of archived months, with each month's row counts and date range (its zone map)."""
+    __tablename__ = "partitions"
+
+    month = Column(String, primary_key=True)
+    status = Column(String, nullable=False)
+    path = Column(String)
+    transaction_count = Column(Integer, nullable=False)
+    chargeback_count = Column(Integer, nullable=False)
+    first_transaction_at = Column(DateTime, nullable=False)
+    last_transaction_at = Column(DateTime, nullable=False)
+    first_chargeback_at = Column(DateTime)
+    last_chargeback_at = Column(DateTime)
+    archived_at = Column(DateTime, nullable=False)
+
+
+class PartitionMerchantStats(Base):
+    """What an attached month contributes to `merchant_stats`; subtracted again when it is detached."""
+    __tablename__ = "partition_merchant_stats"
+
+    month = Column(String, primary_key=True)
+    merchant_id = Column(Integer, primary_key=True)
+    transaction_count = Column(Integer, nullable=False)
+    chargeback_count = Column(Integer, nullable=False)
+    chargeback_amount = Column(Float, nullable=False)
+
+
+class PartitionChargebackDaily(Base):
+    """What an attached month contributes to `chargeback_daily`."""
+    __tablename__ = "partition_chargeback_daily"
+
+    month = Column(String, primary_key=True)
+    period = Column(String, primary_key=True)
+    merchant_id = Column(Integer, primary_key=True)
+    reason_code = Column(String, primary_key=True)
+    chargeback_count = Column(Integer, nullable=False)
+    chargeback_amount = Column(Float, nullable=False)
+
+
+class PartitionCustomerRisk(Base):
+    """Per (customer, merchant) chargeback totals of an attached month, clustered on customer_id."""
+    __tablename__ = "partition_customer_risk"
+
+    customer_id = Column(String, primary_key=True)
+    merchant_id = Column(Integer, primary_key=True)
+    month = Column(String, primary_key=True)
+    chargeback_count = Column(Integer, nullable=False)
+    total_amount = Column(Float, nullable=False)
+    first_chargeback_date = Column(DateTime, nullable=False)
+    last_chargeback_date = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_partition_customer_risk_month", "month", "customer_id"),
+        {"sqlite_with_rowid": False},
+    )
+
+
+class LegacyOrphan(Base):
+    """
+    Rows of the record layout whose parent was missing when they were converted (see
+    `copy_legacy_rows`): they cannot be keyed, so they are kept here as JSON instead.
+    """
+    __tablename__ = "legacy_orphans"
+
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)
+    external_id = Column(String, nullable=False)
+    parent_id = Column(String)
+    record = Column(String, nullable=False)
+
+
+class FxRate(Base):
+    __tablename__ = "fx_rates"
+
+    currency = Column(String(3), primary_key=True)
+    effective_date = Column(Date, primary_key=True)
+    units_per_usd = Column(Float, nullable=False)
+
+
+event.listen(FxRate.__table__, "after_create", seed_fx_rates)
+
+event.listen(Base.metadata, "after_create", install_rollups)
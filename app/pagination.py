@@ -0,0 +1,76 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Every list endpoint orders its rows by a sort key that ends in a unique column, for example
+`(-chargeback_ratio, merchant_id)`. When a page is full, the key of its last row is returned in the
+`X-Next-Cursor` response header as an opaque token. Passing that token back as `?cursor=` resumes
+strictly after that row with a `(key) > (:k0, :k1, ...)` predicate instead of an OFFSET, so rows
+inserted ahead of the cursor never shift the next page and earlier rows are never re-sorted and discarded.
+
+Tokens are URL-safe base64 of a JSON array `[scope, key]`. The scope names the endpoint and the
+parameters that shape the result, so a cursor cannot be replayed against a different query.
+"""
+import base64
+import binascii
+import json
+from typing import Callable, Optional, Sequence
+from fastapi import HTTPException, Response
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+
+CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(scope: str, key: Sequence) -> str:
+    payload = json.dumps([scope, list(key)], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], scope: str, width: Optional[int] = None) -> Optional[tuple]:
+    """Key encoded in `cursor`, or None for the first page. Raises 400 for malformed or foreign cursors."""
+    if cursor is None:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_scope, key = json.loads(payload)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if cursor_scope != scope or not isinstance(key, list) or (width is not None and len(key) != width):
+        raise HTTPException(status_code=400, detail="cursor does not belong to this query")
+    return tuple(key)
+
+
+def check_cursor_offset(cursor: Optional[str], offset: int) -> None:
+    if cursor is not None and offset:
+        raise HTTPException(status_code=400, detail="cursor and offset cannot be combined")
+
+
+def keyset_params(after: Sequence) -> dict:
+    return {f"k{i}": value for i, value in enumerate(after)}
+
+
+def keyset_statements(body: str, key: Sequence[str]) -> tuple[TextClause, TextClause]:
+    """
+    Wrap an unordered SELECT so it is ordered by the `key` expressions (written against its output
+    columns). Returns the first-page statement and the statement that resumes after `:k0, :k1, ...`.
+    """
+    order = ", ".join(key)
+    placeholders = ", ".join(f":k{i}" for i in range(len(key)))
+    first = text(f"""
+        SELECT * FROM ({body})
+        ORDER BY {order}
+        LIMIT :limit OFFSET :offset
+    """)
+    after = text(f"""
+        SELECT * FROM ({body})
+        WHERE ({order}) > ({placeholders})
+        ORDER BY {order}
+        LIMIT :limit OFFSET :offset
+    """)
+    return first, after
+
+
+def set_next_cursor(response: Response, scope: str, rows: list, limit: int, key: Callable) -> None:
+    """Advertise the cursor for the next page when this page came back full."""
+    if rows and len(rows) >= limit:
+        response.headers[CURSOR_HEADER] = encode_cursor(scope, key(rows[-1]))
@@ -0,0 +1,448 @@
+"""
+Monthly partitions of `transactions` and `chargebacks`.
+
+The hot `transactions` and `chargebacks` tables hold the open months and take every write. Once a
+month is closed (its last day is PARTITION_CLOSE_AFTER_DAYS in the past), `archive_month()` moves
+its transactions, and the chargebacks filed against them, into `transactions_YYYY_MM` and
+`chargebacks_YYYY_MM`. Chargebacks follow their transaction's month, so every join stays inside one
+partition. Partition tables carry the indexes of the hot tables and are read-only: triggers reject
+every write, and ingestion rejects chargebacks against an archived transaction as unknown.
+
+The `partitions` catalog records each month with its row counts and its first/last transaction and
+chargeback timestamps. Read endpoints resolve their `start`/`end` parameters against that zone map
+with `fact_sources()` and only read the partitions whose range overlaps. The hot tables are always
+read: they have no zone map.
+
+What an attached month contributes to the rollup tables is kept in `partition_merchant_stats`,
+`partition_chargeback_daily` and `partition_customer_risk`, which `rebuild_all()` also reads.
+Archiving leaves the rollups and the sketches unchanged, since the rows only move. `detach_month()`
+writes the month to a standalone SQLite file in PARTITION_DIR (made read-only), subtracts its
+contribution from the rollups, rebuilds the sketches of its chargeback days and drops its tables;
+`attach_month()` loads such a file back. A detached month is invisible
+to every endpoint. SQLite attaches at most 10 databases per connection, so attached months live in
+the main database and only detached ones are separate files.
+"""
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Optional
+from fastapi import HTTPException, Query
+from sqlalchemy import Column, Index, MetaData, Table, text
+from sqlalchemy.engine import Connection, Engine
+from app.constants import PARTITION_CLOSE_AFTER_DAYS, PARTITION_DIR
+from app.database import write_transaction
+from app.encoding import copy_legacy_rows
+from app.models import Chargeback, Transaction
+from app.rollups import (
+    BUCKET_UPSERT_SQL, CUSTOMER_RISK_COLUMNS, MARK_SKETCH_DAYS_SQL, customer_risk_select, drop_triggers, install_triggers,
+)
+
+MONTH_PATTERN = re.compile(r"^(\d{4})-(0[1-9]|1[0-2])$")
+DETACHED_SCHEMA = "detached"
+TRANSACTION_COLUMNS = ", ".join(column.name for column in Transaction.__table__.columns)
+CHARGEBACK_COLUMNS = ", ".join(column.name for column in Chargeback.__table__.columns)
+
+
+@dataclass(frozen=True)
+class FactSource:
+    """A `transactions` table and the `chargebacks` table filed against it."""
+    transactions: str
+    chargebacks: str
+
+
+HOT = FactSource("transactions", "chargebacks")
+DETACHED = FactSource(f"{DETACHED_SCHEMA}.transactions", f"{DETACHED_SCHEMA}.chargebacks")
+
+
+def partition_source(month: str) -> FactSource:
+    suffix = month.replace("-", "_")
+    return FactSource(f"transactions_{suffix}", f"chargebacks_{suffix}")
+
+
+def month_bounds(month: str) -> tuple:
+    """First day of `month` (YYYY-MM) and first day of the month after it."""
+    match = MONTH_PATTERN.match(month)
+    if match is None:
+        raise ValueError(f"month must be YYYY-MM, got {month!r}")
+    first = date(int(match[1]), int(match[2]), 1)
+    return first, (first + timedelta(days=32)).replace(day=1)
+
+
+@dataclass(frozen=True)
+class DateRange:
+    """Half-open `[start, end)` day range from the `start`/`end` query parameters; either side may be open."""
+    start: Optional[date] = None
+    end: Optional[date] = None
+
+    @property
+    def bounded(self) -> bool:
+        return self.start is not None or self.end is not None
+
+    @property
+    def bounds(self) -> tuple:
+        """Which sides are set: the shape of the statement, which is what statements are cached on."""
+        return self.start is not None, self.end is not None
+
+    @property
+    def params(self) -> dict:
+        return {name: day.isoformat() for name, day in (("start", self.start), ("end", self.end)) if day is not None}
+
+    def scope(self, name: str) -> str:
+        """Cursor scope, so a cursor is only accepted for the range it was issued for."""
+        return f"{name}:{self.start or ''}:{self.end or ''}" if self.bounded else name
+
+
+UNBOUNDED = DateRange()
+
+
+def get_date_range(
+    start: Optional[date] = Query(None, description="First day to include (YYYY-MM-DD)"),
+    end: Optional[date] = Query(None, description="First day to exclude (YYYY-MM-DD)"),
+) -> DateRange:
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return DateRange(start, end)
+
+
+def range_condition(column: str, bounds: tuple) -> str:
+    """SQL condition keeping `column` inside a range of shape `bounds` (`:start`/`:end` parameters)."""
+    has_start, has_end = bounds
+    terms = [f"{column} >= :start"] * has_start + [f"{column} < :end"] * has_end
+    return " AND ".join(terms) or "1 = 1"
+
+
+def union_all(select: str, sources: tuple, **fields: str) -> str:
+    """`select`, with `{transactions}`/`{chargebacks}` (and `fields`) placeholders, once per source."""
+    return "\n        UNION ALL\n".join(
+        select.format(transactions=source.transactions, chargebacks=source.chargebacks, **fields) for source in sources
+    )
+
+
+@dataclass(frozen=True)
+class Partition:
+    """An attached month and its zone map (timestamps as stored)."""
+    month: str
+    first_transaction_at: str
+    last_transaction_at: str
+    first_chargeback_at: Optional[str]
+    last_chargeback_at: Optional[str]
+
+    @property
+    def source(self) -> FactSource:
+        return partition_source(self.month)
+
+    def overlaps(self, dates: DateRange, by: str) -> bool:
+        if by == "chargeback":
+            first, last = self.first_chargeback_at, self.last_chargeback_at
+            if first is None:
+                return False
+        else:
+            first, last = self.first_transaction_at, self.last_transaction_at
+        return (dates.start is None or last >= dates.start.isoformat()) and (
+            dates.end is None or first < dates.end.isoformat()
+        )
+
+
+ATTACHED_PARTITIONS_SQL = """
+    SELECT month, first_transaction_at, last_transaction_at, first_chargeback_at, last_chargeback_at
+    FROM partitions
+    WHERE status = 'attached'
+    ORDER BY month
+"""
+
+_catalogs: dict = {}
+
+
+def attached_partitions(conn: Connection) -> tuple:
+    """
+    The attached partitions, oldest first. Archive, detach and attach all create or drop tables, so
+    the catalog is cached per database until `PRAGMA schema_version` changes. Both are read on the
+    driver connection: routing does not count as a statement of the request.
+    """
+    driver = conn.connection.driver_connection
+    version = driver.execute("PRAGMA schema_version").fetchone()[0]
+    cached = _catalogs.get(conn.engine.url.database)
+    if cached is None or cached[0] != version:
+        cached = _catalogs[conn.engine.url.database] = (
+            version, tuple(Partition(*row) for row in driver.execute(ATTACHED_PARTITIONS_SQL)),
+        )
+    return cached[1]
+
+
+def fact_sources(conn: Connection, dates: DateRange = UNBOUNDED, by: str = "chargeback") -> tuple:
+    """
+    The hot tables plus every attached partition whose `by` ("chargeback" or "transaction")
+    timestamps overlap `dates`.
+    """
+    return (HOT, *(partition.source for partition in attached_partitions(conn) if partition.overlaps(dates, by)))
+
+
+# Maintenance: archive, detach and attach.
+
+WRITE_MERCHANT_SUMMARY_SQL = """
+    INSERT INTO partition_merchant_stats (month, merchant_id, transaction_count, chargeback_count, chargeback_amount)
+    SELECT :month, t.merchant_id, COUNT(DISTINCT t.id), COUNT(c.id), COALESCE(SUM(c.amount), 0.0)
+    FROM {transactions} t
+    LEFT JOIN {chargebacks} c ON c.transaction_id = t.id
+    GROUP BY t.merchant_id
+"""
+
+WRITE_DAILY_SUMMARY_SQL = """
+    INSERT INTO partition_chargeback_daily (month, period, merchant_id, reason_code, chargeback_count, chargeback_amount)
+    SELECT :month, DATE(c.chargeback_date), t.merchant_id, c.reason_code, COUNT(*), SUM(c.amount)
+    FROM {chargebacks} c
+    JOIN {transactions} t ON t.id = c.transaction_id
+    GROUP BY 2, 3, 4
+"""
+
+WRITE_CUSTOMER_SUMMARY_SQL = """
+    INSERT INTO partition_customer_risk
+        (month, customer_id, merchant_id, chargeback_count, total_amount, first_chargeback_date, last_chargeback_date)
+    SELECT :month, t.customer_id, t.merchant_id, COUNT(*), SUM(c.amount), MIN(c.chargeback_date), MAX(c.chargeback_date)
+    FROM {chargebacks} c
+    JOIN {transactions} t ON t.id = c.transaction_id
+    GROUP BY 2, 3
+"""
+
+APPLY_MERCHANT_SUMMARY_SQL = """
+    UPDATE merchant_stats
+    SET transaction_count = merchant_stats.transaction_count + :sign * p.transaction_count,
+        chargeback_count = merchant_stats.chargeback_count + :sign * p.chargeback_count,
+        chargeback_amount = merchant_stats.chargeback_amount + :sign * p.chargeback_amount
+    FROM partition_merchant_stats p
+    WHERE p.month = :month AND p.merchant_id = merchant_stats.merchant_id
+"""
+
+# Weekly and monthly buckets follow through the chargeback_daily triggers.
+ADD_DAILY_SUMMARY_SQL = f"""
+    INSERT INTO chargeback_daily (period, merchant_id, reason_code, chargeback_count, chargeback_amount)
+    SELECT period, merchant_id, reason_code, chargeback_count, chargeback_amount
+    FROM partition_chargeback_daily
+    WHERE month = :month
+    {BUCKET_UPSERT_SQL}
+"""
+
+SUBTRACT_DAILY_SUMMARY_SQL = """
+    UPDATE chargeback_daily
+    SET chargeback_count = chargeback_daily.chargeback_count - p.chargeback_count,
+        chargeback_amount = chargeback_daily.chargeback_amount - p.chargeback_amount
+    FROM partition_chargeback_daily p
+    WHERE p.month = :month AND p.period = chargeback_daily.period
+      AND p.merchant_id = chargeback_daily.merchant_id AND p.reason_code = chargeback_daily.reason_code
+"""
+
+MARK_MONTH_SKETCH_DAYS_SQL = MARK_SKETCH_DAYS_SQL.format(
+    "SELECT DISTINCT period FROM partition_chargeback_daily WHERE month = :month"
+)
+
+MONTH_CUSTOMERS_SQL = "SELECT customer_id FROM partition_customer_risk WHERE month = :month"
+
+# Recomputes every customer with chargebacks in the month, leaving out `:excluded_month`.
+REFRESH_MONTH_CUSTOMERS_SQL = [
+    f"DELETE FROM customer_risk WHERE customer_id IN ({MONTH_CUSTOMERS_SQL})",
+    f"""
+    INSERT INTO customer_risk ({CUSTOMER_RISK_COLUMNS}){customer_risk_select(
+        f"t.customer_id IN ({MONTH_CUSTOMERS_SQL})",
+        f"customer_id IN ({MONTH_CUSTOMERS_SQL}) AND month <> :excluded_month",
+    )}
+    """,
+]
+
+DELETE_SUMMARIES_SQL = [
+    f"DELETE FROM {table} WHERE month = :month"
+    for table in ("partition_merchant_stats", "partition_chargeback_daily", "partition_customer_risk")
+]
+
+RECORD_PARTITION_SQL = """
+    INSERT INTO partitions (
+        month, status, path, transaction_count, chargeback_count,
+        first_transaction_at, last_transaction_at, first_chargeback_at, last_chargeback_at, archived_at
+    )
+    SELECT :month, 'attached', NULL, tx.n, cb.n, tx.first, tx.last, cb.first, cb.last, CURRENT_TIMESTAMP
+    FROM (SELECT COUNT(*) AS n, MIN(timestamp) AS first, MAX(timestamp) AS last FROM {transactions}) tx,
+         (SELECT COUNT(*) AS n, MIN(chargeback_date) AS first, MAX(chargeback_date) AS last FROM {chargebacks}) cb
+"""
+
+PARTITIONS_SQL = text("SELECT * FROM partitions ORDER BY month")
+PARTITION_SQL = text("SELECT * FROM partitions WHERE month = :month")
+SET_PARTITION_STATUS_SQL = text("UPDATE partitions SET status = :status, path = :path WHERE month = :month")
+
+
+def _fact_tables(metadata: MetaData, source: FactSource, schema: Optional[str] = None) -> list:
+    """Copies of the hot table definitions named after `source`: same columns and indexes, no foreign keys."""
+    tables = []
+    for hot, name in ((Transaction.__table__, source.transactions), (Chargeback.__table__, source.chargebacks)):
+        name = name.rsplit(".", 1)[-1]
+        table = Table(
+            name, metadata,
+            *(Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in hot.columns),
+            schema=schema,
+        )
+        for index in hot.indexes:
+            Index(index.name.replace(hot.name, name, 1), *(table.c[c.name] for c in index.columns))
+        tables.append(table)
+    return tables
+
+
+def _create_fact_tables(conn: Connection, source: FactSource, schema: Optional[str] = None) -> None:
+    for table in _fact_tables(MetaData(), source, schema):
+        table.create(conn)
+
+
+# Rows are copied in rowid order, which the export uses to break ties between equal dates.
+def _copy_rows(conn: Connection, origin: FactSource, target: FactSource) -> None:
+    conn.execute(text(
+        f"INSERT INTO {target.transactions} ({TRANSACTION_COLUMNS})"
+        f" SELECT {TRANSACTION_COLUMNS} FROM {origin.transactions} ORDER BY rowid"
+    ))
+    conn.execute(text(
+        f"INSERT INTO {target.chargebacks} ({CHARGEBACK_COLUMNS})"
+        f" SELECT {CHARGEBACK_COLUMNS} FROM {origin.chargebacks} ORDER BY rowid"
+    ))
+
+
+def _load_detached_rows(conn: Connection, source: FactSource) -> None:
+    # A month detached before the compact layout of app/encoding.py is converted on the way in.
+    columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA {DETACHED_SCHEMA}.table_info(transactions)")}
+    if "external_id" in columns:
+        _copy_rows(conn, DETACHED, source)
+    else:
+        copy_legacy_rows(conn, "transactions", DETACHED.transactions, source.transactions, "merchants")
+        copy_legacy_rows(conn, "chargebacks", DETACHED.chargebacks, source.chargebacks, source.transactions)
+
+
+def _seal(conn: Connection, month: str, source: FactSource) -> None:
+    for table in (source.transactions, source.chargebacks):
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            conn.exec_driver_sql(f"""
+    CREATE TRIGGER trg_{table}_read_only_{operation.lower()}
+    BEFORE {operation} ON {table}
+    BEGIN
+        SELECT RAISE(ABORT, 'partition {month} is read-only');
+    END
+    """)
+
+
+def _write_summaries(conn: Connection, month: str, source: FactSource) -> None:
+    for statement in (WRITE_MERCHANT_SUMMARY_SQL, WRITE_DAILY_SUMMARY_SQL, WRITE_CUSTOMER_SUMMARY_SQL):
+        conn.execute(text(union_all(statement, (source,))), {"month": month})
+
+
+def _refresh_month_customers(conn: Connection, month: str, excluded_month: str = "") -> None:
+    for statement in REFRESH_MONTH_CUSTOMERS_SQL:
+        conn.execute(text(statement), {"month": month, "excluded_month": excluded_month})
+
+
+def _partition(conn: Connection, month: str, status: str) -> dict:
+    row = conn.execute(PARTITION_SQL, {"month": month}).mappings().first()
+    if row is None:
+        raise ValueError(f"{month} is not archived")
+    if row["status"] != status:
+        raise ValueError(f"{month} is {row['status']}")
+    return dict(row)
+
+
+def list_partitions(engine: Engine) -> list:
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(PARTITIONS_SQL).mappings()]
+
+
+def archive_month(engine: Engine, month: str, today: Optional[date] = None) -> dict:
+    """Move a closed month out of the hot tables into its read-only partition. Returns its catalog row."""
+    first, following = month_bounds(month)
+    closes = following - timedelta(days=1) + timedelta(days=PARTITION_CLOSE_AFTER_DAYS)
+    if (today or date.today()) < closes:
+        raise ValueError(f"{month} stays open for chargebacks until {closes}")
+    source = partition_source(month)
+    with engine.connect() as conn, write_transaction(conn):
+        if conn.execute(PARTITION_SQL, {"month": month}).first() is not None:
+            raise ValueError(f"{month} is already archived")
+        _create_fact_tables(conn, source)
+        moved = conn.execute(text(
+            f"INSERT INTO {source.transactions} ({TRANSACTION_COLUMNS}) SELECT {TRANSACTION_COLUMNS} FROM transactions"
+            " WHERE timestamp >= :start AND timestamp < :end ORDER BY rowid"
+        ), {"start": first.isoformat(), "end": following.isoformat()}).rowcount
+        if not moved:
+            raise ValueError(f"{month} has no transactions")
+        conn.execute(text(
+            f"INSERT INTO {source.chargebacks} ({CHARGEBACK_COLUMNS}) SELECT {CHARGEBACK_COLUMNS} FROM chargebacks"
+            f" WHERE transaction_id IN (SELECT id FROM {source.transactions}) ORDER BY rowid"
+        ))
+        _write_summaries(conn, month, source)
+        # The rows only move, and the rollups already count them: no triggers for the delete.
+        drop_triggers(conn)
+        conn.execute(text(f"DELETE FROM chargebacks WHERE transaction_id IN (SELECT id FROM {source.transactions})"))
+        conn.execute(text(f"DELETE FROM transactions WHERE id IN (SELECT id FROM {source.transactions})"))
+        install_triggers(conn)
+        _seal(conn, month, source)
+        conn.execute(text(union_all(RECORD_PARTITION_SQL, (source,))), {"month": month})
+        return dict(conn.execute(PARTITION_SQL, {"month": month}).mappings().one())
+
+
+def detach_month(engine: Engine, month: str, directory: str = PARTITION_DIR) -> Path:
+    """
+    Write an attached month to `<directory>/<month>.db` (read-only), take it out of the rollups and
+    drop its tables. Returns the file's path.
+    """
+    from app.sketches import rebuild_stale_sketches
+
+    source = partition_source(month)
+    path = Path(directory).resolve() / f"{month}.db"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # A copy left by an earlier detach; the month has been attached since, so it is replaced.
+    path.unlink(missing_ok=True)
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql(f"ATTACH DATABASE ? AS {DETACHED_SCHEMA}", (str(path),))
+            try:
+                with write_transaction(conn):
+                    _partition(conn, month, "attached")
+                    _create_fact_tables(conn, HOT, schema=DETACHED_SCHEMA)
+                    _copy_rows(conn, source, DETACHED)
+                    conn.execute(text(APPLY_MERCHANT_SUMMARY_SQL), {"month": month, "sign": -1})
+                    conn.execute(text(SUBTRACT_DAILY_SUMMARY_SQL), {"month": month})
+                    conn.execute(text(MARK_MONTH_SKETCH_DAYS_SQL), {"month": month})
+                    _refresh_month_customers(conn, month, excluded_month=month)
+                    for statement in DELETE_SUMMARIES_SQL:
+                        conn.execute(text(statement), {"month": month})
+                    conn.exec_driver_sql(f"DROP TABLE {source.chargebacks}")
+                    conn.exec_driver_sql(f"DROP TABLE {source.transactions}")
+                    conn.execute(SET_PARTITION_STATUS_SQL, {"month": month, "status": "detached", "path": str(path)})
+                    rebuild_stale_sketches(conn)
+            finally:
+                conn.exec_driver_sql(f"DETACH DATABASE {DETACHED_SCHEMA}")
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    path.chmod(0o444)
+    return path
+
+
+def attach_month(engine: Engine, month: str) -> dict:
+    """Load a detached month back from its file and add it to the rollups again. Returns its catalog row."""
+    from app.sketches import rebuild_stale_sketches
+
+    source = partition_source(month)
+    with engine.connect() as conn:
+        path = Path(_partition(conn, month, "detached")["path"])
+        if not path.exists():
+            raise ValueError(f"{month}: {path} not found")
+        conn.rollback()
+        conn.exec_driver_sql(f"ATTACH DATABASE ? AS {DETACHED_SCHEMA}", (f"{path.as_uri()}?mode=ro",))
+        try:
+            with write_transaction(conn):
+                _partition(conn, month, "detached")
+                _create_fact_tables(conn, source)
+                _load_detached_rows(conn, source)
+                _write_summaries(conn, month, source)
+                conn.execute(text(APPLY_MERCHANT_SUMMARY_SQL), {"month": month, "sign": 1})
+                conn.execute(text(ADD_DAILY_SUMMARY_SQL), {"month": month})
+                conn.execute(text(MARK_MONTH_SKETCH_DAYS_SQL), {"month": month})
+                _refresh_month_customers(conn, month)
+                _seal(conn, month, source)
+                conn.execute(SET_PARTITION_STATUS_SQL, {"month": month, "status": "attached", "path": str(path)})
+                rebuild_stale_sketches(conn)
+        finally:
+            conn.exec_driver_sql(f"DETACH DATABASE {DETACHED_SCHEMA}")
+        return dict(conn.execute(PARTITION_SQL, {"month": month}).mappings().one())
@@ -0,0 +1,187 @@
+"""
+Precomputed alerts, recommendations and fraud patterns, served from memory.
+
+These three endpoints recompute everything on each request, but their inputs only change when data is
+written. `PrecomputeScheduler` runs a background thread, started from the app's lifespan, that
+computes them at default settings into an immutable `Snapshot`. Everything is read inside one read
+transaction:
+- the alerts list;
+- every recommendation row;
+- every repeat offender;
+- every BIN pattern, each already sorted by its endpoint's order.
+
+A request with the default parameters and no `start`/`end` pages through that snapshot with no SQL.
+Offsets and cursors behave exactly as on the live path, so any page can be served from it.
+
+The snapshot is tagged with the response-cache data version it was built from. Every write bumps that
+version and wakes the scheduler, which rebuilds once writes have been quiet for
+PRECOMPUTE_DEBOUNCE_SECONDS. Writes from other processes bump it through `app.cache.watcher`. It also
+rebuilds every PRECOMPUTE_INTERVAL_SECONDS, so the spike window follows the calendar.
+
+A snapshot is served only while all of these hold:
+- its data version is current;
+- its spike window still ends today;
+- it is at most PRECOMPUTE_MAX_AGE_SECONDS old;
+- the request reads the engine it was built from.
+
+Otherwise the request is computed live, as before.
+"""
+import bisect
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable, Optional
+from sqlalchemy.engine import Engine
+from app.cache import data_version
+from app.constants import (
+    PRECOMPUTE_DEBOUNCE_SECONDS,
+    PRECOMPUTE_INTERVAL_SECONDS,
+    PRECOMPUTE_MAX_AGE_SECONDS,
+)
+from app.database import read_snapshot
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_HEADER = "X-Snapshot-Built-At"
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    engine: Engine
+    data_version: int
+    as_of: date
+    built_at: datetime
+    built_monotonic: float
+    build_ms: float
+    alerts: tuple
+    recommendations: tuple
+    repeat_offenders: tuple
+    bin_patterns: tuple
+
+
+def build_snapshot(engine: Engine) -> Snapshot:
+    from app.constants import BIN_MIN_CHARGEBACKS, BIN_WINDOW_HOURS, MERCHANT_RATIO_ALERT_THRESHOLD, REPEAT_OFFENDER_MIN_CHARGEBACKS
+    from app.detection import detect_bin_bursts
+    from app.partitions import UNBOUNDED, fact_sources
+    from app.routers.alerts import high_ratio_signal, high_value_signal, weekly_spike_signal
+    from app.routers.fraud import REPEAT_OFFENDERS_SQL, bin_pattern_key, bin_timeline_statement
+    from app.routers.recommendations import recommendation_statements
+
+    version = data_version.current
+    as_of = date.today()
+    built_at = datetime.now()
+    started = time.perf_counter()
+    # LIMIT -1 is SQLite for "no limit".
+    everything = {"limit": -1, "offset": 0}
+    with engine.connect() as conn, read_snapshot(conn):
+        sources = fact_sources(conn, UNBOUNDED)
+        alerts = (
+            *high_ratio_signal(conn, MERCHANT_RATIO_ALERT_THRESHOLD),
+            *weekly_spike_signal(conn, as_of),
+            *high_value_signal(conn),
+        )
+        recommendations = tuple(
+            tuple(row) for row in conn.execute(recommendation_statements(sources, UNBOUNDED.bounds)[0], everything)
+        )
+        repeat_offenders = tuple(
+            tuple(row) for row in conn.execute(REPEAT_OFFENDERS_SQL, {
+                **everything, "min_chargebacks": REPEAT_OFFENDER_MIN_CHARGEBACKS,
+            })
+        )
+        timeline = conn.execute(bin_timeline_statement(sources, UNBOUNDED.bounds))
+        bin_patterns = tuple(sorted(
+            detect_bin_bursts(timeline, time_window_hours=BIN_WINDOW_HOURS, min_count=BIN_MIN_CHARGEBACKS),
+            key=bin_pattern_key,
+        ))
+    return Snapshot(
+        engine=engine,
+        data_version=version,
+        as_of=as_of,
+        built_at=built_at,
+        built_monotonic=time.monotonic(),
+        build_ms=(time.perf_counter() - started) * 1000,
+        alerts=alerts,
+        recommendations=recommendations,
+        repeat_offenders=repeat_offenders,
+        bin_patterns=bin_patterns,
+    )
+
+
+def snapshot_page(rows: tuple, key: Callable, limit: int, offset: int, after) -> list:
+    """The page of `rows` (sorted by `key`) that the live keyset statements would return."""
+    if after is False:
+        return []
+    start = offset if after is None else bisect.bisect_right(rows, tuple(after), key=key)
+    return list(rows[start:start + limit])
+
+
+class PrecomputeScheduler:
+    def __init__(self, interval_seconds: float = PRECOMPUTE_INTERVAL_SECONDS,
+                 max_age_seconds: float = PRECOMPUTE_MAX_AGE_SECONDS,
+                 debounce_seconds: float = PRECOMPUTE_DEBOUNCE_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.max_age_seconds = max_age_seconds
+        self.debounce_seconds = debounce_seconds
+        self.engine: Optional[Engine] = None
+        self.snapshot: Optional[Snapshot] = None
+        self._build_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        data_version.subscribe(lambda _: self._wake.set())
+
+    def start(self, engine: Engine) -> None:
+        """Precompute from `engine` from now on; a snapshot of another engine is dropped."""
+        with self._build_lock:
+            if engine is not self.engine:
+                self.engine, self.snapshot = engine, None
+        if self.interval_seconds <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="precompute", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            self._wake.set()
+            thread.join()
+
+    def refresh(self) -> Snapshot:
+        """Rebuild the snapshot now, from the engine the scheduler was started with."""
+        with self._build_lock:
+            self.snapshot = build_snapshot(self.engine)
+            return self.snapshot
+
+    def is_fresh(self, snapshot: Snapshot) -> bool:
+        return (
+            snapshot.data_version == data_version.current
+            and snapshot.as_of == date.today()
+            and time.monotonic() - snapshot.built_monotonic <= self.max_age_seconds
+        )
+
+    def current(self, engine: Engine) -> Optional[Snapshot]:
+        """The snapshot, if it is fresh and was built from `engine`; None means compute live."""
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.engine is not engine or not self.is_fresh(snapshot):
+            return None
+        return snapshot
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("precompute snapshot build failed; requests are computed live")
+            self._wake.wait(self.interval_seconds)
+            # Let a burst of writes (one bump per ingestion batch) finish before rebuilding.
+            while self._wake.is_set() and not self._stop.is_set():
+                self._wake.clear()
+                self._stop.wait(self.debounce_seconds)
+
+
+scheduler = PrecomputeScheduler()
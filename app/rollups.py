@@ -0,0 +1,602 @@
+"""
+Rollup tables maintained incrementally by SQLite triggers.
+
+Every write to `merchants`, `transactions` or `chargebacks` — ORM, Core bulk insert or raw SQL —
+keeps `merchant_stats` in step, so read endpoints can serve per-merchant counters with an indexed
+lookup instead of re-joining the fact tables.
+
+Chargeback volume is also bucketed by (period, merchant_id, reason_code). Chargeback and transaction
+triggers maintain `chargeback_daily`, and triggers on `chargeback_daily` apply each change as a delta
+to `chargeback_weekly` and `chargeback_monthly`, so `/trends` reads one row per bucket instead of
+every chargeback.
+
+`customer_risk` keeps one row per customer with chargebacks (count, distinct merchants, amount,
+first and last chargeback date) for repeat-offender detection. A new chargeback is applied as a
+delta; deletes, updates and transaction changes recompute the affected customer's row from their
+own transactions. `rebuild_all()` recomputes everything from scratch and is exposed as
+`python -m scripts.manage rebuild-rollups`.
+
+`sketch_days` triggers mark the chargeback days whose persisted sketches (see app/sketches.py) have
+to be rebuilt after a delete or an update; the sketches themselves are written in Python.
+
+The `amount_usd` triggers from `app/fx.py` are installed and dropped together with the rollup
+triggers, and `rebuild_all()` recomputes those columns too, so a bulk load only has to call it once.
+"""
+import re
+from app.fx import AMOUNT_USD_TRIGGERS, recompute_amount_usd
+from app.migrations import compact_layout
+
+MERCHANT_STATS_RATIO_SQL = "COALESCE(ROUND(CAST({cb} AS FLOAT) / NULLIF({tx}, 0) * 100, 4), 0.0)"
+
+MERCHANT_STATS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_merchant_stats_ratio
+    AFTER UPDATE OF transaction_count, chargeback_count ON merchant_stats
+    BEGIN
+        UPDATE merchant_stats
+        SET chargeback_ratio = {MERCHANT_STATS_RATIO_SQL.format(cb="NEW.chargeback_count", tx="NEW.transaction_count")}
+        WHERE merchant_id = NEW.merchant_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_merchants_insert_stats
+    AFTER INSERT ON merchants
+    BEGIN
+        INSERT OR IGNORE INTO merchant_stats
+            (merchant_id, transaction_count, chargeback_count, chargeback_amount, chargeback_ratio)
+        VALUES (NEW.id, 0, 0, 0.0, 0.0);
+        UPDATE merchant_stats
+        SET transaction_count = (SELECT COUNT(*) FROM transactions WHERE merchant_id = NEW.id),
+            chargeback_count = (
+                SELECT COUNT(*) FROM chargebacks c
+                JOIN transactions t ON t.id = c.transaction_id
+                WHERE t.merchant_id = NEW.id
+            ),
+            chargeback_amount = (
+                SELECT COALESCE(SUM(c.amount), 0.0) FROM chargebacks c
+                JOIN transactions t ON t.id = c.transaction_id
+                WHERE t.merchant_id = NEW.id
+            )
+        WHERE merchant_id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_merchants_delete_stats
+    AFTER DELETE ON merchants
+    BEGIN
+        DELETE FROM merchant_stats WHERE merchant_id = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_insert_stats
+    AFTER INSERT ON transactions
+    BEGIN
+        UPDATE merchant_stats
+        SET transaction_count = transaction_count + 1,
+            chargeback_count = chargeback_count + (
+                SELECT COUNT(*) FROM chargebacks WHERE transaction_id = NEW.id
+            ),
+            chargeback_amount = chargeback_amount + (
+                SELECT COALESCE(SUM(amount), 0.0) FROM chargebacks WHERE transaction_id = NEW.id
+            )
+        WHERE merchant_id = NEW.merchant_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_delete_stats
+    AFTER DELETE ON transactions
+    BEGIN
+        UPDATE merchant_stats
+        SET transaction_count = transaction_count - 1,
+            chargeback_count = chargeback_count - (
+                SELECT COUNT(*) FROM chargebacks WHERE transaction_id = OLD.id
+            ),
+            chargeback_amount = chargeback_amount - (
+                SELECT COALESCE(SUM(amount), 0.0) FROM chargebacks WHERE transaction_id = OLD.id
+            )
+        WHERE merchant_id = OLD.merchant_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_update_stats
+    AFTER UPDATE OF merchant_id ON transactions
+    WHEN OLD.merchant_id IS NOT NEW.merchant_id
+    BEGIN
+        UPDATE merchant_stats
+        SET transaction_count = transaction_count - 1,
+            chargeback_count = chargeback_count - (
+                SELECT COUNT(*) FROM chargebacks WHERE transaction_id = NEW.id
+            ),
+            chargeback_amount = chargeback_amount - (
+                SELECT COALESCE(SUM(amount), 0.0) FROM chargebacks WHERE transaction_id = NEW.id
+            )
+        WHERE merchant_id = OLD.merchant_id;
+        UPDATE merchant_stats
+        SET transaction_count = transaction_count + 1,
+            chargeback_count = chargeback_count + (
+                SELECT COUNT(*) FROM chargebacks WHERE transaction_id = NEW.id
+            ),
+            chargeback_amount = chargeback_amount + (
+                SELECT COALESCE(SUM(amount), 0.0) FROM chargebacks WHERE transaction_id = NEW.id
+            )
+        WHERE merchant_id = NEW.merchant_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_insert_stats
+    AFTER INSERT ON chargebacks
+    BEGIN
+        UPDATE merchant_stats
+        SET chargeback_count = chargeback_count + 1,
+            chargeback_amount = chargeback_amount + NEW.amount
+        WHERE merchant_id = (SELECT merchant_id FROM transactions WHERE id = NEW.transaction_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_delete_stats
+    AFTER DELETE ON chargebacks
+    BEGIN
+        UPDATE merchant_stats
+        SET chargeback_count = chargeback_count - 1,
+            chargeback_amount = chargeback_amount - OLD.amount
+        WHERE merchant_id = (SELECT merchant_id FROM transactions WHERE id = OLD.transaction_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_update_stats
+    AFTER UPDATE OF transaction_id, amount ON chargebacks
+    BEGIN
+        UPDATE merchant_stats
+        SET chargeback_count = chargeback_count - 1,
+            chargeback_amount = chargeback_amount - OLD.amount
+        WHERE merchant_id = (SELECT merchant_id FROM transactions WHERE id = OLD.transaction_id);
+        UPDATE merchant_stats
+        SET chargeback_count = chargeback_count + 1,
+            chargeback_amount = chargeback_amount + NEW.amount
+        WHERE merchant_id = (SELECT merchant_id FROM transactions WHERE id = NEW.transaction_id);
+    END
+    """,
+]
+
+# Period label for a date or timestamp, per bucket granularity. Labels sort in time order.
+PERIOD_LABEL_SQL = {
+    "daily": "DATE({})",
+    "weekly": "strftime('%Y-W%W', {})",
+    "monthly": "strftime('%Y-%m', {})",
+}
+BUCKET_TABLES = {
+    "daily": "chargeback_daily",
+    "weekly": "chargeback_weekly",
+    "monthly": "chargeback_monthly",
+}
+DAILY_LABEL = PERIOD_LABEL_SQL["daily"]
+
+BUCKET_UPSERT_SQL = """
+        ON CONFLICT (period, merchant_id, reason_code) DO UPDATE
+        SET chargeback_count = chargeback_count + excluded.chargeback_count,
+            chargeback_amount = chargeback_amount + excluded.chargeback_amount"""
+
+ADD_CHARGEBACK_TO_DAILY_SQL = f"""
+        INSERT INTO chargeback_daily (period, merchant_id, reason_code, chargeback_count, chargeback_amount)
+        SELECT {DAILY_LABEL.format("NEW.chargeback_date")}, t.merchant_id, NEW.reason_code, 1, NEW.amount
+        FROM transactions t
+        WHERE t.id = NEW.transaction_id
+        {BUCKET_UPSERT_SQL};"""
+
+REMOVE_CHARGEBACK_FROM_DAILY_SQL = f"""
+        UPDATE chargeback_daily
+        SET chargeback_count = chargeback_count - 1,
+            chargeback_amount = chargeback_amount - OLD.amount
+        WHERE period = {DAILY_LABEL.format("OLD.chargeback_date")}
+          AND merchant_id = (SELECT merchant_id FROM transactions WHERE id = OLD.transaction_id)
+          AND reason_code = OLD.reason_code;"""
+
+
+def _transaction_chargebacks_to_daily(row: str) -> str:
+    """Add the chargebacks already filed against transaction `row` (NEW) to its merchant's buckets."""
+    return f"""
+        INSERT INTO chargeback_daily (period, merchant_id, reason_code, chargeback_count, chargeback_amount)
+        SELECT {DAILY_LABEL.format("c.chargeback_date")}, {row}.merchant_id, c.reason_code, COUNT(*), SUM(c.amount)
+        FROM chargebacks c
+        WHERE c.transaction_id = {row}.id
+        GROUP BY {DAILY_LABEL.format("c.chargeback_date")}, c.reason_code
+        {BUCKET_UPSERT_SQL};"""
+
+
+def _transaction_chargebacks_from_daily(row: str) -> str:
+    """Remove the chargebacks filed against transaction `row` (OLD) from its merchant's buckets."""
+    match = f"""
+                WHERE c.transaction_id = {row}.id
+                  AND {DAILY_LABEL.format("c.chargeback_date")} = chargeback_daily.period
+                  AND c.reason_code = chargeback_daily.reason_code"""
+    return f"""
+        UPDATE chargeback_daily
+        SET chargeback_count = chargeback_count - (SELECT COUNT(*) FROM chargebacks c{match}
+            ),
+            chargeback_amount = chargeback_amount - (SELECT COALESCE(SUM(c.amount), 0.0) FROM chargebacks c{match}
+            )
+        WHERE merchant_id = {row}.merchant_id
+          AND (period, reason_code) IN (
+              SELECT {DAILY_LABEL.format("chargeback_date")}, reason_code FROM chargebacks WHERE transaction_id = {row}.id
+          );"""
+
+
+def _daily_rollup_triggers(granularity: str) -> list:
+    """Propagate every change to a `chargeback_daily` row into the coarser bucket table as a delta."""
+    table = BUCKET_TABLES[granularity]
+    label = PERIOD_LABEL_SQL[granularity]
+    add = f"""
+        INSERT INTO {table} (period, merchant_id, reason_code, chargeback_count, chargeback_amount)
+        VALUES ({label.format("NEW.period")}, NEW.merchant_id, NEW.reason_code, NEW.chargeback_count, NEW.chargeback_amount)
+        {BUCKET_UPSERT_SQL};"""
+    remove = f"""
+        UPDATE {table}
+        SET chargeback_count = chargeback_count - OLD.chargeback_count,
+            chargeback_amount = chargeback_amount - OLD.chargeback_amount
+        WHERE period = {label.format("OLD.period")} AND merchant_id = OLD.merchant_id AND reason_code = OLD.reason_code;"""
+    return [
+        f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargeback_daily_insert_{granularity}
+    AFTER INSERT ON chargeback_daily
+    BEGIN{add}
+    END
+    """,
+        f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargeback_daily_update_{granularity}
+    AFTER UPDATE ON chargeback_daily
+    BEGIN{remove}{add}
+    END
+    """,
+        f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargeback_daily_delete_{granularity}
+    AFTER DELETE ON chargeback_daily
+    BEGIN{remove}
+    END
+    """,
+    ]
+
+
+CHARGEBACK_BUCKET_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_insert_buckets
+    AFTER INSERT ON chargebacks
+    BEGIN{ADD_CHARGEBACK_TO_DAILY_SQL}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_delete_buckets
+    AFTER DELETE ON chargebacks
+    BEGIN{REMOVE_CHARGEBACK_FROM_DAILY_SQL}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_update_buckets
+    AFTER UPDATE OF transaction_id, chargeback_date, reason_code, amount ON chargebacks
+    BEGIN{REMOVE_CHARGEBACK_FROM_DAILY_SQL}{ADD_CHARGEBACK_TO_DAILY_SQL}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_insert_buckets
+    AFTER INSERT ON transactions
+    BEGIN{_transaction_chargebacks_to_daily("NEW")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_delete_buckets
+    AFTER DELETE ON transactions
+    BEGIN{_transaction_chargebacks_from_daily("OLD")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_update_buckets
+    AFTER UPDATE OF merchant_id ON transactions
+    WHEN OLD.merchant_id IS NOT NEW.merchant_id
+    BEGIN{_transaction_chargebacks_from_daily("OLD")}{_transaction_chargebacks_to_daily("NEW")}
+    END
+    """,
+    *_daily_rollup_triggers("weekly"),
+    *_daily_rollup_triggers("monthly"),
+]
+
+CUSTOMER_RISK_COLUMNS = (
+    "customer_id, chargeback_count, merchant_count, total_amount, first_chargeback_date, last_chargeback_date"
+)
+
+
+def customer_risk_select(customers: str = "1 = 1", archived: str = "1 = 1") -> str:
+    """
+    `customer_risk` rows for the customers matching `customers` (a condition on the hot transactions
+    `t`) and `archived` (a condition on `partition_customer_risk`). Hot chargebacks are aggregated per
+    (customer, merchant) and combined with the summaries of archived months, so a merchant seen in
+    both still counts once.
+    """
+    return f"""
+        SELECT customer_id, SUM(chargeback_count), COUNT(DISTINCT merchant_id), SUM(total_amount),
+               MIN(first_chargeback_date), MAX(last_chargeback_date)
+        FROM (
+            SELECT t.customer_id, t.merchant_id, COUNT(*) AS chargeback_count, SUM(cb.amount) AS total_amount,
+                   MIN(cb.chargeback_date) AS first_chargeback_date, MAX(cb.chargeback_date) AS last_chargeback_date
+            FROM transactions t
+            JOIN chargebacks cb ON cb.transaction_id = t.id
+            WHERE {customers}
+            GROUP BY t.customer_id, t.merchant_id
+            UNION ALL
+            SELECT customer_id, merchant_id, chargeback_count, total_amount, first_chargeback_date, last_chargeback_date
+            FROM partition_customer_risk
+            WHERE {archived}
+        )
+        GROUP BY customer_id"""
+
+
+# The merchant only counts as new when the customer has no other chargeback there, hot or archived.
+ADD_CHARGEBACK_TO_CUSTOMER_RISK_SQL = f"""
+        INSERT INTO customer_risk ({CUSTOMER_RISK_COLUMNS})
+        SELECT
+            t.customer_id, 1,
+            NOT EXISTS (
+                SELECT 1 FROM transactions t2
+                JOIN chargebacks cb ON cb.transaction_id = t2.id
+                WHERE t2.customer_id = t.customer_id AND t2.merchant_id = t.merchant_id AND cb.id <> NEW.id
+            ) AND NOT EXISTS (
+                SELECT 1 FROM partition_customer_risk p
+                WHERE p.customer_id = t.customer_id AND p.merchant_id = t.merchant_id
+            ),
+            NEW.amount, NEW.chargeback_date, NEW.chargeback_date
+        FROM transactions t
+        WHERE t.id = NEW.transaction_id
+        ON CONFLICT (customer_id) DO UPDATE
+        SET chargeback_count = chargeback_count + 1,
+            merchant_count = merchant_count + excluded.merchant_count,
+            total_amount = total_amount + excluded.total_amount,
+            first_chargeback_date = MIN(first_chargeback_date, excluded.first_chargeback_date),
+            last_chargeback_date = MAX(last_chargeback_date, excluded.last_chargeback_date);"""
+
+
+def _refresh_customer_risk(customer: str) -> str:
+    """Recompute the `customer_risk` row of `customer` (an SQL expression) from their transactions."""
+    return f"""
+        DELETE FROM customer_risk WHERE customer_id = {customer};
+        INSERT INTO customer_risk ({CUSTOMER_RISK_COLUMNS}){customer_risk_select(
+            f"t.customer_id = {customer}", f"customer_id = {customer}"
+        )};"""
+
+
+def _customer_of(transaction_id: str) -> str:
+    return f"(SELECT customer_id FROM transactions WHERE id = {transaction_id})"
+
+
+# Transaction triggers only fire for transactions that already have chargebacks, so plain
+# transaction inserts stay as cheap as before.
+CUSTOMER_RISK_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_insert_customer_risk
+    AFTER INSERT ON chargebacks
+    BEGIN{ADD_CHARGEBACK_TO_CUSTOMER_RISK_SQL}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_delete_customer_risk
+    AFTER DELETE ON chargebacks
+    BEGIN{_refresh_customer_risk(_customer_of("OLD.transaction_id"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_update_customer_risk
+    AFTER UPDATE OF transaction_id, chargeback_date, amount ON chargebacks
+    BEGIN{_refresh_customer_risk(_customer_of("OLD.transaction_id"))}{_refresh_customer_risk(_customer_of("NEW.transaction_id"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_insert_customer_risk
+    AFTER INSERT ON transactions
+    WHEN EXISTS (SELECT 1 FROM chargebacks WHERE transaction_id = NEW.id)
+    BEGIN{_refresh_customer_risk("NEW.customer_id")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_delete_customer_risk
+    AFTER DELETE ON transactions
+    WHEN EXISTS (SELECT 1 FROM chargebacks WHERE transaction_id = OLD.id)
+    BEGIN{_refresh_customer_risk("OLD.customer_id")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_update_customer_risk
+    AFTER UPDATE OF customer_id, merchant_id ON transactions
+    WHEN (OLD.customer_id IS NOT NEW.customer_id OR OLD.merchant_id IS NOT NEW.merchant_id)
+     AND EXISTS (SELECT 1 FROM chargebacks WHERE transaction_id = NEW.id)
+    BEGIN{_refresh_customer_risk("OLD.customer_id")}{_refresh_customer_risk("NEW.customer_id")}
+    END
+    """,
+]
+
+# Chargeback days whose persisted sketches (see app/sketches.py) no longer match the fact tables. The
+# triggers only mark the days in `sketch_days`: the cells are rebuilt in Python by the writers.
+# `{}` is a SELECT of `period` labels.
+MARK_SKETCH_DAYS_SQL = """
+        INSERT INTO sketch_days (period, version, stale)
+        SELECT period, 0, 1 FROM ({}) WHERE true
+        ON CONFLICT (period) DO UPDATE SET stale = 1;"""
+
+
+def _chargeback_day(row: str) -> str:
+    return f"SELECT {DAILY_LABEL.format(f'{row}.chargeback_date')} AS period"
+
+
+def _transaction_chargeback_days(row: str) -> str:
+    return f"SELECT DISTINCT {DAILY_LABEL.format('chargeback_date')} AS period FROM chargebacks WHERE transaction_id = {row}.id"
+
+
+SKETCH_DAY_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_insert_sketch_days
+    AFTER INSERT ON chargebacks
+    BEGIN{MARK_SKETCH_DAYS_SQL.format(_chargeback_day("NEW"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_delete_sketch_days
+    AFTER DELETE ON chargebacks
+    BEGIN{MARK_SKETCH_DAYS_SQL.format(_chargeback_day("OLD"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_chargebacks_update_sketch_days
+    AFTER UPDATE OF transaction_id, chargeback_date, reason_code, amount_usd ON chargebacks
+    BEGIN{MARK_SKETCH_DAYS_SQL.format(f"{_chargeback_day('OLD')} UNION {_chargeback_day('NEW')}")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_delete_sketch_days
+    AFTER DELETE ON transactions
+    WHEN EXISTS (SELECT 1 FROM chargebacks WHERE transaction_id = OLD.id)
+    BEGIN{MARK_SKETCH_DAYS_SQL.format(_transaction_chargeback_days("OLD"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_transactions_update_sketch_days
+    AFTER UPDATE OF merchant_id, customer_id, country_id, product_category_id, payment_method_id ON transactions
+    WHEN EXISTS (SELECT 1 FROM chargebacks WHERE transaction_id = NEW.id)
+    BEGIN{MARK_SKETCH_DAYS_SQL.format(_transaction_chargeback_days("NEW"))}
+    END
+    """,
+]
+
+REBUILD_CUSTOMER_RISK_SQL = [
+    "DELETE FROM customer_risk",
+    f"""
+    INSERT INTO customer_risk ({CUSTOMER_RISK_COLUMNS}){customer_risk_select()}
+    """,
+]
+
+REBUILD_CHARGEBACK_DAILY_SQL = [
+    "DELETE FROM chargeback_daily",
+    f"""
+    INSERT INTO chargeback_daily (period, merchant_id, reason_code, chargeback_count, chargeback_amount)
+    SELECT period, merchant_id, reason_code, SUM(chargeback_count), SUM(chargeback_amount)
+    FROM (
+        SELECT {DAILY_LABEL.format("c.chargeback_date")} AS period, t.merchant_id, c.reason_code,
+               COUNT(*) AS chargeback_count, SUM(c.amount) AS chargeback_amount
+        FROM chargebacks c
+        JOIN transactions t ON t.id = c.transaction_id
+        GROUP BY 1, 2, 3
+        UNION ALL
+        SELECT period, merchant_id, reason_code, chargeback_count, chargeback_amount
+        FROM partition_chargeback_daily
+    )
+    GROUP BY 1, 2, 3
+    """,
+]
+
+
+def _rebuild_from_daily_sql(granularity: str) -> list:
+    table = BUCKET_TABLES[granularity]
+    label = PERIOD_LABEL_SQL[granularity].format("period")
+    return [
+        f"DELETE FROM {table}",
+        f"""
+    INSERT INTO {table} (period, merchant_id, reason_code, chargeback_count, chargeback_amount)
+    SELECT {label}, merchant_id, reason_code, SUM(chargeback_count), SUM(chargeback_amount)
+    FROM chargeback_daily
+    GROUP BY 1, 2, 3
+    """,
+    ]
+
+
+REBUILD_MERCHANT_STATS_SQL = [
+    "DELETE FROM merchant_stats",
+    f"""
+    INSERT INTO merchant_stats
+        (merchant_id, transaction_count, chargeback_count, chargeback_amount, chargeback_ratio)
+    SELECT
+        m.id,
+        COALESCE(tx.cnt, 0),
+        COALESCE(cb.cnt, 0),
+        COALESCE(cb.amount, 0.0),
+        {MERCHANT_STATS_RATIO_SQL.format(cb="COALESCE(cb.cnt, 0)", tx="tx.cnt")}
+    FROM merchants m
+    LEFT JOIN (
+        SELECT merchant_id, SUM(cnt) AS cnt
+        FROM (
+            SELECT merchant_id, COUNT(*) AS cnt FROM transactions GROUP BY merchant_id
+            UNION ALL
+            SELECT merchant_id, transaction_count FROM partition_merchant_stats
+        )
+        GROUP BY merchant_id
+    ) tx ON tx.merchant_id = m.id
+    LEFT JOIN (
+        SELECT merchant_id, SUM(cnt) AS cnt, SUM(amount) AS amount
+        FROM (
+            SELECT t.merchant_id, COUNT(*) AS cnt, SUM(c.amount) AS amount
+            FROM chargebacks c
+            JOIN transactions t ON t.id = c.transaction_id
+            GROUP BY t.merchant_id
+            UNION ALL
+            SELECT merchant_id, chargeback_count, chargeback_amount FROM partition_merchant_stats
+        )
+        GROUP BY merchant_id
+    ) cb ON cb.merchant_id = m.id
+    """,
+]
+
+# Rebuilt in this order: the weekly and monthly buckets are derived from the daily ones.
+ROLLUP_TABLES = {
+    "merchant_stats": REBUILD_MERCHANT_STATS_SQL,
+    "chargeback_daily": REBUILD_CHARGEBACK_DAILY_SQL,
+    "chargeback_weekly": _rebuild_from_daily_sql("weekly"),
+    "chargeback_monthly": _rebuild_from_daily_sql("monthly"),
+    "customer_risk": REBUILD_CUSTOMER_RISK_SQL,
+}
+
+TRIGGERS = (
+    MERCHANT_STATS_TRIGGERS + CHARGEBACK_BUCKET_TRIGGERS + CUSTOMER_RISK_TRIGGERS + SKETCH_DAY_TRIGGERS
+    + AMOUNT_USD_TRIGGERS
+)
+TRIGGER_NAMES = [re.search(r"CREATE TRIGGER IF NOT EXISTS (\w+)", ddl).group(1) for ddl in TRIGGERS]
+
+
+def install_triggers(connection) -> None:
+    for ddl in TRIGGERS:
+        connection.exec_driver_sql(ddl)
+
+
+def drop_triggers(connection) -> None:
+    """Remove rollup triggers ahead of a bulk load; call `rebuild_all` and `install_triggers` afterwards."""
+    for name in TRIGGER_NAMES:
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild_all(connection) -> dict:
+    """
+    Recompute every rollup table, derived column and sketch day from the fact tables.
+    Returns the row count per rollup, the rows updated per derived column and the sketch days rebuilt.
+    """
+    from app.sketches import rebuild_sketches
+
+    counts = {}
+    for table, statements in ROLLUP_TABLES.items():
+        for statement in statements:
+            connection.exec_driver_sql(statement)
+        counts[table] = connection.exec_driver_sql(f"SELECT COUNT(*) FROM {table}").scalar()
+    counts.update(recompute_amount_usd(connection))
+    counts["sketch_days"] = rebuild_sketches(connection)
+    return counts
+
+
+def install_rollups(target, connection, tables=(), **kw) -> None:
+    """
+    `after_create` hook: install triggers and backfill rollups created against existing data.
+    Fact tables still in the record layout are backfilled by 0004_compact_keys instead.
+    """
+    install_triggers(connection)
+    if not compact_layout(connection):
+        return
+    created = {table.name for table in tables}
+    for table, statements in ROLLUP_TABLES.items():
+        if table in created:
+            for statement in statements:
+                connection.exec_driver_sql(statement)
+    if "sketch_days" in created:
+        from app.sketches import rebuild_sketches
+
+        rebuild_sketches(connection)
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.engine import Engine
+from typing import Optional
+from app.alert_stream import alert_stream
+from app.database import get_read_engine
+from app.metrics import TimedRoute
+
+router = APIRouter(route_class=TimedRoute)
+
+
+@router.get("/alerts/stream", response_class=StreamingResponse)
+def stream_alerts(
+    request: Request,
+    last_event_id: Optional[str] = Header(None, description="Resume after this event id (sent by EventSource on reconnect)"),
+    after: Optional[int] = Query(None, description="Resume after this event id when the header cannot be set"),
+    engine: Engine = Depends(get_read_engine),
+):
+    """
+    Server-Sent Events stream of alerts at default settings. An `alert` event is sent once when an
+    alert fires, and a `resolved` event when it clears. A new subscriber first receives every active
+    alert. A reconnecting one receives only the events after `Last-Event-ID`, or the active alerts
+    again if those events are no longer buffered.
+
+    Alerts are evaluated by an incremental rule engine that reads only the rows appended since its
+    previous pass, woken by every write.
+    """
+    if last_event_id is not None:
+        try:
+            after = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be an integer")
+    alert_stream.start(engine)
+    return StreamingResponse(
+        alert_stream.frames(after, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,96 +1,272 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from fastapi import APIRouter, Depends, Query, Response
+from functools import lru_cache
 from sqlalchemy import text
-from typing import List
-from app.database import get_db
-from app.constants import HIGH_VALUE_THRESHOLD_USD, MERCHANT_RATIO_ALERT_THRESHOLD, currency_to_usd_sql
+from sqlalchemy.engine import Engine
+from typing import List, Optional
+from app.database import get_read_engine
+from app.constants import (
+    ALERT_SIGNAL_WORKERS,
+    HIGH_VALUE_THRESHOLD_USD,
+    MERCHANT_RATIO_ALERT_THRESHOLD,
+    SPIKE_BASELINE_WINDOWS,
+    SPIKE_FACTOR,
+    SPIKE_MIN_CHARGEBACKS,
+    SPIKE_WINDOW_DAYS,
+)
+from app.metrics import TimedRoute
+from app.precompute import SNAPSHOT_HEADER, scheduler
+from app.partitions import HOT, UNBOUNDED, DateRange, fact_sources, get_date_range, range_condition, union_all
+from app.rollups import MERCHANT_STATS_RATIO_SQL
+from app.routers.merchants import PARTITIONED_MERCHANT_COUNTS_SELECT
 from app.schemas import Alert
+from app.serialization import get_format, model_record, rows_response
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+signal_pool = ThreadPoolExecutor(max_workers=ALERT_SIGNAL_WORKERS, thread_name_prefix="alert-signal")
+
+
+HIGH_RATIO_SQL = text("""
+    SELECT
+        m.external_id,
+        m.name,
+        s.transaction_count AS total_transactions,
+        s.chargeback_count AS total_chargebacks,
+        s.chargeback_ratio AS ratio
+    FROM merchant_stats s
+    JOIN merchants m ON m.id = s.merchant_id
+    WHERE s.chargeback_ratio > :ratio_threshold
+    ORDER BY s.chargeback_ratio DESC, s.merchant_id ASC
+""")
+
+# One range scan of the daily buckets covering the current and baseline windows; every
+# merchant × reason code is evaluated in the same GROUP BY.
+WEEKLY_SPIKE_SQL = text("""
+    SELECT
+        m.external_id,
+        m.name,
+        w.reason_code,
+        w.current_count,
+        w.baseline_count
+    FROM (
+        SELECT
+            merchant_id,
+            reason_code,
+            SUM(CASE WHEN period >= :current_start THEN chargeback_count ELSE 0 END) AS current_count,
+            SUM(CASE WHEN period < :current_start THEN chargeback_count ELSE 0 END) AS baseline_count
+        FROM chargeback_daily
+        WHERE period >= :baseline_start AND period < :current_end
+        GROUP BY merchant_id, reason_code
+    ) w
+    JOIN merchants m ON m.id = w.merchant_id
+    WHERE w.current_count >= :min_count
+      AND w.baseline_count > 0
+      AND w.current_count * :baseline_windows > :spike_factor * w.baseline_count
+    ORDER BY w.current_count * 1.0 / w.baseline_count DESC, w.merchant_id ASC, w.reason_code ASC
+""")
+
+# Range scan on the covering ix_transactions_amount_usd_merchant_id, then one index probe per hit into chargebacks.
+HIGH_VALUE_SQL = text("""
+    SELECT
+        t.external_id AS transaction_id,
+        m.external_id AS merchant_id,
+        m.name AS merchant_name,
+        ROUND(t.amount_usd, 2) AS amount_usd
+    FROM transactions t
+    JOIN chargebacks c ON c.transaction_id = t.id
+    JOIN merchants m ON m.id = t.merchant_id
+    WHERE t.amount_usd > :threshold
+""")
+
+PARTITIONED_HIGH_VALUE_SELECT = """
+    SELECT
+        t.external_id AS transaction_id,
+        m.external_id AS merchant_id,
+        m.name AS merchant_name,
+        ROUND(t.amount_usd, 2) AS amount_usd
+    FROM {transactions} t
+    JOIN {chargebacks} c ON c.transaction_id = t.id
+    JOIN merchants m ON m.id = t.merchant_id
+    WHERE t.amount_usd > :threshold AND {dates}"""
+
+
+@lru_cache(maxsize=256)
+def high_ratio_statement(sources: tuple, bounds: tuple):
+    """HIGH_RATIO_SQL over the transactions made inside a range of shape `bounds`."""
+    partials = union_all(PARTITIONED_MERCHANT_COUNTS_SELECT, sources, dates=range_condition("t.timestamp", bounds))
+    return text(f"""
+    SELECT
+        m.external_id,
+        m.name,
+        SUM(p.transactions) AS total_transactions,
+        SUM(p.chargebacks) AS total_chargebacks,
+        {MERCHANT_STATS_RATIO_SQL.format(cb="SUM(p.chargebacks)", tx="SUM(p.transactions)")} AS ratio
+    FROM ({partials}) p
+    JOIN merchants m ON m.id = p.merchant_id
+    GROUP BY m.id, m.external_id, m.name
+    HAVING ratio > :ratio_threshold
+    ORDER BY ratio DESC, m.id ASC
+""")
+
+
+@lru_cache(maxsize=256)
+def high_value_statement(sources: tuple, bounds: tuple):
+    """HIGH_VALUE_SQL over `sources`, for chargebacks dated inside a range of shape `bounds`."""
+    if sources == (HOT,) and bounds == (False, False):
+        return HIGH_VALUE_SQL
+    return text(union_all(PARTITIONED_HIGH_VALUE_SELECT, sources, dates=range_condition("c.chargeback_date", bounds)))
+
+
+def high_ratio_signal(conn, ratio_threshold: float, dates: DateRange = UNBOUNDED) -> List[Alert]:
+    if dates.bounded:
+        statement = high_ratio_statement(fact_sources(conn, dates, by="transaction"), dates.bounds)
+    else:
+        statement = HIGH_RATIO_SQL
+    merchant_rows = conn.execute(statement, {**dates.params, "ratio_threshold": ratio_threshold}).fetchall()
+    return [high_ratio_alert(row, ratio_threshold) for row in merchant_rows]
+
+
+def high_ratio_alert(row, ratio_threshold: float) -> Alert:
+    return Alert(
+        alert_type="HIGH_CHARGEBACK_RATIO",
+        severity="HIGH",
+        description=f"Merchant '{row[1]}' has chargeback ratio of {row[4]:.2f}% (threshold: {ratio_threshold}%)",
+        entity_id=row[0],
+        entity_name=row[1],
+        metric_value=row[4],
+    )
+
+
+def spike_windows(as_of: date, window_days: int, baseline_windows: int) -> dict:
+    """
+    Day labels bounding the current window, the `window_days` days ending with `as_of`,
+    and the `baseline_windows` windows of the same length right before it.
+    """
+    current_start = as_of - timedelta(days=window_days - 1)
+    return {
+        "baseline_start": (current_start - timedelta(days=window_days * baseline_windows)).isoformat(),
+        "current_start": current_start.isoformat(),
+        "current_end": (as_of + timedelta(days=1)).isoformat(),
+    }
+
+
+def weekly_spike_signal(
+    conn, as_of: date, window_days: int = SPIKE_WINDOW_DAYS, baseline_windows: int = SPIKE_BASELINE_WINDOWS,
+    spike_factor: float = SPIKE_FACTOR,
+) -> List[Alert]:
+    spike_rows = conn.execute(WEEKLY_SPIKE_SQL, {
+        **spike_windows(as_of, window_days, baseline_windows),
+        "baseline_windows": baseline_windows,
+        "spike_factor": spike_factor,
+        "min_count": SPIKE_MIN_CHARGEBACKS,
+    }).fetchall()
+    return [weekly_spike_alert(row, as_of, window_days, baseline_windows) for row in spike_rows]
+
+
+def weekly_spike_alert(row, as_of: date, window_days: int, baseline_windows: int) -> Alert:
+    return Alert(
+        alert_type="WEEKLY_SPIKE",
+        severity="MEDIUM",
+        description=(
+            f"Chargeback spike at '{row[1]}' for reason code {row[2]}: {row[3]} in the {window_days} days "
+            f"to {as_of} vs {row[4] / baseline_windows:g} per {window_days} days in the prior "
+            f"{window_days * baseline_windows} days"
+        ),
+        entity_id=row[0],
+        entity_name=row[1],
+        reason_code=row[2],
+        metric_value=row[3],
+    )
+
+
+def high_value_alert(row) -> Alert:
+    return Alert(
+        alert_type="HIGH_VALUE_DISPUTE",
+        severity="HIGH",
+        description=f"High-value chargeback ${row[3]:.2f} USD on transaction {row[0]} at '{row[2]}'",
+        entity_id=row[1],
+        entity_name=row[2],
+        metric_value=row[3],
+    )
+
+
+def high_value_signal(conn, dates: DateRange = UNBOUNDED) -> List[Alert]:
+    statement = high_value_statement(fact_sources(conn, dates), dates.bounds)
+    high_value_rows = conn.execute(statement, {**dates.params, "threshold": HIGH_VALUE_THRESHOLD_USD}).fetchall()
+    return [high_value_alert(row) for row in high_value_rows]
+
+
+def _run_signal(engine, signal, *args) -> tuple[List[Alert], float]:
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        alerts = signal(conn, *args)
+    return alerts, (time.perf_counter() - started) * 1000
+
+
+def evaluate_signals(engine, signals: dict) -> tuple[List[Alert], dict]:
+    """
+    Run each `name -> (signal, args)` on its own pooled connection concurrently.
+    Returns the alerts merged in `signals` order and the wall time of each signal in milliseconds.
+    """
+    # Each signal runs in a copy of the request context, so app.metrics attributes its SQL to /alerts.
+    futures = {
+        name: signal_pool.submit(contextvars.copy_context().run, _run_signal, engine, fn, *args)
+        for name, (fn, args) in signals.items()
+    }
+    alerts, timings = [], {}
+    for name, future in futures.items():
+        signal_alerts, elapsed_ms = future.result()
+        alerts.extend(signal_alerts)
+        timings[name] = elapsed_ms
+    return alerts, timings
 
 
 @router.get("/alerts", response_model=List[Alert])
 def get_alerts(
+    response: Response,
     ratio_threshold: float = Query(MERCHANT_RATIO_ALERT_THRESHOLD, ge=0.0, le=100.0, description="Chargeback ratio threshold (%) for merchant alerts"),
-    db: Session = Depends(get_db),
+    as_of: Optional[date] = Query(None, description="Last day of the spike window (default: today)"),
+    window_days: int = Query(SPIKE_WINDOW_DAYS, ge=1, le=90, description="Length of the spike window in days"),
+    baseline_windows: int = Query(SPIKE_BASELINE_WINDOWS, ge=1, le=52, description="Number of preceding windows averaged as the baseline"),
+    spike_factor: float = Query(SPIKE_FACTOR, ge=1.0, le=100.0, description="Spike when the window count exceeds this multiple of the baseline average"),
+    format: str = Depends(get_format),
+    dates: DateRange = Depends(get_date_range),
+    engine: Engine = Depends(get_read_engine),
 ):
     """
     Return active alerts across three signal types:
     - **HIGH_CHARGEBACK_RATIO**: merchant CB ratio exceeds `ratio_threshold` (default 1.5%).
-    - **WEEKLY_SPIKE**: last-7-day CB count is more than 2× the prior 7 days.
+    - **WEEKLY_SPIKE**: per merchant × reason code, the CB count in the `window_days` days ending
+      `as_of` exceeds `spike_factor` × its average over the `baseline_windows` windows before it.
     - **HIGH_VALUE_DISPUTE**: chargeback on a transaction worth more than $500 USD equivalent.
+
+    `start`/`end` restrict the ratio to transactions made in that range and high-value disputes to
+    chargebacks filed in it; the spike window is set by `as_of`.
+
+    The three signals are independent, so each runs on its own read connection in parallel.
+    Per-signal wall time is reported in the `Server-Timing` response header.
+
+    At default settings the alerts come from the precomputed snapshot while it is fresh; its build
+    time is in the `X-Snapshot-Built-At` header.
     """
-    alerts = []
+    defaults = (
+        ratio_threshold == MERCHANT_RATIO_ALERT_THRESHOLD and as_of in (None, date.today())
+        and window_days == SPIKE_WINDOW_DAYS and baseline_windows == SPIKE_BASELINE_WINDOWS
+        and spike_factor == SPIKE_FACTOR and not dates.bounded
+    )
+    snapshot = scheduler.current(engine) if defaults else None
+    if snapshot is not None:
+        response.headers[SNAPSHOT_HEADER] = snapshot.built_at.isoformat()
+        return rows_response(response, Alert, map(model_record, snapshot.alerts), format)
 
-    merchant_rows = db.execute(text("""
-        SELECT
-            m.id,
-            m.name,
-            COUNT(DISTINCT t.id) AS total_transactions,
-            COUNT(DISTINCT c.id) AS total_chargebacks,
-            ROUND(CAST(COUNT(DISTINCT c.id) AS FLOAT) / NULLIF(COUNT(DISTINCT t.id), 0) * 100, 4) AS ratio
-        FROM merchants m
-        LEFT JOIN transactions t ON t.merchant_id = m.id
-        LEFT JOIN chargebacks c ON c.transaction_id = t.id
-        GROUP BY m.id, m.name
-        HAVING ratio > :ratio_threshold
-    """), {"ratio_threshold": ratio_threshold}).fetchall()
-
-    for row in merchant_rows:
-        alerts.append(Alert(
-            alert_type="HIGH_CHARGEBACK_RATIO",
-            severity="HIGH",
-            description=f"Merchant '{row[1]}' has chargeback ratio of {row[4]:.2f}% (threshold: {ratio_threshold}%)",
-            entity_id=row[0],
-            entity_name=row[1],
-            metric_value=row[4],
-        ))
-
-    spike_row = db.execute(text("""
-        WITH last7 AS (
-            SELECT COUNT(*) AS cnt
-            FROM chargebacks
-            WHERE chargeback_date >= DATE('now', '-7 days')
-        ),
-        prev7 AS (
-            SELECT COUNT(*) AS cnt
-            FROM chargebacks
-            WHERE chargeback_date >= DATE('now', '-14 days')
-              AND chargeback_date < DATE('now', '-7 days')
-        )
-        SELECT last7.cnt, prev7.cnt
-        FROM last7, prev7
-    """)).fetchone()
-
-    if spike_row and spike_row[1] > 0 and spike_row[0] > 2 * spike_row[1]:
-        alerts.append(Alert(
-            alert_type="WEEKLY_SPIKE",
-            severity="MEDIUM",
-            description=f"Chargeback spike detected: {spike_row[0]} in last 7 days vs {spike_row[1]} in previous 7 days",
-            metric_value=spike_row[0],
-        ))
-
-    usd_expr = currency_to_usd_sql()
-    high_value_rows = db.execute(text(f"""
-        SELECT
-            t.id AS transaction_id,
-            m.id AS merchant_id,
-            m.name AS merchant_name,
-            ROUND({usd_expr}, 2) AS amount_usd
-        FROM chargebacks c
-        JOIN transactions t ON t.id = c.transaction_id
-        JOIN merchants m ON m.id = t.merchant_id
-        WHERE {usd_expr} > :threshold
-    """), {"threshold": HIGH_VALUE_THRESHOLD_USD}).fetchall()
-
-    for row in high_value_rows:
-        alerts.append(Alert(
-            alert_type="HIGH_VALUE_DISPUTE",
-            severity="HIGH",
-            description=f"High-value chargeback ${row[3]:.2f} USD on transaction {row[0]} at '{row[2]}'",
-            entity_id=row[1],
-            entity_name=row[2],
-            metric_value=row[3],
-        ))
-
-    return alerts
+    alerts, timings = evaluate_signals(engine, {
+        "high_ratio": (high_ratio_signal, (ratio_threshold, dates)),
+        "weekly_spike": (weekly_spike_signal, (as_of or date.today(), window_days, baseline_windows, spike_factor)),
+        "high_value": (high_value_signal, (dates,)),
+    })
+    response.headers["Server-Timing"] = ", ".join(f"{name};dur={ms:.2f}" for name, ms in timings.items())
+    return rows_response(response, Alert, map(model_record, alerts), format)
@@ -0,0 +1,86 @@
+from fastapi import APIRouter, Depends, HTTPException
+from functools import lru_cache
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from app.constants import REPEAT_OFFENDER_MIN_CHARGEBACKS
+from app.database import get_read_conn
+from app.metrics import TimedRoute
+from app.partitions import HOT, DateRange, fact_sources, get_date_range, range_condition, union_all
+from app.schemas import CustomerRisk
+
+router = APIRouter(route_class=TimedRoute)
+
+# Primary-key lookup on the WITHOUT ROWID table: one B-tree descent, no separate row fetch.
+CUSTOMER_RISK_SQL = text("""
+    SELECT customer_id, chargeback_count, merchant_count, total_amount, first_chargeback_date, last_chargeback_date
+    FROM customer_risk
+    WHERE customer_id = :customer_id
+""")
+
+CUSTOMER_EXISTS_SQL = text("""
+    SELECT 1 FROM transactions WHERE customer_id = :customer_id LIMIT 1
+""")
+
+PARTITIONED_CUSTOMER_EXISTS_SELECT = "SELECT 1 FROM {transactions} WHERE customer_id = :customer_id"
+
+PARTITIONED_CUSTOMER_RISK_SELECT = """
+            SELECT t.customer_id, t.merchant_id, COUNT(*) AS chargeback_count, SUM(c.amount) AS total_amount,
+                   MIN(c.chargeback_date) AS first_chargeback_date, MAX(c.chargeback_date) AS last_chargeback_date
+            FROM {transactions} t
+            JOIN {chargebacks} c ON c.transaction_id = t.id
+            WHERE t.customer_id = :customer_id AND {dates}
+            GROUP BY t.customer_id, t.merchant_id"""
+
+
+@lru_cache(maxsize=256)
+def customer_risk_statement(sources: tuple, bounds: tuple):
+    """CUSTOMER_RISK_SQL computed from the chargebacks in `sources` dated inside a range of shape `bounds`."""
+    partials = union_all(PARTITIONED_CUSTOMER_RISK_SELECT, sources, dates=range_condition("c.chargeback_date", bounds))
+    return text(f"""
+    SELECT customer_id, SUM(chargeback_count), COUNT(DISTINCT merchant_id), SUM(total_amount),
+           MIN(first_chargeback_date), MAX(last_chargeback_date)
+    FROM ({partials})
+    GROUP BY customer_id
+""")
+
+
+@lru_cache(maxsize=256)
+def customer_exists_statement(sources: tuple):
+    if sources == (HOT,):
+        return CUSTOMER_EXISTS_SQL
+    return text(f"{union_all(PARTITIONED_CUSTOMER_EXISTS_SELECT, sources)}\n    LIMIT 1")
+
+
+@router.get("/customers/{customer_id}/risk", response_model=CustomerRisk)
+def get_customer_risk(
+    customer_id: str,
+    dates: DateRange = Depends(get_date_range),
+    conn: Connection = Depends(get_read_conn),
+):
+    """
+    Chargeback history of one customer across all merchants: count, distinct merchants, total
+    amount and first/last chargeback date, from the trigger-maintained `customer_risk` table.
+    With `start`/`end` it is computed from the customer's chargebacks filed in that range instead.
+    A customer with transactions but no chargebacks gets zero counts; an unknown customer is a 404.
+    """
+    params = {**dates.params, "customer_id": customer_id}
+    if dates.bounded:
+        row = conn.execute(customer_risk_statement(fact_sources(conn, dates), dates.bounds), params).fetchone()
+    else:
+        row = conn.execute(CUSTOMER_RISK_SQL, params).fetchone()
+    if row is None:
+        if conn.execute(customer_exists_statement(fact_sources(conn)), params).fetchone() is None:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        return CustomerRisk(
+            customer_id=customer_id, chargeback_count=0, merchant_count=0, total_amount=0.0, repeat_offender=False,
+        )
+
+    return CustomerRisk(
+        customer_id=row[0],
+        chargeback_count=row[1],
+        merchant_count=row[2],
+        total_amount=row[3],
+        first_chargeback_date=row[4],
+        last_chargeback_date=row[5],
+        repeat_offender=row[1] >= REPEAT_OFFENDER_MIN_CHARGEBACKS,
+    )
@@ -0,0 +1,159 @@
+import time
+from datetime import date
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.engine import Connection
+from typing import Optional
+from app.constants import (
+    BIN_MIN_CHARGEBACKS,
+    BIN_WINDOW_HOURS,
+    HIGH_VALUE_THRESHOLD_USD,
+    MERCHANT_RATIO_ALERT_THRESHOLD,
+    REPEAT_OFFENDER_MIN_CHARGEBACKS,
+    SEGMENT_RATIO_THRESHOLD,
+)
+from app.dashboard import load_working_set, transaction_counts
+from app.database import get_read_conn, read_snapshot
+from app.metrics import TimedRoute
+from app.partitions import DateRange, fact_sources, get_date_range
+from app.routers.alerts import high_ratio_signal, high_value_alert, weekly_spike_signal
+from app.routers.fraud import REPEAT_OFFENDERS_SQL, bin_pattern_record, repeat_offender_record, repeat_offender_statements
+from app.routers.merchants import MERCHANT_RATIO_SQL, merchant_ratio_record, merchant_ratio_statements
+from app.routers.recommendations import recommendation_record
+from app.routers.segments import DIMENSION_COLUMN_MAP, segment_statements
+from app.routers.trends import GRANULARITIES, query_trends
+from app.routers.win_rate import win_rate_record
+from app.schemas import (
+    Alert,
+    Dashboard,
+    FraudPattern,
+    HighRiskSegment,
+    MerchantRatio,
+    ReasonCodeSummary,
+    Recommendation,
+    TrendPoint,
+    WinRateByReasonCode,
+)
+from app.serialization import get_format, json_response, model_record, shape
+
+router = APIRouter(route_class=TimedRoute)
+
+DASHBOARD_PANELS = ("ratio", "reason_codes", "segments", "trends", "alerts", "fraud", "recommendations", "win_rate")
+PANEL_MODELS = {
+    "ratio": MerchantRatio,
+    "reason_codes": ReasonCodeSummary,
+    "segments": HighRiskSegment,
+    "trends": TrendPoint,
+    "alerts": Alert,
+    "fraud": FraudPattern,
+    "recommendations": Recommendation,
+    "win_rate": WinRateByReasonCode,
+}
+# Panels computed from the shared chargeback ⨝ transaction working set.
+WORKING_SET_PANELS = {"reason_codes", "segments", "alerts", "fraud", "recommendations", "win_rate"}
+
+
+def parse_panels(panels: Optional[str]) -> set:
+    if panels is None:
+        return set(DASHBOARD_PANELS)
+    selected = {name.strip() for name in panels.split(",") if name.strip()}
+    if not selected or not selected <= set(DASHBOARD_PANELS):
+        raise HTTPException(
+            status_code=400, detail=f"panels must be a comma-separated subset of: {', '.join(DASHBOARD_PANELS)}",
+        )
+    return selected
+
+
+@router.get("/dashboard", response_model=Dashboard)
+def get_dashboard(
+    response: Response,
+    panels: Optional[str] = Query(None, description="Comma-separated panels to compute (default: all)"),
+    limit: int = Query(50, ge=1, le=500, description="Maximum rows per panel (per dimension for segments, per pattern type for fraud)"),
+    granularity: str = Query("daily", description="Trend bucket: daily, weekly or monthly"),
+    as_of: Optional[date] = Query(None, description="Last day of the alert spike window (default: today)"),
+    format: str = Depends(get_format),
+    dates: DateRange = Depends(get_date_range),
+    conn: Connection = Depends(get_read_conn),
+):
+    """
+    Return every dashboard panel in one payload; `panels` limits it to a subset, the rest are null.
+    Each panel matches the first page of its own endpoint at default settings with `limit` rows.
+
+    All panels are computed inside one read transaction, so they describe the same state of the
+    data. Chargebacks are joined to their transactions once and that working set is shared by
+    reason codes, win rate, segments, recommendations, the high-value alert and BIN patterns.
+    Ratio, trends, the ratio and spike alerts and repeat offenders come from the rollup tables.
+    Per-panel wall time is reported in the `Server-Timing` response header. With `format=columnar`
+    each panel is an object of field arrays.
+
+    `start`/`end` apply to every panel as they do on its endpoint. With a range, segments, ratio and
+    repeat offenders are computed from the fact tables of the partitions it overlaps.
+    """
+    selected = parse_panels(panels)
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be 'daily', 'weekly' or 'monthly'")
+
+    timings = {}
+
+    def timed(name: str, build):
+        started = time.perf_counter()
+        result = build()
+        timings[name] = (time.perf_counter() - started) * 1000
+        return result
+
+    page = {**dates.params, "limit": limit, "offset": 0}
+
+    def segments() -> list:
+        if dates.bounded:
+            sources = fact_sources(conn, dates, by="transaction")
+            return [
+                row for dimension in DIMENSION_COLUMN_MAP
+                for row in conn.execute(segment_statements(dimension, sources, dates.bounds)[0], {
+                    **page, "dimension": dimension, "threshold": SEGMENT_RATIO_THRESHOLD,
+                })
+            ]
+        return [
+            row for dimension, counts in transaction_counts(conn, fact_sources(conn, by="transaction")).items()
+            for row in working_set.segments(dimension, counts, SEGMENT_RATIO_THRESHOLD, limit)
+        ]
+
+    with read_snapshot(conn):
+        chargeback_sources = fact_sources(conn, dates)
+        working_set = timed(
+            "working_set", lambda: load_working_set(
+                conn, chargeback_sources, dates, HIGH_VALUE_THRESHOLD_USD, BIN_WINDOW_HOURS, BIN_MIN_CHARGEBACKS,
+            ),
+        ) if selected & WORKING_SET_PANELS else None
+        ratio_statement = (
+            merchant_ratio_statements(fact_sources(conn, dates, by="transaction"), dates.bounds)[0]
+            if dates.bounded else MERCHANT_RATIO_SQL
+        )
+        repeat_statement = (
+            repeat_offender_statements(chargeback_sources, dates.bounds)[0] if dates.bounded else REPEAT_OFFENDERS_SQL
+        )
+        builders = {
+            "ratio": lambda: [merchant_ratio_record(row) for row in conn.execute(ratio_statement, page)],
+            "reason_codes": lambda: working_set.reason_codes(limit),
+            "segments": segments,
+            "trends": lambda: query_trends(conn, granularity, dates.start, dates.end, {}, limit, 0),
+            "alerts": lambda: [model_record(alert) for alert in (
+                *high_ratio_signal(conn, MERCHANT_RATIO_ALERT_THRESHOLD, dates),
+                *weekly_spike_signal(conn, as_of or date.today()),
+                *(high_value_alert(row) for row in working_set.high_value()),
+            )],
+            "fraud": lambda: [
+                *(repeat_offender_record(row) for row in conn.execute(repeat_statement, {
+                    **page, "min_chargebacks": REPEAT_OFFENDER_MIN_CHARGEBACKS,
+                })),
+                *(bin_pattern_record(found, BIN_WINDOW_HOURS)
+                  for found in working_set.bin_patterns(limit)),
+            ],
+            "recommendations": lambda: [recommendation_record(row) for row in working_set.recommendations(limit)],
+            "win_rate": lambda: [win_rate_record(row) for row in working_set.win_rate(limit)],
+        }
+        payload = {
+            name: timed(name, lambda: shape(PANEL_MODELS[name], list(builders[name]()), format)) if name in selected else None
+            for name in DASHBOARD_PANELS
+        }
+
+    response.headers["Server-Timing"] = ", ".join(f"{name};dur={ms:.2f}" for name, ms in timings.items())
+    return json_response(response, payload)
@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
+from sqlalchemy.engine import Connection
+from typing import List, Optional
+from app.constants import SKETCH_QUANTILE_RELATIVE_ACCURACY
+from app.database import get_read_conn
+from app.metrics import TimedRoute
+from app.pagination import check_cursor_offset, decode_cursor, set_next_cursor
+from app.partitions import DateRange, get_date_range
+from app.schemas import AmountDistribution
+from app.serialization import get_format, rows_response
+from app.sketches import DIMENSIONS, HLL_RELATIVE_ERROR, Cell, sketch_store
+
+router = APIRouter(route_class=TimedRoute)
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def distribution_sort_key(row) -> tuple:
+    return (-row[2], row[1])
+
+
+def distribution_record(dimension: str, value: str, cell: Cell) -> tuple:
+    customers, amounts = cell.customers, cell.amounts
+    p50, p90, p99 = (
+        None if amount is None else round(amount, 2) for amount in amounts.quantiles(PERCENTILES)
+    )
+    return (
+        dimension,
+        value,
+        cell.count,
+        round(customers.estimate()),
+        customers.exact,
+        0.0 if customers.exact else round(HLL_RELATIVE_ERROR, 4),
+        p50,
+        p90,
+        p99,
+        round(amounts.min, 2) if amounts.count else None,
+        round(amounts.max, 2) if amounts.count else None,
+        SKETCH_QUANTILE_RELATIVE_ACCURACY,
+    )
+
+
+@router.get("/distributions", response_model=List[AmountDistribution])
+def get_distributions(
+    response: Response,
+    dimension: str = Query("merchant", description="Grouping: merchant, reason_code, country, category or payment_method"),
+    merchant_id: Optional[str] = Query(None, description="Only chargebacks of this merchant"),
+    reason_code: Optional[str] = Query(None, description="Only chargebacks with this reason code"),
+    limit: int = Query(50, ge=1, le=500, description="Maximum number of results"),
+    offset: int = Query(0, ge=0, description="Number of results to skip"),
+    cursor: Optional[str] = Query(None, description="Resume after the page that returned this X-Next-Cursor"),
+    format: str = Depends(get_format),
+    dates: DateRange = Depends(get_date_range),
+    conn: Connection = Depends(get_read_conn),
+):
+    """
+    Return p50/p90/p99 dispute amounts (USD) and distinct customers per group, by chargeback date,
+    ordered by chargeback count.
+
+    Answered from per-day sketches rather than an exact scan (a segment dimension filtered by
+    `merchant_id` or `reason_code` is folded from the matching chargebacks):
+    - `chargeback_count` is exact;
+    - `distinct_customers` is exact when `distinct_customers_exact`, otherwise a HyperLogLog estimate
+      with relative standard error `distinct_customers_error`;
+    - every amount percentile is within `amount_relative_error` (relative) of the exact one.
+    """
+    if dimension not in DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"dimension must be one of: {', '.join(DIMENSIONS)}")
+
+    check_cursor_offset(cursor, offset)
+    scope = dates.scope(f"distributions:{dimension}:{merchant_id or ''}:{reason_code or ''}")
+    after = decode_cursor(cursor, scope, width=2)
+    filters = {name: value for name, value in (("merchant", merchant_id), ("reason_code", reason_code)) if value is not None}
+    groups = sketch_store.merged(conn, dimension, dates, filters)
+
+    # Order and page on the counts first, so percentiles are only read for the page.
+    keys = sorted((-cell.count, value) for value, cell in groups.items())
+    if after is not None:
+        keys = [key for key in keys if key > after]
+    rows = [distribution_record(dimension, value, groups[value]) for _, value in keys[offset:offset + limit]]
+    set_next_cursor(response, scope, rows, limit, distribution_sort_key)
+
+    return rows_response(response, AmountDistribution, rows, format)
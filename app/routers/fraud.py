@@ -1,90 +1,196 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Response
+from functools import lru_cache
 from sqlalchemy import text
-from typing import List
-from app.database import get_db
+from sqlalchemy.engine import Connection
+from typing import List, Optional
+from app.constants import BIN_MIN_CHARGEBACKS, BIN_WINDOW_HOURS, REPEAT_OFFENDER_MIN_CHARGEBACKS
+from app.database import get_read_conn
+from app.metrics import TimedRoute
+from app.pagination import CURSOR_HEADER, check_cursor_offset, decode_cursor, encode_cursor, keyset_params, keyset_statements
+from app.precompute import SNAPSHOT_HEADER, scheduler, snapshot_page
+from app.partitions import HOT, DateRange, fact_sources, get_date_range, range_condition, union_all
+from app.detection import detect_bin_bursts
 from app.schemas import FraudPattern
+from app.serialization import get_format, rows_response
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# Both read ix_customer_risk_chargeback_count in order and never touch the table. The cursor key is
+# (-chargeback_count, customer_id), so resuming takes the rest of the current count, then lower counts.
+REPEAT_OFFENDERS_SQL = text("""
+    SELECT customer_id, chargeback_count, merchant_count, total_amount
+    FROM customer_risk
+    WHERE chargeback_count >= :min_chargebacks
+    ORDER BY chargeback_count DESC, customer_id ASC
+    LIMIT :limit OFFSET :offset
+""")
+
+REPEAT_OFFENDERS_AFTER_SQL = text("""
+    SELECT customer_id, chargeback_count, merchant_count, total_amount
+    FROM customer_risk
+    WHERE chargeback_count >= :min_chargebacks
+      AND chargeback_count <= -:k0
+      AND (chargeback_count < -:k0 OR customer_id > :k1)
+    ORDER BY chargeback_count DESC, customer_id ASC
+    LIMIT :limit OFFSET :offset
+""")
+
+BIN_TIMELINE_SQL = text("""
+    SELECT
+        t.card_bin,
+        c.chargeback_date,
+        t.merchant_id,
+        c.amount
+    FROM chargebacks c
+    JOIN transactions t ON t.id = c.transaction_id
+    ORDER BY t.card_bin, c.chargeback_date, c.id
+""").execution_options(yield_per=2000)
+
+# `customer_risk` covers all time; a date range is answered from the chargebacks filed in it. Counts
+# are taken per (customer, merchant) in each source so merchants seen in several stay distinct.
+PARTITIONED_CUSTOMER_COUNTS_SELECT = """
+            SELECT t.customer_id, t.merchant_id, COUNT(*) AS chargeback_count, SUM(c.amount) AS total_amount
+            FROM {chargebacks} c
+            JOIN {transactions} t ON t.id = c.transaction_id
+            WHERE {dates}
+            GROUP BY t.customer_id, t.merchant_id"""
+
+PARTITIONED_BIN_TIMELINE_SELECT = """
+        SELECT t.card_bin, c.chargeback_date, t.merchant_id, c.amount, c.id
+        FROM {chargebacks} c
+        JOIN {transactions} t ON t.id = c.transaction_id
+        WHERE {dates}"""
+
+
+@lru_cache(maxsize=256)
+def repeat_offender_statements(sources: tuple, bounds: tuple) -> tuple:
+    """Repeat offenders over the chargebacks in `sources` dated inside a range of shape `bounds`."""
+    partials = union_all(PARTITIONED_CUSTOMER_COUNTS_SELECT, sources, dates=range_condition("c.chargeback_date", bounds))
+    return keyset_statements(f"""
+    SELECT customer_id, SUM(chargeback_count) AS chargeback_count, COUNT(DISTINCT merchant_id) AS merchant_count,
+           SUM(total_amount) AS total_amount
+    FROM ({partials})
+    GROUP BY customer_id
+    HAVING SUM(chargeback_count) >= :min_chargebacks
+""", key=["-chargeback_count", "customer_id"])
+
+
+@lru_cache(maxsize=256)
+def bin_timeline_statement(sources: tuple, bounds: tuple):
+    """BIN_TIMELINE_SQL over `sources`, for chargebacks dated inside a range of shape `bounds`."""
+    if sources == (HOT,) and bounds == (False, False):
+        return BIN_TIMELINE_SQL
+    partials = union_all(PARTITIONED_BIN_TIMELINE_SELECT, sources, dates=range_condition("c.chargeback_date", bounds))
+    return text(f"""
+    SELECT card_bin, chargeback_date, merchant_id, amount
+    FROM ({partials})
+    ORDER BY card_bin, chargeback_date, id
+""").execution_options(yield_per=2000)
+
+
+def repeat_offender_key(row) -> tuple:
+    return (-row[1], row[0])
+
+
+def bin_pattern_key(found) -> tuple:
+    return (-found.chargeback_count, found.card_bin)
+
+
+def repeat_offender_record(row) -> tuple:
+    """A REPEAT_OFFENDER `FraudPattern` as a row tuple in field order."""
+    return ("REPEAT_OFFENDER", row[0], row[1], row[2], row[3], None, None)
+
+
+def bin_pattern_record(found, time_window_hours: int) -> tuple:
+    """A BIN_PATTERN `FraudPattern` as a row tuple in field order."""
+    return (
+        "BIN_PATTERN", found.card_bin, found.chargeback_count, found.merchant_count, found.total_amount,
+        time_window_hours,
+        [{"start": b.start, "end": b.end, "chargeback_count": b.chargeback_count} for b in found.bursts],
+    )
+
+
+def _next_key(items: list, limit: int, key):
+    """Sort key of the last item of a full page, or False once that pattern type is exhausted."""
+    return list(key(items[-1])) if len(items) >= limit else False
 
 
 @router.get("/fraud-patterns", response_model=List[FraudPattern])
 def get_fraud_patterns(
+    response: Response,
     limit: int = Query(50, ge=1, le=500, description="Maximum number of results"),
     offset: int = Query(0, ge=0, description="Number of results to skip"),
-    db: Session = Depends(get_db),
+    time_window_hours: int = Query(BIN_WINDOW_HOURS, ge=1, le=24 * 90, description="Burst window (hours) for BIN patterns"),
+    min_count: int = Query(BIN_MIN_CHARGEBACKS, ge=2, le=1000, description="Minimum chargebacks inside one window to flag a BIN"),
+    cursor: Optional[str] = Query(None, description="Resume after the page that returned this X-Next-Cursor"),
+    format: str = Depends(get_format),
+    dates: DateRange = Depends(get_date_range),
+    conn: Connection = Depends(get_read_conn),
 ):
     """
     Detect two fraud signal types:
-    - **REPEAT_OFFENDER**: customers with 3+ chargebacks across any merchants.
-    - **BIN_PATTERN**: card BINs with 2+ chargebacks within a 48-hour window.
+    - **REPEAT_OFFENDER**: customers with 3+ chargebacks across any merchants, read from the
+      trigger-maintained `customer_risk` table.
+    - **BIN_PATTERN**: card BINs with `min_count`+ chargebacks within a `time_window_hours` window (default 2 in 48h).
+      Each BIN pattern lists the exact burst windows found by a sort-and-sweep over (card_bin, chargeback_date).
+
+    `start`/`end` restrict both to chargebacks filed in that range; repeat offenders are then
+    counted from those chargebacks instead of `customer_risk`.
+
+    Both pattern types are paged together: the cursor keeps a position in each list and stops
+    returning a type once it is exhausted. At the default window and count, without `start`/`end`,
+    pages come from the precomputed snapshot while it is fresh.
     """
-    patterns = []
-
-    repeat_offenders = db.execute(text("""
-        SELECT
-            t.customer_id,
-            COUNT(DISTINCT c.id) AS chargeback_count,
-            COUNT(DISTINCT t.merchant_id) AS merchant_count,
-            SUM(c.amount) AS total_amount
-        FROM chargebacks c
-        JOIN transactions t ON t.id = c.transaction_id
-        GROUP BY t.customer_id
-        HAVING chargeback_count >= 3
-        ORDER BY chargeback_count DESC
-        LIMIT :limit OFFSET :offset
-    """), {"limit": limit, "offset": offset}).fetchall()
-
-    for row in repeat_offenders:
-        patterns.append(FraudPattern(
-            pattern_type="REPEAT_OFFENDER",
-            entity_id=row[0],
-            chargeback_count=row[1],
-            merchant_count=row[2],
-            total_amount=row[3],
-            time_window_hours=None,
-        ))
-
-    bin_patterns = db.execute(text("""
-        WITH cb_bins AS (
-            SELECT
-                t.card_bin,
-                c.id AS cb_id,
-                c.chargeback_date,
-                t.merchant_id,
-                c.amount
-            FROM chargebacks c
-            JOIN transactions t ON t.id = c.transaction_id
-        ),
-        bin_pairs AS (
-            SELECT DISTINCT a.card_bin
-            FROM cb_bins a
-            JOIN cb_bins b
-              ON a.card_bin = b.card_bin
-             AND a.cb_id != b.cb_id
-             AND ABS(JULIANDAY(a.chargeback_date) - JULIANDAY(b.chargeback_date)) * 24 <= 48
+    check_cursor_offset(cursor, offset)
+    scope = dates.scope(f"fraud-patterns:{time_window_hours}:{min_count}")
+    repeat_after, bin_after = decode_cursor(cursor, scope, width=2) or (None, None)
+    defaults = time_window_hours == BIN_WINDOW_HOURS and min_count == BIN_MIN_CHARGEBACKS and not dates.bounded
+    snapshot = scheduler.current(conn.engine) if defaults else None
+    if snapshot is not None:
+        repeat_offenders = snapshot_page(snapshot.repeat_offenders, repeat_offender_key, limit, offset, repeat_after)
+        bin_page = snapshot_page(snapshot.bin_patterns, bin_pattern_key, limit, offset, bin_after)
+        response.headers[SNAPSHOT_HEADER] = snapshot.built_at.isoformat()
+    else:
+        repeat_offenders, bin_page = _live_fraud_patterns(
+            conn, dates, limit, offset, time_window_hours, min_count, repeat_after, bin_after,
+        )
+
+    patterns = [repeat_offender_record(row) for row in repeat_offenders]
+    patterns.extend(bin_pattern_record(found, time_window_hours) for found in bin_page)
+
+    next_keys = [_next_key(repeat_offenders, limit, repeat_offender_key), _next_key(bin_page, limit, bin_pattern_key)]
+    if any(next_keys):
+        response.headers[CURSOR_HEADER] = encode_cursor(scope, next_keys)
+    return rows_response(response, FraudPattern, patterns, format)
+
+
+def _live_fraud_patterns(
+    conn: Connection, dates: DateRange, limit: int, offset: int, time_window_hours: int, min_count: int,
+    repeat_after, bin_after,
+) -> tuple:
+    """The repeat-offender rows and BIN patterns of one page, computed from the database."""
+    sources = fact_sources(conn, dates)
+    if dates.bounded:
+        first, resume = repeat_offender_statements(sources, dates.bounds)
+    else:
+        first, resume = REPEAT_OFFENDERS_SQL, REPEAT_OFFENDERS_AFTER_SQL
+    params = {**dates.params, "min_chargebacks": REPEAT_OFFENDER_MIN_CHARGEBACKS, "limit": limit}
+    if repeat_after is False:
+        repeat_offenders = []
+    elif repeat_after is None:
+        repeat_offenders = conn.execute(first, {**params, "offset": offset}).fetchall()
+    else:
+        repeat_offenders = conn.execute(resume, {**params, **keyset_params(repeat_after), "offset": 0}).fetchall()
+
+    if bin_after is False:
+        bin_page = []
+    else:
+        rows = conn.execute(bin_timeline_statement(sources, dates.bounds), dates.params)
+        bin_patterns = sorted(
+            detect_bin_bursts(rows, time_window_hours=time_window_hours, min_count=min_count),
+            key=bin_pattern_key,
         )
-        SELECT
-            cb.card_bin,
-            COUNT(DISTINCT cb.cb_id)      AS chargeback_count,
-            COUNT(DISTINCT cb.merchant_id) AS merchant_count,
-            SUM(cb.amount)                AS total_amount
-        FROM cb_bins cb
-        JOIN bin_pairs bp ON bp.card_bin = cb.card_bin
-        GROUP BY cb.card_bin
-        HAVING chargeback_count >= 2
-        ORDER BY chargeback_count DESC
-        LIMIT :limit OFFSET :offset
-    """), {"limit": limit, "offset": offset}).fetchall()
-
-    for row in bin_patterns:
-        patterns.append(FraudPattern(
-            pattern_type="BIN_PATTERN",
-            entity_id=row[0],
-            chargeback_count=row[1],
-            merchant_count=row[2],
-            total_amount=row[3],
-            time_window_hours=48,
-        ))
-
-    return patterns
+        if bin_after is not None:
+            bin_patterns = [b for b in bin_patterns if bin_pattern_key(b) > tuple(bin_after)]
+        bin_page = bin_patterns[offset:offset + limit]
+    return repeat_offenders, bin_page
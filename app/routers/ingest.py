@@ -0,0 +1,84 @@
+import time
+from typing import Optional
+import anyio
+from fastapi import APIRouter, Depends, Query, Request, Response, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from app.cache import bump_data_version
+from app.database import get_db
+from app.ingestion import CHARGEBACKS, PARSERS, TRANSACTIONS, TableSpec, ingest
+from app.metrics import TimedRoute
+from app.schemas import BulkIngestResult
+
+router = APIRouter(route_class=TimedRoute)
+
+
+def _resolve_format(request: Request, fmt: Optional[str]) -> str:
+    if fmt is None:
+        fmt = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    if fmt not in PARSERS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(sorted(PARSERS))}")
+    return fmt
+
+
+def _body_chunks(request: Request):
+    """Pull the request body chunk by chunk from a worker thread."""
+    stream = request.stream()
+    while True:
+        try:
+            yield anyio.from_thread.run(stream.__anext__)
+        except StopAsyncIteration:
+            return
+
+
+async def _bulk_ingest(
+    request: Request, response: Response, spec: TableSpec, fmt: Optional[str], db: Session,
+) -> BulkIngestResult:
+    fmt = _resolve_format(request, fmt)
+    started = time.perf_counter()
+    stats = await run_in_threadpool(ingest, _body_chunks(request), spec, fmt, db, on_batch=bump_data_version)
+    elapsed = time.perf_counter() - started
+    if stats.error is not None:
+        # The batches before the failed one stay committed; the body says how far the upload got.
+        response.status_code = 500
+    return BulkIngestResult(
+        received=stats.received,
+        inserted=stats.inserted,
+        rejected=stats.rejected,
+        elapsed_seconds=round(elapsed, 4),
+        rows_per_second=round(stats.received / elapsed, 1) if elapsed > 0 else 0.0,
+        rejects=stats.rejects,
+        rejects_truncated=stats.rejected > len(stats.rejects),
+        error=stats.error,
+    )
+
+
+@router.post("/transactions:bulk", response_model=BulkIngestResult)
+async def bulk_ingest_transactions(
+    request: Request,
+    response: Response,
+    format: Optional[str] = Query(None, description="ndjson or csv (defaults from Content-Type)"),
+    db: Session = Depends(get_db),
+):
+    """
+    Stream transactions as NDJSON (one object per line) or CSV (header row first).
+    Rows are validated against the `transactions` table and inserted in batches of 5,000, each in its own transaction.
+    Invalid rows, duplicate ids and unknown `merchant_id`s are rejected individually and reported by line number.
+    If a batch fails to insert, the upload stops there: the response is a 500 whose body has the counts of the
+    batches already committed and the `error`.
+    """
+    return await _bulk_ingest(request, response, TRANSACTIONS, format, db)
+
+
+@router.post("/chargebacks:bulk", response_model=BulkIngestResult)
+async def bulk_ingest_chargebacks(
+    request: Request,
+    response: Response,
+    format: Optional[str] = Query(None, description="ndjson or csv (defaults from Content-Type)"),
+    db: Session = Depends(get_db),
+):
+    """
+    Stream chargebacks as NDJSON or CSV. Same contract as `/transactions:bulk`;
+    rows whose `transaction_id` does not exist are rejected.
+    """
+    return await _bulk_ingest(request, response, CHARGEBACKS, format, db)
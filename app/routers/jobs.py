@@ -0,0 +1,89 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app.database import get_db, get_read_engine
+from app.jobs import FINISHED, JOB_KINDS, JobQueueFull, JobRecord, runner
+from app.metrics import TimedRoute
+from app.schemas import Job, JobProgress, JobRequest
+
+router = APIRouter(route_class=TimedRoute)
+
+
+def job_status(job: JobRecord) -> Job:
+    return Job(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        params=job.params,
+        progress=JobProgress(done=job.progress[0], total=job.progress[1]) if job.progress else None,
+        result=job.result,
+        error=job.error,
+        submitted_at=job.submitted_at,
+        finished_at=job.finished_at,
+    )
+
+
+def enqueue_job(kind: str, params: dict, url: str, response: Response) -> Job:
+    """Submit a validated job, pointing `Location` at its status; 429 when the queue is full."""
+    try:
+        job = runner.submit(kind, params, url)
+    except JobQueueFull as exc:
+        raise HTTPException(status_code=429, detail=str(exc))
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return job_status(job)
+
+
+def _get_job(job_id: str) -> JobRecord:
+    job = runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@router.post("/jobs", response_model=Job, status_code=202)
+def submit_job(
+    request: JobRequest,
+    response: Response,
+    db: Session = Depends(get_db),
+    engine: Engine = Depends(get_read_engine),
+):
+    """
+    Queue a background job and return its id without waiting for it. Kinds:
+    - **seed**: `POST /api/seed` at `scale` (and `seed`); reports transactions written.
+    - **fraud-patterns**: the first page of `/api/fraud-patterns` (`limit`, `time_window_hours`, `min_count`, `start`, `end`).
+    - **recommendations**: the first page of `/api/recommendations` (`limit`, `start`, `end`).
+
+    Params take the same defaults and bounds as the endpoint. Poll `GET /api/jobs/{id}` for the result.
+    """
+    spec = JOB_KINDS.get(request.kind)
+    if spec is None:
+        raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(sorted(JOB_KINDS))}")
+    try:
+        params = spec.params(**request.params).model_dump(mode="json")
+    except ValidationError as exc:
+        raise RequestValidationError([
+            {**error, "loc": ("body", "params", *error["loc"])}
+            for error in exc.errors(include_url=False, include_context=False)
+        ])
+    url = (db.get_bind() if spec.writes else engine).url.render_as_string(hide_password=False)
+    return enqueue_job(request.kind, params, url, response)
+
+
+@router.get("/jobs/{job_id}", response_model=Job)
+def get_job(job_id: str):
+    """Status, progress and, once succeeded, the result of a job. Finished jobs expire after a TTL."""
+    return job_status(_get_job(job_id))
+
+
+@router.post("/jobs/{job_id}:cancel", response_model=Job)
+def cancel_job(job_id: str):
+    """
+    Cancel a job. A queued job never starts; a running one stops at its next checkpoint, and a
+    running SQL statement is interrupted. Returns 409 if the job has already finished.
+    """
+    job = _get_job(job_id)
+    if job.status in FINISHED:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} already {job.status}")
+    return job_status(runner.cancel(job_id))
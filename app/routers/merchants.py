@@ -1,50 +1,122 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Response
+from functools import lru_cache
 from sqlalchemy import text
-from typing import List
-from app.database import get_db
+from sqlalchemy.engine import Connection
+from typing import List, Optional
+from app.database import get_read_conn
+from app.metrics import TimedRoute
+from app.pagination import check_cursor_offset, decode_cursor, keyset_params, keyset_statements, set_next_cursor
+from app.partitions import DateRange, fact_sources, get_date_range, range_condition, union_all
+from app.rollups import MERCHANT_STATS_RATIO_SQL
 from app.schemas import MerchantRatio
+from app.serialization import get_format, rows_response
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# Ties are broken on the merchant's surrogate key (the trailing column), which
+# ix_merchant_stats_chargeback_ratio holds; clients see the external id.
+MERCHANT_RATIO_SELECT = """
+    SELECT
+        m.external_id AS merchant_id,
+        m.name,
+        m.country,
+        s.transaction_count AS total_transactions,
+        s.chargeback_count AS total_chargebacks,
+        s.chargeback_ratio,
+        s.merchant_id AS merchant_key
+    FROM merchant_stats s
+    JOIN merchants m ON m.id = s.merchant_id
+"""
+
+MERCHANT_RATIO_SQL = text(MERCHANT_RATIO_SELECT + """
+    ORDER BY s.chargeback_ratio DESC, s.merchant_id ASC
+    LIMIT :limit OFFSET :offset
+""")
+
+# The leading `<=` term gives SQLite a range bound on ix_merchant_stats_chargeback_ratio, so a
+# later page starts with an index seek rather than walking past every earlier merchant.
+MERCHANT_RATIO_AFTER_SQL = text(MERCHANT_RATIO_SELECT + """
+    WHERE s.chargeback_ratio <= :k0
+      AND (s.chargeback_ratio < :k0 OR s.merchant_id > :k1)
+    ORDER BY s.chargeback_ratio DESC, s.merchant_id ASC
+    LIMIT :limit OFFSET :offset
+""")
+
+
+# The rollup covers all time; a date range is answered from the transactions made in it and their
+# chargebacks, over the partitions that range overlaps.
+PARTITIONED_MERCHANT_COUNTS_SELECT = """
+            SELECT t.merchant_id, COUNT(DISTINCT t.id) AS transactions, COUNT(c.id) AS chargebacks
+            FROM {transactions} t
+            LEFT JOIN {chargebacks} c ON c.transaction_id = t.id
+            WHERE {dates}
+            GROUP BY t.merchant_id"""
+
+
+@lru_cache(maxsize=256)
+def merchant_ratio_statements(sources: tuple, bounds: tuple) -> tuple:
+    """Statements over `sources`, for transactions made inside a range of shape `bounds`."""
+    partials = union_all(PARTITIONED_MERCHANT_COUNTS_SELECT, sources, dates=range_condition("t.timestamp", bounds))
+    return keyset_statements(f"""
+    SELECT
+        m.external_id AS merchant_id,
+        m.name,
+        m.country,
+        COALESCE(SUM(p.transactions), 0) AS total_transactions,
+        COALESCE(SUM(p.chargebacks), 0) AS total_chargebacks,
+        {MERCHANT_STATS_RATIO_SQL.format(cb="COALESCE(SUM(p.chargebacks), 0)", tx="SUM(p.transactions)")} AS chargeback_ratio,
+        m.id AS merchant_key
+    FROM merchants m
+    LEFT JOIN ({partials}) p ON p.merchant_id = m.id
+    GROUP BY m.id, m.external_id, m.name, m.country
+""", key=["-chargeback_ratio", "merchant_key"])
+
+
+def merchant_ratio_key(row) -> tuple:
+    return (row[5], row[6])
+
+
+def merchant_ratio_range_key(row) -> tuple:
+    return (-row[5], row[6])
+
+
+def merchant_ratio_record(row) -> tuple:
+    """A `MerchantRatio` as a row tuple in field order."""
+    return (*row[:5], row[5] if row[5] is not None else 0.0)
 
 
 @router.get("/merchants/chargeback-ratio", response_model=List[MerchantRatio])
 def get_merchant_chargeback_ratio(
+    response: Response,
     limit: int = Query(50, ge=1, le=500, description="Maximum number of results"),
     offset: int = Query(0, ge=0, description="Number of results to skip"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Resume after the page that returned this X-Next-Cursor"),
+    format: str = Depends(get_format),
+    dates: DateRange = Depends(get_date_range),
+    conn: Connection = Depends(get_read_conn),
 ):
     """
     Return all merchants ranked by chargeback ratio (descending).
     Merchants with ratio > 1.5% are candidates for the HIGH_CHARGEBACK_RATIO alert.
+    Served from the `merchant_stats` rollup, which triggers keep in step with every write.
+    With `start`/`end`, the ratio is computed over the transactions made in that range instead.
     """
-    result = db.execute(text("""
-        SELECT
-            m.id AS merchant_id,
-            m.name,
-            m.country,
-            COUNT(DISTINCT t.id) AS total_transactions,
-            COUNT(DISTINCT c.id) AS total_chargebacks,
-            ROUND(
-                CAST(COUNT(DISTINCT c.id) AS FLOAT) / NULLIF(COUNT(DISTINCT t.id), 0) * 100,
-                4
-            ) AS chargeback_ratio
-        FROM merchants m
-        LEFT JOIN transactions t ON t.merchant_id = m.id
-        LEFT JOIN chargebacks c ON c.transaction_id = t.id
-        GROUP BY m.id, m.name, m.country
-        ORDER BY chargeback_ratio DESC
-        LIMIT :limit OFFSET :offset
-    """), {"limit": limit, "offset": offset})
-    rows = result.fetchall()
-    return [
-        MerchantRatio(
-            merchant_id=row[0],
-            name=row[1],
-            country=row[2],
-            total_transactions=row[3],
-            total_chargebacks=row[4],
-            chargeback_ratio=row[5] if row[5] is not None else 0.0,
-        )
-        for row in rows
-    ]
+    check_cursor_offset(cursor, offset)
+    scope = dates.scope("merchants")
+    after = decode_cursor(cursor, scope, width=2)
+    if dates.bounded:
+        first, resume = merchant_ratio_statements(fact_sources(conn, dates, by="transaction"), dates.bounds)
+        if after is None:
+            rows = conn.execute(first, {**dates.params, "limit": limit, "offset": offset}).fetchall()
+        else:
+            rows = conn.execute(resume, {**dates.params, **keyset_params(after), "limit": limit, "offset": 0}).fetchall()
+        set_next_cursor(response, scope, rows, limit, merchant_ratio_range_key)
+    else:
+        if after is None:
+            rows = conn.execute(MERCHANT_RATIO_SQL, {"limit": limit, "offset": offset}).fetchall()
+        else:
+            rows = conn.execute(
+                MERCHANT_RATIO_AFTER_SQL, {"k0": after[0], "k1": after[1], "limit": limit, "offset": 0},
+            ).fetchall()
+        set_next_cursor(response, scope, rows, limit, merchant_ratio_key)
+    return rows_response(response, MerchantRatio, map(merchant_ratio_record, rows), format)
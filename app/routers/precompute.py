@@ -0,0 +1,35 @@
+from typing import Optional
+from fastapi import APIRouter
+from app.metrics import TimedRoute
+from app.precompute import Snapshot, scheduler
+from app.schemas import PrecomputeStatus
+
+router = APIRouter(route_class=TimedRoute)
+
+
+def precompute_status(snapshot: Optional[Snapshot]) -> PrecomputeStatus:
+    if snapshot is None:
+        return PrecomputeStatus(fresh=False)
+    return PrecomputeStatus(
+        built_at=snapshot.built_at,
+        build_ms=round(snapshot.build_ms, 2),
+        data_version=snapshot.data_version,
+        as_of=snapshot.as_of,
+        fresh=scheduler.is_fresh(snapshot),
+        alerts=len(snapshot.alerts),
+        recommendations=len(snapshot.recommendations),
+        repeat_offenders=len(snapshot.repeat_offenders),
+        bin_patterns=len(snapshot.bin_patterns),
+    )
+
+
+@router.get("/precompute", response_model=PrecomputeStatus)
+def get_precompute_status():
+    """When the alerts/recommendations/fraud snapshot was built, how long it took, and whether it is served."""
+    return precompute_status(scheduler.snapshot)
+
+
+@router.post("/precompute:refresh", response_model=PrecomputeStatus)
+def refresh_precompute():
+    """Rebuild the snapshot now instead of waiting for the scheduler."""
+    return precompute_status(scheduler.refresh())
@@ -1,43 +1,90 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List
-from app.database import get_db
+from fastapi import APIRouter, Depends, Query, Response
+from functools import lru_cache
+from sqlalchemy.engine import Connection
+from typing import List, Optional
+from app.columnar import columnar_store, get_analytics_engine, reason_code_sort_key
+from app.database import get_read_conn
+from app.metrics import TimedRoute
+from app.partitions import HOT, DateRange, fact_sources, get_date_range, range_condition, union_all
+from app.pagination import check_cursor_offset, decode_cursor, keyset_params, keyset_statements, set_next_cursor
 from app.schemas import ReasonCodeSummary
+from app.serialization import get_format, rows_response
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# Counted per code on ix_chargebacks_reason_code_amount_status_id; each code's description is
+# looked up once in `reason_codes`.
+REASON_CODES_SQL, REASON_CODES_AFTER_SQL = keyset_statements("""
+    SELECT
+        s.reason_code,
+        r.description AS reason_description,
+        s.count,
+        s.total_amount,
+        s.percentage
+    FROM (
+        SELECT
+            c.reason_code,
+            COUNT(*) AS count,
+            ROUND(SUM(c.amount), 2) AS total_amount,
+            ROUND(CAST(COUNT(*) AS FLOAT) / NULLIF((SELECT COUNT(*) FROM chargebacks), 0) * 100, 2) AS percentage
+        FROM chargebacks c
+        GROUP BY c.reason_code
+    ) s
+    JOIN reason_codes r ON r.code = s.reason_code
+""", key=["-count", "reason_code", "reason_description"])
+
+PARTITIONED_REASON_CODES_SELECT = """
+        SELECT reason_code, COUNT(*) AS count, SUM(amount) AS amount
+        FROM {chargebacks}
+        WHERE {dates}
+        GROUP BY reason_code"""
+
+
+@lru_cache(maxsize=256)
+def reason_code_statements(sources: tuple, bounds: tuple) -> tuple:
+    """Statements over `sources`, for chargebacks dated inside a range of shape `bounds`."""
+    if sources == (HOT,) and bounds == (False, False):
+        return REASON_CODES_SQL, REASON_CODES_AFTER_SQL
+    partials = union_all(PARTITIONED_REASON_CODES_SELECT, sources, dates=range_condition("chargeback_date", bounds))
+    return keyset_statements(f"""
+    SELECT
+        p.reason_code,
+        r.description AS reason_description,
+        SUM(p.count) AS count,
+        ROUND(SUM(p.amount), 2) AS total_amount,
+        ROUND(CAST(SUM(p.count) AS FLOAT) / NULLIF(SUM(SUM(p.count)) OVER (), 0) * 100, 2) AS percentage
+    FROM ({partials}) p
+    JOIN reason_codes r ON r.code = p.reason_code
+    GROUP BY p.reason_code, r.description
+""", key=["-count", "reason_code", "reason_description"])
 
 
 @router.get("/reason-codes", response_model=List[ReasonCodeSummary])
 def get_reason_codes(
+    response: Response,
     limit: int = Query(50, ge=1, le=500, description="Maximum number of results"),
     offset: int = Query(0, ge=0, description="Number of results to skip"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Resume after the page that returned this X-Next-Cursor"),
+    format: str = Depends(get_format),
+    dates: DateRange = Depends(get_date_range),
+    conn: Connection = Depends(get_read_conn),
+    analytics_engine: str = Depends(get_analytics_engine),
 ):
     """
     Return chargeback counts, total disputed amount, and share percentage per reason code.
-    Ordered by frequency descending.
+    Ordered by frequency descending. `start`/`end` restrict it to chargebacks filed in that range.
     """
-    result = db.execute(text("""
-        SELECT
-            reason_code,
-            reason_description,
-            COUNT(*) AS count,
-            SUM(amount) AS total_amount,
-            ROUND(CAST(COUNT(*) AS FLOAT) / NULLIF((SELECT COUNT(*) FROM chargebacks), 0) * 100, 2) AS percentage
-        FROM chargebacks
-        GROUP BY reason_code, reason_description
-        ORDER BY count DESC
-        LIMIT :limit OFFSET :offset
-    """), {"limit": limit, "offset": offset})
-    rows = result.fetchall()
-    return [
-        ReasonCodeSummary(
-            reason_code=row[0],
-            reason_description=row[1],
-            count=row[2],
-            total_amount=row[3],
-            percentage=row[4],
-        )
-        for row in rows
-    ]
+    check_cursor_offset(cursor, offset)
+    scope = dates.scope("reason-codes")
+    after = decode_cursor(cursor, scope, width=3)
+    sources = fact_sources(conn, dates)
+    if analytics_engine == "columnar" and sources == (HOT,) and not dates.bounded:
+        rows = columnar_store.snapshot(conn).reason_codes(limit, offset, after=after)
+    else:
+        first, resume = reason_code_statements(sources, dates.bounds)
+        if after is None:
+            rows = conn.execute(first, {**dates.params, "limit": limit, "offset": offset}).fetchall()
+        else:
+            rows = conn.execute(resume, {**dates.params, **keyset_params(after), "limit": limit, "offset": 0}).fetchall()
+    set_next_cursor(response, scope, rows, limit, reason_code_sort_key)
+    return rows_response(response, ReasonCodeSummary, rows, format)
@@ -1,11 +1,16 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List
-from app.database import get_db
+from fastapi import APIRouter, Depends, Query, Response
+from functools import lru_cache
+from sqlalchemy.engine import Connection
+from typing import List, Optional
+from app.database import get_read_conn
+from app.metrics import TimedRoute
+from app.precompute import SNAPSHOT_HEADER, scheduler, snapshot_page
+from app.partitions import HOT, DateRange, fact_sources, get_date_range, range_condition, union_all
+from app.pagination import check_cursor_offset, decode_cursor, keyset_params, keyset_statements, set_next_cursor
 from app.schemas import Recommendation
+from app.serialization import get_format, rows_response
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 REASON_CODE_RECOMMENDATIONS = {
     "10.4": "Implement 3D Secure authentication to reduce card-not-present fraud. Review your fraud scoring rules.",
@@ -15,50 +20,108 @@ REASON_CODE_RECOMMENDATIONS = {
     "13.2": "Clarify subscription cancellation policy. Send reminders before recurring charges.",
 }
 
+RECOMMENDATIONS_SQL, RECOMMENDATIONS_AFTER_SQL = keyset_statements("""
+    WITH ranked AS (
+        SELECT
+            m.external_id AS merchant_id,
+            m.name AS merchant_name,
+            c.reason_code,
+            COUNT(*) AS chargeback_count,
+            ROW_NUMBER() OVER (
+                PARTITION BY m.id
+                ORDER BY COUNT(*) DESC, c.reason_code ASC
+            ) AS rn
+        FROM chargebacks c
+        JOIN transactions t ON t.id = c.transaction_id
+        JOIN merchants m ON m.id = t.merchant_id
+        GROUP BY m.id, m.external_id, m.name, c.reason_code
+    )
+    SELECT merchant_id, merchant_name, reason_code, chargeback_count
+    FROM ranked
+    WHERE rn = 1
+""", key=["-chargeback_count", "merchant_id"])
+
+PARTITIONED_COUNTS_SELECT = """
+            SELECT t.merchant_id, c.reason_code, COUNT(*) AS chargeback_count
+            FROM {chargebacks} c
+            JOIN {transactions} t ON t.id = c.transaction_id
+            WHERE {dates}
+            GROUP BY t.merchant_id, c.reason_code"""
+
+
+@lru_cache(maxsize=256)
+def recommendation_statements(sources: tuple, bounds: tuple) -> tuple:
+    """Statements over `sources`, for chargebacks dated inside a range of shape `bounds`."""
+    if sources == (HOT,) and bounds == (False, False):
+        return RECOMMENDATIONS_SQL, RECOMMENDATIONS_AFTER_SQL
+    partials = union_all(PARTITIONED_COUNTS_SELECT, sources, dates=range_condition("c.chargeback_date", bounds))
+    return keyset_statements(f"""
+    WITH counts AS (
+        SELECT merchant_id, reason_code, SUM(chargeback_count) AS chargeback_count
+        FROM ({partials})
+        GROUP BY merchant_id, reason_code
+    ),
+    ranked AS (
+        SELECT
+            m.external_id AS merchant_id,
+            m.name AS merchant_name,
+            counts.reason_code,
+            counts.chargeback_count,
+            ROW_NUMBER() OVER (
+                PARTITION BY m.id
+                ORDER BY counts.chargeback_count DESC, counts.reason_code ASC
+            ) AS rn
+        FROM counts
+        JOIN merchants m ON m.id = counts.merchant_id
+    )
+    SELECT merchant_id, merchant_name, reason_code, chargeback_count
+    FROM ranked
+    WHERE rn = 1
+""", key=["-chargeback_count", "merchant_id"])
+
+
+def recommendation_key(row) -> tuple:
+    return (-row[3], row[0])
+
+
+def recommendation_record(row) -> tuple:
+    """A `Recommendation` as a row tuple in field order."""
+    return (*row[:4], REASON_CODE_RECOMMENDATIONS.get(
+        row[2],
+        "Review chargeback patterns and implement additional fraud prevention measures.",
+    ))
+
 
 @router.get("/recommendations", response_model=List[Recommendation])
 def get_recommendations(
+    response: Response,
     limit: int = Query(50, ge=1, le=500, description="Maximum number of results"),
     offset: int = Query(0, ge=0, description="Number of results to skip"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Resume after the page that returned this X-Next-Cursor"),
+    format: str = Depends(get_format),
+    dates: DateRange = Depends(get_date_range),
+    conn: Connection = Depends(get_read_conn),
 ):
     """
     Return one action recommendation per merchant based on their dominant chargeback reason code.
     Dominant code is determined by a ROW_NUMBER() window function over chargeback count per merchant.
+    `start`/`end` restrict it to chargebacks filed in that range. Without them, pages come from the
+    precomputed snapshot while it is fresh.
     """
-    rows = db.execute(text("""
-        WITH ranked AS (
-            SELECT
-                m.id AS merchant_id,
-                m.name AS merchant_name,
-                c.reason_code,
-                COUNT(*) AS chargeback_count,
-                ROW_NUMBER() OVER (
-                    PARTITION BY m.id
-                    ORDER BY COUNT(*) DESC
-                ) AS rn
-            FROM chargebacks c
-            JOIN transactions t ON t.id = c.transaction_id
-            JOIN merchants m ON m.id = t.merchant_id
-            GROUP BY m.id, m.name, c.reason_code
-        )
-        SELECT merchant_id, merchant_name, reason_code, chargeback_count
-        FROM ranked
-        WHERE rn = 1
-        ORDER BY chargeback_count DESC
-        LIMIT :limit OFFSET :offset
-    """), {"limit": limit, "offset": offset}).fetchall()
+    check_cursor_offset(cursor, offset)
+    scope = dates.scope("recommendations")
+    after = decode_cursor(cursor, scope, width=2)
+    snapshot = None if dates.bounded else scheduler.current(conn.engine)
+    if snapshot is not None:
+        rows = snapshot_page(snapshot.recommendations, recommendation_key, limit, offset, after)
+        set_next_cursor(response, scope, rows, limit, recommendation_key)
+        response.headers[SNAPSHOT_HEADER] = snapshot.built_at.isoformat()
+        return rows_response(response, Recommendation, map(recommendation_record, rows), format)
+    first, resume = recommendation_statements(fact_sources(conn, dates), dates.bounds)
+    if after is None:
+        rows = conn.execute(first, {**dates.params, "limit": limit, "offset": offset}).fetchall()
+    else:
+        rows = conn.execute(resume, {**dates.params, **keyset_params(after), "limit": limit, "offset": 0}).fetchall()
+    set_next_cursor(response, scope, rows, limit, recommendation_key)
 
-    return [
-        Recommendation(
-            merchant_id=row[0],
-            merchant_name=row[1],
-            dominant_reason_code=row[2],
-            chargeback_count=row[3],
-            recommendation=REASON_CODE_RECOMMENDATIONS.get(
-                row[2],
-                "Review chargeback patterns and implement additional fraud prevention measures.",
-            ),
-        )
-        for row in rows
-    ]
+    return rows_response(response, Recommendation, map(recommendation_record, rows), format)
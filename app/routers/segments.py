@@ -1,63 +1,112 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List
-from app.database import get_db
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
+from functools import lru_cache
+from sqlalchemy.engine import Connection
+from typing import List, Optional
+from app.columnar import columnar_store, get_analytics_engine, segment_sort_key
+from app.constants import SEGMENT_RATIO_THRESHOLD
+from app.database import get_read_conn
+from app.encoding import DECODE_SQL
+from app.metrics import TimedRoute
+from app.partitions import HOT, DateRange, fact_sources, get_date_range, range_condition, union_all
+from app.pagination import check_cursor_offset, decode_cursor, keyset_params, keyset_statements, set_next_cursor
 from app.schemas import HighRiskSegment
+from app.serialization import get_format, rows_response
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 VALID_DIMENSIONS = {"country", "category", "payment_method"}
 
+# Dictionary codes: segments are grouped on the integer column and only their value is decoded.
+DIMENSION_COLUMN_MAP = {
+    "country": "t.country_id",
+    "category": "t.product_category_id",
+    "payment_method": "t.payment_method_id",
+}
+
+SEGMENT_STATEMENTS = {
+    dimension: keyset_statements(f"""
+        SELECT
+            :dimension AS dimension,
+            {DECODE_SQL.format(col)} AS segment_value,
+            COUNT(DISTINCT t.id) AS total_transactions,
+            COUNT(DISTINCT c.id) AS total_chargebacks,
+            ROUND(
+                CAST(COUNT(DISTINCT c.id) AS FLOAT) / NULLIF(COUNT(DISTINCT t.id), 0) * 100,
+                4
+            ) AS chargeback_ratio
+        FROM transactions t
+        LEFT JOIN chargebacks c ON c.transaction_id = t.id
+        GROUP BY {col}
+        HAVING chargeback_ratio > :threshold
+    """, key=["-chargeback_ratio", "segment_value"])
+    for dimension, col in DIMENSION_COLUMN_MAP.items()
+}
+SEGMENT_SQL = {dimension: first for dimension, (first, _) in SEGMENT_STATEMENTS.items()}
+
+# A transaction and its chargebacks live in the same source, so per-source distinct counts add up.
+PARTITIONED_SEGMENT_SELECT = """
+            SELECT {col} AS segment_code, COUNT(DISTINCT t.id) AS transactions, COUNT(DISTINCT c.id) AS chargebacks
+            FROM {transactions} t
+            LEFT JOIN {chargebacks} c ON c.transaction_id = t.id
+            WHERE {dates}
+            GROUP BY {col}"""
+
+
+@lru_cache(maxsize=256)
+def segment_statements(dimension: str, sources: tuple, bounds: tuple) -> tuple:
+    """Statements over `sources`, for transactions made inside a range of shape `bounds`."""
+    if sources == (HOT,) and bounds == (False, False):
+        return SEGMENT_STATEMENTS[dimension]
+    partials = union_all(
+        PARTITIONED_SEGMENT_SELECT, sources, col=DIMENSION_COLUMN_MAP[dimension], dates=range_condition("t.timestamp", bounds),
+    )
+    return keyset_statements(f"""
+        SELECT
+            :dimension AS dimension,
+            {DECODE_SQL.format("segment_code")} AS segment_value,
+            SUM(transactions) AS total_transactions,
+            SUM(chargebacks) AS total_chargebacks,
+            ROUND(CAST(SUM(chargebacks) AS FLOAT) / NULLIF(SUM(transactions), 0) * 100, 4) AS chargeback_ratio
+        FROM ({partials})
+        GROUP BY segment_code
+        HAVING chargeback_ratio > :threshold
+    """, key=["-chargeback_ratio", "segment_value"])
+
 
 @router.get("/segments/high-risk", response_model=List[HighRiskSegment])
 def get_high_risk_segments(
+    response: Response,
     dimension: str = Query(..., description="Grouping dimension: country, category, or payment_method"),
-    threshold: float = Query(1.5, ge=0.0, le=100.0, description="Chargeback ratio threshold (%)"),
+    threshold: float = Query(SEGMENT_RATIO_THRESHOLD, ge=0.0, le=100.0, description="Chargeback ratio threshold (%)"),
     limit: int = Query(50, ge=1, le=500, description="Maximum number of results"),
     offset: int = Query(0, ge=0, description="Number of results to skip"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Resume after the page that returned this X-Next-Cursor"),
+    format: str = Depends(get_format),
+    dates: DateRange = Depends(get_date_range),
+    conn: Connection = Depends(get_read_conn),
+    analytics_engine: str = Depends(get_analytics_engine),
 ):
     """
     Return segments whose chargeback ratio exceeds the given threshold.
     Use `dimension` to group by country, product category, or payment method.
+    `start`/`end` restrict it to transactions made in that range, with their chargebacks.
     """
     if dimension not in VALID_DIMENSIONS:
         raise HTTPException(status_code=400, detail=f"dimension must be one of: {', '.join(sorted(VALID_DIMENSIONS))}")
 
-    dimension_column_map = {
-        "country": "t.country",
-        "category": "t.product_category",
-        "payment_method": "t.payment_method",
-    }
-    col = dimension_column_map[dimension]
+    check_cursor_offset(cursor, offset)
+    scope = dates.scope(f"segments:{dimension}:{threshold}")
+    after = decode_cursor(cursor, scope, width=2)
+    sources = fact_sources(conn, dates, by="transaction")
+    if analytics_engine == "columnar" and sources == (HOT,) and not dates.bounded:
+        rows = columnar_store.snapshot(conn).segments(dimension, threshold, limit, offset, after=after)
+    else:
+        first, resume = segment_statements(dimension, sources, dates.bounds)
+        params = {**dates.params, "dimension": dimension, "threshold": threshold, "limit": limit, "offset": offset}
+        if after is None:
+            rows = conn.execute(first, params).fetchall()
+        else:
+            rows = conn.execute(resume, {**params, **keyset_params(after), "offset": 0}).fetchall()
+    set_next_cursor(response, scope, rows, limit, segment_sort_key)
 
-    result = db.execute(text(f"""
-        SELECT
-            :dimension AS dimension,
-            {col} AS segment_value,
-            COUNT(DISTINCT t.id) AS total_transactions,
-            COUNT(DISTINCT c.id) AS total_chargebacks,
-            ROUND(
-                CAST(COUNT(DISTINCT c.id) AS FLOAT) / NULLIF(COUNT(DISTINCT t.id), 0) * 100,
-                4
-            ) AS chargeback_ratio
-        FROM transactions t
-        LEFT JOIN chargebacks c ON c.transaction_id = t.id
-        GROUP BY {col}
-        HAVING chargeback_ratio > :threshold
-        ORDER BY chargeback_ratio DESC
-        LIMIT :limit OFFSET :offset
-    """), {"dimension": dimension, "threshold": threshold, "limit": limit, "offset": offset})
-
-    rows = result.fetchall()
-    return [
-        HighRiskSegment(
-            dimension=row[0],
-            segment_value=row[1],
-            total_transactions=row[2],
-            total_chargebacks=row[3],
-            chargeback_ratio=row[4],
-        )
-        for row in rows
-    ]
+    return rows_response(response, HighRiskSegment, rows, format)
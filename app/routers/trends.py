@@ -1,52 +1,212 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
-from sqlalchemy.orm import Session
+from datetime import date, timedelta
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
 from sqlalchemy import text
-from typing import List
-from app.database import get_db
+from sqlalchemy.engine import Connection
+from typing import List, Optional
+from app.database import get_read_conn
+from app.encoding import MERCHANT_KEY_SQL
+from app.metrics import TimedRoute
+from app.pagination import check_cursor_offset, decode_cursor, set_next_cursor
+from app.rollups import BUCKET_TABLES, PERIOD_LABEL_SQL
 from app.schemas import TrendPoint
+from app.serialization import get_format, rows_response
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+GRANULARITIES = tuple(BUCKET_TABLES)
+
+# The bucket tables are keyed on the merchant's surrogate key; the filter takes its external id.
+TREND_FILTERS = {
+    "merchant_id": f"merchant_id = {MERCHANT_KEY_SQL.format(':merchant_id')}",
+    "reason_code": "reason_code = :reason_code",
+}
+
+
+def period_label(granularity: str, day: date) -> str:
+    """Python twin of `PERIOD_LABEL_SQL`: the label of the period containing `day`."""
+    if granularity == "daily":
+        return day.isoformat()
+    if granularity == "weekly":
+        return day.strftime("%Y-W%W")
+    return day.strftime("%Y-%m")
+
+
+def period_start(granularity: str, period: str) -> date:
+    """First day of the period labelled `period` (%W weeks start on Monday; week 00 runs from January 1st)."""
+    try:
+        if granularity == "daily":
+            return date.fromisoformat(period)
+        if granularity == "monthly":
+            return date(int(period[:4]), int(period[5:7]), 1)
+        year, week = int(period[:4]), int(period.split("-W")[1])
+    except (ValueError, IndexError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    jan1 = date(year, 1, 1)
+    first_monday = jan1 + timedelta(days=(7 - jan1.weekday()) % 7)
+    return max(jan1, first_monday + timedelta(weeks=week - 1))
+
+
+def next_period_start(granularity: str, period: str) -> date:
+    """First day whose period label sorts after `period`."""
+    start = period_start(granularity, period)
+    if granularity == "daily":
+        return start + timedelta(days=1)
+    if granularity == "monthly":
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    year, week = start.year, int(period.split("-W")[1])
+    jan1 = date(year, 1, 1)
+    first_monday = jan1 + timedelta(days=(7 - jan1.weekday()) % 7)
+    return min(first_monday + timedelta(weeks=week), date(year + 1, 1, 1))
+
+
+def _align(granularity: str, day: Optional[date], up: bool) -> Optional[date]:
+    """`day` rounded to a period boundary: up to the next one, or down to the start of its own period."""
+    if day is None:
+        return None
+    start = period_start(granularity, period_label(granularity, day))
+    if start == day or not up:
+        return start
+    return next_period_start(granularity, period_label(granularity, day))
+
+
+def bucket_ranges(granularity: str, start: Optional[date], end: Optional[date]) -> list:
+    """
+    Split [start, end) into (bucket granularity, from, to) reads. Whole periods come from the
+    granularity's own bucket table; partial periods at either edge are summed from the daily buckets.
+    """
+    if granularity == "daily":
+        return [("daily", start, end)]
+    inner_start, inner_end = _align(granularity, start, up=True), _align(granularity, end, up=False)
+    if inner_start is not None and inner_end is not None and inner_start >= inner_end:
+        return [("daily", start, end)]
+    ranges = [(granularity, inner_start, inner_end)]
+    if start != inner_start:
+        ranges.append(("daily", start, inner_start))
+    if end != inner_end:
+        ranges.append(("daily", inner_end, end))
+    return ranges
+
+
+def _trend_statement(granularity: str, ranges: list, filters: dict) -> tuple:
+    parts, params = [], {}
+    for i, (source, low, high) in enumerate(ranges):
+        where = [TREND_FILTERS[name] for name in filters]
+        if low is not None:
+            where.append(f"period >= :low{i}")
+            params[f"low{i}"] = period_label(source, low)
+        if high is not None:
+            where.append(f"period < :high{i}")
+            params[f"high{i}"] = period_label(source, high)
+        label = "period" if source == granularity else PERIOD_LABEL_SQL[granularity].format("period")
+        parts.append(f"""
+            SELECT {label} AS period, chargeback_count, chargeback_amount
+            FROM {BUCKET_TABLES[source]}
+            WHERE {" AND ".join(where) or "1 = 1"}""")
+    statement = text(f"""
+        SELECT
+            period,
+            SUM(chargeback_count) AS chargeback_count,
+            ROUND(SUM(chargeback_amount), 2) AS total_amount
+        FROM ({" UNION ALL ".join(parts)})
+        GROUP BY period
+        HAVING SUM(chargeback_count) > 0
+        ORDER BY period ASC
+        LIMIT :limit OFFSET :offset
+    """)
+    return statement, params
+
+
+def query_trends(
+    conn: Connection, granularity: str, start: Optional[date], end: Optional[date], filters: dict, limit: int, offset: int,
+) -> list:
+    """Non-empty periods overlapping [start, end), summed from the bucket tables."""
+    statement, params = _trend_statement(granularity, bucket_ranges(granularity, start, end), filters)
+    return conn.execute(statement, {**params, **filters, "limit": limit, "offset": offset}).fetchall()
+
+
+def _first_and_last_day(conn: Connection, filters: dict) -> tuple:
+    where = " AND ".join(["chargeback_count > 0", *(TREND_FILTERS[name] for name in filters)])
+    first = conn.execute(text(f"SELECT period FROM chargeback_daily WHERE {where} ORDER BY period ASC LIMIT 1"), filters).scalar()
+    last = conn.execute(text(f"SELECT period FROM chargeback_daily WHERE {where} ORDER BY period DESC LIMIT 1"), filters).scalar()
+    if first is None:
+        return None, None
+    return date.fromisoformat(first), date.fromisoformat(last) + timedelta(days=1)
+
+
+def gap_filled_trends(
+    conn: Connection, granularity: str, start: Optional[date], end: Optional[date], filters: dict, limit: int, offset: int,
+) -> list:
+    """
+    Every period from `start` (or the first chargeback) to `end` (or the last), with zero rows for
+    empty periods. Only the periods on the requested page are read from the buckets.
+    """
+    if start is None or end is None:
+        first, last = _first_and_last_day(conn, filters)
+        if first is None:
+            return []
+        start, end = start or first, end or last
+    periods, cursor = [], start
+    while cursor < end and len(periods) < offset + limit:
+        periods.append(period_label(granularity, cursor))
+        cursor = next_period_start(granularity, periods[-1])
+    periods = periods[offset:]
+    if not periods:
+        return []
+    page_start = max(start, period_start(granularity, periods[0]))
+    rows = query_trends(conn, granularity, page_start, min(end, cursor), filters, len(periods), 0)
+    found = {row[0]: (row[1], row[2]) for row in rows}
+    return [(period, *found.get(period, (0, 0.0))) for period in periods]
+
+
+def trend_sort_key(row) -> tuple:
+    return (row[0],)
 
 
 @router.get("/trends", response_model=List[TrendPoint])
 def get_trends(
-    granularity: str = Query("daily", description="Time bucket: daily or weekly"),
+    response: Response,
+    granularity: str = Query("daily", description="Time bucket: daily, weekly or monthly"),
+    start: Optional[date] = Query(None, description="Only chargebacks on or after this date"),
+    end: Optional[date] = Query(None, description="Only chargebacks before this date"),
+    merchant_id: Optional[str] = Query(None, description="Only chargebacks for this merchant"),
+    reason_code: Optional[str] = Query(None, description="Only chargebacks with this reason code"),
+    fill_gaps: bool = Query(False, description="Include periods without chargebacks as zero rows"),
     limit: int = Query(90, ge=1, le=366, description="Maximum number of periods to return"),
     offset: int = Query(0, ge=0, description="Number of periods to skip"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Resume after the page that returned this X-Next-Cursor"),
+    format: str = Depends(get_format),
+    conn: Connection = Depends(get_read_conn),
 ):
     """
-    Return chargeback volume bucketed by day or week.
+    Return chargeback volume bucketed by day, week or month.
     Use `granularity=weekly` to surface the Black Friday spike pattern.
+    Periods are summed from the pre-aggregated bucket tables, so the cost follows the number of
+    periods in range rather than the number of chargebacks. A `start` or `end` inside a week or
+    month counts only the days of that period that fall in range.
     """
-    if granularity not in ("daily", "weekly"):
-        raise HTTPException(status_code=400, detail="granularity must be 'daily' or 'weekly'")
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be 'daily', 'weekly' or 'monthly'")
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    check_cursor_offset(cursor, offset)
+    filters = {
+        name: value
+        for name, value in {"merchant_id": merchant_id, "reason_code": reason_code}.items()
+        if value is not None
+    }
+    scope = f"trends:{granularity}:{start}:{end}:{merchant_id}:{reason_code}:{fill_gaps}"
+    after = decode_cursor(cursor, scope, width=1)
 
-    if granularity == "daily":
-        result = db.execute(text("""
-            SELECT
-                DATE(chargeback_date) AS period,
-                COUNT(*) AS chargeback_count,
-                SUM(amount) AS total_amount
-            FROM chargebacks
-            GROUP BY DATE(chargeback_date)
-            ORDER BY period ASC
-            LIMIT :limit OFFSET :offset
-        """), {"limit": limit, "offset": offset})
-    else:
-        result = db.execute(text("""
-            SELECT
-                strftime('%Y-W%W', chargeback_date) AS period,
-                COUNT(*) AS chargeback_count,
-                SUM(amount) AS total_amount
-            FROM chargebacks
-            GROUP BY strftime('%Y-W%W', chargeback_date)
-            ORDER BY period ASC
-            LIMIT :limit OFFSET :offset
-        """), {"limit": limit, "offset": offset})
-
-    rows = result.fetchall()
-    return [
-        TrendPoint(period=row[0], chargeback_count=row[1], total_amount=row[2])
-        for row in rows
-    ]
+    # Resuming from a cursor moves `start` to the first day after the last period returned, so later
+    # pages never read the buckets of the periods already served.
+    if after is not None:
+        resume_from = next_period_start(granularity, str(after[0]))
+        start = resume_from if start is None else max(start, resume_from)
+        if end is not None and start >= end:
+            return rows_response(response, TrendPoint, [], format)
+
+    fetch = gap_filled_trends if fill_gaps else query_trends
+    rows = fetch(conn, granularity, start, end, filters, limit, offset)
+    set_next_cursor(response, scope, rows, limit, trend_sort_key)
+
+    return rows_response(response, TrendPoint, rows, format)
@@ -1,54 +1,110 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List
-from app.database import get_db
+from fastapi import APIRouter, Depends, Query, Response
+from functools import lru_cache
+from sqlalchemy.engine import Connection
+from typing import List, Optional
+from app.columnar import columnar_store, get_analytics_engine, win_rate_sort_key
+from app.database import get_read_conn
+from app.encoding import CHARGEBACK_STATUS, ENCODE_SQL
+from app.metrics import TimedRoute
+from app.partitions import HOT, DateRange, fact_sources, get_date_range, range_condition, union_all
+from app.pagination import check_cursor_offset, decode_cursor, keyset_params, keyset_statements, set_next_cursor
 from app.schemas import WinRateByReasonCode
+from app.serialization import get_format, rows_response
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# Codes of the chargeback statuses counted below (constant subqueries, evaluated once).
+WON, LOST, OPEN = (ENCODE_SQL.format(kind=CHARGEBACK_STATUS, value=f"'{status}'") for status in ("won", "lost", "open"))
+
+# `win_rate DESC` with NULLs (no resolved disputes) last, spelled as an ascending key for the cursor.
+WIN_RATE_SQL, WIN_RATE_AFTER_SQL = keyset_statements(f"""
+    SELECT
+        s.reason_code,
+        r.description AS reason_description,
+        s.total,
+        s.won,
+        s.lost,
+        s.open,
+        ROUND(CAST(s.won AS FLOAT) / NULLIF(s.won + s.lost, 0) * 100, 2) AS win_rate
+    FROM (
+        SELECT
+            reason_code,
+            COUNT(*) AS total,
+            SUM(CASE WHEN status_id = {WON} THEN 1 ELSE 0 END) AS won,
+            SUM(CASE WHEN status_id = {LOST} THEN 1 ELSE 0 END) AS lost,
+            SUM(CASE WHEN status_id = {OPEN} THEN 1 ELSE 0 END) AS open
+        FROM chargebacks
+        GROUP BY reason_code
+    ) s
+    JOIN reason_codes r ON r.code = s.reason_code
+""", key=["win_rate IS NULL", "-COALESCE(win_rate, 0)", "reason_code", "reason_description"])
+
+PARTITIONED_WIN_RATE_SELECT = f"""
+        SELECT
+            reason_code,
+            COUNT(*) AS total,
+            SUM(CASE WHEN status_id = {WON} THEN 1 ELSE 0 END) AS won,
+            SUM(CASE WHEN status_id = {LOST} THEN 1 ELSE 0 END) AS lost,
+            SUM(CASE WHEN status_id = {OPEN} THEN 1 ELSE 0 END) AS open
+        FROM {{chargebacks}}
+        WHERE {{dates}}
+        GROUP BY reason_code"""
+
+
+@lru_cache(maxsize=256)
+def win_rate_statements(sources: tuple, bounds: tuple) -> tuple:
+    """Statements over `sources`, for chargebacks dated inside a range of shape `bounds`."""
+    if sources == (HOT,) and bounds == (False, False):
+        return WIN_RATE_SQL, WIN_RATE_AFTER_SQL
+    partials = union_all(PARTITIONED_WIN_RATE_SELECT, sources, dates=range_condition("chargeback_date", bounds))
+    return keyset_statements(f"""
+    SELECT
+        p.reason_code,
+        r.description AS reason_description,
+        SUM(p.total) AS total,
+        SUM(p.won) AS won,
+        SUM(p.lost) AS lost,
+        SUM(p.open) AS open,
+        ROUND(CAST(SUM(p.won) AS FLOAT) / NULLIF(SUM(p.won) + SUM(p.lost), 0) * 100, 2) AS win_rate
+    FROM ({partials}) p
+    JOIN reason_codes r ON r.code = p.reason_code
+    GROUP BY p.reason_code, r.description
+""", key=["win_rate IS NULL", "-COALESCE(win_rate, 0)", "reason_code", "reason_description"])
+
+
+def win_rate_record(row) -> tuple:
+    """A `WinRateByReasonCode` as a row tuple in field order."""
+    return (*row[:6], row[6] if row[6] is not None else 0.0)
 
 
 @router.get("/win-rate", response_model=List[WinRateByReasonCode])
 def get_win_rate(
+    response: Response,
     limit: int = Query(50, ge=1, le=500, description="Maximum number of results"),
     offset: int = Query(0, ge=0, description="Number of results to skip"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Resume after the page that returned this X-Next-Cursor"),
+    format: str = Depends(get_format),
+    dates: DateRange = Depends(get_date_range),
+    conn: Connection = Depends(get_read_conn),
+    analytics_engine: str = Depends(get_analytics_engine),
 ):
     """
     Return dispute win rate per reason code.
     Win rate is computed over resolved disputes only (won + lost); open cases are excluded from the denominator.
+    `start`/`end` restrict it to chargebacks filed in that range.
     """
-    rows = db.execute(text("""
-        SELECT
-            reason_code,
-            reason_description,
-            COUNT(*) AS total,
-            SUM(CASE WHEN status = 'won' THEN 1 ELSE 0 END) AS won,
-            SUM(CASE WHEN status = 'lost' THEN 1 ELSE 0 END) AS lost,
-            SUM(CASE WHEN status = 'open' THEN 1 ELSE 0 END) AS open,
-            ROUND(
-                CAST(SUM(CASE WHEN status = 'won' THEN 1 ELSE 0 END) AS FLOAT)
-                / NULLIF(
-                    SUM(CASE WHEN status IN ('won', 'lost') THEN 1 ELSE 0 END),
-                    0
-                ) * 100,
-                2
-            ) AS win_rate
-        FROM chargebacks
-        GROUP BY reason_code, reason_description
-        ORDER BY win_rate DESC
-        LIMIT :limit OFFSET :offset
-    """), {"limit": limit, "offset": offset}).fetchall()
-
-    return [
-        WinRateByReasonCode(
-            reason_code=row[0],
-            reason_description=row[1],
-            total=row[2],
-            won=row[3],
-            lost=row[4],
-            open=row[5],
-            win_rate=row[6] if row[6] is not None else 0.0,
-        )
-        for row in rows
-    ]
+    check_cursor_offset(cursor, offset)
+    scope = dates.scope("win-rate")
+    after = decode_cursor(cursor, scope, width=4)
+    sources = fact_sources(conn, dates)
+    if analytics_engine == "columnar" and sources == (HOT,) and not dates.bounded:
+        rows = columnar_store.snapshot(conn).win_rate(limit, offset, after=after)
+    else:
+        first, resume = win_rate_statements(sources, dates.bounds)
+        if after is None:
+            rows = conn.execute(first, {**dates.params, "limit": limit, "offset": offset}).fetchall()
+        else:
+            rows = conn.execute(resume, {**dates.params, **keyset_params(after), "limit": limit, "offset": 0}).fetchall()
+    set_next_cursor(response, scope, rows, limit, win_rate_sort_key)
+
+    return rows_response(response, WinRateByReasonCode, map(win_rate_record, rows), format)
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional
+from datetime import date, datetime
+from typing import Any, List, Optional
 
 
 class MerchantRatio(BaseModel):
@@ -39,9 +40,26 @@ class Alert(BaseModel):
     description: str
     entity_id: Optional[str] = None
     entity_name: Optional[str] = None
+    reason_code: Optional[str] = None
     metric_value: Optional[float] = None
 
 
+class BurstWindow(BaseModel):
+    start: datetime
+    end: datetime
+    chargeback_count: int
+
+
+class CustomerRisk(BaseModel):
+    customer_id: str
+    chargeback_count: int
+    merchant_count: int
+    total_amount: float
+    first_chargeback_date: Optional[datetime] = None
+    last_chargeback_date: Optional[datetime] = None
+    repeat_offender: bool
+
+
 class FraudPattern(BaseModel):
     pattern_type: str
     entity_id: str
@@ -49,6 +67,7 @@ class FraudPattern(BaseModel):
     merchant_count: int
     total_amount: float
     time_window_hours: Optional[int] = None
+    windows: Optional[List[BurstWindow]] = None
 
 
 class Recommendation(BaseModel):
@@ -67,3 +86,80 @@ class WinRateByReasonCode(BaseModel):
     lost: int
     open: int
     win_rate: float
+
+
+class AmountDistribution(BaseModel):
+    dimension: str
+    value: str
+    chargeback_count: int
+    distinct_customers: int
+    distinct_customers_exact: bool
+    distinct_customers_error: float
+    amount_p50: Optional[float] = None
+    amount_p90: Optional[float] = None
+    amount_p99: Optional[float] = None
+    amount_min: Optional[float] = None
+    amount_max: Optional[float] = None
+    amount_relative_error: float
+
+
+class Dashboard(BaseModel):
+    ratio: Optional[List[MerchantRatio]] = None
+    reason_codes: Optional[List[ReasonCodeSummary]] = None
+    segments: Optional[List[HighRiskSegment]] = None
+    trends: Optional[List[TrendPoint]] = None
+    alerts: Optional[List[Alert]] = None
+    fraud: Optional[List[FraudPattern]] = None
+    recommendations: Optional[List[Recommendation]] = None
+    win_rate: Optional[List[WinRateByReasonCode]] = None
+
+
+class RowReject(BaseModel):
+    line: int
+    id: Optional[str] = None
+    error: str
+
+
+class BulkIngestResult(BaseModel):
+    received: int
+    inserted: int
+    rejected: int
+    elapsed_seconds: float
+    rows_per_second: float
+    rejects: List[RowReject]
+    rejects_truncated: bool
+    error: Optional[str] = None
+
+
+class JobRequest(BaseModel):
+    kind: str
+    params: dict = {}
+
+
+class JobProgress(BaseModel):
+    done: int
+    total: Optional[int] = None
+
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: str
+    params: dict
+    progress: Optional[JobProgress] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    submitted_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class PrecomputeStatus(BaseModel):
+    built_at: Optional[datetime] = None
+    build_ms: Optional[float] = None
+    data_version: Optional[int] = None
+    as_of: Optional[date] = None
+    fresh: bool
+    alerts: int = 0
+    recommendations: int = 0
+    repeat_offenders: int = 0
+    bin_patterns: int = 0
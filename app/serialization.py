@@ -0,0 +1,91 @@
+"""
+Fast JSON rendering for the list endpoints and the dashboard.
+
+Left to FastAPI, a list response would cost three steps:
+- building one Pydantic model per row;
+- validating the whole list again against `response_model`, in a threadpool for sync endpoints;
+- dumping it.
+
+For a 500-row page that costs several times the SQL. The list endpoints instead build plain row
+tuples, already JSON-ready and in their response model's field order. `rows_response` encodes the
+page in one call with orjson, or with the stdlib `json` (same body, slower) when orjson is not
+installed. `response_model` stays on each route, so the OpenAPI schema is unchanged.
+
+`?format=columnar` returns the same page as one object of field arrays,
+`{"merchant_id": [...], "name": [...], ...}`, instead of a list of objects. Field names are sent once
+instead of once per row, so the payload is smaller and faster to parse.
+"""
+import json
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterable
+from fastapi import HTTPException, Query, Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FORMATS = ("rows", "columnar")
+
+
+def get_format(
+    format: str = Query("rows", description="Response shape: rows (a list of objects) or columnar (an object of field arrays)"),
+) -> str:
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="format must be 'rows' or 'columnar'")
+    return format
+
+
+@lru_cache(maxsize=None)
+def model_fields(model: type) -> tuple:
+    return tuple(model.model_fields)
+
+
+def model_record(instance: BaseModel) -> tuple:
+    """The field values of an already-built model, such as a precomputed alert, as a row tuple."""
+    return tuple(getattr(instance, name) for name in model_fields(type(instance)))
+
+
+def shape(model: type, records: list, format: str = "rows"):
+    """`records` (tuples in `model` field order) as a list of objects, or as one object of field arrays."""
+    names = model_fields(model)
+    if format == "columnar":
+        columns = zip(*records) if records else ((),) * len(names)
+        return {name: list(column) for name, column in zip(names, columns)}
+    return [dict(zip(names, record)) for record in records]
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def json_response(response: Response, content) -> FastJSONResponse:
+    """`content` rendered with `dumps`, keeping the headers the endpoint set on its `response`."""
+    return FastJSONResponse(content, headers={
+        name: value for name, value in response.headers.items() if name != "content-length"
+    })
+
+
+def rows_response(response: Response, model: type, records: Iterable, format: str = "rows") -> FastJSONResponse:
+    return json_response(response, shape(model, list(records), format))
@@ -0,0 +1,590 @@
+"""
+Mergeable sketches of distinct customers and dispute amounts, behind `GET /api/distributions`.
+
+Exact answers need a `COUNT(DISTINCT t.customer_id)` and a sort of every amount over the chargeback ⨝
+transaction join, for each group and date range asked for. Instead, each chargeback day is summarized
+by two sets of `Cell`s:
+- one per merchant × reason code, persisted in `chargeback_sketches`;
+- one per code of each segment dimension (country, category, payment method), across merchants and
+  reason codes, persisted in `segment_sketches`.
+
+Each cell holds:
+- the chargeback count;
+- a `HyperLogLog` of customer ids;
+- a `QuantileSketch` of `amount_usd`.
+
+All three merge without loss of their guarantees, so a grouping over any day range is answered by
+merging cells. Cells are keyed on merchant surrogate keys and dictionary codes (see app/encoding.py);
+only the groups returned are decoded. No cell set is keyed on a segment and a merchant or reason code
+together, so a segment dimension filtered by `merchant`/`reason_code` is folded on request from the
+matching chargebacks of the range.
+
+- **HyperLogLog**: 2^SKETCH_HLL_PRECISION one-byte registers. The relative standard error is
+  1.04 / sqrt(2^p), 1.6% at p = 12. Up to SKETCH_HLL_SPARSE_LIMIT customers a sketch is the exact set
+  of their 64-bit hashes, so small groups are counted exactly; a merge stays exact while it fits.
+- **QuantileSketch** (DDSketch): a count per logarithmic bucket. Any quantile it returns is within
+  SKETCH_QUANTILE_RELATIVE_ACCURACY of the amount at that rank; the bound is deterministic, not
+  probabilistic. Merging adds bucket counts, so a merge is exact.
+
+The writers keep the persisted cells current, inside their own transactions:
+- bulk ingestion wraps each batch in `appending_chargebacks()`, which merges the new chargebacks into
+  the cells of their days, reading and writing only the cells they touch;
+- any other change to a chargeback or its transaction marks the chargeback's day stale in
+  `sketch_days` (triggers in app/rollups.py). `rebuild_stale_sketches()` refolds the stale days from
+  the fact tables. Ingestion, the partition commands and `scripts/manage.py` call it;
+  `rebuild_all()` rebuilds every day with `rebuild_sketches()`.
+Every day written gets a new version in `sketch_days`.
+
+`SketchStore` keeps the cells in memory, per process. On a data version bump, or every
+SKETCH_RECHECK_SECONDS for writes from other processes, it reads the days whose version is past the
+last one it read, and folds the days still stale (written without a rebuild) from the fact tables.
+Only one request refreshes at a time, outside the lock that merges take: the others keep merging the
+cells they already have.
+"""
+import bisect
+import hashlib
+import json
+import math
+import struct
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Callable, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from app.cache import data_version
+from app.columnar import MIN_ROWID
+from app.constants import (
+    SKETCH_FOLD_BATCH_SIZE,
+    SKETCH_HLL_PRECISION,
+    SKETCH_HLL_SPARSE_LIMIT,
+    SKETCH_QUANTILE_RELATIVE_ACCURACY,
+    SKETCH_RECHECK_SECONDS,
+)
+from app.database import read_snapshot
+from app.encoding import MERCHANT_KEY_SQL
+from app.partitions import UNBOUNDED, DateRange, FactSource, fact_sources, range_condition, union_all
+from app.rollups import DAILY_LABEL, MARK_SKETCH_DAYS_SQL
+
+DIMENSIONS = ("merchant", "reason_code", "country", "category", "payment_method")
+# Segment dimension -> its dictionary-coded column on `transactions`.
+SEGMENTS = {"country": "country_id", "category": "product_category_id", "payment_method": "payment_method_id"}
+
+HLL_REGISTERS = 1 << SKETCH_HLL_PRECISION
+HLL_RELATIVE_ERROR = 1.04 / math.sqrt(HLL_REGISTERS)
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+_HLL_SUFFIX_BITS = 64 - SKETCH_HLL_PRECISION
+_HLL_SUFFIX_MASK = (1 << _HLL_SUFFIX_BITS) - 1
+
+_GAMMA = (1 + SKETCH_QUANTILE_RELATIVE_ACCURACY) / (1 - SKETCH_QUANTILE_RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# zeros, count, min, max
+_QUANTILE_HEADER = struct.Struct("<qqdd")
+
+FOLD_COLUMNS = f"""{DAILY_LABEL.format("c.chargeback_date")}, t.merchant_id, c.reason_code,
+           {", ".join(f"t.{column}" for column in SEGMENTS.values())}, t.customer_id, c.amount_usd"""
+
+# CROSS JOIN fixes the join order: each stale day is one range of ix_chargebacks_chargeback_date, and
+# each chargeback one transaction lookup, instead of a scan of `transactions`.
+STALE_DAYS_FOLD_SELECT = f"""
+    SELECT {FOLD_COLUMNS}
+    FROM sketch_days s
+    CROSS JOIN {{chargebacks}} c
+    CROSS JOIN {{transactions}} t ON t.id = c.transaction_id
+    WHERE s.stale = 1 AND c.chargeback_date >= s.period AND c.chargeback_date < DATE(s.period, '+1 day')
+"""
+
+APPENDED_FOLD_SQL = text(f"""
+    SELECT {FOLD_COLUMNS}
+    FROM chargebacks c
+    JOIN transactions t ON t.id = c.transaction_id
+    WHERE c.rowid > :after
+""").execution_options(yield_per=SKETCH_FOLD_BATCH_SIZE)
+
+FILTERED_SEGMENT_SELECT = """
+    SELECT t.{column}, t.customer_id, c.amount_usd
+    FROM {chargebacks} c
+    JOIN {transactions} t ON t.id = c.transaction_id
+    WHERE {dates} AND {filters}
+"""
+FILTER_CONDITIONS = {
+    "merchant": f"t.merchant_id = {MERCHANT_KEY_SQL.format(':merchant')}",
+    "reason_code": "c.reason_code = :reason_code",
+}
+
+LAST_CHARGEBACK_SQL = text("SELECT COALESCE(MAX(rowid), :min_rowid) FROM chargebacks")
+STALE_DAYS_SQL = text("SELECT period FROM sketch_days WHERE stale = 1")
+MARK_ALL_DAYS_SQL = [
+    text("UPDATE sketch_days SET stale = 1"),
+    text(MARK_SKETCH_DAYS_SQL.format("SELECT DISTINCT period FROM chargeback_daily")),
+]
+CLEAR_STALE_DAYS_SQL = [
+    text("DELETE FROM chargeback_sketches WHERE period IN (SELECT period FROM sketch_days WHERE stale = 1)"),
+    text("DELETE FROM segment_sketches WHERE period IN (SELECT period FROM sketch_days WHERE stale = 1)"),
+]
+NEXT_VERSION_SQL = text("SELECT COALESCE(MAX(version), 0) + 1 FROM sketch_days")
+SET_VERSION_SQL = text(
+    "UPDATE sketch_days SET stale = 0, version = :version WHERE period IN (SELECT value FROM json_each(:days))"
+)
+SAVE_CELL_SQL = {
+    "chargebacks": text("""
+        INSERT OR REPLACE INTO chargeback_sketches (period, merchant_id, reason_code, chargeback_count, customers, amounts)
+        VALUES (:period, :first, :second, :chargeback_count, :customers, :amounts)
+    """),
+    "segments": text("""
+        INSERT OR REPLACE INTO segment_sketches (period, dimension, value_id, chargeback_count, customers, amounts)
+        VALUES (:period, :first, :second, :chargeback_count, :customers, :amounts)
+    """),
+}
+# The persisted cells of the (period, first, second) keys in the JSON array `:keys`.
+CELLS_AT_SQL = {
+    "chargebacks": text("""
+        SELECT s.period, s.merchant_id, s.reason_code, s.chargeback_count, s.customers, s.amounts
+        FROM json_each(:keys) k
+        CROSS JOIN chargeback_sketches s
+        WHERE s.period = json_extract(k.value, '$[0]') AND s.merchant_id = json_extract(k.value, '$[1]')
+          AND s.reason_code = json_extract(k.value, '$[2]')
+    """),
+    "segments": text("""
+        SELECT s.period, s.dimension, s.value_id, s.chargeback_count, s.customers, s.amounts
+        FROM json_each(:keys) k
+        CROSS JOIN segment_sketches s
+        WHERE s.period = json_extract(k.value, '$[0]') AND s.dimension = json_extract(k.value, '$[1]')
+          AND s.value_id = json_extract(k.value, '$[2]')
+    """),
+}
+
+CHANGED_DAYS_SQL = text("SELECT period, version, stale FROM sketch_days WHERE version > :version OR stale = 1")
+# The persisted cells of the days written since `:version`.
+CHANGED_CELLS_SQL = {
+    "chargebacks": text("""
+        SELECT s.period, s.merchant_id, s.reason_code, s.chargeback_count, s.customers, s.amounts
+        FROM sketch_days d
+        JOIN chargeback_sketches s ON s.period = d.period
+        WHERE d.version > :version AND d.stale = 0
+    """),
+    "segments": text("""
+        SELECT s.period, s.dimension, s.value_id, s.chargeback_count, s.customers, s.amounts
+        FROM sketch_days d
+        JOIN segment_sketches s ON s.period = d.period
+        WHERE d.version > :version AND d.stale = 0
+    """),
+}
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Distinct-count sketch: an exact set of hashes while small, HyperLogLog registers beyond."""
+
+    __slots__ = ("hashes", "registers")
+
+    def __init__(self):
+        self.hashes: Optional[set] = set()
+        self.registers: Optional[bytearray] = None
+
+    @property
+    def exact(self) -> bool:
+        return self.registers is None
+
+    def add(self, value: str) -> None:
+        self.add_hash(_hash64(value))
+
+    def add_hash(self, h: int) -> None:
+        if self.registers is None:
+            self.hashes.add(h)
+            if len(self.hashes) > SKETCH_HLL_SPARSE_LIMIT:
+                self._densify()
+            return
+        index, suffix = h >> _HLL_SUFFIX_BITS, h & _HLL_SUFFIX_MASK
+        rank = _HLL_SUFFIX_BITS - suffix.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def _densify(self) -> None:
+        hashes, self.hashes, self.registers = self.hashes, None, bytearray(HLL_REGISTERS)
+        for h in hashes:
+            self.add_hash(h)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.registers is None:
+            if self.registers is None:
+                self.hashes |= other.hashes
+                if len(self.hashes) > SKETCH_HLL_SPARSE_LIMIT:
+                    self._densify()
+            else:
+                for h in other.hashes:
+                    self.add_hash(h)
+            return
+        if self.registers is None:
+            hashes, self.hashes, self.registers = self.hashes, None, bytearray(other.registers)
+            for h in hashes:
+                self.add_hash(h)
+        else:
+            self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> float:
+        if self.registers is None:
+            return float(len(self.hashes))
+        estimate = _HLL_ALPHA * HLL_REGISTERS * HLL_REGISTERS / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * HLL_REGISTERS and zeros:
+            # Linear counting is more accurate while many registers are still empty.
+            estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+        return estimate
+
+    def to_bytes(self) -> bytes:
+        """The registers, or the sorted hashes (8 bytes each, never as long as the registers)."""
+        if self.registers is None:
+            return struct.pack(f">{len(self.hashes)}Q", *sorted(self.hashes))
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        sketch = cls()
+        if len(data) == HLL_REGISTERS:
+            sketch.hashes, sketch.registers = None, bytearray(data)
+        else:
+            sketch.hashes = set(struct.unpack(f">{len(data) // 8}Q", data))
+        return sketch
+
+
+class QuantileSketch:
+    """
+    DDSketch: values are counted in buckets (γ^(k-1), γ^k] with γ = (1 + α) / (1 - α), so reporting a
+    bucket's midpoint is within α of any value in it.
+    """
+
+    __slots__ = ("buckets", "zeros", "count", "min", "max")
+
+    def __init__(self):
+        self.buckets: Counter = Counter()
+        self.zeros = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        if value > 0:
+            self.buckets[math.ceil(math.log(value) / _LOG_GAMMA)] += 1
+        else:
+            self.zeros += 1
+        self.count += 1
+        self.min, self.max = min(self.min, value), max(self.max, value)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+
+    def quantiles(self, fractions: tuple) -> list:
+        """
+        The value at rank ⌊q·(count - 1)⌋ for each q in `fractions` (ascending), within α, or None
+        when empty.
+        """
+        if not self.count:
+            return [None] * len(fractions)
+        results, seen = [], self.zeros
+        keys = iter(sorted(self.buckets))
+        value = 0.0
+        for fraction in fractions:
+            rank = fraction * (self.count - 1)
+            while seen <= rank:
+                key = next(keys)
+                seen += self.buckets[key]
+                value = 2 * _GAMMA ** key / (_GAMMA + 1)
+            results.append(min(max(value, self.min), self.max))
+        return results
+
+    def to_bytes(self) -> bytes:
+        """Header (zeros, count, min, max), then (bucket, count) pairs in bucket order."""
+        pairs = [number for bucket in sorted(self.buckets.items()) for number in bucket]
+        return _QUANTILE_HEADER.pack(self.zeros, self.count, self.min, self.max) + struct.pack(f"<{len(pairs)}q", *pairs)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "QuantileSketch":
+        sketch = cls()
+        sketch.zeros, sketch.count, sketch.min, sketch.max = _QUANTILE_HEADER.unpack_from(data)
+        pairs = struct.unpack_from(f"<{(len(data) - _QUANTILE_HEADER.size) // 8}q", data, _QUANTILE_HEADER.size)
+        sketch.buckets = Counter(dict(zip(pairs[::2], pairs[1::2])))
+        return sketch
+
+
+class Cell:
+    __slots__ = ("count", "customers", "amounts")
+
+    def __init__(self):
+        self.count = 0
+        self.customers = HyperLogLog()
+        self.amounts = QuantileSketch()
+
+    def add(self, customer_hash: int, amount: Optional[float]) -> None:
+        self.count += 1
+        self.customers.add_hash(customer_hash)
+        if amount is not None:
+            self.amounts.add(amount)
+
+    def merge(self, other: "Cell") -> None:
+        self.count += other.count
+        self.customers.merge(other.customers)
+        self.amounts.merge(other.amounts)
+
+    def row(self) -> dict:
+        return {
+            "chargeback_count": self.count,
+            "customers": self.customers.to_bytes(),
+            "amounts": self.amounts.to_bytes(),
+        }
+
+    @classmethod
+    def from_row(cls, count: int, customers: bytes, amounts: bytes) -> "Cell":
+        cell = cls()
+        cell.count = count
+        cell.customers = HyperLogLog.from_bytes(customers)
+        cell.amounts = QuantileSketch.from_bytes(amounts)
+        return cell
+
+
+def _cell(cells: dict, key: tuple) -> Cell:
+    cell = cells.get(key)
+    if cell is None:
+        cell = cells[key] = Cell()
+    return cell
+
+
+class DayCells:
+    """One day's cells: `chargebacks` per (merchant, reason code), `segments` per (dimension, code)."""
+
+    __slots__ = ("chargebacks", "segments")
+
+    def __init__(self):
+        self.chargebacks: dict = {}
+        self.segments: dict = {}
+
+    def add(self, merchant_id: int, reason_code: str, segment_codes: tuple, customer_id: str, amount: Optional[float]) -> None:
+        customer_hash = _hash64(customer_id)
+        _cell(self.chargebacks, (merchant_id, reason_code)).add(customer_hash, amount)
+        for dimension, code in zip(SEGMENTS, segment_codes):
+            _cell(self.segments, (dimension, code)).add(customer_hash, amount)
+
+
+@lru_cache(maxsize=64)
+def stale_days_fold_statement(source: FactSource):
+    return text(STALE_DAYS_FOLD_SELECT.format(
+        chargebacks=source.chargebacks, transactions=source.transactions,
+    )).execution_options(yield_per=SKETCH_FOLD_BATCH_SIZE)
+
+
+def _fold(conn: Connection, statement, params: dict, days: dict) -> None:
+    """Fold the chargeback rows of `statement` (see FOLD_COLUMNS) into `days` (period -> DayCells)."""
+    for part in conn.execute(statement, params).partitions():
+        for day, merchant_id, reason_code, country, category, payment_method, customer_id, amount in part:
+            cells = days.get(day)
+            if cells is None:
+                cells = days[day] = DayCells()
+            cells.add(merchant_id, reason_code, (country, category, payment_method), customer_id, amount)
+
+
+def fold_stale_days(conn: Connection) -> dict:
+    """The cells of the stale days, folded from the fact tables: period -> DayCells, or None for no chargebacks."""
+    stale = conn.execute(STALE_DAYS_SQL).scalars().all()
+    days = dict.fromkeys(stale)
+    if stale:
+        dates = DateRange(date.fromisoformat(min(stale)), date.fromisoformat(max(stale)) + timedelta(days=1))
+        for source in fact_sources(conn, dates):
+            _fold(conn, stale_days_fold_statement(source), {}, days)
+    return days
+
+
+def _save(conn: Connection, days: dict) -> None:
+    """Write the cells of `days` and give every one of them, empty or not, a new version."""
+    for cell_set, statement in SAVE_CELL_SQL.items():
+        rows = [
+            {"period": day, "first": first, "second": second, **cell.row()}
+            for day, cells in days.items() if cells is not None
+            for (first, second), cell in getattr(cells, cell_set).items()
+        ]
+        if rows:
+            conn.execute(statement, rows)
+    conn.execute(SET_VERSION_SQL, {"version": conn.execute(NEXT_VERSION_SQL).scalar(), "days": json.dumps(list(days))})
+
+
+def rebuild_stale_sketches(conn: Connection) -> int:
+    """Refold the persisted cells of the stale days from the fact tables. Returns the number of days rebuilt."""
+    days = fold_stale_days(conn)
+    if days:
+        for statement in CLEAR_STALE_DAYS_SQL:
+            conn.execute(statement)
+        _save(conn, days)
+    return len(days)
+
+
+def rebuild_sketches(conn: Connection) -> int:
+    """Rebuild every day's cells; reads the days from `chargeback_daily`. Returns the number of days rebuilt."""
+    for statement in MARK_ALL_DAYS_SQL:
+        conn.execute(statement)
+    return rebuild_stale_sketches(conn)
+
+
+@contextmanager
+def appending_chargebacks(conn: Connection):
+    """
+    Wrap an insert into the hot `chargebacks` table, in the writer's transaction: the rows it adds
+    are merged into the persisted cells of their days. Stale days are rebuilt first, so after the
+    insert the only stale days are the ones it marked.
+    """
+    rebuild_stale_sketches(conn)
+    after = conn.execute(LAST_CHARGEBACK_SQL, {"min_rowid": MIN_ROWID}).scalar()
+    yield
+    days: dict = {}
+    _fold(conn, APPENDED_FOLD_SQL, {"after": after}, days)
+    if not days:
+        return
+    for cell_set, statement in CELLS_AT_SQL.items():
+        keys = [[day, *key] for day, cells in days.items() for key in getattr(cells, cell_set)]
+        for day, first, second, count, customers, amounts in conn.execute(statement, {"keys": json.dumps(keys)}):
+            getattr(days[day], cell_set)[(first, second)].merge(Cell.from_row(count, customers, amounts))
+    _save(conn, days)
+
+
+DICTIONARY_VALUES_SQL = text("SELECT id, value FROM dictionary")
+
+# Value of each code of the coded dimensions; reason codes are stored as they are.
+DECODE_SQL = {
+    "merchant": text("SELECT id, external_id FROM merchants"),
+    "country": DICTIONARY_VALUES_SQL,
+    "category": DICTIONARY_VALUES_SQL,
+    "payment_method": DICTIONARY_VALUES_SQL,
+}
+
+
+def _decoder(conn: Connection, dimension: str) -> Optional[dict]:
+    statement = DECODE_SQL.get(dimension)
+    return None if statement is None else dict(conn.execute(statement).all())
+
+
+def _fold_segment(conn: Connection, dimension: str, dates: DateRange, filters: dict) -> dict:
+    """Cells per code of segment `dimension`, folded from the chargebacks in `dates` matching `filters`."""
+    statement = text(union_all(
+        FILTERED_SEGMENT_SELECT, fact_sources(conn, dates),
+        column=SEGMENTS[dimension],
+        dates=range_condition("c.chargeback_date", dates.bounds),
+        filters=" AND ".join(FILTER_CONDITIONS[name] for name in sorted(filters)),
+    ))
+    groups: dict = {}
+    for code, customer_id, amount in conn.execute(statement, {**dates.params, **filters}):
+        _cell(groups, code).add(_hash64(customer_id), amount)
+    return groups
+
+
+class SketchStore:
+    def __init__(self, recheck_seconds: float = SKETCH_RECHECK_SECONDS):
+        self.recheck_seconds = recheck_seconds
+        # `_lock` guards `days` while a merge reads it or a refresh swaps days in; `_refresh_lock`
+        # lets one request at a time read the database.
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._checked: Optional[tuple] = None
+        self._checked_at = 0.0
+        self.database: Optional[str] = None
+        self.version = 0
+        self.days: dict = {}
+        self.day_labels: list = []
+        self.loaded_days = 0
+        self.folded_days = 0
+
+    def _fresh(self, checked: tuple) -> bool:
+        return self._checked == checked and time.monotonic() - self._checked_at < self.recheck_seconds
+
+    def refresh(self, conn: Connection) -> None:
+        """Read the days written since the last refresh if the data version moved, `recheck_seconds` passed or the database changed."""
+        checked = (conn.engine.url.database, data_version.current)
+        if self._fresh(checked):
+            return
+        # While another request refreshes, keep serving the current cells, if they are this database's.
+        if not self._refresh_lock.acquire(blocking=self.database != checked[0]):
+            return
+        try:
+            if self._fresh(checked):
+                return
+            version = self.version if self.database == checked[0] else 0
+            with read_snapshot(conn):
+                changed, version = self._read(conn, version)
+            with self._lock:
+                if self.database != checked[0]:
+                    self.database, self.days, self.day_labels = checked[0], {}, []
+                for day, cells in changed.items():
+                    if cells is None:
+                        if self.days.pop(day, None) is not None:
+                            self.day_labels.remove(day)
+                    else:
+                        if day not in self.days:
+                            bisect.insort(self.day_labels, day)
+                        self.days[day] = cells
+                self.version = version
+            self._checked, self._checked_at = checked, time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def _read(self, conn: Connection, version: int) -> tuple:
+        """Days changed since `version` (period -> DayCells, or None when empty) and the version read."""
+        rows = conn.execute(CHANGED_DAYS_SQL, {"version": version}).all()
+        changed = {period: None for period, _, stale in rows if not stale}
+        for cell_set, statement in CHANGED_CELLS_SQL.items():
+            for day, first, second, count, customers, amounts in conn.execute(statement, {"version": version}):
+                cells = changed[day]
+                if cells is None:
+                    cells = changed[day] = DayCells()
+                getattr(cells, cell_set)[(first, second)] = Cell.from_row(count, customers, amounts)
+        self.loaded_days += len(changed)
+        folded = fold_stale_days(conn)
+        self.folded_days += len(folded)
+        changed.update(folded)
+        return changed, max([version, *(day_version for _, day_version, _ in rows)])
+
+    def _merge(self, cell_set: str, dates: DateRange, group_of: Callable) -> dict:
+        """Merge the `cell_set` cells of the days in `dates` per `group_of(key)`, skipping keys it maps to None."""
+        start, end = dates.params.get("start"), dates.params.get("end")
+        groups: dict = {}
+        with self._lock:
+            first = 0 if start is None else bisect.bisect_left(self.day_labels, start)
+            last = len(self.day_labels) if end is None else bisect.bisect_left(self.day_labels, end)
+            for day in self.day_labels[first:last]:
+                for key, cell in getattr(self.days[day], cell_set).items():
+                    group = group_of(key)
+                    if group is not None:
+                        _cell(groups, group).merge(cell)
+        return groups
+
+    def merged(self, conn: Connection, dimension: str, dates: DateRange = UNBOUNDED, filters: Optional[dict] = None) -> dict:
+        """
+        Cells of the chargebacks in `dates` matching `filters` ("merchant", "reason_code" -> value),
+        merged per value of `dimension`.
+        """
+        self.refresh(conn)
+        filters = filters or {}
+        if dimension in SEGMENTS and filters:
+            groups = _fold_segment(conn, dimension, dates, filters)
+        elif dimension in SEGMENTS:
+            groups = self._merge("segments", dates, lambda key: key[1] if key[0] == dimension else None)
+        else:
+            wanted = []
+            if "merchant" in filters:
+                wanted.append((0, {code for code, value in _decoder(conn, "merchant").items() if value == filters["merchant"]}))
+            if "reason_code" in filters:
+                wanted.append((1, {filters["reason_code"]}))
+            position = DIMENSIONS.index(dimension)
+            groups = self._merge(
+                "chargebacks", dates, lambda key: key[position] if all(key[i] in codes for i, codes in wanted) else None,
+            )
+        decoder = _decoder(conn, dimension)
+        return groups if decoder is None else {decoder.get(code): cell for code, cell in groups.items()}
+
+
+sketch_store = SketchStore()
@@ -0,0 +1,274 @@
+"""
+Query-level benchmark of the router SQL at several data scales.
+
+For each size a SQLite database is generated with `scripts.seed_data` (and kept in `--data-dir`
+for later runs), the statements the routers issue are captured with `scripts.router_queries`, and
+each one is replayed on the app's read engine:
+
+- cold: a fresh connection per run, with the database file evicted from the OS page cache where
+  the platform allows it, so pages are read from disk and nothing is in SQLite's page cache;
+- warm: repeated runs on one connection after a first untimed run.
+
+The JSON report has p50/p95 latency per query and state, the peak RSS reached while it ran, and its
+`EXPLAIN QUERY PLAN`. Keys are stable, so two reports diff cleanly; `--baseline` compares against
+an earlier report and exits non-zero on a regression.
+
+    python -m scripts.benchmark --sizes 10k,1m,10m --output benchmark-report.json
+    python -m scripts.benchmark --sizes 10k --baseline benchmark-report.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from app.database import create_read_engine
+from scripts.router_queries import capture_router_queries, plan_warnings
+from scripts.seed_data import DEFAULT_SEED, build_plan, plan_shards
+
+DEFAULT_SIZES = "10k,1m,10m"
+SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+def parse_size(label: str) -> int:
+    label = label.strip().lower()
+    if label[-1:] in SUFFIXES:
+        return int(float(label[:-1]) * SUFFIXES[label[-1]])
+    return int(label)
+
+
+def seed_scale(transactions: int, seed: int) -> float:
+    """`seed_data` scale factor that generates about `transactions` rows."""
+    plan, _ = build_plan(seed)
+    per_unit = sum(shard.count for shard in plan_shards(plan, 1.0))
+    return transactions / per_unit
+
+
+def build_database(path: Path, transactions: int, seed: int, workers: int, rebuild: bool) -> float:
+    """Generate the database at `path` unless it already exists. Returns the seconds spent."""
+    if path.exists() and not rebuild:
+        return 0.0
+    from scripts import seed_data
+
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    seed_data.main([
+        "--scale", repr(seed_scale(transactions, seed)), "--seed", str(seed),
+        "--workers", str(workers), "--database", f"sqlite:///{path}",
+    ])
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return time.perf_counter() - started
+
+
+def evict_from_page_cache(path: Path) -> bool:
+    """Ask the OS to drop the cached pages of the database files. Returns False where unsupported."""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for name in (str(path), f"{path}-wal"):
+        if os.path.exists(name):
+            fd = os.open(name, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+    return True
+
+
+def reset_peak_rss() -> bool:
+    """Reset the kernel's high-water mark for this process (Linux); False if it cannot be reset."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def _summary(samples: list) -> dict:
+    return {
+        "runs": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+
+def time_query(engine: Engine, path: Path, query, cold_runs: int, warm_runs: int) -> dict:
+    cold = []
+    for _ in range(cold_runs):
+        engine.dispose()
+        evict_from_page_cache(path)
+        with engine.connect() as conn:
+            started = time.perf_counter()
+            query.execute(conn)
+            cold.append(time.perf_counter() - started)
+
+    warm = []
+    with engine.connect() as conn:
+        rows = len(query.execute(conn))
+        for _ in range(warm_runs):
+            started = time.perf_counter()
+            query.execute(conn)
+            warm.append(time.perf_counter() - started)
+    return {"rows": rows, "cold": _summary(cold), "warm": _summary(warm)}
+
+
+def table_counts(engine: Engine) -> dict:
+    with engine.connect() as conn:
+        return {
+            table: conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            for table in ("merchants", "transactions", "chargebacks")
+        }
+
+
+def benchmark_database(path: Path, cold_runs: int, warm_runs: int, progress=None) -> dict:
+    engine = create_read_engine(f"sqlite:///{path}", pool_size=8, max_overflow=0)
+    try:
+        queries = capture_router_queries(engine)
+        results = {}
+        for number, query in enumerate(queries, 1):
+            if progress:
+                progress(number, len(queries), query)
+            with engine.connect() as conn:
+                plan = query.explain(conn)
+            reset_peak_rss()
+            timings = time_query(engine, path, query, cold_runs, warm_runs)
+            results[query.id] = {
+                "sql": " ".join(query.statement.split()),
+                "parameters": [p if isinstance(p, (int, float, str, type(None))) else str(p) for p in query.parameters],
+                "plan": plan,
+                "plan_warnings": plan_warnings(plan),
+                **timings,
+                "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1),
+            }
+        return {"tables": table_counts(engine), "queries": results}
+    finally:
+        engine.dispose()
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    sizes: list, data_dir: Path, seed: int = DEFAULT_SEED, cold_runs: int = 3, warm_runs: int = 20,
+    workers: int = 1, rebuild: bool = False, progress=None,
+) -> dict:
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "seed": seed,
+        "cold_cache_eviction": hasattr(os, "posix_fadvise"),
+        "sizes": {},
+    }
+    for label in sizes:
+        transactions = parse_size(label)
+        path = data_dir / f"transactions-{label}-seed{seed}.db"
+        build_seconds = build_database(path, transactions, seed, workers, rebuild)
+        report["sizes"][label] = {
+            "database": str(path),
+            "build_seconds": round(build_seconds, 1),
+            "database_mb": round(path.stat().st_size / 2**20, 1),
+            **benchmark_database(path, cold_runs, warm_runs, progress),
+        }
+    return report
+
+
+def compare_reports(baseline: dict, report: dict, tolerance: float) -> list:
+    """Queries whose warm or cold p95 grew by more than `tolerance`, or whose plan changed."""
+    regressions = []
+    for label, size in report["sizes"].items():
+        before = baseline.get("sizes", {}).get(label, {}).get("queries", {})
+        for query_id, result in size["queries"].items():
+            old = before.get(query_id)
+            if old is None:
+                continue
+            for state in ("warm", "cold"):
+                was, now = old[state]["p95_ms"], result[state]["p95_ms"]
+                if now > was * (1 + tolerance) and now - was > 1.0:
+                    regressions.append(f"{label} {query_id}: {state} p95 {was:.1f} ms -> {now:.1f} ms")
+            if old["plan"] != result["plan"]:
+                regressions.append(f"{label} {query_id}: plan changed")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the router SQL at several data scales")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated transaction counts, e.g. 10k,1m,10m")
+    parser.add_argument("--data-dir", type=Path, default=Path(".benchmarks"), help="Where generated databases are kept")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="RNG seed for the generated data")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Generator processes")
+    parser.add_argument("--cold-runs", type=int, default=3, help="Timed runs per query on a cold cache")
+    parser.add_argument("--warm-runs", type=int, default=20, help="Timed runs per query on a warm connection")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate databases that already exist")
+    parser.add_argument("--output", type=Path, default=Path("benchmark-report.json"), help="JSON report path")
+    parser.add_argument("--baseline", type=Path, help="Earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 growth before flagging (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+
+    def report_progress(number: int, total: int, query) -> None:
+        print(f"\r[{number}/{total}] {query.request[:70]:<70}", end="", file=sys.stderr)
+
+    report = run_benchmark(
+        [label.strip() for label in args.sizes.split(",") if label.strip()], args.data_dir, seed=args.seed,
+        cold_runs=args.cold_runs, warm_runs=args.warm_runs, workers=args.workers, rebuild=args.rebuild,
+        progress=report_progress,
+    )
+    print(file=sys.stderr)
+    args.output.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+    for label, size in report["sizes"].items():
+        print(f"{label}: {size['tables']['transactions']:,} transactions, {size['database_mb']} MB")
+        for query_id, result in size["queries"].items():
+            flag = "  !" if result["plan_warnings"] else ""
+            print(f"  {result['warm']['p50_ms']:>9.2f} / {result['cold']['p95_ms']:>9.2f} ms  {query_id}{flag}")
+    print(f"report written to {args.output} (warm p50 / cold p95; ! = full scan or temp B-tree)")
+
+    if baseline is not None:
+        regressions = compare_reports(baseline, report, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+Index advisor driven by the SQL the routers actually issue.
+
+The statements are captured with `scripts.router_queries` against a scaled database generated by
+`scripts.benchmark` (kept in `--data-dir`), and each one's `EXPLAIN QUERY PLAN` is checked for full
+scans, temp B-trees and index lookups that still have to read the table row. For every such table
+access a covering index is proposed: the columns the plan looks up by, then the GROUP BY columns
+when the table drives the query, then every other column the statement reads from that table.
+
+Each candidate is created on the scratch database and kept only if it makes the statements that
+proposed it measurably faster. Candidates that are a prefix of another kept index on the same table
+are folded into it, and kept indexes leading with the same column are merged into one when that
+serves their statements as well. The kept set is then applied together, and the report lists every statement's
+warm p50 and plan before and after.
+
+    python -m scripts.index_advisor --size 1m
+    python -m scripts.index_advisor --size 1m --apply sqlite:///./monteverde.db --version 0003_advisor
+
+`--apply` creates the kept indexes on the target database as a versioned, idempotent migration
+(`app.migrations.apply_index_migration`). Indexes worth keeping for every deployment should also be
+declared on the models and registered with `@migration`; the report prints the declarations.
+"""
+import argparse
+import json
+import re
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from sqlalchemy import create_engine
+from app.database import create_read_engine
+from app.migrations import apply_index_migration
+from scripts.benchmark import build_database, parse_size, percentile
+from scripts.router_queries import capture_router_queries, plan_warnings
+from scripts.seed_data import DEFAULT_SEED
+
+TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+PLAN_ACCESS = re.compile(
+    r"^(SCAN|SEARCH) (\w+)(?: USING (COVERING INDEX|INDEX|PRIMARY KEY|INTEGER PRIMARY KEY)(?: (\w+))?)?(?: \((.*)\))?"
+)
+LOOKUP_TERM = re.compile(r"(\w+)(=|>|<)")
+GROUP_BY = re.compile(r"\bGROUP BY\b(.*?)(?:\bHAVING\b|\bORDER BY\b|\bLIMIT\b|\bWINDOW\b|\)|$)", re.IGNORECASE | re.DOTALL)
+SQL_WORDS = {
+    "where", "on", "join", "left", "inner", "cross", "group", "order", "limit", "union", "having", "using", "as", "and",
+}
+MIN_ROWS = 1000
+
+
+@dataclass(frozen=True)
+class Candidate:
+    table: str
+    columns: tuple
+
+    @property
+    def name(self) -> str:
+        return f"ix_{self.table}_{'_'.join(self.columns)}"
+
+    @property
+    def ddl(self) -> str:
+        return f"CREATE INDEX IF NOT EXISTS {self.name} ON {self.table} ({', '.join(self.columns)})"
+
+    def covers(self, other: "Candidate") -> bool:
+        return self.table == other.table and self.columns[:len(other.columns)] == other.columns
+
+
+def _schema(conn) -> dict:
+    """Columns and row count of every table big enough for an index to matter."""
+    tables = {}
+    for (name,) in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+        if name.startswith("sqlite_") or name == "schema_migrations":
+            continue
+        rows = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {name}").scalar()
+        columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({name})")]
+        tables[name] = {"rows": rows, "columns": columns}
+    return tables
+
+
+def _index_columns(conn, index: str) -> tuple:
+    return tuple(row[2] for row in conn.exec_driver_sql(f"PRAGMA index_info({index})"))
+
+
+def _referenced_columns(statement: str, alias: str, table: str, columns: list, single_table: bool) -> list:
+    """Columns of `table` read by `statement`, in order of first appearance."""
+    if single_table:
+        words = re.findall(r"(?<![.\w])(\w+)\b", statement)
+    else:
+        words = re.findall(rf"\b{re.escape(alias)}\.(\w+)\b", statement)
+    seen = []
+    for word in words:
+        if word in columns and word not in seen:
+            seen.append(word)
+    return seen
+
+
+def propose(conn, query, plan: list, schema: dict) -> list:
+    """Covering-index candidates for the table accesses in `plan` that read rows or sort."""
+    statement = query.statement
+    refs = {}
+    for table, alias in TABLE_REF.findall(statement):
+        if table in schema:
+            name = alias if alias and alias.lower() not in SQL_WORDS else table
+            refs[name] = table
+    single_table = len(set(refs.values())) == 1 and all(name == table for name, table in refs.items())
+    group_by = " ".join(GROUP_BY.findall(statement))
+    sorts = any(line.strip().startswith("USE TEMP B-TREE") for line in plan)
+
+    candidates = []
+    for line in map(str.strip, plan):
+        access = PLAN_ACCESS.match(line)
+        if access is None or access.group(2) not in refs:
+            continue
+        kind, alias, using, index, lookup = access.groups()
+        table = refs[alias]
+        if schema[table]["rows"] < MIN_ROWS or (using or "").endswith("PRIMARY KEY"):
+            continue
+        if using == "COVERING INDEX" and not (kind == "SCAN" and sorts):
+            continue
+        columns = schema[table]["columns"]
+        referenced = _referenced_columns(statement, alias, table, columns, single_table)
+        terms = LOOKUP_TERM.findall(lookup or "")
+        keys = [column for column, op in terms if op == "="] + [column for column, op in terms if op != "="]
+        grouped = [c for c in _referenced_columns(group_by, alias, table, columns, single_table)] if kind == "SCAN" else []
+        ordered = []
+        for column in [*keys, *grouped, *referenced]:
+            if column not in ordered:
+                ordered.append(column)
+        if not ordered or (index and _index_columns(conn, index) == tuple(ordered)):
+            continue
+        candidates.append(Candidate(table, tuple(ordered)))
+    return candidates
+
+
+def warm_ms(engine, query, runs: int) -> float:
+    samples = []
+    with engine.connect() as conn:
+        query.execute(conn)
+        for _ in range(runs):
+            started = time.perf_counter()
+            query.execute(conn)
+            samples.append(time.perf_counter() - started)
+    return percentile(samples, 0.50) * 1000
+
+
+def _explain(engine, query) -> list:
+    with engine.connect() as conn:
+        return query.explain(conn)
+
+
+def _measure(engine, queries: list, runs: int) -> dict:
+    return {query.id: {"p50_ms": round(warm_ms(engine, query, runs), 3), "plan": _explain(engine, query)} for query in queries}
+
+
+def _set_indexes(writer, create: list = (), drop: list = ()) -> None:
+    with writer.begin() as conn:
+        for candidate in drop:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {candidate.name}")
+        for candidate in create:
+            conn.exec_driver_sql(candidate.ddl)
+
+
+def _merge_shared_prefixes(reader, writer, kept: list, proposals: dict, runs: int, min_gain: float) -> list:
+    """
+    Replace kept indexes that lead with the same column on the same table by one index holding all
+    their columns, when that single index serves their statements about as well as the separate ones.
+    """
+    groups = {}
+    for candidate in kept:
+        groups.setdefault((candidate.table, candidate.columns[0]), []).append(candidate)
+    for (table, _), group in groups.items():
+        if len(group) < 2:
+            continue
+        columns = []
+        for candidate in group:
+            columns += [column for column in candidate.columns if column not in columns]
+        merged = Candidate(table, tuple(columns))
+        queries = list({query.id: query for candidate in group for query in proposals[candidate]}.values())
+        _set_indexes(writer, create=group)
+        reader.dispose()
+        separate = sum(warm_ms(reader, query, runs) for query in queries)
+        _set_indexes(writer, create=[merged], drop=group)
+        reader.dispose()
+        combined = sum(warm_ms(reader, query, runs) for query in queries)
+        _set_indexes(writer, drop=[merged])
+        reader.dispose()
+        if combined <= separate * (1 + min_gain):
+            kept = [candidate for candidate in kept if candidate not in group] + [merged]
+            proposals[merged] = queries
+    return kept
+
+
+def _redundant_indexes(conn, kept: list) -> list:
+    """Existing indexes whose columns are a prefix of a kept index (candidates for dropping)."""
+    redundant = []
+    for name, table in conn.exec_driver_sql(
+        "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_autoindex_%'"
+    ).fetchall():
+        existing = Candidate(table, _index_columns(conn, name))
+        if existing.columns and any(candidate.name != name and candidate.covers(existing) for candidate in kept):
+            redundant.append(name)
+    return sorted(redundant)
+
+
+def advise(path: Path, runs: int = 10, min_gain: float = 0.10, progress=None) -> dict:
+    """Propose, evaluate and select covering indexes on the database at `path` (which is modified)."""
+    url = f"sqlite:///{path}"
+    reader = create_read_engine(url, pool_size=4, max_overflow=0)
+    writer = create_engine(url)
+    try:
+        queries = capture_router_queries(reader)
+        with reader.connect() as conn:
+            schema = _schema(conn)
+            proposals = {}
+            for query in queries:
+                plan = query.explain(conn)
+                for candidate in propose(conn, query, plan, schema):
+                    proposals.setdefault(candidate, []).append(query)
+
+        evaluated = []
+        for number, (candidate, proposed_by) in enumerate(proposals.items(), 1):
+            if progress:
+                progress(number, len(proposals), candidate)
+            before = sum(warm_ms(reader, query, runs) for query in proposed_by)
+            _set_indexes(writer, create=[candidate])
+            reader.dispose()
+            after = sum(warm_ms(reader, query, runs) for query in proposed_by)
+            _set_indexes(writer, drop=[candidate])
+            reader.dispose()
+            gain = (before - after) / before if before else 0.0
+            evaluated.append({
+                "index": candidate, "before_ms": before, "after_ms": after, "gain": gain,
+                "queries": sorted({query.id for query in proposed_by}),
+            })
+
+        kept = [e["index"] for e in evaluated if e["gain"] >= min_gain and e["before_ms"] - e["after_ms"] >= 0.5]
+        kept = [c for c in kept if not any(other != c and other.covers(c) for other in kept)]
+        kept = _merge_shared_prefixes(reader, writer, kept, proposals, runs, min_gain)
+
+        before = _measure(reader, queries, runs)
+        _set_indexes(writer, create=kept)
+        reader.dispose()
+        after = _measure(reader, queries, runs)
+        with reader.connect() as conn:
+            redundant = _redundant_indexes(conn, kept)
+        return {
+            "database": str(path),
+            "tables": {name: table["rows"] for name, table in schema.items()},
+            "candidates": [
+                {
+                    "index": e["index"].name, "ddl": e["index"].ddl, "kept": e["index"] in kept,
+                    "before_ms": round(e["before_ms"], 3), "after_ms": round(e["after_ms"], 3),
+                    "gain": round(e["gain"], 3), "queries": e["queries"],
+                }
+                for e in evaluated
+            ],
+            "kept": [candidate.ddl for candidate in kept],
+            "redundant": redundant,
+            "queries": {
+                query_id: {
+                    "before": before[query_id], "after": after[query_id],
+                    "warnings_before": plan_warnings(before[query_id]["plan"]),
+                    "warnings_after": plan_warnings(after[query_id]["plan"]),
+                }
+                for query_id in before
+            },
+        }
+    finally:
+        reader.dispose()
+        writer.dispose()
+
+
+def model_declarations(ddl: list) -> list:
+    """`Index(...)` lines for app/models.py matching the kept indexes."""
+    lines = []
+    for statement in ddl:
+        name, table, columns = re.search(r"EXISTS (\w+) ON (\w+) \((.*)\)", statement).groups()
+        quoted = ", ".join(f'"{column}"' for column in columns.split(", "))
+        lines.append(f'{table}: Index("{name}", {quoted}),')
+    return lines
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Propose and apply covering indexes for the router SQL")
+    parser.add_argument("--size", default="1m", help="Transactions in the scratch database, e.g. 100k or 1m")
+    parser.add_argument("--data-dir", type=Path, default=Path(".benchmarks"), help="Where generated databases are kept")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="RNG seed for the generated data")
+    parser.add_argument("--workers", type=int, default=1, help="Generator processes")
+    parser.add_argument("--runs", type=int, default=10, help="Timed warm runs per statement")
+    parser.add_argument("--min-gain", type=float, default=0.10, help="Keep an index that saves at least this fraction")
+    parser.add_argument("--output", type=Path, help="Write the full report as JSON")
+    parser.add_argument("--apply", metavar="DATABASE_URL", help="Create the kept indexes on this database")
+    parser.add_argument("--version", default="advisor", help="schema_migrations version recorded by --apply")
+    args = parser.parse_args(argv)
+
+    # The advisor adds and drops indexes, so it works on its own copy of the benchmark database.
+    label = args.size.strip()
+    source = args.data_dir / f"transactions-{label}-seed{args.seed}.db"
+    build_database(source, parse_size(label), args.seed, args.workers, rebuild=False)
+    scratch = args.data_dir / f"advisor-{label}-seed{args.seed}.db"
+    with closing(sqlite3.connect(source)) as origin, closing(sqlite3.connect(scratch)) as copy:
+        origin.backup(copy)
+
+    def report_progress(number: int, total: int, candidate: Candidate) -> None:
+        print(f"\r[{number}/{total}] {candidate.name[:70]:<70}", end="", file=sys.stderr)
+
+    report = advise(scratch, runs=args.runs, min_gain=args.min_gain, progress=report_progress)
+    print(file=sys.stderr)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+    print("candidates (warm p50 of the statements that proposed them):")
+    for candidate in report["candidates"]:
+        mark = "+" if candidate["kept"] else " "
+        print(f" {mark} {candidate['before_ms']:>9.2f} -> {candidate['after_ms']:>9.2f} ms  {candidate['index']}")
+    print("statements (warm p50 before -> after; ! = full scan or temp B-tree):")
+    for query_id, result in report["queries"].items():
+        flags = ("!" if result["warnings_before"] else " ") + ("!" if result["warnings_after"] else " ")
+        print(f"  {result['before']['p50_ms']:>9.2f} -> {result['after']['p50_ms']:>9.2f} ms {flags} {query_id}")
+    if report["redundant"]:
+        print(f"existing indexes made redundant (not dropped): {', '.join(report['redundant'])}")
+    if report["kept"]:
+        print("declarations for app/models.py:")
+        for line in model_declarations(report["kept"]):
+            print(f"  {line}")
+
+    if args.apply:
+        target = create_engine(args.apply)
+        with target.begin() as conn:
+            created = apply_index_migration(conn, args.version, report["kept"])
+        target.dispose()
+        if created is None:
+            print(f"{args.version} already applied to {args.apply}")
+        else:
+            print(f"{args.version}: created {', '.join(created) or 'no new indexes'} on {args.apply}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Storage size and join speed of the compact fact layout against the record layout it replaced.
+
+For each size, a database is generated as in `scripts.benchmark`. Two copies are made from it:
+- compact: the layout of app/encoding.py, as stored by the app (integer surrogate keys, dictionary
+  codes, descriptions in `reason_codes`);
+- legacy: the same rows in the record layout, with string ids and values on every row and the
+  indexes the tables had before 0004_compact_keys.
+
+Both copies are vacuumed, so neither carries free pages. The report has the bytes of each fact
+table and of its indexes (from `dbstat`, or the file size where SQLite lacks it), and the warm
+p50/p95 of the joins in `JOIN_QUERIES` on each copy, with whether both returned the same rows.
+
+    python -m scripts.layout_benchmark --sizes 10k,1m --output layout-report.json
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from sqlalchemy import create_engine, text
+from app.database import create_read_engine
+from app.encoding import CHARGEBACK_STATUS, DECODE_SQL, ENCODE_SQL, RECORDS
+from scripts.benchmark import _git_commit, _summary, build_database, parse_size
+from scripts.seed_data import DEFAULT_SEED
+
+DEFAULT_SIZES = "10k,1m"
+
+LAYOUTS = ("legacy", "compact")
+FACT_TABLES = {
+    "legacy": ("merchants", "transactions", "chargebacks"),
+    "compact": ("merchants", "transactions", "chargebacks", "dictionary", "reason_codes"),
+}
+
+# The secondary indexes of the fact tables before 0004_compact_keys.
+LEGACY_INDEXES = [
+    "CREATE INDEX ix_transactions_merchant_id ON transactions (merchant_id)",
+    "CREATE INDEX ix_transactions_customer_id ON transactions (customer_id)",
+    "CREATE INDEX ix_transactions_card_bin ON transactions (card_bin)",
+    "CREATE INDEX ix_transactions_timestamp ON transactions (timestamp)",
+    "CREATE INDEX ix_transactions_amount_usd ON transactions (amount_usd)",
+    "CREATE INDEX ix_transactions_country_id ON transactions (country, id)",
+    "CREATE INDEX ix_transactions_product_category_id ON transactions (product_category, id)",
+    "CREATE INDEX ix_transactions_payment_method_id ON transactions (payment_method, id)",
+    "CREATE INDEX ix_transactions_amount_usd_id_merchant_id ON transactions (amount_usd, id, merchant_id)",
+    "CREATE INDEX ix_chargebacks_transaction_id ON chargebacks (transaction_id)",
+    "CREATE INDEX ix_chargebacks_chargeback_date ON chargebacks (chargeback_date)",
+    "CREATE INDEX ix_chargebacks_reason_code ON chargebacks (reason_code)",
+    "CREATE INDEX ix_chargebacks_status ON chargebacks (status)",
+    "CREATE INDEX ix_chargebacks_amount_usd ON chargebacks (amount_usd)",
+    "CREATE INDEX ix_chargebacks_reason_code_reason_description_amount_status"
+    " ON chargebacks (reason_code, reason_description, amount, status)",
+]
+
+COPY_LEGACY_SQL = [
+    "INSERT INTO merchants SELECT external_id, name, country FROM compact.merchants ORDER BY id",
+    f"""
+    INSERT INTO transactions
+    SELECT t.external_id, t.timestamp, t.amount, {DECODE_SQL.format("t.currency_id")}, m.external_id, t.customer_id,
+        {DECODE_SQL.format("t.payment_method_id")}, {DECODE_SQL.format("t.country_id")},
+        {DECODE_SQL.format("t.product_category_id")}, {DECODE_SQL.format("t.status_id")}, t.card_bin, t.amount_usd
+    FROM compact.transactions t JOIN compact.merchants m ON m.id = t.merchant_id
+    ORDER BY t.id
+    """,
+    f"""
+    INSERT INTO chargebacks
+    SELECT c.external_id, t.external_id, c.chargeback_date, c.reason_code, r.description,
+        {DECODE_SQL.format("c.status_id")}, c.amount, c.amount_usd
+    FROM compact.chargebacks c
+    JOIN compact.transactions t ON t.id = c.transaction_id
+    JOIN compact.reason_codes r ON r.code = c.reason_code
+    ORDER BY c.id
+    """,
+]
+
+WON, LOST = (ENCODE_SQL.format(kind=CHARGEBACK_STATUS, value=f"'{status}'") for status in ("won", "lost"))
+
+# name -> statement per layout; both statements return the same rows.
+JOIN_QUERIES = {
+    "chargebacks_per_merchant": {
+        "legacy": """
+            SELECT m.id, COUNT(*), ROUND(SUM(c.amount), 2)
+            FROM chargebacks c JOIN transactions t ON t.id = c.transaction_id JOIN merchants m ON m.id = t.merchant_id
+            GROUP BY m.id ORDER BY m.id
+        """,
+        "compact": """
+            SELECT m.external_id, COUNT(*), ROUND(SUM(c.amount), 2)
+            FROM chargebacks c JOIN transactions t ON t.id = c.transaction_id JOIN merchants m ON m.id = t.merchant_id
+            GROUP BY m.id ORDER BY m.external_id
+        """,
+    },
+    "chargebacks_per_country": {
+        "legacy": """
+            SELECT t.country, COUNT(*), COUNT(c.id)
+            FROM transactions t LEFT JOIN chargebacks c ON c.transaction_id = t.id
+            GROUP BY t.country ORDER BY 1
+        """,
+        "compact": f"""
+            SELECT {DECODE_SQL.format("t.country_id")}, COUNT(*), COUNT(c.id)
+            FROM transactions t LEFT JOIN chargebacks c ON c.transaction_id = t.id
+            GROUP BY t.country_id ORDER BY 1
+        """,
+    },
+    "win_rate_per_reason": {
+        "legacy": """
+            SELECT reason_code, reason_description, SUM(status = 'won'), SUM(status = 'lost')
+            FROM chargebacks
+            GROUP BY reason_code, reason_description ORDER BY reason_code
+        """,
+        "compact": f"""
+            SELECT s.reason_code, r.description, s.won, s.lost
+            FROM (
+                SELECT reason_code, SUM(status_id = {WON}) AS won, SUM(status_id = {LOST}) AS lost
+                FROM chargebacks GROUP BY reason_code
+            ) s
+            JOIN reason_codes r ON r.code = s.reason_code
+            ORDER BY s.reason_code
+        """,
+    },
+    "repeat_customers": {
+        layout: """
+            SELECT t.customer_id, COUNT(*), COUNT(DISTINCT t.merchant_id)
+            FROM chargebacks c JOIN transactions t ON t.id = c.transaction_id
+            GROUP BY t.customer_id HAVING COUNT(*) >= 3 ORDER BY t.customer_id
+        """
+        for layout in LAYOUTS
+    },
+}
+
+
+def build_layouts(path: Path, rebuild: bool = False) -> dict:
+    """Vacuumed copies of the generated database at `path` in each layout, built unless they exist."""
+    copies = {layout: path.with_name(f"{path.stem}-{layout}.db") for layout in LAYOUTS}
+    if all(copy.exists() for copy in copies.values()) and not rebuild:
+        return copies
+    for copy in copies.values():
+        copy.unlink(missing_ok=True)
+
+    with sqlite3.connect(path) as conn:
+        conn.execute("VACUUM INTO ?", (str(copies["compact"]),))
+
+    legacy = create_engine(f"sqlite:///{copies['legacy']}")
+    RECORDS.create_all(bind=legacy)
+    with legacy.begin() as conn:
+        for table in ("transactions", "chargebacks"):
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN amount_usd FLOAT")
+        conn.exec_driver_sql("ATTACH DATABASE ? AS compact", (str(copies["compact"]),))
+        for statement in COPY_LEGACY_SQL:
+            conn.exec_driver_sql(statement)
+        for statement in LEGACY_INDEXES:
+            conn.exec_driver_sql(statement)
+    legacy.dispose()
+    with sqlite3.connect(copies["legacy"]) as conn:
+        conn.execute("VACUUM")
+    return copies
+
+
+def table_bytes(path: Path, tables: tuple) -> dict:
+    """Bytes of each table and of its indexes, and their total."""
+    with sqlite3.connect(path) as conn:
+        try:
+            pages = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+        except sqlite3.OperationalError:
+            return {"tables": {}, "total": path.stat().st_size}
+        owners = conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')").fetchall()
+    sizes = {table: {"data": 0, "indexes": 0} for table in tables}
+    for name, table in owners:
+        if table in sizes:
+            sizes[table]["data" if name == table else "indexes"] += pages.get(name, 0)
+    return {"tables": sizes, "total": sum(size["data"] + size["indexes"] for size in sizes.values())}
+
+
+def benchmark_joins(copies: dict, runs: int, progress=None) -> dict:
+    engines = {layout: create_read_engine(f"sqlite:///{copies[layout]}") for layout in LAYOUTS}
+    results = {}
+    try:
+        for number, (name, statements) in enumerate(JOIN_QUERIES.items(), 1):
+            if progress:
+                progress(number, len(JOIN_QUERIES), name)
+            rows, timings = {}, {}
+            for layout, engine in engines.items():
+                statement = text(statements[layout])
+                with engine.connect() as conn:
+                    rows[layout] = [tuple(row) for row in conn.execute(statement)]
+                    samples = []
+                    for _ in range(runs):
+                        started = time.perf_counter()
+                        conn.execute(statement).fetchall()
+                        samples.append(time.perf_counter() - started)
+                timings[layout] = _summary(samples)
+            results[name] = {"rows": len(rows["compact"]), "identical": rows["legacy"] == rows["compact"], **timings}
+    finally:
+        for engine in engines.values():
+            engine.dispose()
+    return results
+
+
+def run_layout_benchmark(
+    sizes: list, data_dir: Path, seed: int = DEFAULT_SEED, runs: int = 20, workers: int = 1,
+    rebuild: bool = False, progress=None,
+) -> dict:
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "seed": seed,
+        "sizes": {},
+    }
+    for label in sizes:
+        path = data_dir / f"transactions-{label}-seed{seed}.db"
+        build_database(path, parse_size(label), seed, workers, rebuild)
+        copies = build_layouts(path, rebuild)
+        report["sizes"][label] = {
+            "bytes": {layout: table_bytes(copies[layout], FACT_TABLES[layout]) for layout in LAYOUTS},
+            "database_bytes": {layout: copies[layout].stat().st_size for layout in LAYOUTS},
+            "joins": benchmark_joins(copies, runs, progress),
+        }
+    return report
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the size and join speed of the compact and record layouts")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated transaction counts, e.g. 10k,1m")
+    parser.add_argument("--data-dir", type=Path, default=Path(".benchmarks"), help="Where generated databases are kept")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="RNG seed for the generated data")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Generator processes")
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs per join and layout")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate databases that already exist")
+    parser.add_argument("--output", type=Path, default=Path("layout-report.json"), help="JSON report path")
+    args = parser.parse_args(argv)
+
+    def report_progress(number: int, total: int, name: str) -> None:
+        print(f"\r[{number}/{total}] {name:<40}", end="", file=sys.stderr)
+
+    report = run_layout_benchmark(
+        [label.strip() for label in args.sizes.split(",") if label.strip()], args.data_dir, seed=args.seed,
+        runs=args.runs, workers=args.workers, rebuild=args.rebuild, progress=report_progress,
+    )
+    print(file=sys.stderr)
+    args.output.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+    for label, size in report["sizes"].items():
+        legacy, compact = size["bytes"]["legacy"]["total"], size["bytes"]["compact"]["total"]
+        print(f"{label}: fact tables and indexes {legacy / 2**20:,.1f} MB -> {compact / 2**20:,.1f} MB")
+        for name, result in size["joins"].items():
+            flag = "" if result["identical"] else "  !"
+            print(f"  {result['legacy']['p50_ms']:>9.2f} -> {result['compact']['p50_ms']:>9.2f} ms  {name}{flag}")
+    print(f"report written to {args.output} (warm p50 legacy -> compact; ! = the layouts returned different rows)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
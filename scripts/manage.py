@@ -0,0 +1,99 @@
+import argparse
+from datetime import date
+from app.database import engine, create_tables
+from app.constants import PARTITION_DIR
+from app.fx import recompute_amount_usd, set_fx_rate
+from app.partitions import archive_month, attach_month, detach_month, list_partitions
+from app.rollups import rebuild_all
+from app.sketches import rebuild_stale_sketches
+
+
+def _print_counts(counts: dict) -> None:
+    for name, rows in counts.items():
+        print(f"{name}: {rows} rows")
+
+
+def _rebuild_rollups(args: argparse.Namespace) -> None:
+    with engine.begin() as conn:
+        _print_counts(rebuild_all(conn))
+
+
+def _recompute_usd(args: argparse.Namespace) -> None:
+    with engine.begin() as conn:
+        counts = recompute_amount_usd(conn, currency=args.currency, since=args.since)
+        counts["sketch_days"] = rebuild_stale_sketches(conn)
+        _print_counts(counts)
+
+
+def _set_fx_rate(args: argparse.Namespace) -> None:
+    with engine.begin() as conn:
+        counts = set_fx_rate(conn, args.currency, args.effective_date, args.units_per_usd)
+        counts["sketch_days"] = rebuild_stale_sketches(conn)
+        _print_counts(counts)
+
+
+def _print_partition(partition: dict) -> None:
+    print(
+        f"{partition['month']}: {partition['status']}, {partition['transaction_count']} transactions, "
+        f"{partition['chargeback_count']} chargebacks" + (f", {partition['path']}" if partition["path"] else "")
+    )
+
+
+def _archive_month(args: argparse.Namespace) -> None:
+    _print_partition(archive_month(engine, args.month))
+
+
+def _detach_month(args: argparse.Namespace) -> None:
+    print(detach_month(engine, args.month, args.directory))
+
+
+def _attach_month(args: argparse.Namespace) -> None:
+    _print_partition(attach_month(engine, args.month))
+
+
+def _list_partitions(args: argparse.Namespace) -> None:
+    for partition in list_partitions(engine):
+        _print_partition(partition)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="MonteVerde maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-rollups", help="Recompute every rollup table from the fact tables")
+    rebuild.set_defaults(handler=_rebuild_rollups)
+
+    recompute = commands.add_parser("recompute-usd", help="Recompute amount_usd from the fx_rates table")
+    recompute.add_argument("--currency", help="Only rows in this currency")
+    recompute.add_argument("--since", type=date.fromisoformat, help="Only rows dated on or after YYYY-MM-DD")
+    recompute.set_defaults(handler=_recompute_usd)
+
+    fx_rate = commands.add_parser("set-fx-rate", help="Record a rate and recompute the rows it applies to")
+    fx_rate.add_argument("currency", help="ISO currency code, e.g. MXN")
+    fx_rate.add_argument("effective_date", type=date.fromisoformat, help="First day the rate applies (YYYY-MM-DD)")
+    fx_rate.add_argument("units_per_usd", type=float, help="Units of the currency per 1 USD")
+    fx_rate.set_defaults(handler=_set_fx_rate)
+
+    archive = commands.add_parser("archive-month", help="Move a closed month into its read-only partition")
+    archive.add_argument("month", help="YYYY-MM")
+    archive.set_defaults(handler=_archive_month)
+
+    detach = commands.add_parser("detach-month", help="Write an archived month to its own file and detach it")
+    detach.add_argument("month", help="YYYY-MM")
+    detach.add_argument("--directory", default=PARTITION_DIR, help=f"Where to write the file (default: {PARTITION_DIR})")
+    detach.set_defaults(handler=_detach_month)
+
+    attach = commands.add_parser("attach-month", help="Load a detached month back from its file")
+    attach.add_argument("month", help="YYYY-MM")
+    attach.set_defaults(handler=_attach_month)
+
+    partitions = commands.add_parser("list-partitions", help="Show archived months")
+    partitions.set_defaults(handler=_list_partitions)
+
+    args = parser.parse_args(argv)
+    create_tables()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
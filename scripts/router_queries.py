@@ -0,0 +1,113 @@
+"""
+Capture the SQL the analytics routers issue, for the benchmark suite and the index advisor.
+
+Each request in `ROUTER_REQUESTS` is sent through the real FastAPI app, with the read engine
+pointed at the target database and the response cache bypassed. Every statement executed while
+serving it is recorded with its bound parameters. When a response advertises a next-page cursor,
+that page is requested too, so the keyset "resume" statements are covered as well as first pages.
+Replaying a `CapturedQuery` runs exactly what the router ran.
+"""
+import hashlib
+from dataclasses import dataclass
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+from app.pagination import CURSOR_HEADER
+
+ROUTER_REQUESTS = [
+    "/api/merchants/chargeback-ratio?limit=20",
+    "/api/reason-codes?limit=20",
+    "/api/reason-codes?start=2024-11-25&end=2024-12-02&limit=20",
+    "/api/win-rate?limit=20",
+    "/api/segments/high-risk?dimension=country&threshold=0&limit=2",
+    "/api/segments/high-risk?dimension=category&threshold=0&limit=3",
+    "/api/segments/high-risk?dimension=payment_method&threshold=0&limit=2",
+    "/api/merchants/chargeback-ratio?start=2024-11-01&end=2024-12-01&limit=20",
+    "/api/trends?granularity=daily&limit=30",
+    "/api/trends?granularity=weekly&start=2024-11-13&end=2024-12-20",
+    "/api/trends?granularity=monthly&reason_code=10.4&fill_gaps=true",
+    "/api/alerts",
+    "/api/alerts?as_of=2024-12-20&baseline_windows=4",
+    "/api/fraud-patterns?limit=20",
+    "/api/recommendations?limit=20",
+    "/api/dashboard?limit=20",
+    "/api/export/chargebacks?start=2024-11-25&end=2024-12-02",
+]
+
+NEXT_PAGE = " (next page)"
+
+
+@dataclass(frozen=True)
+class CapturedQuery:
+    request: str
+    statement: str
+    parameters: tuple
+    occurrence: int = 0
+
+    @property
+    def id(self) -> str:
+        """Stable across runs (alert signals execute concurrently, so capture order is not)."""
+        digest = hashlib.sha1(self.statement.encode("utf-8")).hexdigest()[:10]
+        return f"{self.request} [{digest}{f'#{self.occurrence}' if self.occurrence else ''}]"
+
+    def execute(self, conn: Connection) -> list:
+        return conn.exec_driver_sql(self.statement, self.parameters).fetchall()
+
+    def explain(self, conn: Connection) -> list:
+        """`EXPLAIN QUERY PLAN` detail lines, indented by depth."""
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {self.statement}", self.parameters).fetchall()
+        depth = {0: -1}
+        lines = []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append("  " * depth[node] + detail)
+        return lines
+
+
+def plan_warnings(plan: list) -> list:
+    """Lines of an `explain()` plan that read a whole table without an index or sort in a temp B-tree."""
+    warnings = []
+    for line in map(str.strip, plan):
+        full_scan = line.startswith("SCAN ") and " USING " not in line and not line.startswith(("SCAN (", "SCAN CONSTANT"))
+        if full_scan or line.startswith("USE TEMP B-TREE"):
+            warnings.append(line)
+    return warnings
+
+
+def capture_router_queries(engine: Engine, requests: list = ROUTER_REQUESTS, follow_cursor: bool = True) -> list:
+    """Serve `requests` from `engine` and return every statement the routers executed, in order."""
+    from fastapi.testclient import TestClient
+    from app.cache import bump_data_version
+    from app.columnar import get_analytics_engine
+    from app.database import get_read_engine
+    from app.main import app
+
+    captured, current = [], {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("PRAGMA", "BEGIN")):
+            return
+        request = current["request"]
+        occurrence = sum(1 for query in captured if query.request == request and query.statement == statement)
+        captured.append(CapturedQuery(request, statement, tuple(parameters or ()), occurrence))
+
+    saved = dict(app.dependency_overrides)
+    app.dependency_overrides[get_read_engine] = lambda: engine
+    app.dependency_overrides[get_analytics_engine] = lambda: "sql"
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        client = TestClient(app)
+        for request in requests:
+            current["request"] = request
+            bump_data_version()
+            response = client.get(request)
+            response.raise_for_status()
+            cursor = response.headers.get(CURSOR_HEADER)
+            if follow_cursor and cursor:
+                current["request"] = request + NEXT_PAGE
+                bump_data_version()
+                client.get(f"{request}&cursor={cursor}").raise_for_status()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(saved)
+    return captured
@@ -1,11 +1,29 @@
-import uuid
+"""
+Synthetic data generator with engineered fraud patterns.
+
+Volume scales linearly with `scale` (1.0 ≈ 5,900 transactions, 1,700 ≈ 10M). Transactions are
+generated in fixed-size shards, each driven by its own RNG stream derived from `(seed, merchant,
+shard)`, so the output is identical for a given seed no matter how many worker processes produce
+it. Rows are written in chunks with Core `executemany` inserts and only a bounded number of shards
+is in flight at a time, so memory stays flat as the scale grows.
+
+    python -m scripts.seed_data --scale 1700 --seed 7 --workers 4
+"""
+import argparse
 import random
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Callable, Iterator, Optional
 from faker import Faker
+from sqlalchemy import text
 from sqlalchemy.orm import Session
+from app.encoding import CHARGEBACK_RECORD, TRANSACTION_RECORD, insert_records, surrogate_keys
 from app.models import Merchant, Transaction, Chargeback
-
-fake = Faker()
+from app.rollups import drop_triggers, install_triggers, rebuild_all
 
 COUNTRIES = ["MX", "CO", "CL"]
 CURRENCIES = {"MX": "MXN", "CO": "COP", "CL": "CLP"}
@@ -32,159 +50,300 @@ END_DATE = datetime(2024, 12, 31)
 BLACK_FRIDAY_START = datetime(2024, 11, 25)
 BLACK_FRIDAY_END = datetime(2024, 12, 1)
 
-REPEAT_OFFENDER_IDS = [str(uuid.uuid4()) for _ in range(5)]
 HIGH_CB_BIN_PATTERNS = ["411111", "524099", "601100"]
+REPEAT_OFFENDER_COUNT = 5
+REPEAT_OFFENDER_MERCHANTS = 3
+BIN_BURST_SIZE = 3
+
+PROBLEM_MERCHANT_TXS = 700
+CLEAN_MERCHANT_TXS = 450
+CLEAN_MERCHANT_COUNT = 10
+
+PROBLEM_CB_RATE = 0.08
+CLEAN_CB_RATE = 0.025
+BLACK_FRIDAY_CB_RATE = 0.12
+REPEAT_OFFENDER_CB_RATE = 0.05
+REPEAT_OFFENDER_TX_RATE = 0.04
+HOT_BIN_TX_RATE = 0.06
+BIN_POOL_SIZE = 512
+
+DEFAULT_SEED = 20241001
+SHARD_SIZE = 20_000
+CHUNK_SIZE = 10_000
+
+# Shards are generated in the record layout (string ids and values) and encoded as they are inserted.
+TX_COLUMNS = [c.name for c in TRANSACTION_RECORD.columns]
+CB_COLUMNS = [c.name for c in CHARGEBACK_RECORD.columns]
+
+# Surrogate keys of the transactions inserted after `after`; read by rowid, so it needs no index.
+LAST_TRANSACTION_KEY_SQL = text("SELECT COALESCE(MAX(id), 0) FROM transactions")
+NEW_TRANSACTION_KEYS_SQL = text("SELECT external_id, id FROM transactions WHERE id > :after")
+
+
+@dataclass(frozen=True)
+class SeedPlan:
+    """Everything a worker needs to generate a shard; derived deterministically from the seed."""
+    seed: int
+    merchants: tuple  # (id, country, is_problem)
+    repeat_offender_ids: tuple
+    bin_anchors: tuple  # (card_bin, anchor timestamp, chargeback delay in days)
+    bin_pool: tuple
+
+
+@dataclass(frozen=True)
+class Shard:
+    merchant_index: int
+    shard_index: int
+    count: int
 
 
-def _random_date(start: datetime, end: datetime) -> datetime:
+def _rng_uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _random_date(rng: random.Random, start: datetime, end: datetime) -> datetime:
     delta = end - start
-    return start + timedelta(seconds=random.randint(0, int(delta.total_seconds())))
+    return start + timedelta(seconds=rng.randint(0, int(delta.total_seconds())))
 
 
-def _amount_for_currency(currency: str) -> float:
+def _amount_for_currency(rng: random.Random, currency: str) -> float:
     ranges = {"MXN": (200, 25000), "COP": (50000, 2000000), "CLP": (5000, 500000)}
     lo, hi = ranges[currency]
-    return round(random.uniform(lo, hi), 2)
+    return round(rng.uniform(lo, hi), 2)
 
 
-def run_seed(db: Session) -> dict:
-    db.query(Chargeback).delete()
-    db.query(Transaction).delete()
-    db.query(Merchant).delete()
-    db.commit()
+def build_plan(seed: int = DEFAULT_SEED) -> tuple[SeedPlan, list[dict]]:
+    rng = random.Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
 
-    merchants = _create_merchants(db)
-    transactions = _create_transactions(db, merchants)
-    chargebacks = _create_chargebacks(db, transactions, merchants)
+    merchants = [
+        {"id": _rng_uuid(rng), "name": "TechZone Express MX", "country": "MX"},
+        {"id": _rng_uuid(rng), "name": "Moda Rapida CO", "country": "CO"},
+    ]
+    for i in range(CLEAN_MERCHANT_COUNT):
+        country = COUNTRIES[i % 3]
+        merchants.append({"id": _rng_uuid(rng), "name": f"{fake.company()} {country}", "country": country})
+
+    bin_anchors = tuple(
+        (card_bin, _random_date(rng, START_DATE, END_DATE - timedelta(days=2)), rng.randint(1, 45))
+        for card_bin in HIGH_CB_BIN_PATTERNS
+    )
+    plan = SeedPlan(
+        seed=seed,
+        merchants=tuple((m["id"], m["country"], i < 2) for i, m in enumerate(merchants)),
+        repeat_offender_ids=tuple(_rng_uuid(rng) for _ in range(REPEAT_OFFENDER_COUNT)),
+        bin_anchors=bin_anchors,
+        bin_pool=tuple(fake.credit_card_number()[:6] for _ in range(BIN_POOL_SIZE)),
+    )
+    return plan, merchants
+
+
+def plan_shards(plan: SeedPlan, scale: float, shard_size: int = SHARD_SIZE) -> list[Shard]:
+    shards = []
+    for index, (_, _, is_problem) in enumerate(plan.merchants):
+        total = max(1, round((PROBLEM_MERCHANT_TXS if is_problem else CLEAN_MERCHANT_TXS) * scale))
+        for shard_index, start in enumerate(range(0, total, shard_size)):
+            shards.append(Shard(index, shard_index, min(shard_size, total - start)))
+    return shards
+
+
+def _planted(plan: SeedPlan, merchant_index: int) -> list[tuple]:
+    """
+    Transactions forced into the first shard of a merchant so the engineered patterns exist at
+    any scale: each repeat offender disputes at three different merchants, and each hot BIN gets a
+    burst of chargebacks inside a 48h window.
+    """
+    planted = []
+    n = len(plan.merchants)
+    for offender_index, customer_id in enumerate(plan.repeat_offender_ids):
+        for j in range(REPEAT_OFFENDER_MERCHANTS):
+            if (offender_index + j) % n == merchant_index:
+                planted.append(("repeat", customer_id, None, None))
+    for bin_index, (card_bin, anchor, delay_days) in enumerate(plan.bin_anchors):
+        for j in range(BIN_BURST_SIZE):
+            if (bin_index + j) % n == merchant_index:
+                planted.append(("bin", None, card_bin, (anchor + timedelta(hours=12 * j), delay_days)))
+    return planted
+
+
+def generate_shard(plan: SeedPlan, shard: Shard) -> tuple[list[tuple], list[tuple]]:
+    """Generate one shard of transaction and chargeback rows (column order: TX_COLUMNS / CB_COLUMNS)."""
+    rng = random.Random(f"{plan.seed}:{shard.merchant_index}:{shard.shard_index}")
+    merchant_id, country, is_problem = plan.merchants[shard.merchant_index]
+    currency = CURRENCIES[country]
+    base_rate = PROBLEM_CB_RATE if is_problem else CLEAN_CB_RATE
+    anchors = {card_bin: (anchor, delay) for card_bin, anchor, delay in plan.bin_anchors}
+    window = timedelta(hours=48)
+    planted = _planted(plan, shard.merchant_index) if shard.shard_index == 0 else []
+
+    txs, cbs = [], []
+    for i in range(shard.count):
+        forced = planted[i] if i < len(planted) else None
+        ts = _random_date(rng, START_DATE, END_DATE)
+        if forced and forced[0] == "repeat":
+            customer_id = forced[1]
+        elif rng.random() < REPEAT_OFFENDER_TX_RATE:
+            customer_id = rng.choice(plan.repeat_offender_ids)
+        else:
+            customer_id = _rng_uuid(rng)
+        payment_method = "credit_card" if forced else rng.choices(PAYMENT_METHODS, PAYMENT_METHOD_WEIGHTS)[0]
+        if forced and forced[0] == "bin":
+            card_bin = forced[2]
+            ts = forced[3][0]
+        elif payment_method == "credit_card" and rng.random() < HOT_BIN_TX_RATE:
+            card_bin = rng.choice(HIGH_CB_BIN_PATTERNS)
+        else:
+            card_bin = rng.choice(plan.bin_pool)
+        status = "approved" if forced else rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+        tx_id = _rng_uuid(rng)
+        amount = _amount_for_currency(rng, currency)
+        txs.append((
+            tx_id, ts, amount, currency, merchant_id, customer_id, payment_method,
+            country, rng.choice(CATEGORIES), status, card_bin,
+        ))
+
+        if status != "approved":
+            continue
+        cb_date = None
+        anchor = anchors.get(card_bin)
+        if anchor and abs(ts - anchor[0]) <= window:
+            cb_date = ts + timedelta(days=anchor[1])
+        elif (
+            forced
+            or rng.random() < base_rate
+            or (BLACK_FRIDAY_START <= ts <= BLACK_FRIDAY_END and rng.random() < BLACK_FRIDAY_CB_RATE)
+            or (customer_id in plan.repeat_offender_ids and rng.random() < REPEAT_OFFENDER_CB_RATE)
+        ):
+            cb_date = ts + timedelta(days=rng.randint(1, 45))
+        if cb_date is None:
+            continue
+        reason_code = rng.choices(REASON_CODE_LIST, REASON_CODE_WEIGHTS)[0]
+        cbs.append((
+            _rng_uuid(rng), tx_id, cb_date, reason_code, REASON_CODES[reason_code],
+            rng.choice(CB_STATUSES), amount,
+        ))
+    return txs, cbs
+
+
+def iter_shards(plan: SeedPlan, shards: list[Shard], workers: int = 1) -> Iterator[tuple[list[tuple], list[tuple]]]:
+    """Yield generated shards, keeping at most `2 * workers` of them in memory."""
+    if workers <= 1:
+        for shard in shards:
+            yield generate_shard(plan, shard)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for shard in shards:
+            pending.append(pool.submit(generate_shard, plan, shard))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def _insert_chunks(
+    db: Session, table: str, columns: list[str], rows: list[tuple], chunk_size: int, parents: dict,
+) -> None:
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        insert_records(db.connection(), table, [dict(zip(columns, row)) for row in chunk], parents=parents)
+
+
+def run_seed(
+    db: Session,
+    scale: float = 1.0,
+    seed: int = DEFAULT_SEED,
+    workers: int = 1,
+    chunk_size: int = CHUNK_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> dict:
+    """
+    Wipe the fact tables and regenerate them at `scale`. Rollup triggers and secondary indexes are
+    dropped for the load; rollups and `amount_usd` are recomputed once and indexes rebuilt in one
+    sorted pass at the end, which is much cheaper than maintaining both row by row. Chargebacks are
+    resolved to the surrogate keys of their shard's transactions, so no lookup needs an index.
+    """
+    plan, merchants = build_plan(seed)
+    shards = plan_shards(plan, scale)
+    total = sum(s.count for s in shards)
+    indexes = [*Transaction.__table__.indexes, *Chargeback.__table__.indexes]
+
+    conn = db.connection()
+    drop_triggers(conn)
+    for index in indexes:
+        index.drop(conn, checkfirst=True)
+    try:
+        conn.execute(Chargeback.__table__.delete())
+        conn.execute(Transaction.__table__.delete())
+        conn.execute(Merchant.__table__.delete())
+        insert_records(conn, "merchants", merchants)
+        merchant_keys = surrogate_keys(conn, Merchant, (m["id"] for m in merchants))
+        db.commit()
+
+        tx_count = cb_count = 0
+        for txs, cbs in iter_shards(plan, shards, workers):
+            after = db.connection().execute(LAST_TRANSACTION_KEY_SQL).scalar()
+            _insert_chunks(db, "transactions", TX_COLUMNS, txs, chunk_size, merchant_keys)
+            transaction_keys = dict(db.connection().execute(NEW_TRANSACTION_KEYS_SQL, {"after": after}).all())
+            _insert_chunks(db, "chargebacks", CB_COLUMNS, cbs, chunk_size, transaction_keys)
+            db.commit()
+            tx_count += len(txs)
+            cb_count += len(cbs)
+            if progress:
+                progress(tx_count, total)
+    finally:
+        conn = db.connection()
+        rebuild_all(conn)
+        for index in indexes:
+            index.create(conn, checkfirst=True)
+        install_triggers(conn)
+        db.commit()
 
     return {
         "merchants": len(merchants),
-        "transactions": len(transactions),
-        "chargebacks": len(chargebacks),
+        "transactions": tx_count,
+        "chargebacks": cb_count,
     }
 
 
-def _create_merchants(db: Session) -> list[Merchant]:
-    merchants = []
+def main(argv: list[str] | None = None) -> None:
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+    from app.database import Base, SQLALCHEMY_DATABASE_URL
 
-    problem_merchants = [
-        Merchant(id=str(uuid.uuid4()), name="TechZone Express MX", country="MX"),
-        Merchant(id=str(uuid.uuid4()), name="Moda Rapida CO", country="CO"),
-    ]
+    parser = argparse.ArgumentParser(description="Generate synthetic MonteVerde data")
+    parser.add_argument("--scale", type=float, default=1.0, help="Volume multiplier (1.0 ≈ 5,900 transactions)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="RNG seed; same seed gives the same data")
+    parser.add_argument("--workers", type=int, default=1, help="Generator processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows per executemany batch")
+    parser.add_argument("--database", default=SQLALCHEMY_DATABASE_URL, help="SQLAlchemy database URL")
+    args = parser.parse_args(argv)
 
-    clean_merchants = [
-        Merchant(id=str(uuid.uuid4()), name=f"{fake.company()} {'MX' if i % 3 == 0 else 'CO' if i % 3 == 1 else 'CL'}", country=["MX", "CO", "CL"][i % 3])
-        for i in range(10)
-    ]
+    engine = create_engine(args.database)
 
-    all_merchants = problem_merchants + clean_merchants
-    db.add_all(all_merchants)
-    db.commit()
-    merchants.extend(all_merchants)
-    return merchants
-
-
-def _create_transactions(db: Session, merchants: list[Merchant]) -> list[Transaction]:
-    transactions = []
-    problem_merchant_ids = {merchants[0].id, merchants[1].id}
-
-    for merchant in merchants:
-        count = 700 if merchant.id in problem_merchant_ids else 450
-        for _ in range(count):
-            country = merchant.country
-            currency = CURRENCIES[country]
-            ts = _random_date(START_DATE, END_DATE)
-            customer_id = random.choice(REPEAT_OFFENDER_IDS) if random.random() < 0.04 else str(uuid.uuid4())
-            payment_method = random.choices(PAYMENT_METHODS, PAYMENT_METHOD_WEIGHTS)[0]
-            card_bin = (
-                random.choice(HIGH_CB_BIN_PATTERNS)
-                if payment_method == "credit_card" and random.random() < 0.06
-                else fake.credit_card_number()[:6]
-            )
-            tx = Transaction(
-                id=str(uuid.uuid4()),
-                timestamp=ts,
-                amount=_amount_for_currency(currency),
-                currency=currency,
-                merchant_id=merchant.id,
-                customer_id=customer_id,
-                payment_method=payment_method,
-                country=country,
-                product_category=random.choice(CATEGORIES),
-                status=random.choices(STATUSES, STATUS_WEIGHTS)[0],
-                card_bin=card_bin,
-            )
-            transactions.append(tx)
-
-    db.add_all(transactions)
-    db.commit()
-    return transactions
-
-
-def _create_chargebacks(db: Session, transactions: list[Transaction], merchants: list[Merchant]) -> list[Chargeback]:
-    chargebacks = []
-    problem_merchant_ids = {merchants[0].id, merchants[1].id}
-    approved_txs = [t for t in transactions if t.status == "approved"]
-
-    problem_txs = [t for t in approved_txs if t.merchant_id in problem_merchant_ids]
-    clean_txs = [t for t in approved_txs if t.merchant_id not in problem_merchant_ids]
-
-    problem_cb_count = int(len(problem_txs) * 0.08)
-    clean_cb_count = int(len(clean_txs) * 0.025)
-
-    problem_sample = random.sample(problem_txs, min(problem_cb_count, len(problem_txs)))
-    clean_sample = random.sample(clean_txs, min(clean_cb_count, len(clean_txs)))
-
-    selected_txs = problem_sample + clean_sample
-
-    black_friday_txs = [
-        t for t in approved_txs
-        if BLACK_FRIDAY_START <= t.timestamp <= BLACK_FRIDAY_END
-           and t not in selected_txs
-    ]
-    bf_extra = random.sample(black_friday_txs, min(int(len(black_friday_txs) * 0.12), len(black_friday_txs)))
-    selected_txs = list(set(selected_txs + bf_extra))
+    @event.listens_for(engine, "connect")
+    def _bulk_load_pragmas(dbapi_conn, _):
+        dbapi_conn.execute("PRAGMA journal_mode=WAL")
+        dbapi_conn.execute("PRAGMA synchronous=NORMAL")
+        dbapi_conn.execute("PRAGMA cache_size=-524288")
+        dbapi_conn.execute("PRAGMA temp_store=MEMORY")
 
-    repeat_offender_txs = [
-        t for t in approved_txs
-        if t.customer_id in set(REPEAT_OFFENDER_IDS) and t not in selected_txs
-    ]
-    repeat_sample = random.sample(repeat_offender_txs, min(len(repeat_offender_txs), 5 * 3))
-    selected_txs = list(set(selected_txs + repeat_sample))
-
-    bin_txs_map: dict[str, list[Transaction]] = {}
-    for t in approved_txs:
-        if t.card_bin in HIGH_CB_BIN_PATTERNS:
-            bin_txs_map.setdefault(t.card_bin, []).append(t)
-
-    for bin_group in bin_txs_map.values():
-        if len(bin_group) >= 3:
-            anchor_time = _random_date(START_DATE, END_DATE - timedelta(days=2))
-            anchored = [
-                t for t in bin_group
-                if abs((t.timestamp - anchor_time).total_seconds()) <= 48 * 3600
-            ]
-            if len(anchored) < 3:
-                anchored = bin_group[:3]
-            for t in anchored:
-                if t not in selected_txs:
-                    selected_txs.append(t)
-
-    reason_code_keys = list(REASON_CODES.keys())
-    for tx in selected_txs:
-        reason_code = random.choices(reason_code_keys, REASON_CODE_WEIGHTS)[0]
-        cb_date = tx.timestamp + timedelta(days=random.randint(1, 45))
-        cb = Chargeback(
-            id=str(uuid.uuid4()),
-            transaction_id=tx.id,
-            chargeback_date=cb_date,
-            reason_code=reason_code,
-            reason_description=REASON_CODES[reason_code],
-            status=random.choice(CB_STATUSES),
-            amount=tx.amount,
-        )
-        chargebacks.append(cb)
-
-    db.add_all(chargebacks)
-    db.commit()
-    return chargebacks
+    import app.models  # noqa: F401  registers tables and rollup triggers
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+
+    def report(done: int, total: int) -> None:
+        elapsed = time.perf_counter() - started
+        print(f"\r{done:,}/{total:,} transactions ({done / max(elapsed, 1e-9):,.0f}/s)", end="", file=sys.stderr)
+
+    with sessionmaker(bind=engine)() as db:
+        result = run_seed(db, scale=args.scale, seed=args.seed, workers=args.workers,
+                          chunk_size=args.chunk_size, progress=report)
+    print(file=sys.stderr)
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
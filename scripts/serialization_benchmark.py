@@ -0,0 +1,181 @@
+"""
+Response serialization benchmark for the list endpoints, in both response shapes.
+
+For each size, a database is generated as in `scripts.benchmark`. A full page of each request in
+`SERIALIZATION_REQUESTS` is then served by the real app, and the report times:
+- request: the whole request through the app, with the response cache cleared, in the default row
+  shape and with `?format=columnar`;
+- pydantic: encoding that page the way FastAPI does for a `response_model` route. That is one
+  model per row, then validating and dumping the list through the route's response field; it is
+  what these endpoints did before the fast path;
+- rows / columnar: encoding the same row tuples with `app.serialization`;
+- parse: `json.loads` of each body on the client.
+
+It also records each body's size, and whether the fast row body is byte-identical to the pydantic
+one.
+
+    python -m scripts.serialization_benchmark --sizes 10k,1m --output serialization-report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import typing
+from datetime import datetime, timezone
+from pathlib import Path
+from app.database import create_read_engine
+from app.serialization import dumps, orjson, shape
+from scripts.benchmark import _git_commit, _summary, build_database, parse_size
+from scripts.seed_data import DEFAULT_SEED
+
+DEFAULT_SIZES = "10k,1m"
+
+SERIALIZATION_REQUESTS = [
+    "/api/merchants/chargeback-ratio?limit=500",
+    "/api/reason-codes?limit=500",
+    "/api/win-rate?limit=500",
+    "/api/segments/high-risk?dimension=category&threshold=0&limit=500",
+    "/api/trends?granularity=daily&fill_gaps=true&limit=366",
+    "/api/alerts",
+    "/api/fraud-patterns?min_count=2&limit=500",
+    "/api/recommendations?limit=500",
+]
+
+
+def _route(request: str):
+    from app.main import API_ROUTERS
+
+    path = request.split("?", 1)[0]
+    return next(
+        route for module in API_ROUTERS for route in module.router.routes
+        if "/api" + route.path == path and "GET" in route.methods
+    )
+
+
+def _timed(fn, runs: int) -> tuple:
+    result = fn()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return result, _summary(samples)
+
+
+def benchmark_serialization(path: Path, runs: int, progress=None) -> dict:
+    from fastapi.routing import serialize_response
+    from fastapi.testclient import TestClient
+    from app.cache import response_cache
+    from app.columnar import get_analytics_engine
+    from app.database import get_read_engine
+    from app.main import app
+
+    engine = create_read_engine(f"sqlite:///{path}")
+    saved = dict(app.dependency_overrides)
+    app.dependency_overrides[get_read_engine] = lambda: engine
+    app.dependency_overrides[get_analytics_engine] = lambda: "sql"
+    client = TestClient(app)
+    results = {}
+    try:
+        for number, request in enumerate(SERIALIZATION_REQUESTS, 1):
+            if progress:
+                progress(number, len(SERIALIZATION_REQUESTS), request)
+            separator = "&" if "?" in request else "?"
+
+            def get(url: str) -> bytes:
+                response_cache.clear()
+                response = client.get(url)
+                response.raise_for_status()
+                return response.content
+
+            rows_body, rows_request = _timed(lambda: get(request), runs)
+            columnar_body, columnar_request = _timed(lambda: get(f"{request}{separator}format=columnar"), runs)
+
+            route = _route(request)
+            model = typing.get_args(route.response_model)[0]
+            items = json.loads(rows_body)
+            records = [tuple(item.values()) for item in items]
+
+            def pydantic() -> bytes:
+                models = [model(**item) for item in items]
+                return asyncio.run(serialize_response(field=route.response_field, response_content=models, dump_json=True))
+
+            pydantic_body, pydantic_timing = _timed(pydantic, runs)
+            _, rows_timing = _timed(lambda: dumps(shape(model, records, "rows")), runs)
+            _, columnar_timing = _timed(lambda: dumps(shape(model, records, "columnar")), runs)
+            _, rows_parse = _timed(lambda: json.loads(rows_body), runs)
+            _, columnar_parse = _timed(lambda: json.loads(columnar_body), runs)
+            results[request] = {
+                "rows": len(items),
+                "identical": pydantic_body == rows_body,
+                "bytes": {"rows": len(rows_body), "columnar": len(columnar_body)},
+                "request": {"rows": rows_request, "columnar": columnar_request},
+                "encode": {"pydantic": pydantic_timing, "rows": rows_timing, "columnar": columnar_timing},
+                "parse": {"rows": rows_parse, "columnar": columnar_parse},
+            }
+    finally:
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(saved)
+        engine.dispose()
+    return results
+
+
+def run_serialization_benchmark(
+    sizes: list, data_dir: Path, seed: int = DEFAULT_SEED, runs: int = 20, workers: int = 1, progress=None,
+) -> dict:
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "encoder": "orjson" if orjson is not None else "json",
+        "seed": seed,
+        "sizes": {},
+    }
+    for label in sizes:
+        path = data_dir / f"transactions-{label}-seed{seed}.db"
+        build_database(path, parse_size(label), seed, workers, rebuild=False)
+        report["sizes"][label] = {"requests": benchmark_serialization(path, runs, progress)}
+    return report
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark list response serialization in row and columnar shape")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated transaction counts, e.g. 10k,1m")
+    parser.add_argument("--data-dir", type=Path, default=Path(".benchmarks"), help="Where generated databases are kept")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="RNG seed for the generated data")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Generator processes")
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs per measurement")
+    parser.add_argument("--output", type=Path, default=Path("serialization-report.json"), help="JSON report path")
+    args = parser.parse_args(argv)
+
+    def report_progress(number: int, total: int, request: str) -> None:
+        print(f"\r[{number}/{total}] {request[:70]:<70}", end="", file=sys.stderr)
+
+    report = run_serialization_benchmark(
+        [label.strip() for label in args.sizes.split(",") if label.strip()], args.data_dir, seed=args.seed,
+        runs=args.runs, workers=args.workers, progress=report_progress,
+    )
+    print(file=sys.stderr)
+    args.output.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+    print(f"encoder: {report['encoder']}")
+    for label, size in report["sizes"].items():
+        print(f"{label}:")
+        for request, result in size["requests"].items():
+            encode, size_bytes = result["encode"], result["bytes"]
+            flag = "" if result["identical"] else "  !"
+            print(
+                f"  {encode['pydantic']['p50_ms']:>7.2f} / {encode['rows']['p50_ms']:>6.2f} / "
+                f"{encode['columnar']['p50_ms']:>6.2f} ms  {size_bytes['rows']:>8,} / {size_bytes['columnar']:>8,} B  "
+                f"{request} ({result['rows']} rows){flag}"
+            )
+    print(f"report written to {args.output} (encode p50 pydantic / rows / columnar; bytes rows / columnar; "
+          f"! = row body differs from pydantic)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
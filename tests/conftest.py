@@ -1,23 +1,32 @@
+import os
+import shutil
+import tempfile
 import uuid
 import pytest
 from datetime import datetime, timedelta
-from fastapi.testclient import TestClient
+
+TEST_DATABASE_DIR = tempfile.mkdtemp(prefix="monteverde-test-")
+TEST_DATABASE_URL = f"sqlite:///{os.path.join(TEST_DATABASE_DIR, 'test.db')}"
+# The app's own engines, and the lifespan's migrations and precompute scheduler, use a scratch file
+# instead of the checked-in monteverde.db. Set before app.database is imported.
+os.environ["MONTEVERDE_DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DATABASE_DIR, 'app.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
 
-from app.database import Base, get_db
+from app.database import Base, create_read_engine, get_db, get_read_engine
+from app.encoding import insert_records
 from app.main import app
 from app.models import Merchant, Transaction, Chargeback
 
-TEST_DATABASE_URL = "sqlite://"
 
 engine = create_engine(
     TEST_DATABASE_URL,
     connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+read_engine = create_read_engine(TEST_DATABASE_URL)
 
 
 def override_get_db():
@@ -33,6 +42,9 @@ def setup_db():
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
+    read_engine.dispose()
+    engine.dispose()
+    shutil.rmtree(TEST_DATABASE_DIR, ignore_errors=True)
 
 
 @pytest.fixture(scope="session")
@@ -45,6 +57,7 @@ def db_session():
 @pytest.fixture(scope="session")
 def client(setup_db, db_session):
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_engine] = lambda: read_engine
     _seed_test_data(db_session)
     with TestClient(app) as c:
         yield c
@@ -57,17 +70,17 @@ def _seed_test_data(db):
     db.query(Merchant).delete()
     db.commit()
 
-    m1 = Merchant(id="merchant-high-1", name="High Ratio Merchant A", country="MX")
-    m2 = Merchant(id="merchant-high-2", name="High Ratio Merchant B", country="CO")
-    m3 = Merchant(id="merchant-clean-1", name="Clean Merchant C", country="CL")
-    db.add_all([m1, m2, m3])
+    m1 = dict(id="merchant-high-1", name="High Ratio Merchant A", country="MX")
+    m2 = dict(id="merchant-high-2", name="High Ratio Merchant B", country="CO")
+    m3 = dict(id="merchant-clean-1", name="Clean Merchant C", country="CL")
+    insert_records(db.connection(), "merchants", [m1, m2, m3])
     db.commit()
 
     now = datetime(2024, 11, 15, 12, 0, 0)
     txs = []
 
     for i in range(80):
-        txs.append(Transaction(
+        txs.append(dict(
             id=f"tx-m1-{i}",
             timestamp=now - timedelta(days=i % 30),
             amount=500.0,
@@ -82,7 +95,7 @@ def _seed_test_data(db):
         ))
 
     for i in range(80):
-        txs.append(Transaction(
+        txs.append(dict(
             id=f"tx-m2-{i}",
             timestamp=now - timedelta(days=i % 30),
             amount=300000.0,
@@ -97,7 +110,7 @@ def _seed_test_data(db):
         ))
 
     for i in range(100):
-        txs.append(Transaction(
+        txs.append(dict(
             id=f"tx-m3-{i}",
             timestamp=now - timedelta(days=i % 30),
             amount=50000.0,
@@ -114,7 +127,7 @@ def _seed_test_data(db):
     repeat_offender_id = "repeat-customer-001"
     for i in range(3):
         mid = ["merchant-high-1", "merchant-high-2", "merchant-clean-1"][i]
-        txs.append(Transaction(
+        txs.append(dict(
             id=f"tx-repeat-{i}",
             timestamp=now - timedelta(days=i),
             amount=800.0,
@@ -131,7 +144,7 @@ def _seed_test_data(db):
     bin_anchor = datetime(2024, 11, 10, 10, 0, 0)
     high_value_bin = "999888"
     for i in range(3):
-        txs.append(Transaction(
+        txs.append(dict(
             id=f"tx-bin-{i}",
             timestamp=bin_anchor + timedelta(hours=i * 12),
             amount=1200.0,
@@ -145,13 +158,13 @@ def _seed_test_data(db):
             card_bin=high_value_bin,
         ))
 
-    db.add_all(txs)
+    insert_records(db.connection(), "transactions", txs)
     db.commit()
 
     cbs = []
 
     for i in range(10):
-        cbs.append(Chargeback(
+        cbs.append(dict(
             id=f"cb-m1-{i}",
             transaction_id=f"tx-m1-{i}",
             chargeback_date=now - timedelta(days=i % 30) + timedelta(days=5),
@@ -162,7 +175,7 @@ def _seed_test_data(db):
         ))
 
     for i in range(10):
-        cbs.append(Chargeback(
+        cbs.append(dict(
             id=f"cb-m2-{i}",
             transaction_id=f"tx-m2-{i}",
             chargeback_date=now - timedelta(days=i % 30) + timedelta(days=5),
@@ -173,7 +186,7 @@ def _seed_test_data(db):
         ))
 
     for i in range(1):
-        cbs.append(Chargeback(
+        cbs.append(dict(
             id=f"cb-m3-{i}",
             transaction_id=f"tx-m3-{i}",
             chargeback_date=now - timedelta(days=i % 30) + timedelta(days=5),
@@ -183,7 +196,7 @@ def _seed_test_data(db):
             amount=50000.0,
         ))
 
-    cbs.append(Chargeback(
+    cbs.append(dict(
         id="cb-m3-dup",
         transaction_id="tx-m3-1",
         chargeback_date=now + timedelta(days=5),
@@ -193,7 +206,7 @@ def _seed_test_data(db):
         amount=50000.0,
     ))
 
-    cbs.append(Chargeback(
+    cbs.append(dict(
         id="cb-m3-recurring",
         transaction_id="tx-m3-2",
         chargeback_date=now + timedelta(days=6),
@@ -208,7 +221,7 @@ def _seed_test_data(db):
     spike_txs = []
     for i in range(20):
         tx_id = f"tx-spike-{i}"
-        spike_txs.append(Transaction(
+        spike_txs.append(dict(
             id=tx_id,
             timestamp=spike_base - timedelta(hours=i),
             amount=200.0,
@@ -221,7 +234,7 @@ def _seed_test_data(db):
             status="approved",
             card_bin="411111",
         ))
-        cbs.append(Chargeback(
+        cbs.append(dict(
             id=f"cb-spike-{i}",
             transaction_id=tx_id,
             chargeback_date=spike_base - timedelta(hours=i) + timedelta(days=1),
@@ -235,7 +248,7 @@ def _seed_test_data(db):
     prev_txs = []
     for i in range(3):
         tx_id = f"tx-prev-{i}"
-        prev_txs.append(Transaction(
+        prev_txs.append(dict(
             id=tx_id,
             timestamp=prev_base - timedelta(hours=i),
             amount=200.0,
@@ -248,7 +261,7 @@ def _seed_test_data(db):
             status="approved",
             card_bin="411111",
         ))
-        cbs.append(Chargeback(
+        cbs.append(dict(
             id=f"cb-prev-{i}",
             transaction_id=tx_id,
             chargeback_date=prev_base - timedelta(hours=i) + timedelta(days=1),
@@ -258,10 +271,10 @@ def _seed_test_data(db):
             amount=200.0,
         ))
 
-    db.add_all(spike_txs + prev_txs)
+    insert_records(db.connection(), "transactions", spike_txs + prev_txs)
     db.commit()
 
-    high_val_tx = Transaction(
+    high_val_tx = dict(
         id="tx-high-value-1",
         timestamp=now,
         amount=10000.0,
@@ -274,10 +287,10 @@ def _seed_test_data(db):
         status="approved",
         card_bin="411111",
     )
-    db.add(high_val_tx)
+    insert_records(db.connection(), "transactions", [high_val_tx])
     db.commit()
 
-    cbs.append(Chargeback(
+    cbs.append(dict(
         id="cb-high-value-1",
         transaction_id="tx-high-value-1",
         chargeback_date=now + timedelta(days=3),
@@ -288,7 +301,7 @@ def _seed_test_data(db):
     ))
 
     for i in range(3):
-        cbs.append(Chargeback(
+        cbs.append(dict(
             id=f"cb-repeat-{i}",
             transaction_id=f"tx-repeat-{i}",
             chargeback_date=now - timedelta(days=i) + timedelta(days=2),
@@ -299,7 +312,7 @@ def _seed_test_data(db):
         ))
 
     for i in range(3):
-        cbs.append(Chargeback(
+        cbs.append(dict(
             id=f"cb-bin-{i}",
             transaction_id=f"tx-bin-{i}",
             chargeback_date=bin_anchor + timedelta(hours=i * 12) + timedelta(days=2),
@@ -309,5 +322,5 @@ def _seed_test_data(db):
             amount=1200.0,
         ))
 
-    db.add_all(cbs)
+    insert_records(db.connection(), "chargebacks", cbs)
     db.commit()
@@ -1,4 +1,5 @@
 import pytest
+from datetime import datetime
 
 
 def test_seed_loads_data():
@@ -19,6 +20,60 @@ def test_seed_loads_data():
     assert result["chargebacks"] >= 200
 
 
+def _seeded_snapshot(scale, seed, workers):
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.database import Base
+    from scripts.seed_data import run_seed
+
+    seed_engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=seed_engine)
+    with sessionmaker(bind=seed_engine)() as db:
+        result = run_seed(db, scale=scale, seed=seed, workers=workers, chunk_size=500)
+        txs = db.execute(text("SELECT * FROM transactions ORDER BY id")).fetchall()
+        cbs = db.execute(text("SELECT * FROM chargebacks ORDER BY id")).fetchall()
+        stats = db.execute(text("SELECT * FROM merchant_stats ORDER BY merchant_id")).fetchall()
+        offenders = db.execute(text("""
+            SELECT t.customer_id
+            FROM chargebacks c
+            JOIN transactions t ON t.id = c.transaction_id
+            GROUP BY t.customer_id
+            HAVING COUNT(*) >= 3 AND COUNT(DISTINCT t.merchant_id) >= 3
+        """)).fetchall()
+    return result, txs, cbs, stats, offenders
+
+
+def test_seed_is_deterministic_across_workers():
+    first = _seeded_snapshot(scale=0.2, seed=7, workers=1)
+    second = _seeded_snapshot(scale=0.2, seed=7, workers=2)
+    other = _seeded_snapshot(scale=0.2, seed=8, workers=1)
+
+    assert first == second
+    assert first[1] != other[1]
+    result, txs, cbs, stats, offenders = first
+    assert result == {"merchants": 12, "transactions": len(txs), "chargebacks": len(cbs)}
+    assert sum(row[1] for row in stats) == len(txs)
+    assert len(offenders) >= 5
+
+
+def test_seed_scale_plants_bin_bursts():
+    from scripts.seed_data import HIGH_CB_BIN_PATTERNS, build_plan, generate_shard, plan_shards
+    from app.detection import detect_bin_bursts
+
+    plan, _ = build_plan(seed=3)
+    shards = plan_shards(plan, scale=0.05)
+    assert sum(s.count for s in shards) == 290
+    tx_bins, rows = {}, []
+    for shard in shards:
+        txs, cbs = generate_shard(plan, shard)
+        tx_bins.update({tx[0]: (tx[10], tx[4]) for tx in txs})
+        rows.extend((tx_bins[cb[1]][0], cb[2], tx_bins[cb[1]][1], cb[6]) for cb in cbs)
+    rows.sort(key=lambda r: (r[0], r[1]))
+    found = {b.card_bin for b in detect_bin_bursts(rows, time_window_hours=48, min_count=3)}
+    assert set(HIGH_CB_BIN_PATTERNS) <= found
+
+
 def test_merchant_ratio_returns_all_merchants(client):
     response = client.get("/api/merchants/chargeback-ratio")
     assert response.status_code == 200
@@ -79,7 +134,7 @@ def test_trends_weekly_granularity(client):
 
 
 def test_trends_invalid_granularity(client):
-    response = client.get("/api/trends?granularity=monthly")
+    response = client.get("/api/trends?granularity=hourly")
     assert response.status_code == 400
 
 
@@ -189,3 +244,2128 @@ def test_alerts_configurable_threshold(client):
     tight_count = sum(1 for a in response_tight.json() if a["alert_type"] == "HIGH_CHARGEBACK_RATIO")
     loose_count = sum(1 for a in response_loose.json() if a["alert_type"] == "HIGH_CHARGEBACK_RATIO")
     assert tight_count >= loose_count
+
+
+MERCHANT_STATS_RAW_SQL = """
+    SELECT
+        m.id,
+        COUNT(DISTINCT t.id),
+        COUNT(DISTINCT c.id),
+        COALESCE(SUM(c.amount), 0.0),
+        COALESCE(ROUND(CAST(COUNT(DISTINCT c.id) AS FLOAT) / NULLIF(COUNT(DISTINCT t.id), 0) * 100, 4), 0.0)
+    FROM merchants m
+    LEFT JOIN transactions t ON t.merchant_id = m.id
+    LEFT JOIN chargebacks c ON c.transaction_id = t.id
+    GROUP BY m.id
+    ORDER BY m.id
+"""
+
+MERCHANT_STATS_ROLLUP_SQL = """
+    SELECT merchant_id, transaction_count, chargeback_count, chargeback_amount, chargeback_ratio
+    FROM merchant_stats
+    ORDER BY merchant_id
+"""
+
+
+def _add(session, table, **record):
+    """Insert one record, in the layout clients send, into `table`."""
+    from app.encoding import insert_records
+
+    insert_records(session.connection(), table, [record])
+
+
+def test_merchant_stats_tracks_writes(client, db_session):
+    from sqlalchemy import text
+    from app.models import Transaction, Chargeback
+
+    assert db_session.execute(text(MERCHANT_STATS_ROLLUP_SQL)).fetchall() == \
+        db_session.execute(text(MERCHANT_STATS_RAW_SQL)).fetchall()
+
+    _add(
+        db_session, "transactions",
+        id="tx-rollup-1", timestamp=datetime(2024, 11, 1), amount=100.0, currency="CLP",
+        merchant_id="merchant-clean-1", customer_id="cust-rollup-1", payment_method="debit_card",
+        country="CL", product_category="Groceries", status="approved", card_bin="601100",
+    )
+    db_session.commit()
+    _add(
+        db_session, "chargebacks",
+        id="cb-rollup-1", transaction_id="tx-rollup-1", chargeback_date=datetime(2024, 11, 5),
+        reason_code="13.3", reason_description="Not as Described or Defective Merchandise",
+        status="open", amount=100.0,
+    )
+    db_session.commit()
+    assert db_session.execute(text(MERCHANT_STATS_ROLLUP_SQL)).fetchall() == \
+        db_session.execute(text(MERCHANT_STATS_RAW_SQL)).fetchall()
+
+    db_session.query(Chargeback).filter_by(external_id="cb-rollup-1").delete()
+    db_session.query(Transaction).filter_by(external_id="tx-rollup-1").delete()
+    db_session.commit()
+    assert db_session.execute(text(MERCHANT_STATS_ROLLUP_SQL)).fetchall() == \
+        db_session.execute(text(MERCHANT_STATS_RAW_SQL)).fetchall()
+
+
+def test_rebuild_rollups_matches_raw_join(client, db_session):
+    from sqlalchemy import text
+    from app.rollups import rebuild_all
+
+    counts = rebuild_all(db_session.connection())
+    db_session.commit()
+    assert counts["merchant_stats"] == 3
+    assert db_session.execute(text(MERCHANT_STATS_ROLLUP_SQL)).fetchall() == \
+        db_session.execute(text(MERCHANT_STATS_RAW_SQL)).fetchall()
+
+
+def test_detect_bin_bursts_sweep():
+    from app.detection import detect_bin_bursts
+
+    base = datetime(2024, 11, 1)
+    rows = [
+        ("111111", base, "m1", 10.0),
+        ("111111", base.replace(hour=10), "m2", 10.0),
+        ("111111", base.replace(day=10), "m1", 10.0),
+        ("222222", base, "m1", 5.0),
+        ("222222", base.replace(day=5), "m1", 5.0),
+        ("333333", base, "m1", 1.0),
+        ("333333", base.replace(day=2), "m1", 1.0),
+        ("333333", base.replace(day=3), "m1", 1.0),
+        ("333333", base.replace(day=4), "m1", 1.0),
+    ]
+    found = {b.card_bin: b for b in detect_bin_bursts(rows, time_window_hours=48, min_count=2)}
+
+    assert set(found) == {"111111", "333333"}
+    assert found["111111"].chargeback_count == 3
+    assert found["111111"].merchant_count == 2
+    assert [(b.start, b.end, b.chargeback_count) for b in found["111111"].bursts] == [
+        (base, base.replace(hour=10), 2),
+    ]
+    assert [(b.start, b.end, b.chargeback_count) for b in found["333333"].bursts] == [
+        (base, base.replace(day=4), 4),
+    ]
+
+    strict = {b.card_bin for b in detect_bin_bursts(rows, time_window_hours=48, min_count=3)}
+    assert strict == {"333333"}
+
+
+def test_fraud_patterns_bin_windows_configurable(client):
+    response = client.get("/api/fraud-patterns?time_window_hours=24&min_count=3")
+    assert response.status_code == 200
+    bin_patterns = [p for p in response.json() if p["pattern_type"] == "BIN_PATTERN"]
+    by_bin = {p["entity_id"]: p for p in bin_patterns}
+    assert "999888" in by_bin
+    assert by_bin["999888"]["time_window_hours"] == 24
+    assert by_bin["999888"]["windows"] == [
+        {"start": "2024-11-12T10:00:00", "end": "2024-11-13T10:00:00", "chargeback_count": 3},
+    ]
+    for pattern in bin_patterns:
+        assert all(w["chargeback_count"] >= 3 for w in pattern["windows"])
+
+
+def _cleanup_ingested(db_session, tx_ids=(), cb_ids=()):
+    from app.cache import bump_data_version
+    from app.models import Transaction, Chargeback
+
+    db_session.query(Chargeback).filter(Chargeback.external_id.in_(list(cb_ids))).delete(synchronize_session=False)
+    db_session.query(Transaction).filter(Transaction.external_id.in_(list(tx_ids))).delete(synchronize_session=False)
+    db_session.commit()
+    bump_data_version()
+
+
+def test_bulk_ingest_ndjson_transactions_and_chargebacks(client, db_session):
+    import json
+    from sqlalchemy import text
+
+    def tx(i, **overrides):
+        row = {
+            "id": f"tx-bulk-{i}", "timestamp": "2024-11-20T10:00:00", "amount": 150.5, "currency": "CLP",
+            "merchant_id": "merchant-clean-1", "customer_id": f"cust-bulk-{i}", "payment_method": "debit_card",
+            "country": "CL", "product_category": "Groceries", "status": "approved", "card_bin": "601100",
+        }
+        row.update(overrides)
+        return json.dumps(row)
+
+    lines = [tx(i) for i in range(5)] + [
+        tx(5, amount="not-a-number"),
+        tx(6, merchant_id="merchant-missing"),
+        tx(0),
+        "{broken json",
+        tx(7, card_bin="12345678"),
+    ]
+    body = ("\n".join(lines) + "\n").encode()
+
+    def chunked():
+        for start in range(0, len(body), 37):
+            yield body[start:start + 37]
+
+    try:
+        response = client.post("/api/transactions:bulk", content=chunked(),
+                                headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 200
+        result = response.json()
+        assert result["received"] == 10
+        assert result["inserted"] == 5
+        assert result["rejected"] == 5
+        assert not result["rejects_truncated"]
+        errors = {r["line"]: r["error"] for r in result["rejects"]}
+        assert "amount" in errors[6]
+        assert "unknown merchant_id" in errors[7]
+        assert "duplicate id" in errors[8]
+        assert "invalid JSON" in errors[9]
+        assert "card_bin" in errors[10]
+
+        csv_body = (
+            "id,transaction_id,chargeback_date,reason_code,reason_description,status,amount\n"
+            "cb-bulk-0,tx-bulk-0,2024-11-25T09:00:00,13.3,Not as Described or Defective Merchandise,open,150.5\n"
+            "cb-bulk-1,tx-bulk-missing,2024-11-25T09:00:00,13.3,Not as Described or Defective Merchandise,open,150.5\n"
+        )
+        response = client.post("/api/chargebacks:bulk", content=csv_body, headers={"Content-Type": "text/csv"})
+        assert response.status_code == 200
+        result = response.json()
+        assert (result["received"], result["inserted"], result["rejected"]) == (2, 1, 1)
+        assert result["rejects"][0]["line"] == 3
+
+        stats = db_session.execute(text(
+            "SELECT transaction_count, chargeback_count FROM merchant_stats s"
+            " JOIN merchants m ON m.id = s.merchant_id WHERE m.external_id = 'merchant-clean-1'"
+        )).fetchone()
+        raw = db_session.execute(text("""
+            SELECT COUNT(DISTINCT t.id), COUNT(DISTINCT c.id)
+            FROM transactions t LEFT JOIN chargebacks c ON c.transaction_id = t.id
+            JOIN merchants m ON m.id = t.merchant_id
+            WHERE m.external_id = 'merchant-clean-1'
+        """)).fetchone()
+        assert tuple(stats) == tuple(raw)
+    finally:
+        _cleanup_ingested(db_session, tx_ids=[f"tx-bulk-{i}" for i in range(8)], cb_ids=["cb-bulk-0"])
+
+
+def test_parse_csv_reads_quoted_newlines_and_reports_start_lines():
+    from app.ingestion import MAX_LINE_BYTES, RowError, parse_csv
+
+    lines = enumerate([
+        "id,note",
+        'a,"first',
+        'second"',
+        "",
+        "b,plain",
+        None,
+        "c,one,extra",
+    ], start=1)
+    records = list(parse_csv(lines))
+    assert records[:2] == [(2, {"id": "a", "note": "first\nsecond"}), (5, {"id": "b", "note": "plain"})]
+    assert [(line, str(error)) for line, error in records[2:] if isinstance(error, RowError)] == [
+        (6, f"line exceeds {MAX_LINE_BYTES} bytes"), (7, "expected 2 columns, got 3"),
+    ]
+
+
+def test_bulk_ingest_failed_batch_reports_committed_counts(client, db_session, monkeypatch):
+    import json
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    from app import ingestion
+
+    calls = []
+    insert_records = ingestion.insert_records
+
+    def fail_second_batch(conn, table, rows, **kwargs):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return insert_records(conn, table, rows, **kwargs)
+
+    body = "\n".join(json.dumps({
+        "id": f"tx-partial-{i}", "timestamp": "2024-11-20T10:00:00", "amount": 10.0, "currency": "CLP",
+        "merchant_id": "merchant-clean-1", "customer_id": "cust-partial", "payment_method": "debit_card",
+        "country": "CL", "product_category": "Groceries", "status": "approved", "card_bin": "601100",
+    }) for i in range(5)).encode()
+    try:
+        monkeypatch.setattr(ingestion, "insert_records", fail_second_batch)
+        stats = ingestion.ingest([body], ingestion.TRANSACTIONS, "ndjson", db_session, batch_size=2)
+        assert (stats.received, stats.inserted, stats.rejected) == (4, 2, 0)
+        assert stats.error == "batch starting at line 3 was not inserted: database is locked"
+        stored = db_session.execute(text(
+            "SELECT external_id FROM transactions WHERE external_id LIKE 'tx-partial-%' ORDER BY external_id"
+        )).scalars().all()
+        assert stored == ["tx-partial-0", "tx-partial-1"]
+
+        calls.clear()
+        calls.append(0)
+        response = client.post("/api/transactions:bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 500
+        result = response.json()
+        assert (result["received"], result["inserted"]) == (5, 0)
+        assert result["error"] == "batch starting at line 1 was not inserted: database is locked"
+    finally:
+        _cleanup_ingested(db_session, tx_ids=[f"tx-partial-{i}" for i in range(5)])
+
+
+def test_bulk_ingest_rejects_unknown_format(client):
+    response = client.post("/api/transactions:bulk?format=xml", content=b"<a/>")
+    assert response.status_code == 400
+
+
+def test_alerts_signals_run_concurrently_with_timings(client, monkeypatch):
+    import threading
+    from app.cache import bump_data_version
+    from app.routers import alerts as alerts_router
+
+    bump_data_version()
+    barrier = threading.Barrier(3, timeout=5)
+
+    def wait_then(signal):
+        def wrapped(conn, *args):
+            barrier.wait()
+            return signal(conn, *args)
+        return wrapped
+
+    for name in ("high_ratio_signal", "weekly_spike_signal", "high_value_signal"):
+        monkeypatch.setattr(alerts_router, name, wait_then(getattr(alerts_router, name)))
+
+    response = client.get("/api/alerts")
+    assert response.status_code == 200
+    types = [a["alert_type"] for a in response.json()]
+    assert types == sorted(types, key=["HIGH_CHARGEBACK_RATIO", "WEEKLY_SPIKE", "HIGH_VALUE_DISPUTE"].index)
+    timing = dict(part.strip().split(";dur=") for part in response.headers["Server-Timing"].split(","))
+    assert set(timing) == {"high_ratio", "weekly_spike", "high_value"}
+    assert all(float(ms) >= 0 for ms in timing.values())
+
+
+def test_response_cache_etag_and_304_without_sql(client):
+    from sqlalchemy import event
+    from app.cache import bump_data_version
+    from tests.conftest import read_engine as engine
+
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    bump_data_version()
+    first = client.get("/api/reason-codes?limit=10&offset=0")
+    assert first.status_code == 200
+    assert first.headers["x-cache"] == "MISS"
+    etag = first.headers["etag"]
+    assert etag.startswith('"') and etag.endswith('"')
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        reordered = client.get("/api/reason-codes?offset=0&limit=10")
+        assert reordered.headers["x-cache"] == "HIT"
+        assert reordered.json() == first.json()
+
+        revalidated = client.get("/api/reason-codes?limit=10&offset=0", headers={"If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+        assert revalidated.headers["etag"] == etag
+        assert statements == []
+
+        bump_data_version()
+        recomputed = client.get("/api/reason-codes?limit=10&offset=0", headers={"If-None-Match": etag})
+        assert recomputed.status_code == 304
+        assert recomputed.headers["x-cache"] == "MISS"
+        assert statements
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert client.get("/api/trends?granularity=hourly").headers["x-cache"] == "MISS"
+    assert client.get("/api/trends?granularity=hourly").headers["x-cache"] == "MISS"
+
+
+def test_response_cache_lru_bounds():
+    from app.cache import CachedResponse, ResponseCache
+
+    def entry(version, size):
+        return CachedResponse(version=version, stored_at=0.0, etag='"x"', status=200, headers=[], body=b"x" * size)
+
+    cache = ResponseCache(max_entries=2, max_bytes=100, ttl_seconds=1e12)
+    cache.put("a", entry(1, 10))
+    cache.put("b", entry(1, 10))
+    assert cache.get("a", 1) is not None
+    cache.put("c", entry(1, 10))
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) is not None
+    assert cache.get("a", 2) is None
+    assert cache.get("a", 1) is None
+
+    cache.put("big", entry(1, 95))
+    cache.put("small", entry(1, 10))
+    assert cache.get("big", 1) is None
+    assert cache.get("small", 1) is not None
+    assert len(cache) == 1
+
+
+def test_data_version_watcher_sees_commits_from_other_connections():
+    import sqlite3
+    from app.cache import DataVersion, DataVersionWatcher
+    from tests.conftest import TEST_DATABASE_URL, engine
+
+    version = DataVersion()
+    watcher = DataVersionWatcher(version)
+    watcher.watch(engine)
+    try:
+        assert watcher.check() is False
+        # Stands in for scripts/manage.py committing from another process.
+        other = sqlite3.connect(TEST_DATABASE_URL.removeprefix("sqlite:///"), isolation_level=None)
+        try:
+            other.execute("CREATE TABLE watcher_probe (id INTEGER)")
+            other.execute("DROP TABLE watcher_probe")
+        finally:
+            other.close()
+        assert watcher.check() is True
+        assert version.current == 1
+        assert watcher.check() is False
+    finally:
+        watcher.stop()
+
+
+def test_read_connections_are_query_only_with_profile_pragmas(client):
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    from app.constants import SQLITE_PRAGMA_PROFILES
+    from app.database import create_read_engine
+    from tests.conftest import TEST_DATABASE_URL
+
+    engine = create_read_engine(TEST_DATABASE_URL, pool_size=2, max_overflow=0, profile="analytics")
+    try:
+        with engine.connect() as conn:
+            profile = SQLITE_PRAGMA_PROFILES["analytics"]
+            assert conn.execute(text("PRAGMA query_only")).scalar() == 1
+            assert conn.execute(text("PRAGMA cache_size")).scalar() == int(profile["cache_size"])
+            assert conn.execute(text("PRAGMA mmap_size")).scalar() == int(profile["mmap_size"])
+            with pytest.raises(OperationalError):
+                conn.execute(text("DELETE FROM merchants"))
+        assert engine.pool.size() == 2
+    finally:
+        engine.dispose()
+
+
+def _columnar_matches_sql(conn, snapshot):
+    from app.routers.reason_codes import REASON_CODES_SQL
+    from app.routers.segments import SEGMENT_SQL
+    from app.routers.win_rate import WIN_RATE_SQL
+
+    page = {"limit": 500, "offset": 0}
+    assert snapshot.reason_codes(**page) == [tuple(r) for r in conn.execute(REASON_CODES_SQL, page)]
+    assert snapshot.win_rate(**page) == [tuple(r) for r in conn.execute(WIN_RATE_SQL, page)]
+    for dimension, statement in SEGMENT_SQL.items():
+        for threshold in (0.0, 1.5, 5.0):
+            params = {"dimension": dimension, "threshold": threshold, **page}
+            assert snapshot.segments(dimension, threshold, **page) == [tuple(r) for r in conn.execute(statement, params)]
+
+
+def test_columnar_engine_matches_sql_on_seeded_data():
+    pytest.importorskip("numpy")
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.columnar import ColumnarStore
+    from app.database import Base
+    from scripts.seed_data import run_seed
+
+    seed_engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=seed_engine)
+    with sessionmaker(bind=seed_engine)() as db:
+        run_seed(db, scale=0.2, seed=11)
+    with seed_engine.connect() as conn:
+        _columnar_matches_sql(conn, ColumnarStore().snapshot(conn))
+
+
+def test_columnar_engine_serves_endpoints_and_refreshes_incrementally(client, db_session):
+    pytest.importorskip("numpy")
+    from app.cache import bump_data_version
+    from app.columnar import columnar_store, get_analytics_engine, sql_round
+    from app.main import app
+    from tests.conftest import read_engine
+
+    assert sql_round(2.675, 2) == 2.68 and sql_round(-0.125, 2) == -0.13
+
+    urls = [
+        "/api/reason-codes", "/api/win-rate", "/api/trends?granularity=daily", "/api/trends?granularity=weekly",
+        "/api/segments/high-risk?dimension=country&threshold=0", "/api/segments/high-risk?dimension=category",
+    ]
+    bump_data_version()
+    expected = {url: client.get(url).json() for url in urls}
+
+    app.dependency_overrides[get_analytics_engine] = lambda: "columnar"
+    try:
+        bump_data_version()
+        assert {url: client.get(url).json() for url in urls} == expected
+
+        reloads = columnar_store.full_reloads
+        _add(
+            db_session, "transactions",
+            id="tx-columnar-1", timestamp=datetime(2024, 11, 1), amount=100.0, currency="CLP",
+            merchant_id="merchant-clean-1", customer_id="cust-columnar-1", payment_method="debit_card",
+            country="CL", product_category="Toys", status="approved", card_bin="601100",
+        )
+        db_session.commit()
+        _add(
+            db_session, "chargebacks",
+            id="cb-columnar-1", transaction_id="tx-columnar-1", chargeback_date=datetime(2024, 11, 5),
+            reason_code="11.1", reason_description="Card Recovery Bulletin", status="won", amount=100.0,
+        )
+        db_session.commit()
+        bump_data_version()
+        codes = {row["reason_code"] for row in client.get("/api/reason-codes").json()}
+        categories = {row["segment_value"] for row in client.get("/api/segments/high-risk?dimension=category&threshold=0").json()}
+        assert "11.1" in codes and "Toys" in categories
+        assert columnar_store.full_reloads == reloads
+
+        with read_engine.connect() as conn:
+            _columnar_matches_sql(conn, columnar_store.snapshot(conn))
+    finally:
+        app.dependency_overrides.pop(get_analytics_engine, None)
+        _cleanup_ingested(db_session, tx_ids=["tx-columnar-1"], cb_ids=["cb-columnar-1"])
+
+    with read_engine.connect() as conn:
+        _columnar_matches_sql(conn, columnar_store.snapshot(conn))
+    assert columnar_store.full_reloads == reloads + 1
+
+
+def test_columnar_refresh_reads_both_tables_from_one_snapshot(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    from sqlalchemy.orm import sessionmaker
+    from app.columnar import ColumnarStore, _TransactionColumns
+    from app.database import Base, create_read_engine, create_write_engine
+    from app.encoding import insert_records
+    from scripts.seed_data import run_seed
+
+    url = f"sqlite:///{tmp_path / 'race.db'}"
+    write_engine, read_engine = create_write_engine(url), create_read_engine(url)
+    Base.metadata.create_all(bind=write_engine)
+    with sessionmaker(bind=write_engine)() as db:
+        run_seed(db, scale=0.05, seed=3)
+    sync = _TransactionColumns.sync
+    ingested = []
+
+    def sync_then_ingest(self, conn, force=False):
+        # An ingestion batch commits a transaction and its chargeback between the two syncs.
+        reloaded = sync(self, conn, force)
+        if ingested:
+            return reloaded
+        ingested.append(True)
+        with write_engine.begin() as writer:
+            merchant = writer.exec_driver_sql("SELECT MIN(external_id) FROM merchants").scalar()
+            insert_records(writer, "transactions", [dict(
+                id="tx-race", timestamp=datetime(2024, 11, 1), amount=100.0, currency="CLP",
+                merchant_id=merchant, customer_id="cust-race", payment_method="debit_card",
+                country="CL", product_category="Toys", status="approved", card_bin="601100",
+            )])
+            insert_records(writer, "chargebacks", [dict(
+                id="cb-race", transaction_id="tx-race", chargeback_date=datetime(2024, 11, 5),
+                reason_code="11.1", reason_description="Card Recovery Bulletin", status="won", amount=100.0,
+            )])
+        return reloaded
+
+    monkeypatch.setattr(_TransactionColumns, "sync", sync_then_ingest)
+    store = ColumnarStore(recheck_seconds=0)
+    try:
+        with read_engine.connect() as conn:
+            store.snapshot(conn)
+            assert ingested
+            _columnar_matches_sql(conn, store.snapshot(conn))
+        assert store.full_reloads == 1
+    finally:
+        read_engine.dispose()
+        write_engine.dispose()
+
+
+def test_export_chargebacks_ndjson_with_filters(client, db_session):
+    import json
+    from sqlalchemy import text
+
+    response = client.get("/api/export/chargebacks")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == db_session.execute(text("SELECT COUNT(*) FROM chargebacks")).scalar()
+    assert [r["chargeback_date"] for r in rows] == sorted(r["chargeback_date"] for r in rows)
+
+    high_value = next(r for r in rows if r["chargeback_id"] == "cb-high-value-1")
+    assert high_value["currency"] == "MXN"
+    assert high_value["amount_usd"] == round(10000.0 / 17.0, 2)
+    assert high_value["merchant_name"] == "High Ratio Merchant A"
+    assert high_value["chargeback_date"] == "2024-11-18T12:00:00"
+
+    filtered = client.get(
+        "/api/export/chargebacks",
+        params={"merchant_id": "merchant-high-2", "reason_code": "13.1", "status": "open",
+                "start": "2024-11-01T00:00:00", "end": "2024-11-21T00:00:00"},
+    )
+    ids = {json.loads(line)["chargeback_id"] for line in filtered.text.splitlines()}
+    assert ids == {f"cb-m2-{i}" for i in range(10)}
+
+    assert client.get("/api/export/chargebacks", params={"status": "lost"}).text == ""
+
+
+def test_export_chargebacks_csv_streams_in_chunks(client, monkeypatch):
+    import csv
+    import io
+    from app.routers import export
+    from tests.conftest import read_engine
+
+    monkeypatch.setattr(export, "EXPORT_CHUNK_ROWS", 5)
+    with client.stream("GET", "/api/export/chargebacks?format=csv&reason_code=10.4") as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert 'filename="chargebacks.csv"' in response.headers["content-disposition"]
+        body = "".join(response.iter_text())
+    rows = list(csv.DictReader(io.StringIO(body)))
+    assert list(rows[0]) == export.EXPORT_COLUMNS
+    assert rows and all(r["reason_code"] == "10.4" for r in rows)
+
+    chunks = list(export.stream_export(read_engine, "csv", {}))
+    assert len(chunks) > 1
+
+    assert client.get("/api/export/chargebacks?format=xml").status_code == 400
+    assert client.get("/api/export/chargebacks?start=2024-12-01&end=2024-11-01").status_code == 400
+
+
+def _walk_cursor(client, url, limit):
+    separator = "&" if "?" in url else "?"
+    pages, cursor = [], None
+    while True:
+        response = client.get(f"{url}{separator}limit={limit}" + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return [row for page in pages for row in page], len(pages)
+
+
+CURSOR_URLS = [
+    "/api/merchants/chargeback-ratio", "/api/reason-codes", "/api/win-rate", "/api/recommendations",
+    "/api/segments/high-risk?dimension=country&threshold=0", "/api/trends?granularity=daily",
+    "/api/trends?granularity=weekly", "/api/fraud-patterns?min_count=2",
+]
+
+
+@pytest.mark.parametrize("url", CURSOR_URLS)
+def test_cursor_pagination_walks_every_row_once(client, url):
+    from app.cache import bump_data_version
+
+    bump_data_version()
+    separator = "&" if "?" in url else "?"
+    everything = client.get(f"{url}{separator}limit=366").json()
+    walked, pages = _walk_cursor(client, url, limit=2)
+    if url.startswith("/api/fraud-patterns"):
+        key = lambda p: (p["pattern_type"], p["entity_id"])
+        assert sorted(map(key, walked)) == sorted(map(key, everything))
+    else:
+        assert walked == everything
+    assert pages >= len(everything) // 2
+
+
+def test_cursor_pagination_columnar_engine_matches_sql(client):
+    pytest.importorskip("numpy")
+    from app.cache import bump_data_version
+    from app.columnar import get_analytics_engine
+    from app.main import app
+
+    urls = [u for u in CURSOR_URLS if u.split("?")[0] in ("/api/reason-codes", "/api/win-rate", "/api/segments/high-risk", "/api/trends")]
+    bump_data_version()
+    expected = {url: _walk_cursor(client, url, limit=2) for url in urls}
+    app.dependency_overrides[get_analytics_engine] = lambda: "columnar"
+    try:
+        bump_data_version()
+        assert {url: _walk_cursor(client, url, limit=2) for url in urls} == expected
+    finally:
+        app.dependency_overrides.pop(get_analytics_engine, None)
+
+
+def test_cursor_pages_are_stable_while_rows_are_ingested(client, db_session):
+    from datetime import timedelta
+    from app.cache import bump_data_version
+
+    bump_data_version()
+    first = client.get("/api/trends?granularity=daily&limit=5")
+    cursor = first.headers["x-next-cursor"]
+    second = client.get(f"/api/trends?granularity=daily&limit=5&cursor={cursor}").json()
+    assert second[0]["period"] > first.json()[-1]["period"]
+
+    early = datetime.fromisoformat(first.json()[0]["period"]) - timedelta(days=30)
+    try:
+        _add(
+            db_session, "transactions",
+            id="tx-cursor-1", timestamp=early, amount=10.0, currency="MXN", merchant_id="merchant-high-1",
+            customer_id="cust-cursor-1", payment_method="credit_card", country="MX",
+            product_category="Electronics", status="approved", card_bin="411111",
+        )
+        db_session.commit()
+        _add(
+            db_session, "chargebacks",
+            id="cb-cursor-1", transaction_id="tx-cursor-1", chargeback_date=early,
+            reason_code="10.4", reason_description="Card-Not-Present Fraud", status="open", amount=10.0,
+        )
+        db_session.commit()
+        bump_data_version()
+        assert client.get(f"/api/trends?granularity=daily&limit=5&cursor={cursor}").json() == second
+        assert client.get("/api/trends?granularity=daily&limit=5&offset=5").json() != second
+    finally:
+        _cleanup_ingested(db_session, tx_ids=["tx-cursor-1"], cb_ids=["cb-cursor-1"])
+
+
+def test_cursor_rejects_bad_tokens(client):
+    from app.pagination import encode_cursor
+
+    assert client.get("/api/reason-codes?cursor=not-a-cursor").status_code == 400
+    foreign = encode_cursor("merchants", [1.0, "merchant-high-1"])
+    assert client.get(f"/api/reason-codes?cursor={foreign}").status_code == 400
+    cursor = client.get("/api/merchants/chargeback-ratio?limit=1").headers["x-next-cursor"]
+    assert client.get(f"/api/merchants/chargeback-ratio?limit=1&offset=1&cursor={cursor}").status_code == 400
+    weekly = client.get("/api/trends?granularity=weekly&limit=1").headers["x-next-cursor"]
+    assert client.get(f"/api/trends?granularity=daily&cursor={weekly}").status_code == 400
+
+
+def test_amount_usd_follows_date_effective_fx_rates(client, db_session):
+    from datetime import date
+    from sqlalchemy import text
+    from app.cache import bump_data_version
+    from app.fx import recompute_amount_usd, set_fx_rate
+
+    def usd(table, row_id):
+        return db_session.execute(text(f"SELECT amount_usd FROM {table} WHERE external_id = :id"), {"id": row_id}).scalar()
+
+    assert usd("transactions", "tx-high-value-1") == 10000.0 / 17.0
+    assert usd("chargebacks", "cb-high-value-1") == 10000.0 / 17.0
+    assert usd("chargebacks", "cb-m2-0") == 300000.0 / 4000.0
+
+    try:
+        counts = set_fx_rate(db_session.connection(), "MXN", date(2024, 11, 16), 25.0)
+        db_session.commit()
+        bump_data_version()
+        assert counts["chargebacks.amount_usd"] >= 1
+        assert usd("transactions", "tx-high-value-1") == 10000.0 / 17.0
+        assert usd("chargebacks", "cb-high-value-1") == 10000.0 / 25.0
+
+        alerts = client.get("/api/alerts").json()
+        assert any(a["alert_type"] == "HIGH_VALUE_DISPUTE" and a["metric_value"] == 588.24 for a in alerts)
+        export = client.get("/api/export/chargebacks?reason_code=10.4&start=2024-11-18&end=2024-11-19").text
+        assert '"amount_usd":400.0' in export
+    finally:
+        db_session.execute(text("DELETE FROM fx_rates WHERE currency = 'MXN' AND effective_date = '2024-11-16'"))
+        recompute_amount_usd(db_session.connection(), currency="MXN")
+        db_session.commit()
+        bump_data_version()
+    assert usd("chargebacks", "cb-high-value-1") == 10000.0 / 17.0
+
+
+def test_migration_adds_amount_usd_to_existing_database(tmp_path):
+    from sqlalchemy import create_engine, text
+    from app.database import Base
+    from app.encoding import RECORDS, insert_records
+    from app.migrations import apply_migrations
+
+    legacy = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    RECORDS.create_all(bind=legacy)
+    with legacy.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO merchants VALUES ('m1', 'Legacy', 'CO')")
+        conn.exec_driver_sql(
+            "INSERT INTO transactions VALUES ('t1', '2024-01-01 00:00:00.000000', 8000.0, 'COP', 'm1', 'c1',"
+            " 'credit_card', 'CO', 'Apparel', 'approved', '524099')"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO transactions VALUES ('t-orphan', '2024-01-01 00:00:00.000000', 1.0, 'COP', 'm-missing', 'c1',"
+            " 'credit_card', 'CO', 'Apparel', 'approved', '524099')"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO chargebacks VALUES ('c1', 't1', '2024-01-05 00:00:00.000000', '13.1',"
+            " 'Merchandise/Services Not Received', 'open', 8000.0)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO chargebacks VALUES ('c-orphan', 't-orphan', '2024-01-06 00:00:00.000000', '13.1',"
+            " 'A later description', 'open', 1.0)"
+        )
+
+    Base.metadata.create_all(bind=legacy)
+    with legacy.begin() as conn:
+        assert apply_migrations(conn) == [
+            "0001_amount_usd", "0002_covering_indexes", "0003_monthly_partitions", "0004_compact_keys",
+        ]
+        assert apply_migrations(conn) == []
+        assert conn.execute(text("SELECT external_id, amount_usd FROM transactions")).fetchall() == [("t1", 2.0)]
+        assert conn.execute(text("""
+            SELECT c.external_id, t.external_id, r.description, d.value
+            FROM chargebacks c
+            JOIN transactions t ON t.id = c.transaction_id
+            JOIN reason_codes r ON r.code = c.reason_code
+            JOIN dictionary d ON d.id = c.status_id
+        """)).fetchall() == [("c1", "t1", "Merchandise/Services Not Received", "open")]
+        assert conn.execute(text("SELECT transaction_count, chargeback_count FROM merchant_stats")).fetchall() == [(1, 1)]
+        orphans = conn.execute(text(
+            "SELECT source, external_id, parent_id, json_extract(record, '$.amount') FROM legacy_orphans ORDER BY id"
+        )).fetchall()
+        assert orphans == [("transactions", "t-orphan", "m-missing", 1.0), ("chargebacks", "c-orphan", "t-orphan", 1.0)]
+        insert_records(conn, "transactions", [{
+            "id": "t2", "timestamp": datetime(2024, 1, 2), "amount": 34.0, "currency": "MXN", "merchant_id": "m1",
+            "customer_id": "c2", "payment_method": "credit_card", "country": "MX", "product_category": "Apparel",
+            "status": "approved", "card_bin": "411111",
+        }])
+        assert conn.execute(text("SELECT amount_usd FROM transactions WHERE external_id = 't2'")).scalar() == 2.0
+        indexes = {row[1] for row in conn.exec_driver_sql("PRAGMA index_list(transactions)")}
+        assert {
+            "ix_transactions_amount_usd_merchant_id", "ix_transactions_country_id", "ix_transactions_external_id",
+        } <= indexes
+        assert "ix_transactions_amount_usd" not in indexes
+    legacy.dispose()
+
+
+def _direct_trends(db_session, granularity, start=None, end=None, merchant_id=None, reason_code=None):
+    from sqlalchemy import text
+    from app.rollups import PERIOD_LABEL_SQL
+
+    label = PERIOD_LABEL_SQL[granularity].format("c.chargeback_date")
+    rows = db_session.execute(text(f"""
+        SELECT {label} AS period, COUNT(*), ROUND(SUM(c.amount), 2)
+        FROM chargebacks c JOIN transactions t ON t.id = c.transaction_id JOIN merchants m ON m.id = t.merchant_id
+        WHERE (:start IS NULL OR DATE(c.chargeback_date) >= :start) AND (:end IS NULL OR DATE(c.chargeback_date) < :end)
+          AND (:merchant_id IS NULL OR m.external_id = :merchant_id) AND (:reason_code IS NULL OR c.reason_code = :reason_code)
+        GROUP BY period ORDER BY period
+    """), {"start": start, "end": end, "merchant_id": merchant_id, "reason_code": reason_code})
+    return [{"period": p, "chargeback_count": n, "total_amount": a} for p, n, a in rows]
+
+
+@pytest.mark.parametrize("granularity", ["daily", "weekly", "monthly"])
+def test_trends_buckets_match_chargebacks(client, db_session, granularity):
+    from datetime import date, timedelta
+
+    days = sorted({r["period"] for r in _direct_trends(db_session, "daily")})
+    start = (date.fromisoformat(days[0]) + timedelta(days=3)).isoformat()
+    end = (date.fromisoformat(days[-1]) - timedelta(days=2)).isoformat()
+    for filters in (
+        {}, {"start": start}, {"end": end}, {"start": start, "end": end},
+        {"merchant_id": "merchant-high-1"}, {"reason_code": "10.4", "start": start, "end": end},
+    ):
+        query = "&".join(f"{name}={value}" for name, value in filters.items())
+        response = client.get(f"/api/trends?granularity={granularity}&limit=366&{query}")
+        assert response.status_code == 200
+        assert response.json() == _direct_trends(db_session, granularity, **filters), filters
+
+
+def test_trends_fill_gaps(client, db_session):
+    from datetime import date, timedelta
+
+    sparse = client.get("/api/trends?granularity=daily&reason_code=12.6&limit=366").json()
+    day = date.fromisoformat(sparse[0]["period"])
+    start, end = (day - timedelta(days=3)).isoformat(), (day + timedelta(days=4)).isoformat()
+
+    filled = client.get(f"/api/trends?granularity=daily&reason_code=12.6&start={start}&end={end}&fill_gaps=true").json()
+    assert [p["period"] for p in filled] == [(day + timedelta(days=i)).isoformat() for i in range(-3, 4)]
+    assert [p for p in filled if p["chargeback_count"]] == sparse[:1]
+    assert all(p["total_amount"] == 0.0 for p in filled if not p["chargeback_count"])
+
+    weeks = client.get("/api/trends?granularity=weekly&fill_gaps=true&limit=366").json()
+    assert [p for p in weeks if p["chargeback_count"]] == client.get("/api/trends?granularity=weekly&limit=366").json()
+    assert weeks[0]["chargeback_count"] and weeks[-1]["chargeback_count"]
+
+    rows, _ = _walk_cursor(client, "/api/trends?granularity=weekly&fill_gaps=true", limit=4)
+    assert rows == weeks
+    assert client.get("/api/trends?start=2024-02-01&end=2024-01-01").status_code == 400
+
+
+def test_trend_buckets_follow_writes(client, db_session):
+    from datetime import datetime
+    from sqlalchemy import text
+    from app.cache import bump_data_version
+    from app.rollups import ROLLUP_TABLES
+
+    def buckets():
+        return {
+            table: sorted(tuple(r) for r in db_session.execute(text(
+                f"SELECT period, merchant_id, reason_code, chargeback_count, ROUND(chargeback_amount, 6) FROM {table}"
+                " WHERE chargeback_count > 0"
+            )))
+            for table in ("chargeback_daily", "chargeback_weekly", "chargeback_monthly")
+        }
+
+    before = buckets()
+    try:
+        _add(
+            db_session, "chargebacks",
+            id="cb-bucket-1", transaction_id="tx-high-value-1", chargeback_date=datetime(2023, 12, 31, 9),
+            reason_code="99.9", reason_description="Bucket test", status="open", amount=40.0,
+        )
+        db_session.commit()
+        bump_data_version()
+        assert client.get("/api/trends?granularity=monthly&reason_code=99.9").json() == [
+            {"period": "2023-12", "chargeback_count": 1, "total_amount": 40.0},
+        ]
+        db_session.execute(text(
+            "UPDATE chargebacks SET chargeback_date = '2024-01-01 09:00:00.000000', amount = 60.0 WHERE external_id = 'cb-bucket-1'"
+        ))
+        db_session.commit()
+        bump_data_version()
+        assert client.get("/api/trends?granularity=weekly&reason_code=99.9&fill_gaps=true&start=2023-12-30").json() == [
+            {"period": "2023-W52", "chargeback_count": 0, "total_amount": 0.0},
+            {"period": "2024-W01", "chargeback_count": 1, "total_amount": 60.0},
+        ]
+    finally:
+        db_session.execute(text("DELETE FROM chargebacks WHERE external_id = 'cb-bucket-1'"))
+        db_session.commit()
+        bump_data_version()
+    assert buckets() == before
+
+    for table in ("chargeback_daily", "chargeback_weekly", "chargeback_monthly"):
+        for statement in ROLLUP_TABLES[table]:
+            db_session.execute(text(statement))
+    assert buckets() == before
+    db_session.rollback()
+
+
+def test_benchmark_report_covers_router_queries(tmp_path):
+    import json
+    from scripts.benchmark import compare_reports, parse_size, percentile, run_benchmark
+    from scripts.router_queries import NEXT_PAGE, ROUTER_REQUESTS
+
+    assert parse_size("10k") == 10_000 and parse_size("1m") == 1_000_000 and parse_size("2500") == 2500
+    assert percentile([5, 1, 4, 2, 3], 0.5) == 3 and percentile(list(range(1, 21)), 0.95) == 19
+
+    report = run_benchmark(["2k"], tmp_path, cold_runs=1, warm_runs=2)
+    size = report["sizes"]["2k"]
+    assert 1_500 < size["tables"]["transactions"] < 2_500
+    requests = {query_id.rsplit(" [", 1)[0].removesuffix(NEXT_PAGE) for query_id in size["queries"]}
+    assert requests == set(ROUTER_REQUESTS)
+    for result in size["queries"].values():
+        assert result["plan"] and result["warm"]["runs"] == 2 and result["cold"]["runs"] == 1
+        assert result["warm"]["p50_ms"] <= result["warm"]["p95_ms"]
+        assert set(result["plan_warnings"]) <= {line.strip() for line in result["plan"]}
+
+    assert compare_reports(report, report, tolerance=0.25) == []
+    query_id = next(iter(size["queries"]))
+    slower = json.loads(json.dumps(report))
+    slower["sizes"]["2k"]["queries"][query_id]["warm"]["p95_ms"] += 50.0
+    slower["sizes"]["2k"]["queries"][query_id]["plan"] = ["SCAN t"]
+    assert len(compare_reports(report, slower, tolerance=0.25)) == 2
+
+
+def test_metrics_endpoint_reports_sql_work_per_route(client, tmp_path):
+    import json
+    from app.cache import bump_data_version
+    from app.metrics import configure_slow_query_log, registry, slow_query_log
+
+    registry.reset()
+    bump_data_version()
+    assert client.get("/api/reason-codes").status_code == 200
+    assert client.get("/api/reason-codes").status_code == 200
+    assert client.get("/api/no-such-route").status_code == 404
+    assert client.get("/api/export/chargebacks").status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'monteverde_http_requests_total{route="/api/reason-codes",method="GET",status="200"} 2' in body
+    assert 'monteverde_http_request_duration_seconds_count{route="/api/reason-codes"} 2' in body
+    assert 'monteverde_http_requests_total{route="unmatched",method="GET",status="404"} 1' in body
+    assert 'route="/metrics"' not in body
+    samples = {
+        line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+        for line in body.splitlines() if line and not line.startswith("#")
+    }
+    # The second /reason-codes request is a cache hit: counted, but with no SQL of its own.
+    assert samples['monteverde_sql_statements_total{route="/api/reason-codes"}'] == 1
+    assert samples['monteverde_sql_rows_total{route="/api/reason-codes"}'] > 0
+    assert samples['monteverde_sql_rows_total{route="/api/export/chargebacks"}'] > 0
+    assert samples['monteverde_serialization_seconds_total{route="/api/reason-codes"}'] > 0
+
+    log_path = tmp_path / "slow.jsonl"
+    configure_slow_query_log(str(log_path))
+    threshold = registry.slow_query_seconds
+    registry.slow_query_seconds = 0.0
+    try:
+        bump_data_version()
+        client.get("/api/win-rate")
+    finally:
+        registry.slow_query_seconds = threshold
+        for handler in list(slow_query_log.handlers):
+            slow_query_log.removeHandler(handler)
+            handler.close()
+
+    body = client.get("/metrics").text
+    assert 'monteverde_slow_queries_total{route="/api/win-rate"} 0' not in body
+    assert 'monteverde_slow_query_seconds{route="/api/win-rate",sample="0"}' in body
+    assert "#   plan: " in body
+    logged = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert logged and logged[0]["route"] == "/api/win-rate" and logged[0]["plan"]
+
+
+def test_alerts_spikes_per_merchant_and_reason_code(client):
+    from datetime import date
+    from app.routers.alerts import spike_windows
+
+    assert spike_windows(date(2024, 11, 20), 7, 2) == {
+        "baseline_start": "2024-10-31", "current_start": "2024-11-14", "current_end": "2024-11-21",
+    }
+
+    spikes = [a for a in client.get("/api/alerts").json() if a["alert_type"] == "WEEKLY_SPIKE"]
+    assert [(a["entity_id"], a["reason_code"], a["metric_value"]) for a in spikes] == [("merchant-high-1", "10.4", 20)]
+
+    # Historical reference time: the 13.1 disputes at merchant-high-2 ran at 7 in the week to Nov 20
+    # against 3 in the week before. merchant-high-1's 10.4 count (9 vs 6) stays under 2×.
+    spikes = [
+        a for a in client.get("/api/alerts?as_of=2024-11-20").json() if a["alert_type"] == "WEEKLY_SPIKE"
+    ]
+    assert [(a["entity_id"], a["reason_code"], a["metric_value"]) for a in spikes] == [("merchant-high-2", "13.1", 7)]
+    assert "7 in the 7 days to 2024-11-20 vs 3 per 7 days" in spikes[0]["description"]
+
+    # 7 vs 3 is not a spike at 2.5×; averaged over a two-week baseline both merchants spike.
+    assert not any(
+        a["alert_type"] == "WEEKLY_SPIKE"
+        for a in client.get("/api/alerts?as_of=2024-11-20&spike_factor=2.5").json()
+    )
+    spikes = [
+        a for a in client.get("/api/alerts?as_of=2024-11-20&spike_factor=2.5&baseline_windows=2").json()
+        if a["alert_type"] == "WEEKLY_SPIKE"
+    ]
+    assert [(a["entity_id"], a["metric_value"]) for a in spikes] == [("merchant-high-2", 7), ("merchant-high-1", 9)]
+    assert "1.5 per 7 days" in spikes[0]["description"] and "3 per 7 days" in spikes[1]["description"]
+    assert client.get("/api/alerts?window_days=0").status_code == 422
+
+
+CUSTOMER_RISK_RAW_SQL = """
+    SELECT t.customer_id, COUNT(*), COUNT(DISTINCT t.merchant_id), ROUND(SUM(c.amount), 4),
+           MIN(c.chargeback_date), MAX(c.chargeback_date)
+    FROM chargebacks c
+    JOIN transactions t ON t.id = c.transaction_id
+    GROUP BY t.customer_id
+    ORDER BY t.customer_id
+"""
+
+CUSTOMER_RISK_ROLLUP_SQL = """
+    SELECT customer_id, chargeback_count, merchant_count, ROUND(total_amount, 4),
+           first_chargeback_date, last_chargeback_date
+    FROM customer_risk
+    ORDER BY customer_id
+"""
+
+
+def _customer_risk_in_step(db_session):
+    from sqlalchemy import text
+
+    return db_session.execute(text(CUSTOMER_RISK_ROLLUP_SQL)).fetchall() == \
+        db_session.execute(text(CUSTOMER_RISK_RAW_SQL)).fetchall()
+
+
+def _risk_tx(tx_id, merchant_id, customer_id="cust-risk"):
+    return dict(
+        id=tx_id, timestamp=datetime(2024, 11, 1), amount=100.0, currency="MXN", merchant_id=merchant_id,
+        customer_id=customer_id, payment_method="credit_card", country="MX", product_category="Electronics",
+        status="approved", card_bin="411111",
+    )
+
+
+def _risk_cb(cb_id, tx_id, day):
+    return dict(
+        id=cb_id, transaction_id=tx_id, chargeback_date=datetime(2024, 11, day), reason_code="10.4",
+        reason_description="Card-Not-Present Fraud", status="open", amount=100.0,
+    )
+
+
+def _add_risk_chargebacks(db_session, *merchant_ids):
+    """One transaction of `cust-risk` at each merchant, each with a chargeback filed on Nov 3, 9, 12..."""
+    from app.encoding import insert_records
+
+    tx_ids = [f"tx-risk-{i}" for i in range(1, len(merchant_ids) + 1)]
+    insert_records(db_session.connection(), "transactions", [_risk_tx(t, m) for t, m in zip(tx_ids, merchant_ids)])
+    db_session.commit()
+    insert_records(db_session.connection(), "chargebacks", [
+        _risk_cb(f"cb-risk-{i}", tx_id, day) for i, (tx_id, day) in enumerate(zip(tx_ids, (3, 9, 12)), start=1)
+    ])
+    db_session.commit()
+
+
+def _cleanup_customer_risk(db_session):
+    from app.cache import bump_data_version
+    from app.models import Chargeback, Transaction
+
+    db_session.query(Chargeback).filter(Chargeback.external_id.like("cb-risk-%")).delete(synchronize_session=False)
+    db_session.query(Transaction).filter(Transaction.external_id.like("tx-risk-%")).delete(synchronize_session=False)
+    db_session.commit()
+    bump_data_version()
+
+
+def test_customer_risk_serves_seeded_customers(client, db_session):
+    from app.cache import bump_data_version
+
+    assert _customer_risk_in_step(db_session)
+    bump_data_version()
+    risk = client.get("/api/customers/repeat-customer-001/risk").json()
+    assert risk["chargeback_count"] == 3 and risk["merchant_count"] == 3 and risk["repeat_offender"]
+    assert risk["first_chargeback_date"] < risk["last_chargeback_date"]
+
+
+def test_customer_risk_of_a_customer_without_chargebacks_is_zero(client):
+    assert client.get("/api/customers/cust-cl-50/risk").json() == {
+        "customer_id": "cust-cl-50", "chargeback_count": 0, "merchant_count": 0, "total_amount": 0.0,
+        "first_chargeback_date": None, "last_chargeback_date": None, "repeat_offender": False,
+    }
+    assert client.get("/api/customers/no-such-customer/risk").status_code == 404
+
+
+def test_customer_risk_tracks_inserted_chargebacks(client, db_session):
+    from sqlalchemy import text
+
+    try:
+        _add_risk_chargebacks(db_session, "merchant-high-1", "merchant-high-1")
+        assert _customer_risk_in_step(db_session)
+        assert db_session.execute(text("SELECT merchant_count FROM customer_risk WHERE customer_id = 'cust-risk'")).scalar() == 1
+    finally:
+        _cleanup_customer_risk(db_session)
+
+
+def test_customer_risk_untouched_by_a_chargeback_filed_before_its_transaction(client, db_session):
+    import json
+
+    # It has no transaction surrogate key to point to, so ingestion rejects it.
+    early = client.post("/api/chargebacks:bulk", content=json.dumps(_risk_cb("cb-risk-1", "tx-risk-1", 12), default=str),
+                        headers={"Content-Type": "application/x-ndjson"}).json()
+    assert (early["inserted"], early["rejected"]) == (0, 1)
+    assert early["rejects"][0]["error"] == "unknown transaction_id 'tx-risk-1'"
+    assert _customer_risk_in_step(db_session)
+
+
+def test_customer_risk_follows_moved_and_reassigned_transactions(client, db_session):
+    from sqlalchemy import text
+    from app.cache import bump_data_version
+
+    try:
+        _add_risk_chargebacks(db_session, "merchant-high-1", "merchant-high-1", "merchant-high-2")
+        db_session.execute(text(
+            "UPDATE transactions SET merchant_id = (SELECT id FROM merchants WHERE external_id = 'merchant-clean-1')"
+            " WHERE external_id = 'tx-risk-1'"
+        ))
+        db_session.execute(text(
+            "UPDATE chargebacks SET chargeback_date = '2024-10-30 00:00:00.000000' WHERE external_id = 'cb-risk-2'"
+        ))
+        db_session.execute(text("UPDATE transactions SET customer_id = 'cust-risk-other' WHERE external_id = 'tx-risk-3'"))
+        db_session.commit()
+        assert _customer_risk_in_step(db_session)
+
+        bump_data_version()
+        risk = client.get("/api/customers/cust-risk/risk").json()
+        assert (risk["chargeback_count"], risk["merchant_count"], risk["total_amount"]) == (2, 2, 200.0)
+        assert risk["first_chargeback_date"].startswith("2024-10-30") and not risk["repeat_offender"]
+    finally:
+        _cleanup_customer_risk(db_session)
+
+
+def test_customer_risk_drops_customers_whose_chargebacks_are_deleted(client, db_session):
+    from sqlalchemy import text
+
+    _add_risk_chargebacks(db_session, "merchant-high-1", "merchant-high-2")
+    _cleanup_customer_risk(db_session)
+    assert _customer_risk_in_step(db_session)
+    assert db_session.execute(text("SELECT COUNT(*) FROM customer_risk WHERE customer_id LIKE 'cust-risk%'")).scalar() == 0
+
+
+def test_customer_risk_rebuild_matches_the_trigger_maintained_rows(client, db_session):
+    from sqlalchemy import text
+    from app.rollups import rebuild_all
+
+    before = db_session.execute(text(CUSTOMER_RISK_ROLLUP_SQL)).fetchall()
+    assert rebuild_all(db_session.connection())["customer_risk"] == len(before)
+    db_session.commit()
+    assert db_session.execute(text(CUSTOMER_RISK_ROLLUP_SQL)).fetchall() == before
+
+
+def test_customer_risk_queries_read_its_indexes(client):
+    from app.routers.customers import CUSTOMER_RISK_SQL
+    from app.routers.fraud import REPEAT_OFFENDERS_AFTER_SQL, REPEAT_OFFENDERS_SQL
+    from tests.conftest import read_engine
+
+    with read_engine.connect() as conn:
+        plans = [
+            " ".join(row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement.text}", params))
+            for statement, params in (
+                (REPEAT_OFFENDERS_SQL, {"min_chargebacks": 3, "limit": 10, "offset": 0}),
+                (REPEAT_OFFENDERS_AFTER_SQL, {"min_chargebacks": 3, "k0": -4, "k1": "x", "limit": 10, "offset": 0}),
+                (CUSTOMER_RISK_SQL, {"customer_id": "x"}),
+            )
+        ]
+    assert all("COVERING INDEX ix_customer_risk_chargeback_count" in plan and "TEMP B-TREE" not in plan for plan in plans[:2])
+    assert plans[2] == "SEARCH customer_risk USING PRIMARY KEY (customer_id=?)"
+
+
+def test_index_advisor_proposes_covering_indexes_and_migrates_idempotently(tmp_path):
+    from sqlalchemy import create_engine
+    from app.database import Base, create_read_engine
+    from app.migrations import apply_index_migration, apply_migrations
+    from scripts.index_advisor import Candidate, _schema, model_declarations, propose
+    from scripts.router_queries import capture_router_queries, plan_warnings
+
+    url = f"sqlite:///{tmp_path / 'advisor.db'}"
+    writer = create_engine(url)
+    Base.metadata.create_all(bind=writer)
+    with writer.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_transactions_country_id")
+        conn.exec_driver_sql("DROP INDEX ix_chargebacks_reason_code_amount_status_id")
+
+    reader = create_read_engine(url)
+    queries = capture_router_queries(reader, [
+        "/api/segments/high-risk?dimension=country", "/api/reason-codes", "/api/merchants/chargeback-ratio",
+    ], follow_cursor=False)
+    with reader.connect() as conn:
+        schema = _schema(conn)
+        for table in ("transactions", "chargebacks"):
+            schema[table]["rows"] = 10**6
+        proposed = {
+            query.request.split("?")[0]: propose(conn, query, query.explain(conn), schema) for query in queries
+        }
+        segments_plan = next(q for q in queries if "segments" in q.request).explain(conn)
+    reader.dispose()
+    assert "SCAN t" in plan_warnings(segments_plan)
+    assert Candidate("transactions", ("country_id", "id")) in proposed["/api/segments/high-risk"]
+    assert Candidate("chargebacks", ("reason_code", "amount")) in proposed["/api/reason-codes"]
+    assert proposed["/api/merchants/chargeback-ratio"] == []
+    assert model_declarations([Candidate("transactions", ("country_id", "id")).ddl]) == [
+        'transactions: Index("ix_transactions_country_id_id", "country_id", "id"),'
+    ]
+
+    with writer.begin() as conn:
+        assert apply_migrations(conn) == [
+            "0001_amount_usd", "0002_covering_indexes", "0003_monthly_partitions", "0004_compact_keys",
+        ]
+        assert apply_migrations(conn) == []
+        ddl = [Candidate("transactions", ("card_bin", "customer_id")).ddl]
+        assert apply_index_migration(conn, "0099_advisor", ddl) == ["ix_transactions_card_bin_customer_id"]
+        assert apply_index_migration(conn, "0099_advisor", ddl) is None
+        assert apply_index_migration(conn, "0100_advisor", ddl) == []
+        indexes = {row[1] for row in conn.exec_driver_sql("PRAGMA index_list(transactions)")}
+        assert {"ix_transactions_country_id", "ix_transactions_card_bin_customer_id"} <= indexes
+    writer.dispose()
+
+
+def test_dashboard_panels_match_endpoints_from_one_snapshot(client):
+    from app.cache import bump_data_version
+    from app.metrics import registry
+
+    endpoints = {
+        "ratio": "/api/merchants/chargeback-ratio",
+        "reason_codes": "/api/reason-codes",
+        "trends": "/api/trends",
+        "fraud": "/api/fraud-patterns",
+        "recommendations": "/api/recommendations",
+        "win_rate": "/api/win-rate",
+    }
+    registry.reset()
+    bump_data_version()
+    expected = {name: client.get(url).json() for name, url in endpoints.items()}
+    expected["segments"] = [
+        row
+        for dimension in ("country", "category", "payment_method")
+        for row in client.get(f"/api/segments/high-risk?dimension={dimension}").json()
+    ]
+    expected["alerts"] = client.get("/api/alerts").json()
+
+    response = client.get("/api/dashboard")
+    assert response.status_code == 200
+    dashboard = response.json()
+    assert set(dashboard) == set(expected)
+    for name, rows in expected.items():
+        if name == "alerts":
+            # The high-value alert has no ORDER BY in either path.
+            assert sorted(dashboard[name], key=str) == sorted(rows, key=str), name
+        else:
+            assert dashboard[name] == rows, name
+    timings = [part.split(";")[0] for part in response.headers["Server-Timing"].split(", ")]
+    assert timings[0] == "working_set" and set(timings[1:]) == set(expected)
+
+    body = client.get("/metrics").text
+    statements = {
+        line.split('route="')[1].split('"')[0]: float(line.rsplit(" ", 1)[1])
+        for line in body.splitlines() if line.startswith("monteverde_sql_statements_total{")
+    }
+    assert statements["/api/dashboard"] < sum(v for route, v in statements.items() if route != "/api/dashboard")
+
+    subset = client.get("/api/dashboard?panels=ratio,trends&limit=2").json()
+    assert subset["ratio"] == expected["ratio"][:2] and subset["trends"] == expected["trends"][:2]
+    assert all(subset[name] is None for name in expected if name not in ("ratio", "trends"))
+    assert client.get("/api/dashboard?panels=ratio,nope").status_code == 400
+    assert client.get("/api/dashboard?granularity=hourly").status_code == 400
+
+
+def test_read_snapshot_ignores_commits_made_while_it_is_open(tmp_path):
+    from sqlalchemy import create_engine
+    from app.database import create_read_engine, read_snapshot
+
+    url = f"sqlite:///{tmp_path / 'snapshot.db'}"
+    writer = create_engine(url)
+    with writer.begin() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        conn.exec_driver_sql("CREATE TABLE events (id INTEGER PRIMARY KEY)")
+        conn.exec_driver_sql("INSERT INTO events DEFAULT VALUES")
+    reader = create_read_engine(url)
+
+    with reader.connect() as conn:
+        with read_snapshot(conn):
+            before = conn.exec_driver_sql("SELECT COUNT(*) FROM events").scalar()
+            with writer.begin() as other:
+                other.exec_driver_sql("INSERT INTO events DEFAULT VALUES")
+            during = conn.exec_driver_sql("SELECT COUNT(*) FROM events").scalar()
+        after = conn.exec_driver_sql("SELECT COUNT(*) FROM events").scalar()
+    reader.dispose()
+    writer.dispose()
+    assert (before, during, after) == (1, 1, 2)
+
+
+ROLLUP_SNAPSHOT_SQL = [
+    "SELECT merchant_id, transaction_count, chargeback_count, ROUND(chargeback_amount, 4), chargeback_ratio"
+    " FROM merchant_stats ORDER BY 1",
+    *(
+        f"SELECT period, merchant_id, reason_code, chargeback_count, ROUND(chargeback_amount, 4) FROM {table}"
+        " WHERE chargeback_count > 0 ORDER BY 1, 2, 3"
+        for table in ("chargeback_daily", "chargeback_weekly", "chargeback_monthly")
+    ),
+    "SELECT customer_id, chargeback_count, merchant_count, ROUND(total_amount, 4), first_chargeback_date,"
+    " last_chargeback_date FROM customer_risk ORDER BY 1",
+]
+
+
+PARTITION_URLS = [
+    "/api/merchants/chargeback-ratio", "/api/reason-codes", "/api/win-rate", "/api/recommendations",
+    "/api/segments/high-risk?dimension=country", "/api/fraud-patterns?min_count=2", "/api/alerts?as_of=2024-11-20",
+    "/api/customers/repeat-customer-001/risk", "/api/trends?granularity=weekly", "/api/dashboard?as_of=2024-11-20",
+    "/api/export/chargebacks",
+]
+PARTITION_URLS += [f"{path}{'&' if '?' in path else '?'}start=2024-11-01&end=2024-11-16" for path in PARTITION_URLS]
+
+
+@pytest.fixture
+def partitioned(client, tmp_path):
+    """
+    Write engine of a scratch database seeded like the test database, which the API reads from, and
+    the statements of the last `_partition_responses()`.
+    """
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import Session
+    from app.cache import bump_data_version
+    from app.database import Base, create_read_engine, get_read_engine
+    from app.main import app
+    from app.migrations import apply_migrations
+    from tests.conftest import _seed_test_data, read_engine
+
+    url = f"sqlite:///{tmp_path / 'partitioned.db'}"
+    writer = create_engine(url)
+    Base.metadata.create_all(bind=writer)
+    with writer.begin() as conn:
+        apply_migrations(conn)
+    with Session(writer) as session:
+        _seed_test_data(session)
+    reader = create_read_engine(url)
+    statements = []
+    app.dependency_overrides[get_read_engine] = lambda: reader
+    event.listen(reader, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    try:
+        yield writer, statements
+    finally:
+        app.dependency_overrides[get_read_engine] = lambda: read_engine
+        bump_data_version()
+        reader.dispose()
+        writer.dispose()
+
+
+def _partition_responses(client, statements):
+    from app.cache import bump_data_version
+
+    bump_data_version()
+    statements.clear()
+    return {path: client.get(path).content for path in PARTITION_URLS}
+
+
+def _partition_rollups_in_step(writer):
+    from sqlalchemy import text
+    from app.rollups import ROLLUP_TABLES
+
+    def rollups():
+        with writer.connect() as conn:
+            return [conn.execute(text(sql)).fetchall() for sql in ROLLUP_SNAPSHOT_SQL]
+
+    maintained = rollups()
+    with writer.begin() as conn:
+        for statements in ROLLUP_TABLES.values():
+            for statement in statements:
+                conn.execute(text(statement))
+    return rollups() == maintained
+
+
+def test_partitions_keep_the_open_month_hot(partitioned):
+    from app.partitions import archive_month
+
+    writer, _ = partitioned
+    with pytest.raises(ValueError, match="stays open"):
+        archive_month(writer, "2026-09")
+
+
+def test_archived_months_serve_the_same_responses(client, partitioned):
+    import json
+    from sqlalchemy import text
+    from app.partitions import archive_month
+
+    writer, statements = partitioned
+    with writer.connect() as conn:
+        transactions = conn.execute(text("SELECT COUNT(*) FROM transactions")).scalar()
+    before = _partition_responses(client, statements)
+    assert json.loads(before["/api/reason-codes?start=2024-11-01&end=2024-11-16"]) != json.loads(before["/api/reason-codes"])
+    october = archive_month(writer, "2024-10")
+    november = archive_month(writer, "2024-11")
+    with writer.connect() as conn:
+        hot = conn.execute(text("SELECT COUNT(*) FROM transactions")).scalar()
+    assert hot > 0 and october["transaction_count"] + november["transaction_count"] + hot == transactions
+    assert _partition_responses(client, statements) == before
+    assert _partition_rollups_in_step(writer)
+
+
+def test_partitions_outside_the_range_are_pruned(client, partitioned):
+    from app.cache import bump_data_version
+    from app.partitions import archive_month
+
+    writer, statements = partitioned
+    archive_month(writer, "2024-10")
+    archive_month(writer, "2024-11")
+    # Chargebacks filed from Nov 10 on are all in the November partition.
+    bump_data_version()
+    statements.clear()
+    client.get("/api/reason-codes?start=2024-11-10")
+    assert "chargebacks_2024_11" in statements[0] and "2024_10" not in statements[0]
+
+
+def test_archived_partitions_are_read_only(partitioned):
+    from sqlalchemy.exc import IntegrityError
+    from app.partitions import archive_month
+
+    writer, _ = partitioned
+    archive_month(writer, "2024-11")
+    with pytest.raises(IntegrityError, match="read-only"):
+        with writer.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM chargebacks_2024_11")
+
+
+def test_detached_month_drops_out_of_responses(client, partitioned, tmp_path):
+    import json
+    from sqlalchemy import text
+    from app.partitions import archive_month, detach_month
+
+    writer, statements = partitioned
+    archive_month(writer, "2024-10")
+    archive_month(writer, "2024-11")
+    with writer.connect() as conn:
+        hot_chargebacks = conn.execute(text("SELECT COUNT(*) FROM chargebacks")).scalar()
+    path = detach_month(writer, "2024-11", tmp_path / "partitions")
+    assert path.exists() and path.stat().st_mode & 0o222 == 0
+    assert _partition_rollups_in_step(writer)
+    detached = _partition_responses(client, statements)
+    assert sum(row["count"] for row in json.loads(detached["/api/reason-codes"])) == hot_chargebacks
+    assert json.loads(detached["/api/reason-codes?start=2024-11-01&end=2024-11-16"]) == []
+    assert json.loads(detached["/api/customers/repeat-customer-001/risk"]) == {"detail": "Customer not found"}
+
+
+def test_reattached_month_serves_the_same_responses(client, partitioned, tmp_path):
+    from app.partitions import archive_month, attach_month, detach_month, list_partitions
+
+    writer, statements = partitioned
+    before = _partition_responses(client, statements)
+    archive_month(writer, "2024-10")
+    archive_month(writer, "2024-11")
+    detach_month(writer, "2024-11", tmp_path / "partitions")
+    attach_month(writer, "2024-11")
+    assert [p["status"] for p in list_partitions(writer)] == ["attached", "attached"]
+    assert _partition_responses(client, statements) == before
+    assert _partition_rollups_in_step(writer)
+
+
+def _wait_for_job(client, job_id, timeout=60.0):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {job['status']}")
+
+
+def test_jobs_return_endpoint_results_and_expire(client):
+    from app.jobs import runner
+
+    response = client.post("/api/jobs", json={"kind": "fraud-patterns", "params": {"limit": 10, "min_count": 2}})
+    assert response.status_code == 202
+    job = response.json()
+    assert response.headers["location"] == f"/api/jobs/{job['id']}"
+    assert job["status"] in ("queued", "running")
+    assert job["params"]["time_window_hours"] == 48
+
+    ranged = client.post("/api/jobs", json={
+        "kind": "recommendations", "params": {"start": "2024-11-01", "end": "2024-11-16"},
+    }).json()
+
+    done = _wait_for_job(client, job["id"])
+    assert done["status"] == "succeeded" and done["error"] is None
+    assert done["result"] == client.get("/api/fraud-patterns?limit=10&min_count=2").json()
+    assert done["progress"] == {"done": 0, "total": None}
+    ranged = _wait_for_job(client, ranged["id"])
+    assert ranged["result"] == client.get("/api/recommendations?start=2024-11-01&end=2024-11-16").json()
+
+    assert client.post("/api/jobs", json={"kind": "export"}).status_code == 400
+    assert client.post("/api/jobs", json={"kind": "recommendations", "params": {"limit": 0}}).status_code == 422
+    bad_range = client.post("/api/jobs", json={
+        "kind": "fraud-patterns", "params": {"start": "2024-12-01", "end": "2024-11-01"},
+    })
+    assert bad_range.status_code == 422 and "start must be before end" in bad_range.text
+    assert client.get("/api/jobs/unknown").status_code == 404
+    assert client.post(f"/api/jobs/{job['id']}:cancel").status_code == 409
+
+    ttl = runner.ttl_seconds
+    runner.ttl_seconds = 0
+    try:
+        assert client.get(f"/api/jobs/{job['id']}").status_code == 404
+    finally:
+        runner.ttl_seconds = ttl
+
+
+def test_seed_job_reports_progress_and_cancels(client, tmp_path):
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import sessionmaker
+    from app.cache import data_version
+    from app.database import Base, get_db
+    from app.main import app
+    from app.migrations import apply_migrations
+    from tests.conftest import override_get_db
+
+    writer = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    Base.metadata.create_all(bind=writer)
+    with writer.begin() as conn:
+        apply_migrations(conn)
+    sessions = sessionmaker(bind=writer)
+
+    def counts():
+        with writer.connect() as conn:
+            return conn.execute(text(
+                "SELECT (SELECT COUNT(*) FROM transactions), (SELECT SUM(transaction_count) FROM merchant_stats)"
+            )).one()
+
+    def override():
+        with sessions() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override
+    try:
+        version = data_version.current
+        job = client.post("/api/jobs", json={"kind": "seed", "params": {"scale": 0.5}}).json()
+        done = _wait_for_job(client, job["id"])
+        assert done["status"] == "succeeded"
+        transactions = done["result"]["transactions"]
+        assert done["progress"] == {"done": transactions, "total": transactions}
+        assert counts() == (transactions, transactions)
+        assert data_version.current > version
+
+        # Three 20k-transaction shards: the cancellation lands before the last one is written.
+        job = client.post("/api/jobs", json={"kind": "seed", "params": {"scale": 10}}).json()
+        cancelling = client.post(f"/api/jobs/{job['id']}:cancel")
+        assert cancelling.status_code == 200
+        cancelled = _wait_for_job(client, job["id"])
+        assert cancelled["status"] == "cancelled" and cancelled["result"] is None
+        written, rolled_up = counts()
+        assert written == rolled_up and written < 40_000
+
+        response = client.post("/api/seed")
+        assert response.status_code == 202
+        job = response.json()
+        assert response.headers["location"] == f"/api/jobs/{job['id']}"
+        assert (job["kind"], job["params"]) == ("seed", {"scale": 1.0, "seed": None})
+        assert _wait_for_job(client, job["id"])["status"] == "succeeded"
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+        writer.dispose()
+
+
+def test_precomputed_snapshot_serves_every_page_without_sql(client):
+    from sqlalchemy import event
+    from app.cache import bump_data_version, response_cache
+    from app.precompute import SNAPSHOT_HEADER, scheduler
+    from tests.conftest import read_engine
+
+    urls = [
+        "/api/alerts", "/api/recommendations?limit=1", "/api/recommendations?offset=1",
+        "/api/fraud-patterns?limit=1", "/api/fraud-patterns?limit=2&offset=1",
+    ]
+
+    def walk(url):
+        pages = []
+        while url:
+            response = client.get(url)
+            pages.append((response.json(), SNAPSHOT_HEADER.lower() in response.headers))
+            cursor = response.headers.get("x-next-cursor")
+            url = cursor and f"{url.split('?')[0]}?limit=1&cursor={cursor}"
+        return pages
+
+    bump_data_version()
+    live = {url: walk(url) for url in urls}
+    assert not any(served for pages in live.values() for _, served in pages)
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    previous = scheduler.engine
+    scheduler.start(read_engine)
+    try:
+        status = client.post("/api/precompute:refresh").json()
+        assert status["fresh"] and status["build_ms"] > 0
+        assert status["recommendations"] == 3 and status["repeat_offenders"] == 1 and status["bin_patterns"] >= 1
+        assert status["alerts"] == len(live["/api/alerts"][0][0])
+
+        response_cache.clear()
+        event.listen(read_engine, "before_cursor_execute", listener)
+        served = {url: walk(url) for url in urls}
+        assert statements == []
+        assert {url: [body for body, _ in pages] for url, pages in served.items()} == {
+            url: [body for body, _ in pages] for url, pages in live.items()
+        }
+        assert all(from_snapshot for pages in served.values() for _, from_snapshot in pages)
+
+        # Non-default parameters and date ranges are computed live.
+        for url in ["/api/alerts?ratio_threshold=2", "/api/fraud-patterns?min_count=3",
+                    "/api/recommendations?start=2024-11-01"]:
+            assert SNAPSHOT_HEADER.lower() not in client.get(url).headers
+        assert statements
+
+        # A write makes the snapshot stale until it is rebuilt.
+        bump_data_version()
+        assert SNAPSHOT_HEADER.lower() not in client.get("/api/alerts").headers
+        assert client.get("/api/precompute").json()["fresh"] is False
+    finally:
+        event.remove(read_engine, "before_cursor_execute", listener)
+        scheduler.start(previous)
+
+
+@pytest.fixture
+def alert_stream(client, tmp_path):
+    """An `AlertStream` over a scratch database seeded like the test database, and its write engine."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from app.alert_stream import AlertStream
+    from app.database import Base, create_read_engine
+    from app.migrations import apply_migrations
+    from tests.conftest import _seed_test_data
+
+    url = f"sqlite:///{tmp_path / 'stream.db'}"
+    writer = create_engine(url)
+    Base.metadata.create_all(bind=writer)
+    with writer.begin() as conn:
+        apply_migrations(conn)
+    with Session(writer) as session:
+        _seed_test_data(session)
+    reader = create_read_engine(url)
+    try:
+        yield AlertStream(reader), writer
+    finally:
+        reader.dispose()
+        writer.dispose()
+
+
+def _stream_add(writer, prefix, merchant_id, count, amount=100.0, days_ago=0, reason_code=None):
+    """Commit `count` transactions made today - `days_ago`, each with a chargeback if `reason_code` is given."""
+    from datetime import date, timedelta
+    from sqlalchemy.orm import Session
+
+    day = datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=12) - timedelta(days=days_ago)
+    with Session(writer) as session:
+        for i in range(count):
+            _add(
+                session, "transactions",
+                id=f"{prefix}-{i}", timestamp=day, amount=amount, currency="USD",
+                merchant_id=merchant_id, customer_id=f"{prefix}-cust-{i}", payment_method="credit_card",
+                country="MX", product_category="Electronics", status="approved", card_bin="411111",
+            )
+        session.flush()
+        if reason_code is not None:
+            for i in range(count):
+                _add(
+                    session, "chargebacks",
+                    id=f"cb-{prefix}-{i}", transaction_id=f"{prefix}-{i}", chargeback_date=day,
+                    reason_code=reason_code, reason_description="Card-Not-Present Fraud", status="open", amount=amount,
+                )
+        session.commit()
+
+
+def _stream_add_spike(writer):
+    """A spike of 10.4 disputes in merchant-clean-1's current window, over a two-dispute baseline."""
+    _stream_add(writer, "tx-stream-base", "merchant-clean-1", 2, days_ago=10, reason_code="10.4")
+    _stream_add(writer, "tx-stream-now", "merchant-clean-1", 6, reason_code="10.4")
+
+
+def _streamed_matches_live(client, stream):
+    import json
+    from app.cache import bump_data_version
+    from app.database import get_read_engine
+    from app.main import app
+    from tests.conftest import read_engine
+
+    bump_data_version()
+    app.dependency_overrides[get_read_engine] = lambda: stream.engine
+    try:
+        live = sorted(json.dumps(alert, sort_keys=True) for alert in client.get("/api/alerts").json())
+    finally:
+        app.dependency_overrides[get_read_engine] = lambda: read_engine
+    streamed = sorted(json.dumps(alert.model_dump(mode="json"), sort_keys=True) for alert in stream.rules.active.values())
+    return streamed == live
+
+
+def test_alert_stream_first_poll_fires_every_active_alert(client, alert_stream):
+    stream, _ = alert_stream
+    events = stream.poll()
+    assert stream.rules.full_passes == 1
+    assert [e.kind for e in events] == ["alert"] * len(events) and [e.id for e in events] == list(range(1, len(events) + 1))
+    assert {e.key[:2] for e in events} >= {("HIGH_CHARGEBACK_RATIO", "merchant-high-1"), ("HIGH_CHARGEBACK_RATIO", "merchant-high-2")}
+    assert _streamed_matches_live(client, stream)
+    assert stream.poll() == []
+
+
+def test_alert_stream_reads_only_appended_rows(client, alert_stream):
+    from sqlalchemy import event
+
+    stream, writer = alert_stream
+    stream.poll()
+    _stream_add_spike(writer)
+    _stream_add(writer, "tx-stream-big", "merchant-clean-1", 1, amount=9000.0, reason_code="13.1")
+    statements = []
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(stream.engine, "before_cursor_execute", listener)
+    try:
+        events = stream.poll()
+    finally:
+        event.remove(stream.engine, "before_cursor_execute", listener)
+    assert stream.rules.full_passes == 1
+    assert not any("chargeback_daily" in sql or "HAVING" in sql for sql in statements)
+    assert len(statements) <= 5
+    assert all(e.kind == "alert" for e in events)
+    assert {("WEEKLY_SPIKE", "merchant-clean-1", "10.4"), ("HIGH_VALUE_DISPUTE", "tx-stream-big-0")} <= {e.key for e in events}
+    assert _streamed_matches_live(client, stream)
+
+
+def test_alert_stream_resolves_an_alert_without_repeating_the_others(client, alert_stream):
+    stream, writer = alert_stream
+    stream.poll()
+    _stream_add(writer, "tx-stream-dilute", "merchant-high-2", 800)
+    events = stream.poll()
+    assert [(e.kind, e.key) for e in events] == [("resolved", ("HIGH_CHARGEBACK_RATIO", "merchant-high-2"))]
+    assert stream.rules.full_passes == 1
+    assert _streamed_matches_live(client, stream)
+
+
+def test_alert_stream_reevaluates_in_full_after_a_delete(client, alert_stream):
+    from sqlalchemy.orm import Session
+    from app.models import Chargeback
+
+    stream, writer = alert_stream
+    _stream_add_spike(writer)
+    stream.poll()
+    with Session(writer) as session:
+        session.query(Chargeback).filter(Chargeback.external_id.like("cb-tx-stream-now-%")).delete(synchronize_session=False)
+        session.commit()
+    events = stream.poll()
+    assert stream.rules.full_passes == 2
+    assert ("resolved", ("WEEKLY_SPIKE", "merchant-clean-1", "10.4")) in [(e.kind, e.key) for e in events]
+    assert _streamed_matches_live(client, stream)
+
+
+def test_alert_stream_replays_missed_events_or_the_active_alerts(alert_stream):
+    stream, writer = alert_stream
+    stream.poll()
+    _stream_add(writer, "tx-stream-dilute", "merchant-high-2", 800)
+    events = stream.poll()
+    last = events[-1].id
+    assert stream.replay(events[0].id - 1) == (events, last)
+    assert stream.replay(last) == ([], last)
+    active, position = stream.replay(None)
+    assert {e.key for e in active} == set(stream.rules.active) and position == last
+    assert [e.id for e in active] == sorted(e.id for e in active)
+    assert stream.replay(last + 100)[0] == active
+
+
+def test_alert_stream_frames_wake_waiting_subscribers(alert_stream):
+    import asyncio
+    import json
+
+    stream, writer = alert_stream
+    last = stream.poll()[-1].id
+
+    async def subscribe():
+        async def connected():
+            return False
+
+        frames = stream.frames(last, connected)
+        assert (await frames.__anext__()).startswith("retry: ")
+        waiting = asyncio.ensure_future(frames.__anext__())
+        await asyncio.sleep(0)
+        _stream_add(writer, "tx-stream-late", "merchant-clean-1", 1, amount=12000.0, reason_code="13.1")
+        await asyncio.to_thread(stream.poll)
+        frame = await asyncio.wait_for(waiting, 5)
+        await frames.aclose()
+        return frame
+
+    lines = asyncio.run(subscribe()).splitlines()
+    assert lines[0] == f"id: {last + 1}" and lines[1] == "event: alert"
+    assert json.loads(lines[2].removeprefix("data: "))["entity_id"] == "merchant-clean-1"
+
+
+def test_alert_stream_rejects_a_malformed_last_event_id(client):
+    assert client.get("/api/alerts/stream", headers={"Last-Event-ID": "abc"}).status_code == 400
+
+
+SERIALIZATION_URLS = {
+    "/api/merchants/chargeback-ratio?limit=2": "MerchantRatio",
+    "/api/reason-codes": "ReasonCodeSummary",
+    "/api/win-rate": "WinRateByReasonCode",
+    "/api/segments/high-risk?dimension=country&threshold=0": "HighRiskSegment",
+    "/api/trends?fill_gaps=true&start=2024-11-01&end=2024-11-08": "TrendPoint",
+    "/api/alerts?as_of=2024-11-20": "Alert",
+    "/api/fraud-patterns?min_count=2": "FraudPattern",
+    "/api/recommendations": "Recommendation",
+    "/api/distributions?dimension=reason_code": "AmountDistribution",
+}
+
+
+def test_fast_serialization_matches_response_model_and_columnar_transposes(client):
+    import json
+    from typing import List
+    from pydantic import TypeAdapter
+    from app import schemas
+    from app.pagination import CURSOR_HEADER
+
+    for url, name in SERIALIZATION_URLS.items():
+        model = getattr(schemas, name)
+        response = client.get(url)
+        assert response.headers["content-type"] == "application/json"
+        adapter = TypeAdapter(List[model])
+        assert adapter.dump_json(adapter.validate_python(response.json())) == response.content, url
+
+        columnar = client.get(f"{url}{'&' if '?' in url else '?'}format=columnar")
+        assert columnar.headers.get(CURSOR_HEADER) == response.headers.get(CURSOR_HEADER)
+        assert columnar.json() == {field: [row[field] for row in response.json()] for field in model.model_fields}
+        assert len(columnar.content) < len(response.content) or not response.json()
+
+    assert client.get("/api/merchants/chargeback-ratio?limit=2").headers[CURSOR_HEADER]
+    assert client.get("/api/trends?start=2030-01-01&format=columnar").json() == {
+        "period": [], "chargeback_count": [], "total_amount": [],
+    }
+    assert client.get("/api/reason-codes?format=xml").status_code == 400
+
+    dashboard = client.get("/api/dashboard?as_of=2024-11-20&panels=ratio,fraud")
+    assert schemas.Dashboard(**dashboard.json()).model_dump_json().encode() == dashboard.content
+    assert dashboard.json()["trends"] is None
+    columnar = client.get("/api/dashboard?as_of=2024-11-20&panels=ratio,fraud&format=columnar").json()
+    for panel, model in (("ratio", schemas.MerchantRatio), ("fraud", schemas.FraudPattern)):
+        rows = dashboard.json()[panel]
+        assert columnar[panel] == {field: [row[field] for row in rows] for field in model.model_fields}
+    assert columnar["trends"] is None
+    assert json.loads(client.get("/api/dashboard?panels=alerts&as_of=2024-11-20").content)["alerts"] == \
+        client.get("/api/alerts?as_of=2024-11-20").json()
+
+
+def test_serialization_benchmark_reports_both_shapes(tmp_path):
+    from scripts.serialization_benchmark import SERIALIZATION_REQUESTS, run_serialization_benchmark
+
+    report = run_serialization_benchmark(["2k"], tmp_path, runs=2)
+    results = report["sizes"]["2k"]["requests"]
+    assert list(results) == SERIALIZATION_REQUESTS
+    for request, result in results.items():
+        assert result["identical"], request
+        assert result["bytes"]["columnar"] <= result["bytes"]["rows"]
+        for timings in (result["request"], result["encode"], result["parse"]):
+            assert all(summary["runs"] == 2 and summary["p50_ms"] <= summary["p95_ms"] for summary in timings.values())
+        assert set(result["encode"]) == {"pydantic", "rows", "columnar"}
+
+
+def test_layout_benchmark_compares_sizes_and_joins(tmp_path):
+    from scripts.layout_benchmark import JOIN_QUERIES, run_layout_benchmark
+
+    report = run_layout_benchmark(["2k"], tmp_path, runs=2)
+    size = report["sizes"]["2k"]
+    assert size["bytes"]["compact"]["total"] < size["bytes"]["legacy"]["total"]
+    for table in size["bytes"]["legacy"]["tables"] and ("transactions", "chargebacks"):  # empty without dbstat
+        assert size["bytes"]["compact"]["tables"][table]["indexes"] < size["bytes"]["legacy"]["tables"][table]["indexes"]
+    assert list(size["joins"]) == list(JOIN_QUERIES)
+    for name, result in size["joins"].items():
+        assert result["identical"] and result["rows"] > 0, name
+        assert all(result[layout]["runs"] == 2 for layout in ("legacy", "compact"))
+
+
+def _exact_distributions(conn, column, start=None, end=None, merchant_id=None):
+    from sqlalchemy import text
+
+    rows = conn.execute(text(f"""
+        SELECT {column}, t.customer_id, c.amount_usd
+        FROM chargebacks c
+        JOIN transactions t ON t.id = c.transaction_id
+        JOIN merchants m ON m.id = t.merchant_id
+        WHERE (:start IS NULL OR DATE(c.chargeback_date) >= :start)
+          AND (:end IS NULL OR DATE(c.chargeback_date) < :end)
+          AND (:merchant_id IS NULL OR m.external_id = :merchant_id)
+    """), {"start": start, "end": end, "merchant_id": merchant_id}).fetchall()
+    groups = {}
+    for value, customer_id, amount in rows:
+        group = groups.setdefault(value, {"count": 0, "customers": set(), "amounts": []})
+        group["count"] += 1
+        group["customers"].add(customer_id)
+        group["amounts"].append(amount)
+    return groups
+
+
+def _assert_distributions_match(distributions, exact):
+    assert {row["value"]: row["chargeback_count"] for row in distributions} == \
+        {value: group["count"] for value, group in exact.items()}
+    assert [row["chargeback_count"] for row in distributions] == \
+        sorted((row["chargeback_count"] for row in distributions), reverse=True)
+    for row in distributions:
+        group = exact[row["value"]]
+        amounts = sorted(group["amounts"])
+        assert row["distinct_customers_exact"] and row["distinct_customers_error"] == 0.0
+        assert row["distinct_customers"] == len(group["customers"])
+        assert (row["amount_min"], row["amount_max"]) == (round(amounts[0], 2), round(amounts[-1], 2))
+        for name, fraction in (("amount_p50", 0.5), ("amount_p90", 0.9), ("amount_p99", 0.99)):
+            expected = amounts[int(fraction * (len(amounts) - 1))]
+            assert abs(row[name] - expected) <= row["amount_relative_error"] * expected + 0.005, (row, name)
+
+
+def _rebuild_stale_sketches(client, db_session):
+    """
+    Rebuild the days left stale by writes that did not rebuild them (the fixture, earlier tests), as
+    the next ingestion batch would, and bring the sketch store up to date.
+    """
+    from app.cache import bump_data_version
+    from app.sketches import rebuild_stale_sketches
+
+    rebuild_stale_sketches(db_session.connection())
+    db_session.commit()
+    bump_data_version()
+    client.get("/api/distributions?dimension=reason_code")
+
+
+def _add_sketch_chargeback(db_session):
+    """A 250 USD chargeback of merchant-clean-1 on Nov 6, reason code 11.1, written without a rebuild."""
+    from app.cache import bump_data_version
+
+    _add(
+        db_session, "transactions",
+        id="tx-sketch-1", timestamp=datetime(2024, 11, 2), amount=250.0, currency="USD",
+        merchant_id="merchant-clean-1", customer_id="cust-sketch-1", payment_method="debit_card",
+        country="CL", product_category="Toys", status="approved", card_bin="601100",
+    )
+    db_session.commit()
+    _add(
+        db_session, "chargebacks",
+        id="cb-sketch-1", transaction_id="tx-sketch-1", chargeback_date=datetime(2024, 11, 6),
+        reason_code="11.1", reason_description="Card Recovery Bulletin", status="open", amount=250.0,
+    )
+    db_session.commit()
+    bump_data_version()
+
+
+def _sketch_chargeback_row(client):
+    rows = client.get("/api/distributions?dimension=reason_code&merchant_id=merchant-clean-1").json()
+    return next((row for row in rows if row["value"] == "11.1"), None)
+
+
+SKETCH_CHARGEBACK_ROW = {"value": "11.1", "chargeback_count": 1, "distinct_customers": 1, "amount_max": 250.0}
+
+
+def test_distributions_match_exact_answers_per_dimension(client, db_session):
+    from tests.conftest import read_engine
+
+    _rebuild_stale_sketches(client, db_session)
+    with read_engine.connect() as conn:
+        for dimension, column in (
+            ("merchant", "m.external_id"), ("reason_code", "c.reason_code"),
+            ("country", "(SELECT value FROM dictionary WHERE id = t.country_id)"),
+        ):
+            _assert_distributions_match(
+                client.get(f"/api/distributions?dimension={dimension}&limit=500").json(), _exact_distributions(conn, column),
+            )
+
+
+def test_distributions_match_exact_answers_over_a_date_range(client, db_session):
+    from tests.conftest import read_engine
+
+    _rebuild_stale_sketches(client, db_session)
+    with read_engine.connect() as conn:
+        _assert_distributions_match(
+            client.get("/api/distributions?dimension=category&start=2024-11-01&end=2024-11-15").json(),
+            _exact_distributions(
+                conn, "(SELECT value FROM dictionary WHERE id = t.product_category_id)", "2024-11-01", "2024-11-15",
+            ),
+        )
+
+
+def test_distributions_match_exact_answers_filtered_by_merchant(client, db_session):
+    from tests.conftest import read_engine
+
+    _rebuild_stale_sketches(client, db_session)
+    with read_engine.connect() as conn:
+        _assert_distributions_match(
+            client.get("/api/distributions?dimension=reason_code&merchant_id=merchant-high-1").json(),
+            _exact_distributions(conn, "c.reason_code", merchant_id="merchant-high-1"),
+        )
+        # No cell set covers a segment and a merchant together: folded on request.
+        _assert_distributions_match(
+            client.get("/api/distributions?dimension=country&merchant_id=merchant-high-1&end=2024-11-15").json(),
+            _exact_distributions(
+                conn, "(SELECT value FROM dictionary WHERE id = t.country_id)", end="2024-11-15",
+                merchant_id="merchant-high-1",
+            ),
+        )
+
+
+def test_distributions_pages_with_a_cursor(client):
+    first = client.get("/api/distributions?dimension=reason_code&limit=2")
+    rest = client.get(f"/api/distributions?dimension=reason_code&limit=500&cursor={first.headers['X-Next-Cursor']}")
+    assert first.json() + rest.json() == client.get("/api/distributions?dimension=reason_code").json()
+
+
+def test_distributions_reject_an_unknown_dimension(client):
+    assert client.get("/api/distributions?dimension=status").status_code == 400
+
+
+def test_distributions_fold_only_a_stale_day_on_read(client, db_session):
+    from app.sketches import sketch_store
+
+    _rebuild_stale_sketches(client, db_session)
+    loaded, folded = sketch_store.loaded_days, sketch_store.folded_days
+    try:
+        _add_sketch_chargeback(db_session)
+        assert SKETCH_CHARGEBACK_ROW.items() <= _sketch_chargeback_row(client).items()
+        assert (sketch_store.loaded_days, sketch_store.folded_days) == (loaded, folded + 1)
+    finally:
+        _cleanup_ingested(db_session, tx_ids=["tx-sketch-1"], cb_ids=["cb-sketch-1"])
+
+
+def test_distributions_load_a_rebuilt_day(client, db_session):
+    from app.sketches import sketch_store
+
+    _rebuild_stale_sketches(client, db_session)
+    loaded, folded = sketch_store.loaded_days, sketch_store.folded_days
+    try:
+        _add_sketch_chargeback(db_session)
+        _rebuild_stale_sketches(client, db_session)
+        assert SKETCH_CHARGEBACK_ROW.items() <= _sketch_chargeback_row(client).items()
+        assert (sketch_store.loaded_days, sketch_store.folded_days) == (loaded + 1, folded)
+    finally:
+        _cleanup_ingested(db_session, tx_ids=["tx-sketch-1"], cb_ids=["cb-sketch-1"])
+
+
+def test_distributions_fold_the_day_of_a_deleted_chargeback(client, db_session):
+    from app.sketches import sketch_store
+
+    _add_sketch_chargeback(db_session)
+    _rebuild_stale_sketches(client, db_session)
+    folded = sketch_store.folded_days
+    _cleanup_ingested(db_session, tx_ids=["tx-sketch-1"], cb_ids=["cb-sketch-1"])
+    assert _sketch_chargeback_row(client) is None
+    assert sketch_store.folded_days == folded + 1
+
+
+def test_bulk_ingest_merges_chargebacks_into_the_sketches_of_their_day(client, db_session):
+    import json
+    from sqlalchemy import text
+    from app.sketches import rebuild_stale_sketches, sketch_store
+
+    transaction = {
+        "id": "tx-sketch-2", "timestamp": "2024-11-02T10:00:00", "amount": 80.0, "currency": "USD",
+        "merchant_id": "merchant-high-1", "customer_id": "cust-sketch-2", "payment_method": "credit_card",
+        "country": "MX", "product_category": "Electronics", "status": "approved", "card_bin": "411111",
+    }
+    chargeback = {
+        "id": "cb-sketch-2", "transaction_id": "tx-sketch-2", "chargeback_date": "2024-11-13T09:00:00",
+        "reason_code": "10.4", "reason_description": "Card-Not-Present Fraud", "status": "open", "amount": 80.0,
+    }
+    try:
+        assert client.post("/api/transactions:bulk", content=json.dumps(transaction)).json()["inserted"] == 1
+        before = client.get("/api/distributions?dimension=category&start=2024-11-13&end=2024-11-14").json()
+        loaded, folded = sketch_store.loaded_days, sketch_store.folded_days
+        assert client.post("/api/chargebacks:bulk", content=json.dumps(chargeback)).json()["inserted"] == 1
+        after = client.get("/api/distributions?dimension=category&start=2024-11-13&end=2024-11-14").json()
+        assert {row["value"]: row["chargeback_count"] for row in after} == {
+            **{row["value"]: row["chargeback_count"] for row in before},
+            "Electronics": sum(row["chargeback_count"] for row in before if row["value"] == "Electronics") + 1,
+        }
+        assert sketch_store.folded_days == folded and sketch_store.loaded_days == loaded + 1
+        assert db_session.execute(text("SELECT stale FROM sketch_days WHERE period = '2024-11-13'")).scalar() == 0
+    finally:
+        _cleanup_ingested(db_session, tx_ids=["tx-sketch-2"], cb_ids=["cb-sketch-2"])
+        rebuild_stale_sketches(db_session.connection())
+        db_session.commit()
+
+
+def test_bulk_ingest_merge_stores_the_cells_of_a_rebuild(client, db_session):
+    import json
+    from sqlalchemy import text
+    from app.sketches import rebuild_stale_sketches
+
+    chargebacks = [
+        {
+            "id": f"cb-sketch-merge-{i}", "transaction_id": "tx-m1-0", "chargeback_date": "2024-11-13T09:00:00",
+            "reason_code": reason_code, "reason_description": "Merged", "status": "open", "amount": amount,
+        }
+        for i, (reason_code, amount) in enumerate((("10.4", 80.0), ("13.1", 1200.0)))
+    ]
+    cells_sql = text("""
+        SELECT 'chargebacks', merchant_id, reason_code, chargeback_count, customers, amounts
+        FROM chargeback_sketches WHERE period = '2024-11-13'
+        UNION ALL
+        SELECT dimension, value_id, NULL, chargeback_count, customers, amounts
+        FROM segment_sketches WHERE period = '2024-11-13'
+        ORDER BY 1, 2, 3
+    """)
+    try:
+        body = "\n".join(json.dumps(chargeback) for chargeback in chargebacks)
+        assert client.post("/api/chargebacks:bulk", content=body).json()["inserted"] == 2
+        merged = db_session.execute(cells_sql).all()
+        db_session.execute(text("UPDATE sketch_days SET stale = 1 WHERE period = '2024-11-13'"))
+        rebuild_stale_sketches(db_session.connection())
+        assert db_session.execute(cells_sql).all() == merged
+        db_session.commit()
+    finally:
+        _cleanup_ingested(db_session, cb_ids=[chargeback["id"] for chargeback in chargebacks])
+        rebuild_stale_sketches(db_session.connection())
+        db_session.commit()
+
+
+def test_sketches_merge_losslessly_and_stay_within_error_bounds():
+    import random
+    from app.constants import SKETCH_QUANTILE_RELATIVE_ACCURACY
+    from app.sketches import HLL_RELATIVE_ERROR, HyperLogLog, QuantileSketch
+
+    rng = random.Random(7)
+    customers = [f"customer-{n}" for n in range(50000)]
+    whole, left, right = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for n, customer in enumerate(customers + customers[:5000]):
+        whole.add(customer)
+        (left if n % 2 else right).add(customer)
+    left.merge(right)
+    assert not whole.exact and left.registers == whole.registers
+    assert abs(whole.estimate() - 50000) <= 3 * HLL_RELATIVE_ERROR * 50000
+
+    small = HyperLogLog()
+    for customer in customers[:100] + customers[:50]:
+        small.add(customer)
+    assert small.exact and small.estimate() == 100
+    # Persisted sketches read back unchanged, sparse or dense.
+    for sketch in (small, whole):
+        copy = HyperLogLog.from_bytes(sketch.to_bytes())
+        assert (copy.hashes, copy.registers) == (sketch.hashes, sketch.registers)
+
+    amounts = [round(rng.lognormvariate(4, 1.2), 2) for _ in range(20000)]
+    whole, left, right = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    for n, amount in enumerate(amounts):
+        whole.add(amount)
+        (left if n % 3 else right).add(amount)
+    left.merge(right)
+    assert (left.buckets, left.count, left.min, left.max) == (whole.buckets, whole.count, whole.min, whole.max)
+    amounts.sort()
+    fractions = (0.0, 0.01, 0.25, 0.5, 0.9, 0.99, 1.0)
+    for fraction, estimate in zip(fractions, whole.quantiles(fractions)):
+        expected = amounts[int(fraction * (len(amounts) - 1))]
+        assert abs(estimate - expected) <= SKETCH_QUANTILE_RELATIVE_ACCURACY * expected
+    assert QuantileSketch().quantiles((0.5,)) == [None]
+    copy = QuantileSketch.from_bytes(whole.to_bytes())
+    assert (copy.buckets, copy.zeros, copy.count, copy.min, copy.max) == \
+        (whole.buckets, whole.zeros, whole.count, whole.min, whole.max)